@@ -3,68 +3,74 @@ import os
 import subprocess
 import re
 import logging
+from GQC import pipeline
 
 logger = logging.getLogger(__name__)
 
 def align_assembly_to_benchmark_haplotypes(queryfasta:str, outputfiles:dict, benchparams, args):
-    matbenchfasta = benchparams["matbenchmark"]
-    patbenchfasta = benchparams["patbenchmark"]
-    if (args.aligner == "minimap2"):
-        if not os.path.exists(outputfiles["aligntomatbenchprefix"] + ".mm2defparams.sort.bam"):
-            minimap2_align(queryfasta, matbenchfasta, outputfiles["aligntomatbenchprefix"], args)
-        if not os.path.exists(outputfiles["aligntopatbenchprefix"] + ".mm2defparams.sort.bam"):
-            minimap2_align(queryfasta, patbenchfasta, outputfiles["aligntopatbenchprefix"], args)
+    matbamfile = align_assembly_to_benchmark_haplotype(queryfasta, "mat", outputfiles, benchparams, args)
+    patbamfile = align_assembly_to_benchmark_haplotype(queryfasta, "pat", outputfiles, benchparams, args)
 
-        matbamfile = outputfiles["aligntomatbenchprefix"] + ".mm2defparams.sort.bam"
-        patbamfile = outputfiles["aligntopatbenchprefix"] + ".mm2defparams.sort.bam"
-    elif (args.aligner == "winnowmap2" or args.aligner == "winnowmap"):
-        if not os.path.exists(outputfiles["aligntomatbenchprefix"] + ".wm2defparams.sort.bam"):
-            winnowmap2_align(queryfasta, matbenchfasta, outputfiles["aligntomatbenchprefix"], benchparams["winnowmaprepkmers"], args)
-        if not os.path.exists(outputfiles["aligntopatbenchprefix"] + ".wm2defparams.sort.bam"):
-            winnowmap2_align(queryfasta, patbenchfasta, outputfiles["aligntopatbenchprefix"], benchparams["winnowmaprepkmers"], args)
+    return [matbamfile, patbamfile]
 
-        matbamfile = outputfiles["aligntomatbenchprefix"] + ".wm2defparams.sort.bam"
-        patbamfile = outputfiles["aligntopatbenchprefix"] + ".wm2defparams.sort.bam"
+# align the test assembly to one ("mat" or "pat") haplotype of the benchmark, so that
+# the two alignments can be run as separate pipeline steps:
+def align_assembly_to_benchmark_haplotype(queryfasta:str, haplotype:str, outputfiles:dict, benchparams, args)->str:
+    benchfasta = benchparams[haplotype + "benchmark"]
+    alignprefix = outputfiles["alignto" + haplotype + "benchprefix"]
+    bamfile = benchmark_haplotype_bamfile(haplotype, outputfiles, args)
+    if not os.path.exists(bamfile):
+        if (args.aligner == "minimap2"):
+            minimap2_align(queryfasta, benchfasta, alignprefix, args)
+        elif (args.aligner == "winnowmap2" or args.aligner == "winnowmap"):
+            winnowmap2_align(queryfasta, benchfasta, alignprefix, benchparams["winnowmaprepkmers"], args)
+        elif (args.aligner == "wfmash"):
+            wfmash_align(queryfasta, benchfasta, alignprefix, args)
+
+    return bamfile
+
+# name of the sorted bam file of alignments of the test assembly to one haplotype of the benchmark:
+def benchmark_haplotype_bamfile(haplotype:str, outputfiles:dict, args)->str:
+    alignprefix = outputfiles["alignto" + haplotype + "benchprefix"]
+    if (args.aligner == "minimap2"):
+        bamfile = alignprefix + ".mm2defparams.sort.bam"
+    elif (args.aligner == "winnowmap2" or args.aligner == "winnowmap"):
+        bamfile = alignprefix + ".wm2defparams.sort.bam"
     elif (args.aligner == "wfmash"):
-        if not os.path.exists(outputfiles["aligntomatbenchprefix"] + ".wfmdefparams.sort.bam"):
-            wfmash_align(queryfasta, matbenchfasta, outputfiles["aligntomatbenchprefix"], args)
-        if not os.path.exists(outputfiles["aligntopatbenchprefix"] + ".wfmdefparams.sort.bam"):
-            wfmash_align(queryfasta, patbenchfasta, outputfiles["aligntopatbenchprefix"], args)
-
-        matbamfile = outputfiles["aligntomatbenchprefix"] + ".wfmdefparams.sort.bam"
-        patbamfile = outputfiles["aligntopatbenchprefix"] + ".wfmdefparams.sort.bam"
+        bamfile = alignprefix + ".wfmdefparams.sort.bam"
     else:
         logger.critical("Unrecognized aligner " + args.aligner)
         print("Unrecognized aligner " + args.aligner)
         exit(1)
 
-    return [matbamfile, patbamfile]
+    return bamfile
 
-def align_haplotype_to_haplotype(queryfasta:str, reffasta:str, outputprefix:str, benchparams, args):
+# when a manifest (see pipeline.read_manifest) is passed, an existing bam file is only
+# reused if it was made from the current contents of the two fasta files:
+def align_haplotype_to_haplotype(queryfasta:str, reffasta:str, outputprefix:str, benchparams, args, manifest=None):
     if (args.aligner == "minimap2"):
         outputbam = outputprefix + ".mm2defparams.sort.bam"
-        if not os.path.exists(outputbam):
-            logger.info("Output bam file " + outputbam + " does not exist--aligning with " + args.aligner)
-            minimap2_align(queryfasta, reffasta, outputprefix, args)
-        else:
-            logger.info("Skipping alignment of " + queryfasta + " to " + reffasta + " into bam file " + outputbam + " because it already exists!")
     elif (args.aligner == "winnowmap2" or args.aligner == "winnowmap"):
         outputbam = outputprefix + ".wm2defparams.sort.bam"
-        if not os.path.exists(outputbam):
-            winnowmap2_align(queryfasta, reffasta, outputprefix, benchparams["winnowmaprepkmers"], args)
-        else:
-            logger.info("Skipping alignment of " + queryfasta + " to " + reffasta + " into bam file " + outputbam + " because it already exists!")
     elif (args.aligner == "wfmash"):
         outputbam = outputprefix + ".wfmdefparams.sort.bam"
-        if not os.path.exists(outputbam):
-            wfmash_align(queryfasta, reffasta, outputprefix, args)
-        else:
-            logger.info("Skipping alignment of " + queryfasta + " to " + reffasta + " into bam file " + outputbam + " because it already exists!")
     else:
         logger.critical("Unrecognized aligner " + args.aligner)
         print("Unrecognized aligner " + args.aligner)
         exit(1)
 
+    if pipeline.needs_update(manifest, outputbam, [outputbam], [queryfasta, reffasta], {"aligner": args.aligner}):
+        logger.info("Output bam file " + outputbam + " does not exist--aligning with " + args.aligner)
+        if (args.aligner == "minimap2"):
+            minimap2_align(queryfasta, reffasta, outputprefix, args)
+        elif (args.aligner == "winnowmap2" or args.aligner == "winnowmap"):
+            winnowmap2_align(queryfasta, reffasta, outputprefix, benchparams["winnowmaprepkmers"], args)
+        else:
+            wfmash_align(queryfasta, reffasta, outputprefix, args)
+        pipeline.record_outputs(manifest, outputbam, [outputbam])
+    else:
+        logger.info("Skipping alignment of " + queryfasta + " to " + reffasta + " into bam file " + outputbam + " because it already exists!")
+
     return outputbam
 
 def minimap2_align(queryfasta:str, benchfasta:str, prefix:str, args)->list:
@@ -4,12 +4,17 @@ import pysam
 import pybedtools
 import logging
 import statistics
+import bisect
+import itertools
+import numpy as np
 from collections import namedtuple
 from pathlib import Path
 from GQC import seqparse
 from GQC import phasing
 from GQC import bedtoolslib
+from GQC import intervals
 from GQC import output
+from GQC import pipeline
 
 # create namedtuple for bed intervals:
 varianttuple = namedtuple('varianttuple', ['chrom', 'start', 'end', 'name', 'vartype', 'excluded', 'qvscore']) 
@@ -17,8 +22,9 @@ varianttuple = namedtuple('varianttuple', ['chrom', 'start', 'end', 'name', 'var
 logger = logging.getLogger(__name__)
 
 # query start is always less than query end regardless of strand. query left always corresponds to ref start, 
-# and so will be greater than query right when strand is reversed--all four are 1-based
-def write_bedfiles(bamobj, pafaligns, refobj, queryobj, hetsites, testmatbed, testpatbed, truthbed, hetallelebed, excludedbedobj, args):
+# and so will be greater than query right when strand is reversed--all four are 1-based. With refcontigs, only
+# alignments to those reference contigs are parsed from bamobj:
+def write_bedfiles(bamobj, pafaligns, refobj, queryobj, hetsites, testmatbed, testpatbed, truthbed, hetallelebed, excludedbedobj, args, refcontigs=None):
 
     refcoveredstring = ""
     querycoveredstring = ""
@@ -28,6 +34,18 @@ def write_bedfiles(bamobj, pafaligns, refobj, queryobj, hetsites, testmatbed, te
         user_variantfile = args.variantfile
     else:
         user_variantfile = None
+    if hetsites:
+        hetstarts = phasing.index_hetsite_starts(hetsites)
+    else:
+        hetstarts = {}
+    if 'variantengine' in args:
+        variantengine = args.variantengine
+    else:
+        variantengine = "numpy"
+    if 'seqwindow' in args:
+        seqwindow = args.seqwindow
+    else:
+        seqwindow = 0
     variants = []
     hetsitealleles = {}
     alignedscorecounts = []
@@ -35,24 +53,11 @@ def write_bedfiles(bamobj, pafaligns, refobj, queryobj, hetsites, testmatbed, te
     indelerrorscorecounts = []
 
     if ((testmatbed is not None and not os.path.exists(testmatbed)) or (testpatbed is not None and not os.path.exists(testpatbed)) or (truthbed is not None and not os.path.exists(truthbed))):
-        if bamobj is not None:
-            for align in bamobj.fetch():
-                if align.is_secondary:
-                    continue
-                if align.reference_length >= args.minalignlength:
-                    query, querystart, queryend, ref, refstart, refend, strand = retrieve_align_data(align)
-                    if strand == "F":
-                        queryleft = querystart
-                        queryright = queryend
-                    else:
-                        queryleft = queryend
-                        queryright = querystart
-                    querynamestring = query + "." + str(queryleft) + "." + str(queryright)
-                    refnamestring = ref + "." + str(refstart) + "." + str(refend) + "." + strand
-                    querycoveredstring += query + "\t" + str(querystart - 1) + "\t" + str(queryend) + "\t" + refnamestring + "\n"
-                    refcoveredstring += ref + "\t" + str(refstart - 1) + "\t" + str(refend) + "\t" + querynamestring + "\n"
-                    if user_variantfile is None:
-                        variants.extend(align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, True))
+        if bamobj is not None and user_variantfile is None and 't' in args and args.t > 1 and bamobj.has_index():
+            logger.info("Finding variants in alignments to each reference contig with " + str(args.t) + " worker processes")
+            [refcoveredstring, querycoveredstring, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts] = collect_align_data_by_contig(bamobj, refobj, queryobj, hetsites, hetstarts, excludedbedobj, args.t, args.minalignlength, variantengine, seqwindow, refcontigs)
+        elif bamobj is not None:
+            [refcoveredstring, querycoveredstring, variants] = collect_align_data(fetch_contig_aligns(bamobj, refcontigs), queryobj, refobj, hetsites, hetstarts, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, args.minalignlength, user_variantfile is None, variantengine, seqwindow)
             # mark variants that are in excluded regions:
             logger.debug("Beginning to exclude variants in excluded regions")
             if excludedbedobj:
@@ -120,6 +125,106 @@ def write_bedfiles(bamobj, pafaligns, refobj, queryobj, hetsites, testmatbed, te
 
     return [refcoveredbed, querycoveredbed, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts]
 
+# strings of query and ref covered regions and a list of variants for the primary alignments of at least
+# minalignlength ref bases in aligns (het site alleles and quality score counts are added to the dictionary
+# and lists passed in):
+def collect_align_data(aligns, queryobj, refobj, hetsites, hetstarts, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, minalignlength:int, findvariants=True, variantengine="numpy", seqwindow=0)->list:
+    refcoveredstring = ""
+    querycoveredstring = ""
+    variants = []
+    for align in aligns:
+        if align.is_secondary:
+            continue
+        if align.reference_length >= minalignlength:
+            query, querystart, queryend, ref, refstart, refend, strand = retrieve_align_data(align)
+            if strand == "F":
+                queryleft = querystart
+                queryright = queryend
+            else:
+                queryleft = queryend
+                queryright = querystart
+            querynamestring = query + "." + str(queryleft) + "." + str(queryright)
+            refnamestring = ref + "." + str(refstart) + "." + str(refend) + "." + strand
+            querycoveredstring += query + "\t" + str(querystart - 1) + "\t" + str(queryend) + "\t" + refnamestring + "\n"
+            refcoveredstring += ref + "\t" + str(refstart - 1) + "\t" + str(refend) + "\t" + querynamestring + "\n"
+            if findvariants:
+                variants.extend(align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, True, variantengine, hetstarts, seqwindow))
+
+    return [refcoveredstring, querycoveredstring, variants]
+
+# run collect_align_data on the alignments to each reference contig (of refcontigs, if given) in a separate worker
+# process, then merge the results in the order of the bam file so that they are identical to those of a single
+# process. Variants are marked as excluded by name, as in exclude_variants, after the names excluded in all contigs
+# are combined
+def collect_align_data_by_contig(bamobj, refobj, queryobj, hetsites, hetstarts, excludedbedobj, numworkers:int, minalignlength:int, variantengine="numpy", seqwindow=0, refcontigs=None)->list:
+    bamfile = os.fsdecode(bamobj.filename)
+    reffasta = os.fsdecode(refobj.filename)
+    queryfasta = os.fsdecode(queryobj.filename) if queryobj is not None else None
+    excludedbedfile = None
+    if excludedbedobj:
+        excludedbedfile = excludedbedobj.fn
+        if not isinstance(excludedbedfile, str) or not os.path.exists(excludedbedfile):
+            excludedbedfile = excludedbedobj.saveas().fn
+
+    refcoveredstring = ""
+    querycoveredstring = ""
+    variants = []
+    excludednames = {}
+    hetsitealleles = {}
+    alignedscorecounts = []
+    snverrorscorecounts = []
+    indelerrorscorecounts = []
+
+    contigs = [contigstats.contig for contigstats in bamobj.get_index_statistics() if contigstats.mapped > 0 and (refcontigs is None or contigstats.contig in refcontigs)]
+    with pipeline.worker_pool(numworkers) as executor:
+        contigresults = {}
+        # submit the longest contigs first to balance the load across workers:
+        for contig in sorted(contigs, key=lambda c: bamobj.get_reference_length(c), reverse=True):
+            contighetsites = {contig: hetsites[contig]} if hetsites and contig in hetsites else {}
+            contighetstarts = {contig: hetstarts[contig]} if contig in hetstarts else {}
+            contigresults[contig] = executor.submit(collect_contig_align_data, contig, bamfile, reffasta, queryfasta, contighetsites, contighetstarts, excludedbedfile, minalignlength, variantengine, seqwindow)
+
+        for contig in contigs:
+            [contigrefcovered, contigquerycovered, contigvariants, contigexcludednames, contighetsitealleles, contigalignedcounts, contigsnvcounts, contigindelcounts] = contigresults[contig].result()
+            refcoveredstring += contigrefcovered
+            querycoveredstring += contigquerycovered
+            variants.extend(contigvariants)
+            excludednames.update(contigexcludednames)
+            hetsitealleles.update(contighetsitealleles)
+            add_score_counts(alignedscorecounts, contigalignedcounts)
+            add_score_counts(snverrorscorecounts, contigsnvcounts)
+            add_score_counts(indelerrorscorecounts, contigindelcounts)
+
+    if excludedbedfile is not None:
+        variants = mark_excluded_variants(variants, excludednames)
+
+    return [refcoveredstring, querycoveredstring, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts]
+
+# worker for collect_align_data_by_contig--opens its own pysam file handles:
+def collect_contig_align_data(contig:str, bamfile:str, reffasta:str, queryfasta, hetsites:dict, hetstarts:dict, excludedbedfile, minalignlength:int, variantengine="numpy", seqwindow=0)->list:
+    bamobj = pysam.AlignmentFile(bamfile, "rb")
+    refobj = pysam.FastaFile(reffasta)
+    queryobj = pysam.FastaFile(queryfasta) if queryfasta is not None else None
+    hetsitealleles = {}
+    alignedscorecounts = []
+    snverrorscorecounts = []
+    indelerrorscorecounts = []
+
+    [refcoveredstring, querycoveredstring, variants] = collect_align_data(bamobj.fetch(contig=contig), queryobj, refobj, hetsites, hetstarts, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, minalignlength, True, variantengine, seqwindow)
+    excludednames = {}
+    if excludedbedfile is not None and len(variants) > 0:
+        excludednames = find_excluded_variant_names(variants, intervals.read_bedfile_intervals(excludedbedfile))
+
+    return [refcoveredstring, querycoveredstring, variants, excludednames, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts]
+
+def add_score_counts(totalcounts:list, counts:list):
+    if len(counts) == 0:
+        return
+    if len(totalcounts) == 0:
+        totalcounts.extend([0] * len(counts))
+    for score in range(len(counts)):
+        totalcounts[score] = totalcounts[score] + counts[score]
+
 def retrieve_align_data(align)->list:
     if align.is_reverse:
         strand = 'R'
@@ -158,19 +263,22 @@ def retrieve_align_data(align)->list:
     return aligndata
 
 # query start and query end are the lower and higher endpoints of the query seq in query coordinates (1-based)
-# regardless of orientation of the alignment
-def align_variants(align, queryobj, query:str, querystart:int, queryend:int, refobj, ref:str, refstart:int, refend:int, strand:str, chromhetsites={}, hetsitealleles={}, alignedscorecounts=[], snverrorscorecounts=[], indelerrorscorecounts=[], widen=True)->list:
+# regardless of orientation of the alignment. engine "numpy" compares the bases of all aligned (M, X or =) blocks
+# at once as byte arrays, engine "python" compares them base by base--both return the same variants.
+# hetstarts (from phasing.index_hetsite_starts) lets the hets within the alignment be found by bisection.
+# If seqwindow is non-zero, ref and query sequences of alignments longer than seqwindow are read from the
+# fasta files in windows of that size as the alignment is traversed rather than all at once
+def align_variants(align, queryobj, query:str, querystart:int, queryend:int, refobj, ref:str, refstart:int, refend:int, strand:str, chromhetsites={}, hetsitealleles={}, alignedscorecounts=[], snverrorscorecounts=[], indelerrorscorecounts=[], widen=True, engine="numpy", hetstarts={}, seqwindow=0)->list:
 
     # coordinates are all one-based, with start at beginning of *original* sequence (not left end of the alignment)
     variantlist = []
     coveredregionlist = []
     homozygousregionlist = []
 
-    # make an array of query positions for each ref position:
-    query_positions = []
-
     if queryobj is None:
         queryseq = align.query_alignment_sequence
+    elif seqwindow > 0 and queryend - querystart + 1 > seqwindow:
+        queryseq = seqparse.WindowedSequence(queryobj, query, querystart-1, queryend, seqwindow, strand == 'R')
     else:
         queryseq = queryobj.fetch(reference=query, start=querystart-1, end=queryend).upper()
 
@@ -187,12 +295,15 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
             qualscore = int(qualscorechar)
             alignedscorecounts[qualscore] = alignedscorecounts[qualscore] + 1
 
-    refseq = refobj.fetch(reference=ref, start=refstart-1, end=refend).upper()
+    if seqwindow > 0 and refend - refstart + 1 > seqwindow:
+        refseq = seqparse.WindowedSequence(refobj, ref, refstart-1, refend, seqwindow)
+    else:
+        refseq = refobj.fetch(reference=ref, start=refstart-1, end=refend).upper()
 
     strandsign = 1
     bedstrand = '+'
     if strand == 'R':
-        if queryobj is not None:
+        if queryobj is not None and queryseq.__class__==str:
             queryseq = seqparse.revcomp(queryseq)
         strandsign = -1
         bedstrand = '-'
@@ -216,6 +327,18 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
     if manualdebug:
         print("Query has length " + str(queryalignlength) + " ref has length " + str(refalignlength))
 
+    if engine == "numpy":
+        [snvopindices, snvrefoffsets, snvqueryoffsets, nqueryoffsets] = find_block_mismatches(alignops, refseq, queryseq, refend-refstart)
+        snvindex = 0
+        if alignedqualscores is not None:
+            for querypos in nqueryoffsets:
+                snverrorscore = int(alignedqualscores[querypos])
+                snverrorscorecounts[snverrorscore] = snverrorscorecounts[snverrorscore] + 1
+    elif engine != "python":
+        logger.critical("Unrecognized variant engine " + engine)
+        print("Unrecognized variant engine " + engine)
+        exit(1)
+
     logger.debug("Traversing alignment with " + str(numops) + " cigar ops aligning " + ref + " to " + query)
     while refcurrentoffset <= refend-refstart and alignopindex < len(alignops): # traverse the alignment operator by operator
         alignop = alignops[alignopindex]
@@ -225,41 +348,55 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
         if op in [0, 7, 8]: # MX= find SNV and MNVs
             if manualdebug:
                 print("Pos " + ref + ":" + str(refcurrentoffset + refstart - 1) + " op M " + str(op) + " has length " + str(oplength))
-            for blockoffset in range(oplength):
-                refpos = refcurrentoffset + blockoffset # this is distance from left-most base of the alignment
-                querypos = querycurrentoffset + blockoffset # this is distance from left-most base of the alignment
-                if strand == 'F':
-                    querycoordinate = querypos + querystart
-                else:
-                    querycoordinate = queryend - querypos
-                if refpos >= len(refseq):
-                    logger.debug("Ref position " + str(refpos) + " in " + ref + " is past end of seq")
-                    continue
-                if querypos >= len(queryseq):
-                    logger.debug("Query position " + str(querypos) + " in " + query + " is past end of seq")
-                    continue
-                if refseq[refpos] != queryseq[querypos] and refseq[refpos] != "N" and queryseq[querypos] != "N":
-                    variantname=query+"_"+str(querycoordinate)+"_"+refseq[refpos]+"_"+queryseq[querypos]+"_"+strand # query's 1-based position, ref base, query base (comp if rev strand), strand
-                    #additionalfields = "0\t" + bedstrand + "\t" + str(refpos+refstart-1) + "\t" + str(refpos+refstart) + "\t0,0,0\t" + alignstring
+            if engine == "numpy":
+                # mismatches in this block have already been found by find_block_mismatches:
+                while snvindex < len(snvopindices) and snvopindices[snvindex] == alignopindex:
+                    refpos = snvrefoffsets[snvindex]
+                    querypos = snvqueryoffsets[snvindex]
+                    if strand == 'F':
+                        querycoordinate = querypos + querystart
+                    else:
+                        querycoordinate = queryend - querypos
+                    variantname=query+"_"+str(querycoordinate)+"_"+refseq[refpos]+"_"+queryseq[querypos]+"_"+strand
                     if alignedqualscores is not None:
                         snverrorscore = int(alignedqualscores[querypos])
                         snverrorscorecounts[snverrorscore] = snverrorscorecounts[snverrorscore] + 1
                     else:
                         snverrorscore = None
                     variantlist.append(varianttuple(chrom=ref, start=refpos+refstart-1, end=refpos+refstart, name=variantname, vartype='SNV', excluded=False, qvscore=snverrorscore))
-                elif queryseq[querypos] == 'N':
-                    if alignedqualscores is not None:
-                        snverrorscore = int(alignedqualscores[querypos])
-                        snverrorscorecounts[snverrorscore] = snverrorscorecounts[snverrorscore] + 1
-
-                query_positions.append(querypos)
+                    snvindex = snvindex + 1
+            else:
+                for blockoffset in range(oplength):
+                    refpos = refcurrentoffset + blockoffset # this is distance from left-most base of the alignment
+                    querypos = querycurrentoffset + blockoffset # this is distance from left-most base of the alignment
+                    if strand == 'F':
+                        querycoordinate = querypos + querystart
+                    else:
+                        querycoordinate = queryend - querypos
+                    if refpos >= len(refseq):
+                        logger.debug("Ref position " + str(refpos) + " in " + ref + " is past end of seq")
+                        continue
+                    if querypos >= len(queryseq):
+                        logger.debug("Query position " + str(querypos) + " in " + query + " is past end of seq")
+                        continue
+                    if refseq[refpos] != queryseq[querypos] and refseq[refpos] != "N" and queryseq[querypos] != "N":
+                        variantname=query+"_"+str(querycoordinate)+"_"+refseq[refpos]+"_"+queryseq[querypos]+"_"+strand # query's 1-based position, ref base, query base (comp if rev strand), strand
+                        #additionalfields = "0\t" + bedstrand + "\t" + str(refpos+refstart-1) + "\t" + str(refpos+refstart) + "\t0,0,0\t" + alignstring
+                        if alignedqualscores is not None:
+                            snverrorscore = int(alignedqualscores[querypos])
+                            snverrorscorecounts[snverrorscore] = snverrorscorecounts[snverrorscore] + 1
+                        else:
+                            snverrorscore = None
+                        variantlist.append(varianttuple(chrom=ref, start=refpos+refstart-1, end=refpos+refstart, name=variantname, vartype='SNV', excluded=False, qvscore=snverrorscore))
+                    elif queryseq[querypos] == 'N':
+                        if alignedqualscores is not None:
+                            snverrorscore = int(alignedqualscores[querypos])
+                            snverrorscorecounts[snverrorscore] = snverrorscorecounts[snverrorscore] + 1
 
         if op in [2, 3]: # deletions
             if manualdebug:
                 print("Pos " + ref + ":" + str(refcurrentoffset + refstart - 1) + " op D " + str(op) + " has length " + str(oplength))
             refpos = refcurrentoffset-1;
-            for deloffset in range(oplength):
-                query_positions.append(querycurrentoffset)
             refallele = refseq[refcurrentoffset:refcurrentoffset+oplength] # one-based refstart+refcurrentoffset to refstart+refcurrentoffset+oplength-1
             queryallele = "*" # one-based between querystart+querycurrentoffset-1 and querystart+querycurrentoffset if forward strand, queryend-querycurrentoffset+1 and queryend-querycurrentoffset if rev
             extendleft = 0
@@ -332,7 +469,6 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
             if alignedqualscores is not None:
                 queryquals = alignedqualscores[querycurrentoffset:querycurrentoffset+oplength]
                 qualscores = [int(x) for x in queryquals]
-            #query_positions.append(querycurrentoffset)
             extendright = 0
             extendleft = 0
             if widen is True: # n.b. - this will *lower* the righthand coordinate of reverse strand queries by "extendright"
@@ -402,13 +538,13 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
 
         alignopindex = alignopindex + 1
 
-    numquerypositions = len(query_positions)
-    refseqlength = len(refseq)
-
     # use query positions to assess het alleles/covered regions:
     if chromhetsites and ref in chromhetsites:
+        blockmap = build_cigar_blockmap(alignops)
         desiredhets = chromhetsites[ref]
-        for het in desiredhets:
+        firsthetindex = phasing.first_hetsite_index(hetstarts, ref, refstart)
+        for hetindex in range(firsthetindex, len(desiredhets)):
+            het = desiredhets[hetindex]
             hetname = het.name
             namefields = hetname.split("_")
             hetpos = int(namefields[-4])
@@ -421,11 +557,11 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
                 continue
             if hetend >= refend:
                 break
-            querystartoffset = query_positions[hetstart-refstart]
-            if hetend - refstart + 2 >= len(query_positions):
+            querystartoffset = blockmap_query_offset(blockmap, hetstart-refstart)
+            if hetend - refstart + 2 >= blockmap['reflength']:
                 queryendoffset = len(queryseq)
             else:
-                queryendoffset = query_positions[hetend-refstart+2]
+                queryendoffset = blockmap_query_offset(blockmap, hetend-refstart+2)
             queryallele = '*'
             if querystartoffset + 1 < queryendoffset - 1:
                 queryallele = queryseq[querystartoffset+1:queryendoffset-1]
@@ -450,6 +586,101 @@ def align_variants(align, queryobj, query:str, querystart:int, queryend:int, ref
 
     return variantlist
 
+# compare the bases of all aligned (M, X or =) blocks of an alignment as NumPy byte arrays, in batches of
+# about batchsize aligned bases so that memory use doesn't grow with the length of the alignment (refseq and
+# queryseq can be strings or seqparse.WindowedSequence objects). Returns the cigar op indices, ref offsets
+# and query offsets of SNVs, and the query offsets of aligned Ns in the query. As in align_variants, ops are
+# only traversed until the ref offset passes maxrefoffset, and bases past the end of either sequence are skipped
+def find_block_mismatches(alignops:list, refseq, queryseq, maxrefoffset:int, batchsize=1000000)->list:
+    snvopindices = []
+    snvrefoffsets = []
+    snvqueryoffsets = []
+    nqueryoffsets = []
+    if len(alignops) == 0:
+        return [snvopindices, snvrefoffsets, snvqueryoffsets, nqueryoffsets]
+
+    cigararray = np.array(alignops, dtype=np.int64)
+    ops = cigararray[:, 0]
+    oplengths = cigararray[:, 1]
+    matchops = np.isin(ops, [0, 7, 8])
+    refadvances = np.where(matchops | np.isin(ops, [2, 3]), oplengths, 0)
+    queryadvances = np.where(matchops | (ops == 1), oplengths, 0)
+    refoffsets = np.cumsum(refadvances) - refadvances
+    queryoffsets = np.cumsum(queryadvances) - queryadvances
+    matchlengths = np.minimum(oplengths, np.minimum(len(refseq) - refoffsets, len(queryseq) - queryoffsets)).clip(min=0)
+    matchlengths = np.where(matchops & (refoffsets <= maxrefoffset), matchlengths, 0)
+    cumlengths = np.cumsum(matchlengths)
+    firstpositions = cumlengths - matchlengths
+
+    nbase = ord("N")
+    for batchstart in range(0, int(cumlengths[-1]), batchsize):
+        # positions are numbered consecutively through the aligned bases of all blocks:
+        positions = np.arange(batchstart, min(batchstart + batchsize, int(cumlengths[-1])))
+        positionops = np.searchsorted(cumlengths, positions, side='right')
+        blockoffsets = positions - firstpositions[positionops]
+        refpositions = refoffsets[positionops] + blockoffsets
+        querypositions = queryoffsets[positionops] + blockoffsets
+
+        refwindow = refseq[int(refpositions[0]):int(refpositions[-1])+1]
+        querywindow = queryseq[int(querypositions[0]):int(querypositions[-1])+1]
+        refbases = np.frombuffer(refwindow.encode(), dtype=np.uint8)[refpositions - refpositions[0]]
+        querybases = np.frombuffer(querywindow.encode(), dtype=np.uint8)[querypositions - querypositions[0]]
+        snvs = (refbases != querybases) & (refbases != nbase) & (querybases != nbase)
+        snvopindices.extend(positionops[snvs].tolist())
+        snvrefoffsets.extend(refpositions[snvs].tolist())
+        snvqueryoffsets.extend(querypositions[snvs].tolist())
+        nqueryoffsets.extend(querypositions[querybases == nbase].tolist())
+
+    return [snvopindices, snvrefoffsets, snvqueryoffsets, nqueryoffsets]
+
+# map between the ref and query offsets of an alignment (both from the left-most aligned base, regardless
+# of strand) built from the boundaries of its cigar blocks, so that offsets can be converted by bisection
+# rather than by walking the cigar or storing a query offset for every ref base:
+def build_cigar_blockmap(alignops:list)->dict:
+    blockmap = {'ops':[], 'lengths':[], 'refoffsets':[], 'queryoffsets':[], 'refblockstarts':[], 'refblockops':[], 'queryblockstarts':[], 'queryblockops':[]}
+    refoffset = 0
+    queryoffset = 0
+    for opindex in range(len(alignops)):
+        [op, oplength] = alignops[opindex]
+        blockmap['ops'].append(op)
+        blockmap['lengths'].append(oplength)
+        blockmap['refoffsets'].append(refoffset)
+        blockmap['queryoffsets'].append(queryoffset)
+        # ops that consume ref (MDN=X):
+        if op in [0, 2, 3, 7, 8]:
+            blockmap['refblockstarts'].append(refoffset)
+            blockmap['refblockops'].append(opindex)
+            refoffset = refoffset + oplength
+        # ops that consume query (MI=X):
+        if op in [0, 1, 7, 8]:
+            blockmap['queryblockstarts'].append(queryoffset)
+            blockmap['queryblockops'].append(opindex)
+            queryoffset = queryoffset + oplength
+    blockmap['reflength'] = refoffset
+    blockmap['querylength'] = queryoffset
+
+    return blockmap
+
+# query offset aligned to a ref offset--ref bases within deletions map to the query base following the deletion:
+def blockmap_query_offset(blockmap:dict, refoffset:int)->int:
+    opindex = blockmap['refblockops'][bisect.bisect_right(blockmap['refblockstarts'], refoffset) - 1]
+    queryoffset = blockmap['queryoffsets'][opindex]
+    if blockmap['ops'][opindex] in [0, 7, 8]:
+        queryoffset = queryoffset + refoffset - blockmap['refoffsets'][opindex]
+
+    return queryoffset
+
+# index of the cigar op that consumes the query base at an offset, or None if no op does:
+def blockmap_query_opindex(blockmap:dict, queryoffset:int):
+    blockindex = bisect.bisect_right(blockmap['queryblockstarts'], queryoffset) - 1
+    if blockindex < 0:
+        return None
+    opindex = blockmap['queryblockops'][blockindex]
+    if queryoffset >= blockmap['queryoffsets'][opindex] + blockmap['lengths'][opindex]:
+        return None
+
+    return opindex
+
 def split_aligns_and_sort(splitbamname, bamobj, minindelsize=10000):
     with pysam.AlignmentFile(splitbamname, "wb", header=bamobj.header) as sbfh:
         for align in bamobj.fetch():
@@ -677,27 +908,26 @@ def create_subalignobjects(align, subaligninfo:list, hardcliplongest:bool)->list
 
     return subalignobjs
 
-def exclude_variants(variants:list, excludedregionsobj:pybedtools.BedTool)->list:
-    # create bedintervals for variants:
+def exclude_variants(variants:list, excludedregionsobj)->list:
+    excludeddict = find_excluded_variant_names(variants, excludedregionsobj)
+
+    return mark_excluded_variants(variants, excludeddict)
+
+# names of variants that intersect excluded regions (a BedTool or an interval set from the intervals module):
+def find_excluded_variant_names(variants:list, excludedregionsobj)->dict:
     logger.debug("Excluding lots of variants in excluded regions")
     numvariants = len(variants)
     logger.debug("There are " + str(numvariants) + " variants")
-    variantbedstringlist = []
-    for variant in variants:
-        chrom = variant.chrom
-        start = variant.start
-        end = variant.end
-        name = variant.name
-        variantbedstringlist.append(chrom + "\t" + str(start) + "\t" + str(end) + "\t" + name + "\n")
-
-    variantbedstring = ''.join(variantbedstringlist)
-    variantbedobj = pybedtools.BedTool(variantbedstring, from_string=True)
-    logger.debug("Created BedTool object")
-    excludedvariants = bedtoolslib.intersectintervals(variantbedobj, excludedregionsobj, wa=True)
+    variantintervals = intervals.create_intervals([variant.chrom for variant in variants], [variant.start for variant in variants], [variant.end for variant in variants], [variant.name for variant in variants])
+    excludedvariants = intervals.intersect_intervals(variantintervals, intervals.as_intervals(excludedregionsobj), mode="u")
     excludeddict = {}
-    for excludedvariant in excludedvariants:
-        excludeddict[excludedvariant.name] = True
+    for chrom in excludedvariants:
+        for variantname in excludedvariants[chrom]['names']:
+            excludeddict[variantname] = True
 
+    return excludeddict
+
+def mark_excluded_variants(variants:list, excludeddict:dict)->list:
     newvariants = []
     numexcluded = 0
     numretained = 0
@@ -752,7 +982,14 @@ def read_paf_aligns(paffile:str, mintargetlength=0)->list:
 
     return alignlist
 
-def read_bam_aligns(bamobj, mintargetlength=0)->list:
+# the alignments of bamobj, or, if refcontigs is given, just those to the reference contigs in refcontigs (in the order
+# of the bam file):
+def fetch_contig_aligns(bamobj, refcontigs=None):
+    if refcontigs is None:
+        return bamobj.fetch()
+    return itertools.chain.from_iterable(bamobj.fetch(contig=refcontig) for refcontig in bamobj.references if refcontig in refcontigs)
+
+def read_bam_aligns(bamobj, mintargetlength=0, refcontigs=None)->list:
 
     alignlist = []
 
@@ -762,7 +999,7 @@ def read_bam_aligns(bamobj, mintargetlength=0)->list:
     for tid in range(len(refentries)):
         reflengthdict[refentries[tid]] = reflengths[tid]
 
-    for align in bamobj.fetch():
+    for align in fetch_contig_aligns(bamobj, refcontigs):
         if align.is_secondary:
             continue
         if align.reference_length >= mintargetlength:
@@ -805,6 +1042,11 @@ def assess_overall_structure(aligndata:list, refobj, queryobj, outputfiles, bedo
             if ref in benchmark_stats["numnonexcludedbases"].keys():
                 benchmark_stats["numnonexcludedbases"][ref] = benchmark_stats["numnonexcludedbases"][ref] - len(interval)
     
+    if bedobjects["allexcludedregions"] is not None:
+        excludedintervals = intervals.as_intervals(bedobjects["allexcludedregions"])
+    else:
+        excludedintervals = None
+
     aligndict = {}
     for align in aligndata:
         refentry = align["target"]
@@ -841,18 +1083,15 @@ def assess_overall_structure(aligndata:list, refobj, queryobj, outputfiles, bedo
             clusterquery = cluster["query"] 
             clusterslope = cluster["slope"]
             clusterintercept = cluster["intercept"]
-            clusterbedstring = ""
-            for align in sorted(cluster["aligns"], key=lambda a: (a["targetstart"], a["targetend"])):
-                clusterbedstring = clusterbedstring + refentry + "\t" + str(align["targetstart"]) + "\t" + str(align["targetend"]) + "\t" + clusterquery + "_" + str(align["querystart"]) + "_" + str(align["queryend"]) + "\n"
-
-            bedtool = pybedtools.BedTool(clusterbedstring, from_string = True)
-            mergedbedtool = bedtoolslib.mergeintervals(bedtool)
-            clusterbases = bedtoolslib.bedsum(mergedbedtool)
-            if bedobjects["allexcludedregions"] is not None:
-                nonexcludedbedtool = bedtoolslib.subtractintervals(mergedbedtool, bedobjects["allexcludedregions"])
+            clusteraligns = cluster["aligns"]
+            clusterintervals = intervals.create_intervals([refentry] * len(clusteraligns), [align["targetstart"] for align in clusteraligns], [align["targetend"] for align in clusteraligns])
+            mergedintervals = intervals.merge_intervals(clusterintervals)
+            clusterbases = intervals.sum_intervals(mergedintervals)
+            if excludedintervals is not None:
+                nonexcludedintervals = intervals.subtract_intervals(mergedintervals, excludedintervals)
             else:
-                nonexcludedbedtool = mergedbedtool
-            cluster["nonexcludedcoveredbases"] = bedtoolslib.bedsum(nonexcludedbedtool)
+                nonexcludedintervals = mergedintervals
+            cluster["nonexcludedcoveredbases"] = intervals.sum_intervals(nonexcludedintervals)
             logger.debug("Cluster on " + clusterquery + " has " + str(clusterbases) + " non-redundant bases, " + str(cluster["nonexcludedcoveredbases"]) + " of which are not excluded")
 
         logger.debug("See how many " + refentry + " clusters are needed to cover 95% of ref")
@@ -918,7 +1157,8 @@ def left_right_hard_clip(align)->list:
     return [lefthardclip, righthardclip]
 
 # Routine to retrieve alignment ref coords and cigar ops for subalignment limits (specified by offsets from query_alignment_start)
-def retrieve_refcoords_and_cigars_from_querycoords(align, desiredquerystart:int, desiredqueryend:int):
+# blockmap (from build_cigar_blockmap) can be passed when retrieving several query ranges from one alignment
+def retrieve_refcoords_and_cigars_from_querycoords(align, desiredquerystart:int, desiredqueryend:int, blockmap=None):
 
     # general stats about this alignment:
     query, querystart, queryend, ref, refstart, refend, strand = retrieve_align_data(align)
@@ -926,15 +1166,21 @@ def retrieve_refcoords_and_cigars_from_querycoords(align, desiredquerystart:int,
     [left_softclip, right_softclip] = left_right_soft_clip(align)
     [left_hardclip, right_hardclip] = left_right_hard_clip(align)
     alignops = align.cigartuples
-
-    # first position will begin at left-most ref/query base of the alignment (regardless of strand)
-    refcurrentoffset = 0
-    querycurrentoffset = 0
-    currentalignopindex = 0
+    if blockmap is None:
+        blockmap = build_cigar_blockmap(alignops)
 
     desiredrefstart = None
     desiredrefend = None
     desiredcigarops = []
+
+    # start traversing at the cigar op containing the desired query start (offsets begin at the left-most
+    # ref/query base of the alignment regardless of strand)
+    currentalignopindex = blockmap_query_opindex(blockmap, desiredquerystart)
+    if currentalignopindex is None:
+        return desiredquerystart, desiredqueryend, ref, desiredrefstart, desiredrefend, desiredcigarops
+    refcurrentoffset = blockmap['refoffsets'][currentalignopindex]
+    querycurrentoffset = blockmap['queryoffsets'][currentalignopindex]
+
     desiredfirstopindex = None
     desiredlastopindex = None
     while refcurrentoffset <= refend-refstart and currentalignopindex < len(alignops): # traverse the alignment operator by operator
@@ -1126,63 +1372,104 @@ def split_disjoint_clusters(refalignclusters:list, maxdistance:int)->list:
 def trim_bamfile_to_intervals(bamfile, intervals, outputbam, headerbam, args, sort=True, index=True):
 
     [aligns, alignedintervals] = index_aligns_by_boundaries(bamfile, args)
-    subaligns = find_phaseblock_subaligns(intervals, alignedintervals, aligns)
+    subaligns = iterate_phaseblock_subaligns(intervals, alignedintervals, aligns)
     write_aligns_to_bamfile(outputbam, subaligns, headerbam=headerbam, sort=sort, index=index)
 
+# An index of the primary alignments in a bam file that records only the BGZF virtual offset of each alignment,
+# keyed by the alignment name used in index_aligns_by_boundaries (query_querystart_queryend), so that the
+# alignments (with their query sequences) don't need to be held in memory. Indexing it reads the alignment
+# from the bam file, so it can be used in place of a dictionary of alignments:
+class AlignOffsetIndex:
+    def __init__(self, bamfile:str):
+        self.bamfile = bamfile
+        self.offsets = {}
+        self.alignobj = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, alignname):
+        return alignname in self.offsets
+
+    def __getitem__(self, alignname:str):
+        if self.alignobj is None:
+            self.alignobj = pysam.AlignmentFile(self.bamfile, "rb")
+        self.alignobj.seek(self.offsets[alignname])
+        return next(self.alignobj)
+
+    def add_align(self, alignname:str, offset:int):
+        self.offsets[alignname] = offset
+
+# read the primary alignments of at least args.minalignlength reference bases in a single pass through the bam
+# file, returning an AlignOffsetIndex of them and an interval set (see the intervals module) of their aligned
+# query regions, named by alignment:
 def index_aligns_by_boundaries(bamfile, args):
 
     logger.info("Indexing aligns in " + bamfile)
     alignobj = pysam.AlignmentFile(bamfile, "rb")
-    aligndict = {}
-    alignbedstring = ""
-    for align in alignobj.fetch():
-        if align.is_secondary:
-            continue
-        if align.reference_length >= args.minalignlength:
+    alignindex = AlignOffsetIndex(bamfile)
+    alignqueries = []
+    alignstarts = []
+    alignends = []
+    alignnames = []
+    # the offset of each record is the position of the file before it is read:
+    alignoffset = alignobj.tell()
+    for align in alignobj.fetch(until_eof=True):
+        if not align.is_unmapped and not align.is_secondary and align.reference_length >= args.minalignlength:
             query, querystart, queryend, ref, refstart, refend, strand = retrieve_align_data(align)
             alignname = query + "_" + str(querystart) + "_" + str(queryend)
-            alignbedstring = alignbedstring + query + "\t" + str(querystart) + "\t" + str(queryend) + "\t" + str(alignname) + "\n"
-            aligndict[alignname] = align
+            alignqueries.append(query)
+            alignstarts.append(querystart)
+            alignends.append(queryend)
+            alignnames.append(alignname)
+            alignindex.add_align(alignname, alignoffset)
+        alignoffset = alignobj.tell()
 
-    alignbedtool = pybedtools.BedTool(alignbedstring, from_string = True)
+    alignintervals = intervals.create_intervals(alignqueries, alignstarts, alignends, alignnames)
 
-    return [aligndict, alignbedtool]
+    return [alignindex, alignintervals]
 
-# Trim alignments to the boundaries of phase blocks:
-def find_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict):
+# Trim alignments to the boundaries of phase blocks (phaseblockints and alignedintervals can be BedTools or
+# interval sets from the intervals module, and aligndict a dictionary of alignments or an AlignOffsetIndex):
+def find_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict)->list:
+    return list(iterate_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict))
+
+# generate the trimmed alignments of find_phaseblock_subaligns one alignment's worth at a time, so that they can be
+# written out (e.g., with write_aligns_to_bamfile) without holding them all in memory:
+def iterate_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict):
 
     # For each alignment, create a list of intersected intervals representing phaseblock regions within the alignment
     # Intervals are in the direction of the query, even if the alignment is on the reverse strand
     phasedaligndict = {}
-    phaseblockalignints = bedtoolslib.intersectintervals(phaseblockints, alignedintervals, wo=True)
+    phaseblockalignints = intervals.intersect_intervals(intervals.as_intervals(phaseblockints), intervals.as_intervals(alignedintervals), mode="wo")
     numphaseblockaligns = len(phaseblockalignints)
     logger.debug("There are " + str(numphaseblockaligns) + " aligned intervals within phase block intervals")
     for blockalign in phaseblockalignints:
-        alignname = blockalign[12]
+        alignname = blockalign.othername
         if alignname not in phasedaligndict.keys():
             phasedaligndict[alignname] = []
         phasedaligndict[alignname].append(blockalign)
 
     # Now for each aligned region, sort the intersecting intervals from low to high coordinate:
     sortedaligns = sorted(phasedaligndict.keys())
-    subalignlist = []
     for alignname in sortedaligns:
-        if alignname not in aligndict.keys():
+        if alignname not in aligndict:
             logger.debug("Skipping alignment " + alignname + "--not in align dictionary!")
             print("Skipping alignment " + alignname + "--not in align dictionary!")
             continue
         alignobj = aligndict[alignname]
         query, querystart, queryend, ref, refstart, refend, strand = retrieve_align_data(alignobj)
+        blockmap = build_cigar_blockmap(alignobj.cigartuples)
         phaseblockintersects = phasedaligndict[alignname]
         subaligninfo = []
         segnumber = 1
         logger.debug("Processing align " + alignname)
-        for phaseblock in sorted(phaseblockintersects, key=lambda x:(x.start, x.stop)):
+        for phaseblock in sorted(phaseblockintersects, key=lambda x:(x.start, x.end)):
             pbstart = phaseblock.start
             pbend = phaseblock.end
-            alignstart = int(phaseblock[10])
-            alignend = int(phaseblock[11])
-            intersectlength = int(phaseblock[13])
+            alignstart = phaseblock.otherstart
+            alignend = phaseblock.otherend
+            intersectlength = phaseblock.overlap
             intersectstart = max(pbstart, alignstart)
             intersectend = min(pbend, alignend)
             logger.debug("Align " + alignname + " intersects phase block " + str(pbstart) + "-" + str(pbend) + " from " + str(intersectstart) + " to " + str(intersectend))
@@ -1197,7 +1484,7 @@ def find_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict):
                 querystartoffset = queryend - intersectend
                 queryendoffset = queryend - intersectstart
 
-            desiredquerystart, desiredqueryend, desiredref, desiredrefstart, desiredrefend, desiredcigarops = retrieve_refcoords_and_cigars_from_querycoords(alignobj, querystartoffset, queryendoffset)
+            desiredquerystart, desiredqueryend, desiredref, desiredrefstart, desiredrefend, desiredcigarops = retrieve_refcoords_and_cigars_from_querycoords(alignobj, querystartoffset, queryendoffset, blockmap)
 
             desiredcigarqueryconsumed = count_consumed_query(desiredcigarops)
             if desiredcigarqueryconsumed != intersectlength:
@@ -1217,10 +1504,8 @@ def find_phaseblock_subaligns(phaseblockints, alignedintervals, aligndict):
         hardcliplongest = False
         if alignobj.is_supplementary or (left_hardclip > 0) or (right_hardclip > 0):
             hardcliplongest = True
-        subalignobjs = create_subalignobjects(alignobj, subaligninfo, hardcliplongest)
-        subalignlist = subalignlist + subalignobjs
-
-    return subalignlist
+        for subalignobj in create_subalignobjects(alignobj, subaligninfo, hardcliplongest):
+            yield subalignobj
 
 def write_aligns_to_bamfile(bamfilename:str, aligns:list, headerbam:str="test_bam_for_header.bam", sort=True, index=True):
 
@@ -3,14 +3,20 @@ import re
 import pybedtools
 import pysam
 import logging
+from GQC import pipeline
+from GQC import intervals as nativeintervals
 
 logger = logging.getLogger(__name__)
 
-def mergebed(bedfile:str, collapsecolumns='4', collapseoutput='collapse', collapsedelim='|', skipifexists=True)->str:
+# when a manifest (see pipeline.read_manifest) is passed, an existing merged file is
+# only reused if it was made from the current contents of bedfile with the same
+# collapse options:
+def mergebed(bedfile:str, collapsecolumns='4', collapseoutput='collapse', collapsedelim='|', skipifexists=True, manifest=None)->str:
 
     mergedbed = bedfile.replace(".bed", ".merged.bed")
+    mergeparams = {"collapsecolumns": collapsecolumns, "collapseoutput": collapseoutput, "collapsedelim": collapsedelim}
 
-    if not skipifexists or not os.path.exists(mergedbed):
+    if not skipifexists or pipeline.needs_update(manifest, mergedbed, [mergedbed], [bedfile], mergeparams, adoptexisting=False):
         logger.debug("Merging " + bedfile + " to create " + mergedbed)
 
         unmergedints = pybedtools.bedtool.BedTool(bedfile)
@@ -25,14 +31,20 @@ def mergebed(bedfile:str, collapsecolumns='4', collapseoutput='collapse', collap
             with open(mergedbed, 'a'):
                 os.utime(mergedbed, None) 
             mergedints = unmergedints
+        pipeline.record_outputs(manifest, mergedbed, [mergedbed])
     else:
         logger.debug("Skipping merging of " + bedfile + ": merged bedfile " + mergedbed + " already exists")
         mergedints = pybedtools.bedtool.BedTool(mergedbed)
 
     return [mergedints, mergedbed]
 
+# the interval helpers below accept either BedTools or interval sets from the intervals module (dicts),
+# which are handled natively without calling out to bedtools:
 def mergeintervals(intervals, collapsecolumns='4', collapseoutput='collapse', collapsedelim='|', distance=0):
 
+    if isinstance(intervals, dict):
+        return nativeintervals.merge_intervals(intervals, distance=distance, collapsedelim=collapsedelim)
+
     mergedints = intervals.merge(c=collapsecolumns, o=collapseoutput, delim=collapsedelim, d=distance)
 
     return mergedints
@@ -57,6 +69,9 @@ def mergemultiplebedfiles(bedfilelist:list, sort=True, postmerge=False):
 
 def bedsum(intervals)->int:
 
+    if isinstance(intervals, dict):
+        return nativeintervals.sum_intervals(intervals)
+
     alllengths = map(len, intervals)
     bedsum = sum(alllengths)
 
@@ -82,6 +97,10 @@ def intersectbed(bedfile1:str, bedfile2:str, outputfile:str, writefirst=False, w
 
 def intersectintervals(intervals1, intervals2, v=False, wo=False, wa=False, wb=False, counts=False):
 
+    if isinstance(intervals1, dict) and not (wa or wb or counts):
+        mode = "wo" if wo else ("v" if v else "u")
+        return nativeintervals.intersect_intervals(intervals1, nativeintervals.as_intervals(intervals2), mode=mode)
+
     if wo:
         print("Intersect called with -wo option")
     intersectedints = intervals1.intersect(intervals2, v=v, wa=wa, wb=wb, wo=wo, c=counts)
@@ -90,6 +109,9 @@ def intersectintervals(intervals1, intervals2, v=False, wo=False, wa=False, wb=F
 
 def subtractintervals(intervals1, intervals2, A=False, wb=False, wo=False):
 
+    if isinstance(intervals1, dict) and not (A or wb or wo):
+        return nativeintervals.subtract_intervals(intervals1, nativeintervals.as_intervals(intervals2))
+
     subtractedints = intervals1.subtract(intervals2, A=A, wb=wb, wo=wo)
 
     return subtractedints
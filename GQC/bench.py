@@ -4,6 +4,7 @@ import re
 import shutil
 import pysam
 import argparse
+import pickle
 import logging
 from pybedtools import BedTool
 import importlib.resources
@@ -17,9 +18,13 @@ from GQC import align
 from GQC import alignparse
 from GQC import structvar
 from GQC import phasing
+from GQC import hetstore
 from GQC import stats
 from GQC import mummermethods
 from GQC import plots
+from GQC import pipeline
+from GQC import intervals
+from GQC import telemetry
 
 # create namedtuple for bed intervals:
 varianttuple = namedtuple('varianttuple', ['chrom', 'start', 'end', 'name', 'vartype', 'excluded', 'qvscore']) 
@@ -70,7 +75,8 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('-r', '--reffasta', type=str, required=True, help='(indexed) fasta file for benchmark reference')
     parser.add_argument('-q', '--queryfasta', type=str, required=True, help='(indexed) fasta file for haploid or diploid test assembly')
     parser.add_argument('-p', '--prefix', type=str, required=True, help='prefix for output directory name, filenames have assembly name in prefix (see -A)')
-    parser.add_argument('-t', type=int, required=False, default=2, help='number of processors to use')
+    parser.add_argument('-t', type=int, required=False, default=2, help='number of processors to use, shared equally by the pipeline steps running at the same time (see --parallelsteps)')
+    parser.add_argument('--parallelsteps', type=int, required=False, default=1, help='maximum number of independent pipeline steps (e.g., the maternal and paternal alignments) to run at the same time, each using an equal share of the -t processors (at most -t steps run at once)')
     parser.add_argument('-a', '--aligner', type=str, required=False, default='minimap2', help='aligner to use when comparing assembly to benchmark, can be minimap2 or winnowmap2 (default winnowmap2)')
     parser.add_argument('-m', '--minalignlength', type=int, required=False, default=500, help='minimum length of alignment required to be included in alignment statistics and error counts')
     parser.add_argument('--mincontiglength', type=int, required=False, default=500, help='minimum length for contig to be included in contig statistics')
@@ -84,6 +90,10 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('--vcf', action='store_true', required=False, default=False, help='write differences from benchmark in VCF format')
     parser.add_argument('-n', '--n_bedfile', type=str, required=False, default=None, help='pre-existing bedfile of locations of N-stretches splitting scaffolds into contigs')
     parser.add_argument('--variantfile', type=str, required=False, default=None, help='pre-existing file of variant locations in assembly compared to benchmark')
+    parser.add_argument('--variantengine', type=str, required=False, default='numpy', choices=['numpy', 'python'], help='method for finding SNVs within aligned blocks: numpy compares whole blocks as arrays, python compares them base by base (slower, same results)')
+    parser.add_argument('--seqwindow', type=int, required=False, default=10000000, help='read the sequences of alignments longer than this from the fasta files in windows of this size rather than all at once, to limit memory use (0 to always read whole alignments)')
+    parser.add_argument('--chromosomes', type=str, required=False, default=None, help='comma-separated names of the benchmark sequences to assess: only alignments to these sequences are used in the structure, aligned bed files and error classification steps, and benchmark totals in the stats are those of these sequences. The results of runs with different sequences can be combined with assemblybench-merge')
+    parser.add_argument('--regions', type=str, required=False, default=None, help='bed file of benchmark regions whose sequences are to be assessed, as with --chromosomes (the whole of each sequence is assessed, so that the results can be combined with assemblybench-merge)')
     parser.add_argument('--structureonly', action='store_true', required=False, help='analyse only the long-range structure of the assembly')
     parser.add_argument('-A', '--assembly', type=str, required=False, default="test", help='name of the assembly being tested--should correspond to query sequence in bam file and will be used in output file names')
     parser.add_argument('-B', '--benchmark', type=str, required=False, default="truth", help='name of the assembly being used as a benchmark--should be the reference sequence in the bam file')
@@ -103,6 +113,30 @@ def parse_arguments(args):
 
     return args
 
+def init_merge_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION] [RUNPREFIX]...",
+        description="Combine the results of assemblybench runs with --chromosomes or --regions into assembly statistics for all of the benchmark sequences they assessed"
+    )
+    parser.add_argument(
+        "-v", "--version", action="version",
+        version = f"{parser.prog} version 0.1.0"
+    )
+    parser.add_argument('runprefixes', nargs='+', help='output prefixes (-p) of the assemblybench runs to combine, which must have used the same options other than --chromosomes, --regions, -t and --parallelsteps')
+    parser.add_argument('-p', '--prefix', type=str, required=True, help='prefix for output directory name')
+    parser.add_argument('-A', '--assembly', type=str, required=False, default="test", help='name of the assembly given to the assemblybench runs')
+    parser.add_argument('-t', type=int, required=False, default=2, help='number of processors to use, shared equally by the pipeline steps running at the same time (see --parallelsteps)')
+    parser.add_argument('--parallelsteps', type=int, required=False, default=1, help='maximum number of independent pipeline steps to run at the same time, each using an equal share of the -t processors (at most -t steps run at once)')
+    parser.add_argument('--debug', action='store_true', required=False, help='print verbose output to log file for debugging purposes')
+
+    return parser
+
+def parse_merge_arguments(args):
+    parser = init_merge_argparse()
+    args = parser.parse_args(args)
+
+    return args
+
 def read_config_data(args)->dict:
     configfile = args.config
     configpath = Path(configfile)
@@ -139,64 +173,76 @@ def read_config_data(args)->dict:
     
     return configvals
 
-def main() -> None:
-
-    args = parse_arguments(sys.argv[1:])
-
-    logfile = args.prefix + ".log"
-    logformat = '%(asctime)s %(message)s'
-    if args.debug:
-        logging.basicConfig(filename=logfile, level=logging.DEBUG, format=logformat)
-        logger.info('Logging verbose output to ' + logfile + ' for debugging.')
-    else:
-        logging.basicConfig(filename=logfile, level=logging.INFO, format=logformat)
-
-    # log the command line:
-    call_command = " ".join(sys.argv)
-    logger.info(call_command)
-
-    # check for necessary installed programs and write an output directory:
-    check_for_bedtools()
-    check_for_aligner(args.aligner)
-    no_rscript = check_for_R()
-
-    # dictionary of parameters from the benchmark configuration file:
-    benchparams = read_config_data(args)
-
-    # pysam objects for the benchmark and test assembly fasta files:
-    ref = Path(args.reffasta)
-    query = Path(args.queryfasta)
-    if not ref.is_file() or not query.is_file():
-        logger.critical("Ref fasta file " + args.reffasta + " and query fasta file " + args.queryfasta + " must exist and be readable")
-        exit(1)
+# the benchmark sequences selected with --chromosomes and --regions, in the order of the benchmark fasta file, or None if
+# the whole benchmark is to be assessed:
+def select_benchmark_sequences(refobj, args)->list:
+    if args.chromosomes is None and args.regions is None:
+        return None
+
+    selectedsequences = []
+    if args.chromosomes is not None:
+        selectedsequences.extend([chrom for chrom in args.chromosomes.split(",") if chrom != ""])
+    if args.regions is not None:
+        selectedsequences.extend(intervals.read_bedfile_intervals(args.regions).keys())
+    for chrom in selectedsequences:
+        if chrom not in refobj.references:
+            logger.critical("Benchmark sequence " + chrom + " is not in the benchmark fasta file " + args.reffasta)
+            print("Benchmark sequence " + chrom + " is not in the benchmark fasta file " + args.reffasta)
+            exit(1)
+    logger.info("Restricting assessment to benchmark sequences " + ",".join([chrom for chrom in refobj.references if chrom in selectedsequences]))
+
+    return [chrom for chrom in refobj.references if chrom in selectedsequences]
+
+# Each step of the assemblybench pipeline is a function taking the dictionary of run
+# data, which holds the command line arguments, benchmark parameters, output file
+# names and the objects that earlier steps have added. Steps open their own pysam
+# objects so that independent steps can run at the same time.
+
+def step_genome_bedfiles(rundata:dict):
+    args = rundata["args"]
     refobj = pysam.FastaFile(args.reffasta)
     queryobj = pysam.FastaFile(args.queryfasta)
 
-    outputdir = output.create_output_directory(args.prefix)
-
-    # dictionary of this run's output file names:
-    outputfiles = output.name_output_files(args, outputdir)
-
     logger.info("Step 1 (of 11): Writing bed files for excluded regions, test assembly scaffold spans, lengths, N stretches, and contigs (ignoring stretches of less than " + str(args.minns) + " Ns)")
-    bedregiondict = {}
     # merged excluded regions are saved as BedTool object "allexcludedregions" in bedregiondict here:
-    seqparse.write_genome_bedfiles(queryobj, refobj, args, benchparams, outputfiles, bedregiondict)
-   
+    seqparse.write_genome_bedfiles(queryobj, refobj, args, rundata["benchparams"], rundata["outputfiles"], rundata["bedregiondict"])
+
+    return {"bases": sum(queryobj.lengths)}
+
+def step_general_stats(rundata:dict):
+    args = rundata["args"]
+    refobj = pysam.FastaFile(args.reffasta)
+    queryobj = pysam.FastaFile(args.queryfasta)
+    bedregiondict = rundata["bedregiondict"]
 
     # find general stats about contig/scaffold lengths, N/L50's, etc.:
     logger.info("Step 2 (of 11): Writing general statistics about " + args.assembly + " assembly")
-    benchmark_stats = stats.write_general_assembly_stats(refobj, queryobj, bedregiondict["testnonnregions"], bedregiondict["testnregions"], outputfiles, args)
+    rundata["benchmark_stats"] = stats.write_general_assembly_stats(refobj, queryobj, bedregiondict["testnonnregions"], bedregiondict["testnregions"], rundata["outputfiles"], args)
+    if rundata["benchmarksequences"] is not None:
+        stats.set_benchmark_totals(rundata["benchmark_stats"], refobj, rundata["benchmarksequences"])
+
+def step_hapmer_markers(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    benchparams = rundata["benchparams"]
 
     logger.info("Step 3 (of 11): Phasing assembly regions using benchmark's haplotype-specific kmers")
     if args.merquryblocks:
         markerbed = outputfiles["phasemarkerbed"]
     else:
         markerbed = outputfiles["mergedphasemarkerbed"]
-    if not os.path.exists(markerbed):
+    if not pipeline.step_is_current(rundata, "hapmermarkers", [markerbed]):
         print("File " + markerbed + " does not exist--calling FASTK to generate one")
         logger.info("File " + markerbed + " does not exist--calling FASTK to generate one")
         check_for_fastk()
-        phasing.map_benchmark_hapmers_onto_assembly(args.queryfasta, benchparams["matmarkerdb"], benchparams["patmarkerdb"], outputdir, outputfiles)
+        phasing.map_benchmark_hapmers_onto_assembly(args.queryfasta, benchparams["matmarkerdb"], benchparams["patmarkerdb"], rundata["outputdir"], outputfiles, manifest=rundata["manifest"], numthreads=args.t)
+    rundata["markerbed"] = markerbed
+
+def step_phase_blocks(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    queryobj = pysam.FastaFile(args.queryfasta)
+    markerbed = rundata["markerbed"]
 
     if args.merquryblocks: # use Merqury phase block algorithm
         logger.info("Using Merqury algorithm with shortnum " + str(args.shortnum) + " and shortlimit " + str(args.shortlimit) + " to find phase blocks")
@@ -207,120 +253,506 @@ def main() -> None:
         logger.info("Using HMM with emission probability " + str(args.alpha) + " and transition probability " + str(args.beta) + " to find phase blocks")
         alpha = args.alpha
         transitionprob = args.beta
-        phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(markerbed, outputfiles["hmmphaseblockbed"], queryobj, alpha, transitionprob, 0)
+        phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(markerbed, outputfiles["hmmphaseblockbed"], queryobj, alpha, transitionprob, 0, manifest=rundata["manifest"], numworkers=args.t)
     phaseblockints.saveas(outputfiles["phaseblockbed"])
-    matphaseblockints = phaseblockints.filter(lambda x: x.name=="mat")
-    patphaseblockints = phaseblockints.filter(lambda x: x.name=="pat")
+    rundata["matphaseblockints"] = phaseblockints.filter(lambda x: x.name=="mat").saveas()
+    rundata["patphaseblockints"] = phaseblockints.filter(lambda x: x.name=="pat").saveas()
     #stats.write_phase_block_stats(phaseblockints, outputfiles, benchmark_stats, args)
 
-    # align test assembly separately to maternal and paternal haplotypes:
-    logger.info("Step 4 (of 11): Aligning assembly separately to maternal and paternal haplotypes of the benchmark and gathering trimmed alignments of phased assembly regions to their corresponding haplotypes")
-    if not os.path.exists(outputfiles["trimmedphasedalignprefix"] + ".merge.sort.bam"):
-        [matbenchbamfile, patbenchbamfile] = align.align_assembly_to_benchmark_haplotypes(args.queryfasta, outputfiles, benchparams, args)
-    
-        # read in alignments from BAM format, filtering out secondaries and finding the optimal alignment on the correct haplotype for each phase block in the assembly
+# step 4 is split into separate steps for each haplotype, which are skipped when the
+# merged, trimmed alignment file already exists:
+def step_align_haplotype(rundata:dict, haplotype:str):
+    args = rundata["args"]
+    if pipeline.step_is_current(rundata, "mergetrimmed", [rundata["trimmedphasedbam"]]):
+        return 0
 
-        benchdiploidheaderfile = benchparams["benchdiploidheader"]
-    
-        [mataligns, matalignedintervals] = alignparse.index_aligns_by_boundaries(matbenchbamfile, args)
-        [pataligns, patalignedintervals] = alignparse.index_aligns_by_boundaries(patbenchbamfile, args)
-    
-        matalignedintervals.saveas(outputfiles["matalignedregions"])
-        patalignedintervals.saveas(outputfiles["patalignedregions"])
-    
-        print("Finding subaligns in maternal alignments for maternal phase blocked regions of the assembly")
-        matblocksubaligns = alignparse.find_phaseblock_subaligns(matphaseblockints, matalignedintervals, mataligns)
-        mattrimmedbamfile = outputfiles["trimmedphasedalignprefix"] + ".mat.bam"
-        alignparse.write_aligns_to_bamfile(mattrimmedbamfile, matblocksubaligns, headerbam=matbenchbamfile, sort=False)
-        print("Finding subaligns in paternal alignments for paternal phase blocked regions of the assembly")
-        patblocksubaligns = alignparse.find_phaseblock_subaligns(patphaseblockints, patalignedintervals, pataligns)
-        pattrimmedbamfile = outputfiles["trimmedphasedalignprefix"] + ".pat.bam"
-        alignparse.write_aligns_to_bamfile(pattrimmedbamfile, patblocksubaligns, headerbam=patbenchbamfile, sort=False)
-
-        # now merge the maternal and paternal trimmed files to a single file with a diploid header, sort, and index:
-        alignparse.merge_trimmed_bamfiles(mattrimmedbamfile, pattrimmedbamfile, benchdiploidheaderfile, outputfiles)
-    else: 
-        logger.info("Skipping step 4 (of 11): Trimmed phased alignments already exist in " + outputfiles["trimmedphasedalignprefix"] + ".merge.sort.bam")
-
-    trimmedphasedbam = outputfiles["trimmedphasedalignprefix"] + ".merge.sort.bam"
+    # align test assembly separately to maternal and paternal haplotypes:
+    logger.info("Step 4 (of 11): Aligning assembly to " + haplotype + " haplotype of the benchmark")
+    rundata[haplotype + "benchbamfile"] = align.align_assembly_to_benchmark_haplotype(args.queryfasta, haplotype, rundata["outputfiles"], rundata["benchparams"], args)
+
+    return {"bases": sum(pysam.FastaFile(args.queryfasta).lengths)}
+
+def step_trim_haplotype_aligns(rundata:dict, haplotype:str):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    if pipeline.step_is_current(rundata, "mergetrimmed", [rundata["trimmedphasedbam"]]):
+        return 0
+
+    logger.info("Step 4 (of 11): Gathering trimmed alignments of " + haplotype + " phased assembly regions to the " + haplotype + " haplotype")
+    # read in alignments from BAM format, filtering out secondaries and finding the optimal alignment on the correct haplotype for each phase block in the assembly
+    benchbamfile = rundata[haplotype + "benchbamfile"]
+    [aligns, alignedintervals] = alignparse.index_aligns_by_boundaries(benchbamfile, args)
+    intervals.write_bedfile_intervals(alignedintervals, outputfiles[haplotype + "alignedregions"])
+
+    print("Finding subaligns in " + haplotype + " alignments for " + haplotype + " phase blocked regions of the assembly")
+    # trimmed alignments are generated from alignments re-read from the bam file and written as they are made:
+    blocksubaligns = alignparse.iterate_phaseblock_subaligns(rundata[haplotype + "phaseblockints"], alignedintervals, aligns)
+    trimmedbamfile = outputfiles["trimmedphasedalignprefix"] + "." + haplotype + ".bam"
+    alignparse.write_aligns_to_bamfile(trimmedbamfile, blocksubaligns, headerbam=benchbamfile, sort=False)
+    rundata[haplotype + "trimmedbamfile"] = trimmedbamfile
+
+    return {"alignments": len(aligns)}
+
+def step_merge_trimmed_aligns(rundata:dict):
+    outputfiles = rundata["outputfiles"]
+    if pipeline.step_is_current(rundata, "mergetrimmed", [rundata["trimmedphasedbam"]]):
+        logger.info("Skipping step 4 (of 11): Trimmed phased alignments already exist in " + rundata["trimmedphasedbam"])
+        return 0
+
+    # now merge the maternal and paternal trimmed files to a single file with a diploid header, sort, and index:
+    benchdiploidheaderfile = rundata["benchparams"]["benchdiploidheader"]
+    alignparse.merge_trimmed_bamfiles(rundata["mattrimmedbamfile"], rundata["pattrimmedbamfile"], benchdiploidheaderfile, outputfiles)
+
+def step_filter_aligns(rundata:dict):
+    args = rundata["args"]
+    trimmedphasedbam = rundata["trimmedphasedbam"]
 
     logger.info("Step 5 (of 11): Filtering alignment to include primary best increasing subset")
     if not args.nosplit:
         splitbam_name = trimmedphasedbam.replace(".bam", ".split.bam")
         splitsortbam_name = splitbam_name.replace(".bam", ".sort.bam")
-        if not os.path.exists(splitsortbam_name):
+        if not pipeline.step_is_current(rundata, "filteraligns", [splitsortbam_name]):
             alignobj = pysam.AlignmentFile(trimmedphasedbam, "rb")
             alignparse.split_aligns_and_sort(splitbam_name, alignobj, minindelsize=args.splitdistance)
             pysam.sort("-o", splitsortbam_name, splitbam_name)
             pysam.index(splitsortbam_name)
-        alignobj = pysam.AlignmentFile(splitsortbam_name, "rb")
-        aligndata = alignparse.read_bam_aligns(alignobj, args.minalignlength)
-        rlis_aligndata = mummermethods.filter_aligns(aligndata, "target")
+        alignbamfile = splitsortbam_name
     else:
-        alignobj = pysam.AlignmentFile(bamfile, "rb")
-        aligndata = alignparse.read_bam_aligns(alignobj, args.minalignlength)
-        rlis_aligndata = mummermethods.filter_aligns(aligndata, "target")
+        alignbamfile = trimmedphasedbam
+    alignobj = pysam.AlignmentFile(alignbamfile, "rb")
+    aligndata = alignparse.read_bam_aligns(alignobj, args.minalignlength, rundata["benchmarksequences"])
+    rundata["rlis_aligndata"] = mummermethods.filter_aligns(aligndata, "target")
+    rundata["alignbamfile"] = alignbamfile
+
+    return {"alignments": len(aligndata)}
+
+def step_overall_structure(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    benchmark_stats = rundata["benchmark_stats"]
+    refobj = pysam.FastaFile(args.reffasta)
+    queryobj = pysam.FastaFile(args.queryfasta)
+    rlis_aligndata = rundata["rlis_aligndata"]
 
     ## find clusters of consistent, covering alignments and calculate continuity statistics:
     logger.info("Step 5 (of 11): Assessing overall structural alignment of assembly")
     # (by default, rlis_aligndata are split alignments filtered for RLIS)
-    alignparse.assess_overall_structure(rlis_aligndata, refobj, queryobj, outputfiles, bedregiondict, benchmark_stats, args)
+    alignparse.assess_overall_structure(rlis_aligndata, refobj, queryobj, outputfiles, rundata["bedregiondict"], benchmark_stats, args)
     structvar.write_structural_errors(rlis_aligndata, refobj, queryobj, outputfiles, benchmark_stats, args)
     stats.write_aligned_cluster_stats(outputfiles, benchmark_stats, args)
 
-    if not args.structureonly:
-       logger.info("Step 6 (of 11): Writing bed files of regions covered by alignments of " + args.assembly + " to " + args.benchmark)
-       ## read in locations of het variants in the benchmark store in dictionary by chrom of position-sorted arrays:
-       hetsites = phasing.read_hetsites(benchparams["hetsitevariants"])
-       hetarrays = phasing.sort_chrom_hetsite_arrays(hetsites)
-
-       pafaligns = None
-       [refcoveredbed, querycoveredbed, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts] = alignparse.write_bedfiles(alignobj, pafaligns, refobj, queryobj, hetarrays, outputfiles["testmatcovered"], outputfiles["testpatcovered"], outputfiles["truthcovered"], outputfiles["coveredhetsitealleles"], bedregiondict["allexcludedregions"], args)
-
-       ## create merged unique outputfiles:
-       [mergedtruthcoveredbed, outputfiles["mergedtruthcovered"]] = bedtoolslib.mergebed(outputfiles["truthcovered"])
-       [mergedtestmatcoveredbed, outputfiles["mergedtestmatcovered"]] = bedtoolslib.mergebed(outputfiles["testmatcovered"])
-       [mergedtestpatcoveredbed, outputfiles["mergedtestpatcovered"]] = bedtoolslib.mergebed(outputfiles["testpatcovered"])
-
-       logger.info("Step 7 (of 11): Writing primary alignment statistics about " + args.assembly + " assembly")
-       stats.write_merged_aligned_stats(refobj, queryobj, mergedtruthcoveredbed, mergedtestmatcoveredbed, mergedtestpatcoveredbed, outputfiles, benchmark_stats, args)
-
-       if alignobj is not None:
-           ## classify variant errors as phasing or novel errors:
-           logger.info("Step 8 (of 11): Writing phase switch statistics")
-           stats.write_het_stats(outputfiles, benchmark_stats, args)
-           logger.info("Step 9 (of 11): Determining whether errors are switched haplotype or novel")
-           errors.classify_errors(refobj, queryobj, variants, hetsites, outputfiles, benchparams, benchmark_stats, args)
-           stats.write_qv_stats(benchmark_stats, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, outputfiles, args)
-#
-           ## evaluate mononucleotide runs:
-           logger.info("Step 10 (of 11): Assessing accuracy of mononucleotide runs")
-           bedtoolslib.intersectbed(benchparams["mononucruns"], outputfiles["mergedtruthcovered"], outputfile=outputfiles["coveredmononucsfile"], writefirst=True)
-           mononucswithvariantsbedfile = bedtoolslib.intersectbed(outputfiles["coveredmononucsfile"], outputfiles["bencherrortypebed"], outputfiles["mononucswithvariantsfile"], outerjoin=True, writeboth=True)
-           mononucstats = errors.gather_mononuc_stats(outputfiles["mononucswithvariantsfile"], outputfiles["mononucstatsfile"])
-           stats.write_mononuc_stats(mononucstats, outputfiles, benchmark_stats, args)
+    return {"alignments": len(rlis_aligndata)}
+
+def step_read_hetsites(rundata:dict):
+    ## read in locations of het variants in the benchmark store in dictionary by chrom of position-sorted arrays:
+    rundata["hetsites"] = hetstore.load_hetsites(rundata["benchparams"]["hetsitevariants"])
+    rundata["hetarrays"] = hetstore.chrom_hetsite_arrays(rundata["hetsites"])
+    if rundata["benchmarksequences"] is not None:
+        rundata["hetarrays"] = dict([(chrom, rundata["hetarrays"][chrom]) for chrom in rundata["benchmarksequences"] if chrom in rundata["hetarrays"]])
+
+    return {"hetsites": len(rundata["hetsites"])}
+
+def step_aligned_bedfiles(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    refobj = pysam.FastaFile(args.reffasta)
+    queryobj = pysam.FastaFile(args.queryfasta)
+    alignobj = pysam.AlignmentFile(rundata["alignbamfile"], "rb")
+
+    logger.info("Step 6 (of 11): Writing bed files of regions covered by alignments of " + args.assembly + " to " + args.benchmark)
+    pafaligns = None
+    [refcoveredbed, querycoveredbed, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts] = alignparse.write_bedfiles(alignobj, pafaligns, refobj, queryobj, rundata["hetarrays"], outputfiles["testmatcovered"], outputfiles["testpatcovered"], outputfiles["truthcovered"], outputfiles["coveredhetsitealleles"], rundata["bedregiondict"]["allexcludedregions"], args, rundata["benchmarksequences"])
+    rundata["variants"] = variants
+    rundata["alignedscorecounts"] = alignedscorecounts
+    rundata["snverrorscorecounts"] = snverrorscorecounts
+    rundata["indelerrorscorecounts"] = indelerrorscorecounts
+    merge_covered_bedfiles(rundata)
+
+    return {"alignments": alignobj.mapped, "variants": len(variants)}
+
+def merge_covered_bedfiles(rundata:dict):
+    outputfiles = rundata["outputfiles"]
+
+    ## create merged unique outputfiles:
+    [rundata["mergedtruthcoveredbed"], outputfiles["mergedtruthcovered"]] = bedtoolslib.mergebed(outputfiles["truthcovered"], manifest=rundata["manifest"])
+    [rundata["mergedtestmatcoveredbed"], outputfiles["mergedtestmatcovered"]] = bedtoolslib.mergebed(outputfiles["testmatcovered"], manifest=rundata["manifest"])
+    [rundata["mergedtestpatcoveredbed"], outputfiles["mergedtestpatcovered"]] = bedtoolslib.mergebed(outputfiles["testpatcovered"], manifest=rundata["manifest"])
+
+def step_merged_aligned_stats(rundata:dict):
+    args = rundata["args"]
+    refobj = pysam.FastaFile(args.reffasta)
+    queryobj = pysam.FastaFile(args.queryfasta)
+
+    logger.info("Step 7 (of 11): Writing primary alignment statistics about " + args.assembly + " assembly")
+    stats.write_merged_aligned_stats(refobj, queryobj, rundata["mergedtruthcoveredbed"], rundata["mergedtestmatcoveredbed"], rundata["mergedtestpatcoveredbed"], rundata["outputfiles"], rundata["benchmark_stats"], args)
+
+def step_het_stats(rundata:dict):
+    ## classify variant errors as phasing or novel errors:
+    logger.info("Step 8 (of 11): Writing phase switch statistics")
+    stats.write_het_stats(rundata["outputfiles"], rundata["benchmark_stats"], rundata["args"])
+
+def step_classify_errors(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    benchmark_stats = rundata["benchmark_stats"]
+    refobj = pysam.FastaFile(args.reffasta)
+    queryobj = pysam.FastaFile(args.queryfasta)
+
+    logger.info("Step 9 (of 11): Determining whether errors are switched haplotype or novel")
+    errors.classify_errors(refobj, queryobj, rundata["variants"], rundata["hetsites"], outputfiles, rundata["benchparams"], benchmark_stats, args)
+    stats.write_qv_stats(benchmark_stats, rundata["alignedscorecounts"], rundata["snverrorscorecounts"], rundata["indelerrorscorecounts"], outputfiles, args)
+
+    return {"variants": len(rundata["variants"])}
+
+def step_mononuc_accuracy(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    benchparams = rundata["benchparams"]
+
+    ## evaluate mononucleotide runs:
+    logger.info("Step 10 (of 11): Assessing accuracy of mononucleotide runs")
+    bedtoolslib.intersectbed(benchparams["mononucruns"], outputfiles["mergedtruthcovered"], outputfile=outputfiles["coveredmononucsfile"], writefirst=True)
+    mononucswithvariantsbedfile = bedtoolslib.intersectbed(outputfiles["coveredmononucsfile"], outputfiles["bencherrortypebed"], outputfiles["mononucswithvariantsfile"], outerjoin=True, writeboth=True)
+    mononucstats = errors.gather_mononuc_stats(outputfiles["mononucswithvariantsfile"], outputfiles["mononucstatsfile"])
+    stats.write_mononuc_stats(mononucstats, outputfiles, rundata["benchmark_stats"], args)
+
+def step_plots(rundata:dict):
+    args = rundata["args"]
+    outputdir = rundata["outputdir"]
+    outputfiles = rundata["outputfiles"]
+    benchparams = rundata["benchparams"]
+    benchmark_stats = rundata["benchmark_stats"]
+    refobj = pysam.FastaFile(args.reffasta)
 
     # plot alignment coverage across assembly and genome:
-    if not no_rscript:
-        logger.info("Step 11 (of 11): Creating plots")
-        if not args.structureonly:
-            plots.plot_benchmark_align_coverage(args.assembly, args.benchmark, outputdir, benchparams)
-            plots.plot_testassembly_align_coverage(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
-            plots.plot_assembly_error_stats(args.assembly, args.benchmark, outputdir)
-            if alignobj is not None:
-                plots.plot_mononuc_accuracy(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
-                if len(alignedscorecounts) > 0:
-                    plots.plot_qv_score_concordance(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
-        plots.plot_svcluster_align_plots(args.assembly, args.benchmark, outputfiles["alignplotdir"], refobj, mode='bench')
-        plots.run_ngax_plot(args.assembly, args.benchmark, outputdir, benchparams["nonnseq"], benchparams["resourcedir"])
-        plots.plot_mononuc_accuracy(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
+    logger.info("Step 11 (of 11): Creating plots")
+    if not args.structureonly:
+        plots.plot_benchmark_align_coverage(args.assembly, args.benchmark, outputdir, benchparams)
+        plots.plot_testassembly_align_coverage(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
         plots.plot_assembly_error_stats(args.assembly, args.benchmark, outputdir)
-        plots.plot_assembly_discrepancy_counts(args.assembly, args.benchmark,  outputdir)
-        if "assemblyqv" in benchmark_stats.keys():
-            assemblyqv = benchmark_stats["assemblyqv"]
-        else:
-            assemblyqv = "NA"
-        plots.plot_assembly_summary_stats(args.assembly, args.benchmark,  outputdir, benchparams["nonnseq"], benchparams["resourcedir"], assemblyqv=assemblyqv)
+        plots.plot_mononuc_accuracy(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
+        if len(rundata["alignedscorecounts"]) > 0:
+            plots.plot_qv_score_concordance(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
+    plots.plot_svcluster_align_plots(args.assembly, args.benchmark, outputfiles["alignplotdir"], refobj, mode='bench')
+    plots.run_ngax_plot(args.assembly, args.benchmark, outputdir, benchparams["nonnseq"], benchparams["resourcedir"])
+    plots.plot_mononuc_accuracy(args.assembly, args.benchmark, outputdir, benchparams["resourcedir"])
+    plots.plot_assembly_error_stats(args.assembly, args.benchmark, outputdir)
+    plots.plot_assembly_discrepancy_counts(args.assembly, args.benchmark,  outputdir)
+    if "assemblyqv" in benchmark_stats.keys():
+        assemblyqv = benchmark_stats["assemblyqv"]
+    else:
+        assemblyqv = "NA"
+    plots.plot_assembly_summary_stats(args.assembly, args.benchmark,  outputdir, benchparams["nonnseq"], benchparams["resourcedir"], assemblyqv=assemblyqv)
+
+# files written by step_aligned_bedfiles whose lines are saved with the results of a restricted run:
+COVEREDBEDFILES = ["truthcovered", "testmatcovered", "testpatcovered", "coveredhetsitealleles"]
+
+# save the per-sequence results of a run restricted with --chromosomes or --regions so that assemblybench-merge
+# can combine them with those of runs on other benchmark sequences:
+def step_save_results(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+
+    benchresults = {"benchmarksequences": rundata["benchmarksequences"], "args": vars(args), "rlis_aligndata": rundata["rlis_aligndata"]}
+    if not args.structureonly:
+        benchresults["variants"] = rundata["variants"]
+        for countkey in ["alignedscorecounts", "snverrorscorecounts", "indelerrorscorecounts"]:
+            benchresults[countkey] = rundata[countkey]
+        benchresults["bedlines"] = {}
+        for filekey in COVEREDBEDFILES:
+            benchresults["bedlines"][filekey] = []
+            if os.path.exists(outputfiles[filekey]):
+                with open(outputfiles[filekey], "r") as bfh:
+                    benchresults["bedlines"][filekey] = bfh.readlines()
+    write_bench_results(benchresults, outputfiles["benchresultsstate"])
+
+    return {"alignments": len(rundata["rlis_aligndata"])}
+
+def write_bench_results(benchresults:dict, statefile:str):
+    with open(statefile, "wb") as sfh:
+        pickle.dump(benchresults, sfh)
+    logger.info("Wrote results for benchmark sequences " + ",".join(benchresults["benchmarksequences"]) + " to " + statefile)
+
+def read_bench_results(statefile:str)->dict:
+    if not os.path.isfile(statefile):
+        logger.critical("Saved assemblybench results " + statefile + " do not exist--was assemblybench run with --chromosomes or --regions?")
+        print("Saved assemblybench results " + statefile + " do not exist--was assemblybench run with --chromosomes or --regions?")
+        exit(1)
+    with open(statefile, "rb") as sfh:
+        return pickle.load(sfh)
+
+# sort keys for the lines of the covered bed files, matching the order in which alignparse.write_bedfiles writes them.
+# Ties in position are broken by the benchmark sequence the line came from, which is the order of a whole-benchmark run:
+def covered_bed_sort_key(filekey:str, bedline:str, chromindices:dict)->tuple:
+    fields = bedline.rstrip("\n").split("\t")
+    position = (fields[0], int(fields[1]), int(fields[2]))
+    if filekey == "truthcovered":
+        return position
+    elif filekey == "coveredhetsitealleles":
+        return position + (chromindices[fields[5]],)
+    else:
+        return position + (chromindices[fields[3].rsplit(".", 3)[0]],)
+
+# combine the saved results of runs on different benchmark sequences into the data the stats steps use:
+def step_merge_results(rundata:dict):
+    args = rundata["args"]
+    outputfiles = rundata["outputfiles"]
+    benchresults = rundata["benchresults"]
+    refobj = pysam.FastaFile(args.reffasta)
+    chromindices = dict([(chrom, chromindex) for chromindex, chrom in enumerate(refobj.references)])
+
+    logger.info("Combining the results of " + str(len(benchresults)) + " assemblybench runs")
+    # mummermethods.filter_aligns puts the alignments of each benchmark sequence in front of those of earlier ones:
+    rlis_aligndata = [align for results in benchresults for align in results["rlis_aligndata"]]
+    rundata["rlis_aligndata"] = sorted(rlis_aligndata, key=lambda align: -chromindices[align["target"]])
+    if args.structureonly:
+        return {"alignments": len(rlis_aligndata)}
+
+    # variants are excluded by name, so a name excluded in one run's sequences is excluded in all of them, as in a
+    # whole-benchmark run:
+    variants = [variant for results in benchresults for variant in results["variants"]]
+    excludednames = dict([(variant.name, True) for variant in variants if variant.excluded])
+    variants = alignparse.mark_excluded_variants(variants, excludednames)
+    rundata["variants"] = sorted(variants, key=lambda variant: chromindices[variant.chrom])
+    for countkey in ["alignedscorecounts", "snverrorscorecounts", "indelerrorscorecounts"]:
+        rundata[countkey] = []
+        for results in benchresults:
+            alignparse.add_score_counts(rundata[countkey], results[countkey])
+    for filekey in COVEREDBEDFILES:
+        bedlines = [bedline for results in benchresults for bedline in results["bedlines"][filekey]]
+        with open(outputfiles[filekey], "w") as bfh:
+            bfh.writelines(sorted(bedlines, key=lambda bedline: covered_bed_sort_key(filekey, bedline, chromindices)))
+    merge_covered_bedfiles(rundata)
+
+    return {"alignments": len(rlis_aligndata), "variants": len(variants)}
+
+# the steps of the pipeline and the steps each one depends on. Steps that write to
+# the general stats file depend on one another so that its sections stay in order.
+# Each step also lists the external files it reads, the arguments that change its
+# results and the files it writes, which the run's manifest uses to decide whether
+# outputs from an earlier run can be reused:
+def define_pipeline_steps(args, no_rscript:bool)->list:
+    steps = []
+    steps.append(pipeline.define_step("genomebeds", step_genome_bedfiles,
+        inputs=lambda rundata: [args.queryfasta, args.reffasta, args.excludefile, args.includefile, args.n_bedfile, rundata["benchparams"].get("excluderegions"), rundata["benchparams"].get("nstretchregions")],
+        params=["minns", "excludefile", "includefile", "n_bedfile"],
+        outputs=lambda rundata: [outputfile for outputfile in [rundata["outputfiles"]["testgenomebed"], rundata["outputfiles"]["testnonnbed"], rundata["outputfiles"]["testnbed"], rundata["outputfiles"]["allexcludedbed"]] if outputfile is not None]))
+    steps.append(pipeline.define_step("generalstats", step_general_stats, requires=["genomebeds"],
+        params=["mincontiglength", "chromosomes", "regions"],
+        outputs=lambda rundata: [rundata["outputfiles"]["generalstatsfile"], rundata["outputfiles"]["contiglengths"], rundata["outputfiles"]["scaffoldlengths"]]))
+    steps.append(pipeline.define_step("hapmermarkers", step_hapmer_markers,
+        inputs=lambda rundata: [args.queryfasta, rundata["benchparams"]["matmarkerdb"], rundata["benchparams"]["patmarkerdb"]],
+        outputs=lambda rundata: [rundata["outputfiles"]["phasemarkerbed"], rundata["outputfiles"]["mergedphasemarkerbed"]]))
+    steps.append(pipeline.define_step("phaseblocks", step_phase_blocks, requires=["hapmermarkers"],
+        params=["merquryblocks", "shortnum", "shortlimit", "alpha", "beta"],
+        outputs=lambda rundata: [rundata["outputfiles"]["phaseblockbed"]]))
+    for haplotype in ["mat", "pat"]:
+        steps.append(pipeline.define_step(haplotype + "align", lambda rundata, hap=haplotype: step_align_haplotype(rundata, hap),
+            inputs=lambda rundata, hap=haplotype: [args.queryfasta, rundata["benchparams"][hap + "benchmark"]],
+            params=["aligner"],
+            outputs=lambda rundata, hap=haplotype: [align.benchmark_haplotype_bamfile(hap, rundata["outputfiles"], args)]))
+        steps.append(pipeline.define_step(haplotype + "trim", lambda rundata, hap=haplotype: step_trim_haplotype_aligns(rundata, hap), requires=[haplotype + "align", "phaseblocks"],
+            outputs=lambda rundata, hap=haplotype: [rundata["outputfiles"]["trimmedphasedalignprefix"] + "." + hap + ".bam"]))
+    steps.append(pipeline.define_step("mergetrimmed", step_merge_trimmed_aligns, requires=["mattrim", "pattrim"],
+        inputs=lambda rundata: [rundata["benchparams"]["benchdiploidheader"]],
+        outputs=lambda rundata: [rundata["trimmedphasedbam"]]))
+    steps.append(pipeline.define_step("filteraligns", step_filter_aligns, requires=["mergetrimmed"],
+        params=["nosplit", "splitdistance", "minalignlength", "chromosomes", "regions"],
+        outputs=lambda rundata: [] if args.nosplit else [rundata["trimmedphasedbam"].replace(".bam", ".split.sort.bam")]))
+    steps.append(pipeline.define_step("structure", step_overall_structure, requires=["filteraligns", "generalstats"],
+        params=["maxclusterdistance", "minalignlength"]))
+    finalsteps = ["structure"]
+    if not args.structureonly:
+        steps.append(pipeline.define_step("hetsites", step_read_hetsites,
+            inputs=lambda rundata: [rundata["benchparams"]["hetsitevariants"]],
+            params=["chromosomes", "regions"]))
+        steps.append(pipeline.define_step("alignedbedfiles", step_aligned_bedfiles, requires=["filteraligns", "hetsites", "genomebeds"],
+            params=["variantfile", "minalignlength"],
+            outputs=lambda rundata: [rundata["outputfiles"][filekey] for filekey in ["testmatcovered", "testpatcovered", "truthcovered", "coveredhetsitealleles"]]))
+        steps.append(pipeline.define_step("alignedstats", step_merged_aligned_stats, requires=["alignedbedfiles", "structure"]))
+        steps.append(pipeline.define_step("hetstats", step_het_stats, requires=["alignedstats"]))
+        steps.append(pipeline.define_step("classifyerrors", step_classify_errors, requires=["hetstats"],
+            params=["vcf"]))
+        steps.append(pipeline.define_step("mononucs", step_mononuc_accuracy, requires=["classifyerrors"],
+            inputs=lambda rundata: [rundata["benchparams"]["mononucruns"]]))
+        finalsteps.append("mononucs")
+    if args.chromosomes is not None or args.regions is not None:
+        steps.append(pipeline.define_step("saveresults", step_save_results, requires=["structure"] + ([] if args.structureonly else ["alignedbedfiles"]),
+            outputs=lambda rundata: [rundata["outputfiles"]["benchresultsstate"]]))
+    if not no_rscript:
+        steps.append(pipeline.define_step("plots", step_plots, requires=finalsteps))
+
+    return steps
+
+# steps of a restricted run whose results are combined by assemblybench-merge:
+MERGEDSTEPS = ["hapmermarkers", "phaseblocks", "matalign", "mattrim", "patalign", "pattrim", "mergetrimmed", "filteraligns", "alignedbedfiles"]
+
+# assemblybench-merge runs the steps that follow the aligned bed files, with the results of the restricted
+# runs in place of the phasing, alignment and bed file steps. The merge step takes on the requirements of the
+# steps it replaces (e.g., reading the het sites, which error classification needs):
+def define_merge_pipeline_steps(args, no_rscript:bool)->list:
+    mergerequires = []
+    steps = []
+    for step in define_pipeline_steps(args, no_rscript):
+        if step["name"] in MERGEDSTEPS:
+            mergerequires.extend([required for required in step["requires"] if required not in MERGEDSTEPS and required not in mergerequires])
+            continue
+        requires = []
+        for required in step["requires"]:
+            if required in MERGEDSTEPS:
+                required = "mergeresults"
+            if required not in requires:
+                requires.append(required)
+        step["requires"] = requires
+        steps.append(step)
+    steps.insert(0, pipeline.define_step("mergeresults", step_merge_results, requires=mergerequires,
+        inputs=lambda rundata: rundata["benchresultsfiles"]))
+
+    return steps
+
+def main() -> None:
+
+    args = parse_arguments(sys.argv[1:])
+
+    logfile = args.prefix + ".log"
+    logformat = '%(asctime)s %(message)s'
+    if args.debug:
+        logging.basicConfig(filename=logfile, level=logging.DEBUG, format=logformat)
+        logger.info('Logging verbose output to ' + logfile + ' for debugging.')
+    else:
+        logging.basicConfig(filename=logfile, level=logging.INFO, format=logformat)
+
+    # log the command line:
+    call_command = " ".join(sys.argv)
+    logger.info(call_command)
+
+    # check for necessary installed programs and write an output directory:
+    check_for_bedtools()
+    check_for_aligner(args.aligner)
+    no_rscript = check_for_R()
+
+    # dictionary of parameters from the benchmark configuration file:
+    benchparams = read_config_data(args)
+
+    # the benchmark and test assembly fasta files must exist (each step opens its own pysam objects):
+    ref = Path(args.reffasta)
+    query = Path(args.queryfasta)
+    if not ref.is_file() or not query.is_file():
+        logger.critical("Ref fasta file " + args.reffasta + " and query fasta file " + args.queryfasta + " must exist and be readable")
+        exit(1)
+
+    outputdir = output.create_output_directory(args.prefix)
+
+    # dictionary of this run's output file names:
+    outputfiles = output.name_output_files(args, outputdir)
+
+    # dictionary of data shared between pipeline steps:
+    rundata = {}
+    rundata["args"] = args
+    rundata["benchparams"] = benchparams
+    rundata["outputdir"] = outputdir
+    rundata["outputfiles"] = outputfiles
+    rundata["bedregiondict"] = {}
+    rundata["trimmedphasedbam"] = outputfiles["trimmedphasedalignprefix"] + ".merge.sort.bam"
+    # benchmark sequences selected with --chromosomes or --regions (None to assess the whole benchmark):
+    rundata["benchmarksequences"] = select_benchmark_sequences(pysam.FastaFile(args.reffasta), args)
+    # record of the inputs, arguments and code version used to create each step's outputs:
+    rundata["manifest"] = pipeline.read_manifest(outputfiles["manifest"])
+
+    # the -t threads are shared by the steps that run at the same time:
+    [args.parallelsteps, args.t] = pipeline.share_threads(args.t, args.parallelsteps)
+
+    steps = define_pipeline_steps(args, no_rscript)
+    pipeline.run_steps(steps, rundata, maxparallel=args.parallelsteps)
+
+    # time and resources used by each step:
+    telemetry.write_telemetry(rundata["telemetry"], outputfiles["telemetryfile"], command=call_command)
+
+# options that can differ between the assemblybench runs combined by merge_main:
+MERGEVARYINGOPTIONS = ['prefix', 'chromosomes', 'regions', 't', 'parallelsteps', 'debug']
+
+# checks that the assemblybench runs combined by merge_main used the same options (other than MERGEVARYINGOPTIONS)
+# and assessed different benchmark sequences, returning the run prefix that assessed each sequence:
+def check_bench_results(runprefixes:list, benchresults:list)->dict:
+    runargs = benchresults[0]["args"]
+    assessedsequences = {}
+    for runprefix, results in zip(runprefixes, benchresults):
+        for option in runargs:
+            if option not in MERGEVARYINGOPTIONS and results["args"].get(option) != runargs[option]:
+                logger.critical("Assemblybench runs " + runprefixes[0] + " and " + runprefix + " used different values of option " + option)
+                print("Assemblybench runs " + runprefixes[0] + " and " + runprefix + " used different values of option " + option)
+                exit(1)
+        for chrom in results["benchmarksequences"]:
+            if chrom in assessedsequences:
+                logger.critical("Assemblybench runs " + assessedsequences[chrom] + " and " + runprefix + " both assessed benchmark sequence " + chrom)
+                print("Assemblybench runs " + assessedsequences[chrom] + " and " + runprefix + " both assessed benchmark sequence " + chrom)
+                exit(1)
+            assessedsequences[chrom] = runprefix
+
+    return assessedsequences
+
+def merge_main() -> None:
+
+    mergeargs = parse_merge_arguments(sys.argv[1:])
+
+    logfile = mergeargs.prefix + ".log"
+    logformat = '%(asctime)s %(message)s'
+    if mergeargs.debug:
+        logging.basicConfig(filename=logfile, level=logging.DEBUG, format=logformat)
+        logger.info('Logging verbose output to ' + logfile + ' for debugging.')
+    else:
+        logging.basicConfig(filename=logfile, level=logging.INFO, format=logformat)
+
+    call_command = " ".join(sys.argv)
+    logger.info(call_command)
+
+    check_for_bedtools()
+    no_rscript = check_for_R()
+
+    benchresultsfiles = []
+    benchresults = []
+    for runprefix in mergeargs.runprefixes:
+        benchresultsfiles.append(output.bench_results_state_file(Path(runprefix).as_posix(), mergeargs.assembly))
+        logger.info("Reading assemblybench results from " + benchresultsfiles[-1])
+        benchresults.append(read_bench_results(benchresultsfiles[-1]))
+
+    # the combined results are written with the options of the assemblybench runs:
+    assessedsequences = check_bench_results(mergeargs.runprefixes, benchresults)
+    runargs = benchresults[0]["args"]
+    args = argparse.Namespace(**runargs)
+    args.prefix = mergeargs.prefix
+    args.t = mergeargs.t
+    args.parallelsteps = mergeargs.parallelsteps
+    args.debug = mergeargs.debug
+    args.chromosomes = None
+    args.regions = None
+
+    benchparams = read_config_data(args)
+    refobj = pysam.FastaFile(args.reffasta)
+    outputdir = output.create_output_directory(args.prefix)
+    outputfiles = output.name_output_files(args, outputdir)
+
+    rundata = {}
+    rundata["args"] = args
+    rundata["benchparams"] = benchparams
+    rundata["outputdir"] = outputdir
+    rundata["outputfiles"] = outputfiles
+    rundata["bedregiondict"] = {}
+    rundata["benchresultsfiles"] = benchresultsfiles
+    rundata["benchresults"] = benchresults
+    # benchmark totals are those of the sequences the runs assessed unless they cover the whole benchmark:
+    rundata["benchmarksequences"] = [chrom for chrom in refobj.references if chrom in assessedsequences]
+    if len(rundata["benchmarksequences"]) < len(refobj.references):
+        logger.warning("Assemblybench runs assessed " + str(len(rundata["benchmarksequences"])) + " of the " + str(len(refobj.references)) + " benchmark sequences")
+    else:
+        rundata["benchmarksequences"] = None
+    rundata["manifest"] = pipeline.read_manifest(outputfiles["manifest"])
+
+    [args.parallelsteps, args.t] = pipeline.share_threads(args.t, args.parallelsteps)
+    steps = define_merge_pipeline_steps(args, no_rscript)
+    pipeline.run_steps(steps, rundata, maxparallel=args.parallelsteps)
+
+    telemetry.write_telemetry(rundata["telemetry"], outputfiles["telemetryfile"], command=call_command)
 
 
 if __name__ == "__main__":
@@ -22,6 +22,8 @@ from GQC import errors
 from GQC import mummermethods
 from GQC import structvar
 from GQC import plots
+from GQC import pipeline
+from GQC import telemetry
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +84,8 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('--splitdistance', type=int, required=False, default=10000, help='By default, split alignments when they contain indels of this size or greater')
     parser.add_argument('--maxclusterdistance', type=int, required=False, default=10000, help='maximum distance within a cluster of alignments')
     parser.add_argument('--vcf', action='store_true', required=False, default=False, help='write differences between assemblies in VCF (as well as BED) format')
+    parser.add_argument('--variantengine', type=str, required=False, default='numpy', choices=['numpy', 'python'], help='method for finding SNVs within aligned blocks: numpy compares whole blocks as arrays, python compares them base by base (slower, same results)')
+    parser.add_argument('--seqwindow', type=int, required=False, default=10000000, help='read the sequences of alignments longer than this from the fasta files in windows of this size rather than all at once, to limit memory use (0 to always read whole alignments)')
     parser.add_argument('--haploid', action='store_true', required=False, help='run with just haploid assemblies q1 and r1')
     parser.add_argument('--hap2dip', action='store_true', required=False, help='compare a haploid assembly q1 to ref haplotypes r1 and r2')
     parser.add_argument('--debug', action='store_true', required=False, help='print verbose output to log file for debugging purposes')
@@ -187,14 +191,25 @@ def main() -> None:
     comparisonoutputfiles = {}
     
     outputdir = output.create_output_directory(args.prefix)
+
+    # record of the inputs, arguments and code version used to create each output, so that
+    # outputs from an earlier run are only reused when they are still valid:
+    compareoutputfiles = output.name_compare_output_files(args, outputdir)
+    manifest = pipeline.read_manifest(compareoutputfiles["manifest"])
     
+    # time and resources used by each step, and the numbers of items it processed:
+    telemetryrecords = []
+    haplotypebases = sum(sum(hapdata[haplotype]['pysamobj'].lengths) for haplotype in hapdata.keys())
+
     logger.info("Step 1 (of n): Scanning assembly sequences for N stretches, contig and scaffold lengths, etc.")
+    steprecord = telemetry.start_step("assemblybedfiles")
     bedregiondict = {}
     
     for haplotype in hapdata.keys():
         hapdict = hapdata[haplotype]
         seqparse.write_assembly_bedfiles(hapdict['pysamobj'], args, compareparams, hapdict['prefix'], bedregiondict)
         stats.write_assembly_haplotype_stats(hapdict['pysamobj'], bedregiondict[hapdict['prefix'] + "nonnregions"], bedregiondict[hapdict['prefix'] + "nregions"], args)
+    telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": haplotypebases}))
    
 
     q1_to_r1_phaseblockints = []
@@ -205,8 +220,10 @@ def main() -> None:
 
     if not args.haploid:
         logger.info("Step 2 (of n): Finding haplotype-specific kmers for each assembly")
+        steprecord = telemetry.start_step("haplotypekmers")
     
-        if not os.path.exists(outputdir + "/r1_not_r2.kmers.k40.ktab") or not os.path.exists(outputdir + "/r2_not_r1.kmers.k40.ktab"):
+        anotbkmerfiles = [outputdir + "/r1_not_r2.kmers.k40.ktab", outputdir + "/r2_not_r1.kmers.k40.ktab"]
+        if pipeline.needs_update(manifest, "anotbkmers", anotbkmerfiles, [hapdata['r1']['fasta'], hapdata['r2']['fasta']]):
             for haplotype in hapdata.keys():
                 hapdict = hapdata[haplotype]
                 kmers.create_kmer_database(hapdict['fasta'], outputdir, hapdict['prefix'])
@@ -218,33 +235,42 @@ def main() -> None:
             for haplotype in hapdata.keys():
                 hapdict = hapdata[haplotype]
                 kmers.remove_kmer_database(outputdir, hapdict['prefix'])
+            pipeline.record_outputs(manifest, "anotbkmers", anotbkmerfiles)
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": haplotypebases}))
        
         logger.info("Step 3 (of n): Writing bed files of kmer locations of " + args.rname + " haplotype markers in the " + args.qname + " assembly")
-        q1hapmerbed = kmers.map_kmer_markers_onto_fasta(hapdata['q1']['fasta'], [outputdir + "/" + 'r1_not_r2.kmers.k40', outputdir + "/" + 'r2_not_r1.kmers.k40'], outputdir)
+        steprecord = telemetry.start_step("hapmermapping")
+        q1hapmerbed = kmers.map_kmer_markers_onto_fasta(hapdata['q1']['fasta'], [outputdir + "/" + 'r1_not_r2.kmers.k40', outputdir + "/" + 'r2_not_r1.kmers.k40'], outputdir, args.t)
         if not args.hap2dip:
-            q2hapmerbed = kmers.map_kmer_markers_onto_fasta(hapdata['q2']['fasta'], [outputdir + "/" + 'r1_not_r2.kmers.k40', outputdir + "/" + 'r2_not_r1.kmers.k40'], outputdir)
+            q2hapmerbed = kmers.map_kmer_markers_onto_fasta(hapdata['q2']['fasta'], [outputdir + "/" + 'r1_not_r2.kmers.k40', outputdir + "/" + 'r2_not_r1.kmers.k40'], outputdir, args.t)
     
+        telemetryrecords.append(telemetry.finish_step(steprecord))
+
         # use HMM algorithm to find matching phase blocks between assemblies
+        steprecord = telemetry.start_step("phaseblocks")
         logger.info("Step 4 (of n): Using HMM with emission probability " + str(args.alpha) + " and transition probability " + str(args.beta) + " to find matching phase blocks between assemblies")
         alpha = args.alpha
         transitionprob = args.beta
         q1phaseblockbed = outputdir + "/" + hapdata['q1']['prefix'] + ".hmmphasedscaffolds.bed"
         q1phaseblockmergedbed = q1phaseblockbed.replace('.bed', '.merged.bed')
         logger.info("Writing phase block bed file of haplotype kmers of " + args.rname + " present within the " + args.qname + " assembly")
-        q1phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(q1hapmerbed, q1phaseblockbed, hapdata['q1']['pysamobj'], alpha, transitionprob, 0)
-        if not os.path.exists(q1phaseblockmergedbed):
+        q1phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(q1hapmerbed, q1phaseblockbed, hapdata['q1']['pysamobj'], alpha, transitionprob, 0, manifest=manifest, numworkers=args.t)
+        if pipeline.needs_update(manifest, q1phaseblockmergedbed, [q1phaseblockmergedbed], [q1hapmerbed], {"alpha": alpha, "beta": transitionprob}):
             q1phaseblockints.saveas(q1phaseblockmergedbed)
+            pipeline.record_outputs(manifest, q1phaseblockmergedbed, [q1phaseblockmergedbed])
         q1_to_r1_phaseblockints = q1phaseblockints.filter(lambda x: x.name=="r1")
         q1_to_r2_phaseblockints = q1phaseblockints.filter(lambda x: x.name=="r2")
 
         if not args.hap2dip:
             q2phaseblockbed = outputdir + "/" + hapdata['q2']['prefix'] + ".hmmphasedscaffolds.bed"
             q2phaseblockmergedbed = q2phaseblockbed.replace('.bed', '.merged.bed')
-            q2phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(q2hapmerbed, q2phaseblockbed, hapdata['q2']['pysamobj'], alpha, transitionprob, 0)
-            if not os.path.exists(q2phaseblockmergedbed):
+            q2phaseblockints = phasing.find_hapmer_phase_blocks_with_hmm(q2hapmerbed, q2phaseblockbed, hapdata['q2']['pysamobj'], alpha, transitionprob, 0, manifest=manifest, numworkers=args.t)
+            if pipeline.needs_update(manifest, q2phaseblockmergedbed, [q2phaseblockmergedbed], [q2hapmerbed], {"alpha": alpha, "beta": transitionprob}):
                 q2phaseblockints.saveas(q2phaseblockmergedbed)
+                pipeline.record_outputs(manifest, q2phaseblockmergedbed, [q2phaseblockmergedbed])
             q2_to_r1_phaseblockints = q2phaseblockints.filter(lambda x: x.name=="r1")
             q2_to_r2_phaseblockints = q2phaseblockints.filter(lambda x: x.name=="r2")
+        telemetryrecords.append(telemetry.finish_step(steprecord))
 
         ##stats.write_phase_block_stats(phaseblockints, outputfiles, benchmark_stats, args)
         #q1_to_r1_numintervals = len(q1_to_r1_phaseblockints)
@@ -255,68 +281,79 @@ def main() -> None:
    
     # align test assembly separately to each ref haplotype separately:
     logger.info("Step 5 (of n): Aligning test haplotypes separately to reference haplotypes and gathering trimmed alignments of phased assembly regions to their corresponding reference haplotype region")
+    steprecord = telemetry.start_step("alignment")
     if not os.path.exists(hapdata['r1']['prefix'] + ".merge.sort.bam"):
         q1_to_r1_prefix = hapdata['q1']['prefix'] + "_to_" + hapdata['r1']['prefix'] + "." + args.aligner
-        q1_to_r1_bamfile = align.align_haplotype_to_haplotype(hapdata['q1']['fasta'], hapdata['r1']['fasta'], q1_to_r1_prefix, compareparams, args)
+        q1_to_r1_bamfile = align.align_haplotype_to_haplotype(hapdata['q1']['fasta'], hapdata['r1']['fasta'], q1_to_r1_prefix, compareparams, args, manifest=manifest)
 
         if not args.haploid:
             q1_to_r2_prefix = hapdata['q1']['prefix'] + "_to_" + hapdata['r2']['prefix'] + "." + args.aligner
-            q1_to_r2_bamfile = align.align_haplotype_to_haplotype(hapdata['q1']['fasta'], hapdata['r2']['fasta'], q1_to_r2_prefix, compareparams, args)
+            q1_to_r2_bamfile = align.align_haplotype_to_haplotype(hapdata['q1']['fasta'], hapdata['r2']['fasta'], q1_to_r2_prefix, compareparams, args, manifest=manifest)
             if not args.hap2dip:
                 q2_to_r1_prefix = hapdata['q2']['prefix'] + "_to_" + hapdata['r1']['prefix'] + "." + args.aligner
-                q2_to_r1_bamfile = align.align_haplotype_to_haplotype(hapdata['q2']['fasta'], hapdata['r1']['fasta'], q2_to_r1_prefix, compareparams, args)
+                q2_to_r1_bamfile = align.align_haplotype_to_haplotype(hapdata['q2']['fasta'], hapdata['r1']['fasta'], q2_to_r1_prefix, compareparams, args, manifest=manifest)
                 q2_to_r2_prefix = hapdata['q2']['prefix'] + "_to_" + hapdata['r2']['prefix'] + "." + args.aligner
-                q2_to_r2_bamfile = align.align_haplotype_to_haplotype(hapdata['q2']['fasta'], hapdata['r2']['fasta'], q2_to_r2_prefix, compareparams, args)
+                q2_to_r2_bamfile = align.align_haplotype_to_haplotype(hapdata['q2']['fasta'], hapdata['r2']['fasta'], q2_to_r2_prefix, compareparams, args, manifest=manifest)
     
             # read in alignments from BAM format, filtering out secondaries and finding the optimal alignment on the correct haplotype for each phase block in the assembly
             logger.info("Finding subaligns in query alignments for haplotype phase blocked regions of the assembly")
             q1_to_r1_trimmedbamfile = q1_to_r1_bamfile.replace(".bam", ".trimmed.bam")
             q1_to_r1_trimmedsortbamfile = q1_to_r1_bamfile.replace(".bam", ".trimmed.sort.bam")
-            if not os.path.exists(q1_to_r1_trimmedsortbamfile):
+            if pipeline.needs_update(manifest, q1_to_r1_trimmedsortbamfile, [q1_to_r1_trimmedsortbamfile], [q1_to_r1_bamfile, q1phaseblockmergedbed]):
                 alignparse.trim_bamfile_to_intervals(q1_to_r1_bamfile, q1_to_r1_phaseblockints, q1_to_r1_trimmedbamfile, q1_to_r1_bamfile, args, sort=True, index=True)
+                pipeline.record_outputs(manifest, q1_to_r1_trimmedsortbamfile, [q1_to_r1_trimmedsortbamfile])
             comparisondata['q1_to_r1']['bamfile'] = q1_to_r1_trimmedsortbamfile
 
             q1_to_r2_trimmedbamfile = q1_to_r2_bamfile.replace(".bam", ".trimmed.bam")
             q1_to_r2_trimmedsortbamfile = q1_to_r2_bamfile.replace(".bam", ".trimmed.sort.bam")
-            if not os.path.exists(q1_to_r2_trimmedsortbamfile):
+            if pipeline.needs_update(manifest, q1_to_r2_trimmedsortbamfile, [q1_to_r2_trimmedsortbamfile], [q1_to_r2_bamfile, q1phaseblockmergedbed]):
                 alignparse.trim_bamfile_to_intervals(q1_to_r2_bamfile, q1_to_r2_phaseblockints, q1_to_r2_trimmedbamfile, q1_to_r2_bamfile, args, sort=True, index=True)
+                pipeline.record_outputs(manifest, q1_to_r2_trimmedsortbamfile, [q1_to_r2_trimmedsortbamfile])
             comparisondata['q1_to_r2']['bamfile'] = q1_to_r2_trimmedsortbamfile
 
             if not args.hap2dip:
                 q2_to_r1_trimmedbamfile = q2_to_r1_bamfile.replace(".bam", ".trimmed.bam")
                 q2_to_r1_trimmedsortbamfile = q2_to_r1_bamfile.replace(".bam", ".trimmed.sort.bam")
-                if not os.path.exists(q2_to_r1_trimmedsortbamfile):
+                if pipeline.needs_update(manifest, q2_to_r1_trimmedsortbamfile, [q2_to_r1_trimmedsortbamfile], [q2_to_r1_bamfile, q2phaseblockmergedbed]):
                     alignparse.trim_bamfile_to_intervals(q2_to_r1_bamfile, q2_to_r1_phaseblockints, q2_to_r1_trimmedbamfile, q2_to_r1_bamfile, args, sort=True, index=True)
+                    pipeline.record_outputs(manifest, q2_to_r1_trimmedsortbamfile, [q2_to_r1_trimmedsortbamfile])
                 comparisondata['q2_to_r1']['bamfile'] = q2_to_r1_trimmedsortbamfile
     
                 q2_to_r2_trimmedbamfile = q2_to_r2_bamfile.replace(".bam", ".trimmed.bam")
                 q2_to_r2_trimmedsortbamfile = q2_to_r2_bamfile.replace(".bam", ".trimmed.sort.bam")
-                if not os.path.exists(q2_to_r2_trimmedsortbamfile):
+                if pipeline.needs_update(manifest, q2_to_r2_trimmedsortbamfile, [q2_to_r2_trimmedsortbamfile], [q2_to_r2_bamfile, q2phaseblockmergedbed]):
                     alignparse.trim_bamfile_to_intervals(q2_to_r2_bamfile, q2_to_r2_phaseblockints, q2_to_r2_trimmedbamfile, q2_to_r2_bamfile, args, sort=True, index=True)
+                    pipeline.record_outputs(manifest, q2_to_r2_trimmedsortbamfile, [q2_to_r2_trimmedsortbamfile])
                 comparisondata['q2_to_r2']['bamfile'] = q2_to_r2_trimmedsortbamfile
     
         else: 
             comparisondata['q1_to_r1']['bamfile'] = q1_to_r1_bamfile
  
+    telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": haplotypebases}))
+
     logger.info("Step 6 (of 11): Filtering alignments to include primary best increasing subset")
 
     for comparison in comparisondata.keys():
+        steprecord = telemetry.start_step(comparison + ".structure")
         trimmedphasedbam = comparisondata[comparison]['bamfile']
         refobj = comparisondata[comparison]['refobj']
         queryobj = comparisondata[comparison]['queryobj']
         if not args.nosplit:
             splitbam_name = trimmedphasedbam.replace(".bam", ".split.bam")
             splitsortbam_name = splitbam_name.replace(".bam", ".sort.bam")
-            if not os.path.exists(splitsortbam_name):
+            if pipeline.needs_update(manifest, splitsortbam_name, [splitsortbam_name], [trimmedphasedbam], {"splitdistance": args.splitdistance}):
                 alignobj = pysam.AlignmentFile(trimmedphasedbam, "rb")
                 alignparse.split_aligns_and_sort(splitbam_name, alignobj, minindelsize=args.splitdistance)
                 pysam.sort("-o", splitsortbam_name, splitbam_name)
                 pysam.index(splitsortbam_name)
+                pipeline.record_outputs(manifest, splitsortbam_name, [splitsortbam_name])
+            alignedbamfile = splitsortbam_name
             alignobj = pysam.AlignmentFile(splitsortbam_name, "rb")
             aligndata = alignparse.read_bam_aligns(alignobj, args.minalignlength)
             rlis_aligndata = mummermethods.filter_aligns(aligndata, "target")
         else:
-            alignobj = pysam.AlignmentFile(bamfile, "rb")
+            alignedbamfile = trimmedphasedbam
+            alignobj = pysam.AlignmentFile(alignedbamfile, "rb")
             aligndata = alignparse.read_bam_aligns(alignobj, args.minalignlength)
             rlis_aligndata = mummermethods.filter_aligns(aligndata, "target")
 
@@ -331,12 +368,16 @@ def main() -> None:
         comparisonoutputfiles[comparison]['structvariantbed'] = outputdir + "/" + comparison + ".svs.bed"
         bedregiondict["allexcludedregions"] = None
         benchmark_stats = {}
-        if not os.path.exists(comparisonoutputfiles[comparison]['structvariantbed']):
+        structureparams = {"minalignlength": args.minalignlength, "maxclusterdistance": args.maxclusterdistance}
+        if pipeline.needs_update(manifest, comparisonoutputfiles[comparison]['structvariantbed'], [comparisonoutputfiles[comparison]['structvariantbed']], [alignedbamfile], structureparams):
             alignparse.assess_overall_structure(rlis_aligndata, refobj, queryobj, outputfiles, bedregiondict, benchmark_stats, args)
             structvar.write_structural_errors(rlis_aligndata, refobj, queryobj, outputfiles, benchmark_stats, args)
+            pipeline.record_outputs(manifest, comparisonoutputfiles[comparison]['structvariantbed'], [comparisonoutputfiles[comparison]['structvariantbed']])
         else:
             logger.info("Not writing structural variant bed file " + comparisonoutputfiles[comparison]['structvariantbed'] + " because it already exists!")
 
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"alignments": len(aligndata)}))
+
         #stats.write_aligned_cluster_stats(outputfiles, benchmark_stats, args)
 
         # arguments only used in assembly benchmarking:
@@ -348,11 +389,18 @@ def main() -> None:
         excludedregions = None
         hetarraybed = None
 
+        steprecord = telemetry.start_step(comparison + ".bedfiles")
+        # write_bedfiles reuses existing coverage files, so remove them if they're out of date:
+        coveredbedfiles = [querycoveredbedfile, refcoveredbedfile]
+        pipeline.needs_update(manifest, comparison + ".covered", coveredbedfiles, [alignedbamfile], {"minalignlength": args.minalignlength})
         [refcoveredbed, querycoveredbed, variants, hetsitealleles, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts] = alignparse.write_bedfiles(alignobj, pafaligns, refobj, queryobj, hetsites, querycoveredbedfile, outputpat, refcoveredbedfile, hetarraybed, excludedregions, args)
 
         # create merged unique outputfiles:
-        [mergedrefcoveredbed, mergedrefcoveredbedfile] = bedtoolslib.mergebed(refcoveredbedfile)
-        [mergedquerycoveredbed, mergedquerycoveredbedfile] = bedtoolslib.mergebed(querycoveredbedfile)
+        pipeline.record_outputs(manifest, comparison + ".covered", coveredbedfiles)
+        [mergedrefcoveredbed, mergedrefcoveredbedfile] = bedtoolslib.mergebed(refcoveredbedfile, manifest=manifest)
+        [mergedquerycoveredbed, mergedquerycoveredbedfile] = bedtoolslib.mergebed(querycoveredbedfile, manifest=manifest)
+
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"variants": len(variants)}))
 
         comparisonoutputfiles[comparison]['refcoveredbed'] = refcoveredbed
         comparisonoutputfiles[comparison]['refcoveredbedfile'] = refcoveredbedfile
@@ -367,60 +415,71 @@ def main() -> None:
         if alignobj is not None:
             # classify variant errors as phasing or novel errors:
             logger.info("Step 8 (of 11): Writing discrepancy files")
+            steprecord = telemetry.start_step(comparison + ".discrepancies")
             #stats.write_het_stats(outputfiles, benchmark_stats, args)
             outputfiles["testerrortypebed"] = outputdir + "/" + comparison + ".querydiscrepancies.bed"
             outputfiles["bencherrortypebed"] = outputdir + "/" + comparison + ".refdiscrepancies.bed"
-            if not os.path.exists(outputfiles["testerrortypebed"]) or not os.path.exists(outputfiles["bencherrortypebed"]):
+            discrepancyfiles = [outputfiles["testerrortypebed"], outputfiles["bencherrortypebed"]]
+            if pipeline.needs_update(manifest, comparison + ".discrepancies", discrepancyfiles, [alignedbamfile], {"minalignlength": args.minalignlength, "vcf": args.vcf}):
                 errors.classify_errors(refobj, queryobj, variants, hetsites, outputfiles, compareparams, benchmark_stats, args)
+                pipeline.record_outputs(manifest, comparison + ".discrepancies", discrepancyfiles)
             else:
                 logger.info("Skipping writing discrepancy files--" + outputfiles["testerrortypebed"] + " and " + outputfiles["bencherrortypebed"] + " already exist!")
             comparisonoutputfiles[comparison]['queryerrorbed'] = outputdir + "/" + comparison + ".querydiscrepancies.bed"
             comparisonoutputfiles[comparison]['referrorbed'] = outputdir + "/" + comparison + ".refdiscrepancies.bed"
             if args.vcf:
                 comparisonoutputfiles[comparison]['referrorvcf'] = outputdir + "/" + comparison + ".refdiscrepancies.vcf"
+            telemetryrecords.append(telemetry.finish_step(steprecord, {"variants": len(variants)}))
             #stats.write_qv_stats(benchmark_stats, alignedscorecounts, snverrorscorecounts, indelerrorscorecounts, outputfiles, args)
 
     # Report general statistics across all haplotype comparisons:
     #stats.write_comparison_stats_file(hapdata, comparisondata, comparisonoutputfiles)
 
     # combine BED/VCF files:
+    steprecord = telemetry.start_step("combinedfiles")
     # Structural variants:
     combinedsvfile = outputdir + "/" + args.qname + "_vs_" + args.rname + ".svs.sort.bed"
-    if not os.path.exists(combinedsvfile):
+    svfiles = [comparisonoutputfiles[comparison]['structvariantbed'] for comparison in comparisondata.keys()]
+    if pipeline.needs_update(manifest, combinedsvfile, [combinedsvfile], svfiles):
         combinedsvbedstring = ""
         for comparison in comparisondata.keys():
             with open(comparisonoutputfiles[comparison]['structvariantbed']) as svfh:
                 combinedsvbedstring = combinedsvbedstring + svfh.read()
         combinedsvobj = pybedtools.bedtool.BedTool(combinedsvbedstring, from_string=True)
         combinedsvobj.sort().saveas(combinedsvfile)
+        pipeline.record_outputs(manifest, combinedsvfile, [combinedsvfile])
 
     # Combined coverage of reference:
     combinedcovfile = outputdir + "/" + args.qname + "_vs_" + args.rname + ".refcovered.sort.bed"
-    if not os.path.exists(combinedcovfile):
+    covfiles = [comparisonoutputfiles[comparison]['refcoveredbedfile'] for comparison in comparisondata.keys()]
+    if pipeline.needs_update(manifest, combinedcovfile, [combinedcovfile], covfiles):
         combinedcovbedstring = ""
         for comparison in comparisondata.keys():
             with open(comparisonoutputfiles[comparison]['refcoveredbedfile']) as covfh:
                 combinedcovbedstring = combinedcovbedstring + covfh.read()
         combinedcovobj = pybedtools.BedTool(combinedcovbedstring, from_string=True)
         combinedcovobj.sort().saveas(combinedcovfile)
+        pipeline.record_outputs(manifest, combinedcovfile, [combinedcovfile])
     else:
         combinedcovobj = pybedtools.BedTool(combinedcovfile)
 
     # Combined coverage of query:
     combinedcovfile = outputdir + "/" + args.rname + "_vs_" + args.qname + ".querycovered.sort.bed"
-    if not os.path.exists(combinedcovfile):
+    covfiles = [comparisonoutputfiles[comparison]['querycoveredbedfile'] for comparison in comparisondata.keys()]
+    if pipeline.needs_update(manifest, combinedcovfile, [combinedcovfile], covfiles):
         combinedcovbedstring = ""
         for comparison in comparisondata.keys():
             with open(comparisonoutputfiles[comparison]['querycoveredbedfile']) as covfh:
                 combinedcovbedstring = combinedcovbedstring + covfh.read()
         combinedcovobj = pybedtools.BedTool(combinedcovbedstring, from_string=True)
         combinedcovobj.sort().saveas(combinedcovfile)
+        pipeline.record_outputs(manifest, combinedcovfile, [combinedcovfile])
     else:
         combinedcovobj = pybedtools.BedTool(combinedcovfile)
 
     # Uncovered regions in the reference:
     uncoveredfile = outputdir + "/" + args.qname + "_vs_" + args.rname + ".refuncovered.sort.bed"
-    if not os.path.exists(uncoveredfile):
+    if pipeline.needs_update(manifest, uncoveredfile, [uncoveredfile], [combinedcovfile, hapdata['r1']['fasta'], hapdata['r2']['fasta']]):
         hap1prefix = hapdata['r1']['prefix']
         hap2prefix = hapdata['r2']['prefix']
         hap1bedobj = bedregiondict[hap1prefix + "genomeregions"]
@@ -429,10 +488,12 @@ def main() -> None:
 
         uncoveredbedtool = bedtoolslib.subtractintervals(genomebedtool, combinedcovobj)
         uncoveredbedtool.sort().saveas(uncoveredfile)
+        pipeline.record_outputs(manifest, uncoveredfile, [uncoveredfile])
     
     # Combined reference error bed files:
     combinedreferrorfile = outputdir + "/" + args.qname + "_vs_" + args.rname + ".refdiscrepancies.sort.bed"
-    if not os.path.exists(combinedreferrorfile):
+    referrorfiles = [comparisonoutputfiles[comparison]['referrorbed'] for comparison in comparisondata.keys()]
+    if pipeline.needs_update(manifest, combinedreferrorfile, [combinedreferrorfile], referrorfiles):
         combinedreferrorbedstring = ""
         for comparison in comparisondata.keys():
             with open(comparisonoutputfiles[comparison]['referrorbed']) as referrorfh:
@@ -441,8 +502,10 @@ def main() -> None:
         combinedreferrorobj = pybedtools.BedTool(combinedreferrorbedstring, from_string=True)
         logger.info("Saving to " + combinedreferrorfile)
         combinedreferrorobj.sort().saveas(combinedreferrorfile)
+        pipeline.record_outputs(manifest, combinedreferrorfile, [combinedreferrorfile])
     else:
         combinedreferrorobj = pybedtools.BedTool(combinedreferrorfile)
+    telemetryrecords.append(telemetry.finish_step(steprecord))
     
     # Combined reference error VCF files:
     #if args.vcf:
@@ -487,6 +550,8 @@ def main() -> None:
             refobj = comparisondata[comparison]['refobj']
             plots.plot_svcluster_align_plots(args.qname, args.rname, outputfiles["alignplotdir"], refobj, mode='compare', prefix=comparison)
 
+    telemetry.write_telemetry(telemetryrecords, compareoutputfiles["telemetryfile"], command=call_command)
+
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,14 @@ import os
 import pybedtools
 import logging
 import math
+import hashlib
 import pysam
 import random
 import numpy as np
 import array
 from GQC import bedtoolslib
 from GQC import seqparse
+from GQC import pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -16,32 +18,116 @@ logger = logging.getLogger(__name__)
 # Input: pysam.AlignmentFile object, pysam.FastaFile object, arguments
 # Output: Integer giving the recommended number of bins
 
-def choose_bin_size(alignobj, refobj, includedintervals, args)->int:
+# Numbers of reads arriving in (starting in or, with bincovoverlap, overlapping) each of a list of (chrom, start, end)
+# regions, counted from the alignments:
+def count_region_arrivals(alignobj, regions:list, bincovoverlap:bool)->list:
 
     [intervalstart, intervalend] = [0, 0]
-    totalreads = 0
-    totalrefbases = 0
-    for interval in includedintervals:
-        ref = interval.chrom
-        if ref == "chrM":
-            continue
-        intervalstart = interval.start
-        intervalend = interval.end
-        def startsinbin(read):
-            if read.reference_start >= intervalstart and read.reference_start < intervalend:
-                return True
-            else:
-                return False
+    def startsinbin(read):
+        if read.reference_start >= intervalstart and read.reference_start < intervalend:
+            return True
+        else:
+            return False
 
-        if args.bincovoverlap:
+    regioncounts = []
+    for [ref, intervalstart, intervalend] in regions:
+        if bincovoverlap:
             readsmapped = alignobj.count(contig = ref, start = intervalstart, end = intervalend)
         else:
             readsmapped = alignobj.count(contig = ref, start = intervalstart, end = intervalend, read_callback = startsinbin)
-        totalreads += readsmapped
-        totalrefbases += intervalend - intervalstart
-        logger.debug("Tallied interval " + ref + ":" + str(intervalstart) + "-" + str(intervalend) + "\t" + str(totalreads) + "\t" + str(totalrefbases))
-
+        regioncounts.append(readsmapped)
+        logger.debug("Tallied interval " + ref + ":" + str(intervalstart) + "-" + str(intervalend) + "\t" + str(readsmapped))
+
+    return regioncounts
+
+# Expected numbers of reads arriving in each of a list of regions from the mapped read counts of the BAM index
+# statistics, assuming each chromosome's reads start uniformly along it. With bincovoverlap, reads starting up to a
+# mean aligned length (from the first reads of the file) before a region also overlap it.
+def index_region_arrivals(alignobj, regions:list, bincovoverlap:bool)->list:
+
+    chromreads = {}
+    for indexstats in alignobj.get_index_statistics():
+        chromreads[indexstats.contig] = indexstats.mapped
+
+    meanalignlength = 0
+    if bincovoverlap:
+        alignlengths = [align.reference_length for align in alignobj.head(10000) if align.reference_length is not None]
+        if len(alignlengths) > 0:
+            meanalignlength = sum(alignlengths)/len(alignlengths)
+
+    regionexpectations = []
+    for [ref, intervalstart, intervalend] in regions:
+        chromlength = alignobj.get_reference_length(ref)
+        regionexpectations.append(chromreads.get(ref, 0) * (intervalend - intervalstart + meanalignlength) / chromlength)
+
+    return regionexpectations
+
+# windows of (up to) windowsize bases at evenly spaced positions through the included regions, so that each
+# chromosome is sampled in proportion to its included bases:
+def sample_region_windows(regions:list, numwindows:int, windowsize:int)->list:
+
+    totalbases = sum([intervalend - intervalstart for [ref, intervalstart, intervalend] in regions])
+    windows = []
+    if numwindows <= 0 or totalbases == 0:
+        return windows
+
+    spacing = totalbases / numwindows
+    windowoffset = spacing / 2
+    regionoffset = 0
+    for [ref, intervalstart, intervalend] in regions:
+        while windowoffset < regionoffset + intervalend - intervalstart and len(windows) < numwindows:
+            windowstart = intervalstart + int(windowoffset - regionoffset)
+            windows.append([ref, windowstart, min(intervalend, windowstart + windowsize)])
+            windowoffset += spacing
+        regionoffset += intervalend - intervalstart
+
+    return windows
+
+# Read arrivals per included base, with its relative standard error. The "count" method counts the reads in every
+# included interval. The "index" method uses BAM index statistics, optionally scaled by the ratio of counted to
+# expected reads in a sample of included windows (args.binsizesamples), in which case the error is estimated from the
+# variation of that ratio between windows--otherwise it only reflects Poisson noise, and assumes reads are spread
+# uniformly along each chromosome.
+def estimate_arrivals_per_base(alignobj, includedintervals, args)->list:
+
+    regions = [[interval.chrom, interval.start, interval.end] for interval in includedintervals if interval.chrom != "chrM"]
+    totalrefbases = sum([intervalend - intervalstart for [ref, intervalstart, intervalend] in regions])
+    method = args.binsizemethod if 'binsizemethod' in args else 'count'
+    numsamples = args.binsizesamples if 'binsizesamples' in args else 0
+
+    if method == 'index':
+        try:
+            expectedreads = sum(index_region_arrivals(alignobj, regions, args.bincovoverlap))
+        except (ValueError, AttributeError, NotImplementedError) as indexerror:
+            logger.warning("Unable to estimate arrival rate from index statistics (" + str(indexerror) + ")--counting reads instead")
+            expectedreads = 0
+        if expectedreads > 0:
+            arrivalsperbase = expectedreads/totalrefbases
+            relativeerror = 1/math.sqrt(expectedreads)
+            samplewindows = sample_region_windows(regions, numsamples, 100000)
+            if len(samplewindows) > 0:
+                windowcounts = count_region_arrivals(alignobj, samplewindows, args.bincovoverlap)
+                windowexpectations = index_region_arrivals(alignobj, samplewindows, args.bincovoverlap)
+                windowratios = [windowcounts[i]/windowexpectations[i] for i in range(len(samplewindows)) if windowexpectations[i] > 0]
+                if sum(windowexpectations) > 0:
+                    arrivalsperbase = arrivalsperbase * sum(windowcounts) / sum(windowexpectations)
+                if len(windowratios) > 1 and sum(windowratios) > 0:
+                    meanratio = sum(windowratios)/len(windowratios)
+                    ratiovariance = sum([(ratio - meanratio)**2 for ratio in windowratios])/(len(windowratios) - 1)
+                    relativeerror = math.sqrt(ratiovariance/len(windowratios))/meanratio
+            logger.info("Estimated " + str(arrivalsperbase) + " read arrivals per base from index statistics and " + str(len(samplewindows)) + " sampled windows (relative standard error " + str(round(relativeerror, 4)) + ")")
+            return [arrivalsperbase, relativeerror]
+
+    totalreads = sum(count_region_arrivals(alignobj, regions, args.bincovoverlap))
     arrivalsperbase = totalreads/totalrefbases
+    relativeerror = 1/math.sqrt(totalreads) if totalreads > 0 else 1.0
+    logger.info("Counted " + str(arrivalsperbase) + " read arrivals per base (relative standard error " + str(round(relativeerror, 4)) + ")")
+
+    return [arrivalsperbase, relativeerror]
+
+def choose_bin_size(alignobj, refobj, includedintervals, args)->int:
+
+    [arrivalsperbase, relativeerror] = estimate_arrivals_per_base(alignobj, includedintervals, args)
     requiredbin = 1000/arrivalsperbase
 
     # round binsize to nearest 1000 base pairs
@@ -161,52 +247,139 @@ def write_nonexcluded_bin_counts(outputbed:str, includedintervals:pybedtools.Bed
 
     return 0
 
+# Counts for a bin of the benchmark: the numbers of kmers without Ns that contain only A/T ("at"), only
+# A/G or C/T ("ag"), only A/C or G/T ("ac") and only G/C ("gc"), and the numbers of G/C and other bases.
+# As in the original base-by-base version of this routine, the last kmer of the bin isn't counted, and
+# bins no longer than kmersize have all counts zero.
 def bin_gccontent_extreme_kmers(refobj:pysam.FastaFile, chrom:str, start:int, end:int, kmersize:int):
     logger.debug("Calculating extreme kmer counts for " + chrom + ":" + str(start) + "-" + str(end))
     refsequence = refobj.fetch(reference=chrom, start=start, end=end).upper()
-    [count_at, count_ag, count_ac, count_gc] = [0, 0, 0, 0]
-    # also track the GC content in each bin
-    [count_gcnucs, count_atnucs] = [0, 0]
-    seqstart = 0
-    seqstop = kmersize
-    # count bases in initial kmer:
-    basecounts = {'A':0, 'C':0, 'G':0, 'T':0, 'N':0}
-    binsize = end - start
-    if seqstop < binsize:
-        for i in (range(0, seqstop)):
-            thisnuc = refsequence[i]
-            basecounts[thisnuc] += 1
-            if thisnuc == 'G' or thisnuc == 'C':
-                count_gcnucs += 1
-            else:
-                count_atnucs += 1
-        kmerseq = refsequence[0:seqstop]
-
-    while seqstop < binsize:
-        if basecounts['N']==0:
-            if basecounts['G']==0 and basecounts['C']==0:
-                count_at += 1
-            if basecounts['A']==0 and basecounts['T']==0:
-                count_gc += 1
-            if (basecounts['T']==0 and basecounts['C']==0) or (basecounts['A']==0 and basecounts['G']==0):
-                count_ag += 1
-            if (basecounts['T']==0 and basecounts['G']==0) or (basecounts['A']==0 and basecounts['C']==0):
-                count_ac += 1
-
-        # subtract the first base and add the next:
-        nextbase = refsequence[seqstop]
-        basecounts[kmerseq[0]] -= 1
-        basecounts[nextbase] += 1
-        kmerseq = kmerseq[1:] + nextbase
-        if nextbase == 'G' or nextbase == 'C':
-            count_gcnucs += 1
-        else:
-            count_atnucs += 1
+    seqcodes = np.frombuffer(refsequence.encode(), dtype=np.uint8)
+    bincounts = gccontent_extreme_kmer_counts(seqcodes, len(seqcodes), kmersize)
+
+    return bincounts[0].tolist()
+
+# the columns of the arrays returned by gccontent_extreme_kmer_counts:
+GCTRACKCOLUMNS = ['count_at', 'count_ag', 'count_ac', 'count_gc', 'count_gcnucs', 'count_atnucs']
+
+# Counts of bin_gccontent_extreme_kmers for consecutive bins of binsize bases in an array of (uppercase)
+# base codes, from prefix sums of the occurrences of each base, with one row for each complete bin:
+def gccontent_extreme_kmer_counts(seqcodes:np.ndarray, binsize:int, kmersize:int)->np.ndarray:
+    numbins = len(seqcodes) // binsize if binsize > 0 else 0
+    bincounts = np.zeros((numbins, len(GCTRACKCOLUMNS)), dtype=np.int64)
+    if numbins == 0 or kmersize >= binsize:
+        return bincounts
+
+    seqcodes = seqcodes[:numbins * binsize]
+    isbase = {}
+    for base in "ACGT":
+        isbase[base] = seqcodes == ord(base)
+    isbase['N'] = ~(isbase['A'] | isbase['C'] | isbase['G'] | isbase['T'])
+
+    # whether the kmer starting at each position (within a bin) has none of each base:
+    nobase = {}
+    for base in isbase:
+        prefixsums = np.zeros(len(seqcodes) + 1, dtype=np.int32)
+        np.cumsum(isbase[base], dtype=np.int32, out=prefixsums[1:])
+        kmercounts = prefixsums[kmersize:] - prefixsums[:-kmersize]
+        nobase[base] = np.concatenate((kmercounts == 0, np.zeros(kmersize - 1, dtype=bool))).reshape(numbins, binsize)[:, :binsize - kmersize]
+
+    nonkmers = nobase['N']
+    bincounts[:, 0] = np.count_nonzero(nonkmers & nobase['G'] & nobase['C'], axis=1)
+    bincounts[:, 1] = np.count_nonzero(nonkmers & ((nobase['T'] & nobase['C']) | (nobase['A'] & nobase['G'])), axis=1)
+    bincounts[:, 2] = np.count_nonzero(nonkmers & ((nobase['T'] & nobase['G']) | (nobase['A'] & nobase['C'])), axis=1)
+    bincounts[:, 3] = np.count_nonzero(nonkmers & nobase['A'] & nobase['T'], axis=1)
+    bincounts[:, 4] = np.count_nonzero((isbase['G'] | isbase['C']).reshape(numbins, binsize), axis=1)
+    bincounts[:, 5] = binsize - bincounts[:, 4]
+
+    return bincounts
+
+# worker for gccontent_extreme_kmer_tracks--counts for the complete bins of a chromosome, reading the
+# sequence a few million bases at a time:
+def chrom_gccontent_extreme_kmer_track(reffasta:str, chrom:str, binsize:int, kmersize:int)->np.ndarray:
+    refobj = pysam.FastaFile(reffasta)
+    numbins = refobj.get_reference_length(chrom) // binsize
+    binsperchunk = max(1, 4000000 // binsize)
+    chromcounts = []
+    for firstbin in range(0, numbins, binsperchunk):
+        lastbin = min(numbins, firstbin + binsperchunk)
+        chunksequence = refobj.fetch(reference=chrom, start=firstbin * binsize, end=lastbin * binsize).upper()
+        chromcounts.append(gccontent_extreme_kmer_counts(np.frombuffer(chunksequence.encode(), dtype=np.uint8), binsize, kmersize))
+
+    if len(chromcounts) == 0:
+        return np.zeros((0, len(GCTRACKCOLUMNS)), dtype=np.int64)
+    return np.concatenate(chromcounts)
+
+# directory for track files: the output directory, unless a directory to be shared by runs on the same benchmark
+# (e.g., one next to a shared benchmark resource directory) is given with --trackdir
+def benchmark_track_directory(args)->str:
+    if 'trackdir' in args and args.trackdir:
+        return args.trackdir
+    return args.prefix
+
+# Track files depend only on the benchmark sequence and the parameters used to make them, so they're named by
+# the benchmark fasta's checksum (cached, with the file's size and modification time, in a manifest in the
+# track directory so that the fasta is only re-read when it changes):
+def benchmark_checksum(refobj:pysam.FastaFile, trackdir:str)->str:
+    trackmanifest = pipeline.read_manifest(trackdir + "/gqctracks.manifest.json")
+    reffasta = os.path.abspath(os.fsdecode(refobj.filename))
+    cachedentry = trackmanifest["files"].get(reffasta)
+    benchmarkchecksum = pipeline.file_checksum(trackmanifest, reffasta)
+    # the manifest is shared by all runs on the benchmark, so it's only rewritten when the fasta's entry changes:
+    if trackmanifest["files"].get(reffasta) != cachedentry:
+        pipeline.write_manifest(trackmanifest)
+
+    return benchmarkchecksum
+
+# Track files are written (with pipeline.write_file_atomically) through temporary files of their own, as readbench
+# runs on the same benchmark (e.g., with --shard) can make the same track at the same time. writetrack is called with
+# the temporary file's name, and a track that another run has finished in the meantime is kept:
+def write_track_file(trackfile:str, writetrack):
+    if os.path.exists(trackfile):
+        logger.info("Track file " + trackfile + " was written by another run")
+        return
+    pipeline.write_file_atomically(trackfile, writetrack)
+
+def gc_track_file(refobj:pysam.FastaFile, binsize:int, kmersize:int, trackdir:str)->str:
+    benchmarkchecksum = benchmark_checksum(refobj, trackdir)
+
+    return trackdir + "/gcextremekmers." + benchmarkchecksum[:16] + ".bin" + str(binsize) + ".k" + str(kmersize) + ".npz"
+
+# GC content and extreme kmer counts (columns GCTRACKCOLUMNS) for the complete bins of each chromosome in a
+# dictionary keyed by chromosome, read from a track file from an earlier run if there is one:
+def gccontent_extreme_kmer_tracks(refobj:pysam.FastaFile, binsize:int, kmersize:int, trackdir:str, numworkers=1)->dict:
+    trackfile = gc_track_file(refobj, binsize, kmersize, trackdir)
+    if os.path.exists(trackfile):
+        logger.info("Reading GC content and extreme kmer counts from " + trackfile)
+        with np.load(trackfile) as trackdata:
+            chroms = trackdata["chroms"].tolist()
+            binoffsets = np.concatenate(([0], np.cumsum(trackdata["chrombins"]))).tolist()
+            bincounts = trackdata["bincounts"]
+            return {chrom: bincounts[binoffsets[i]:binoffsets[i+1]] for i, chrom in enumerate(chroms)}
+
+    logger.info("Calculating GC content and extreme kmer counts in bins of " + str(binsize) + " bases")
+    reffasta = os.fsdecode(refobj.filename)
+    tracks = {}
+    if numworkers > 1:
+        with pipeline.worker_pool(numworkers) as executor:
+            chromresults = {}
+            for chrom in sorted(refobj.references, key=lambda c: refobj.get_reference_length(c), reverse=True):
+                chromresults[chrom] = executor.submit(chrom_gccontent_extreme_kmer_track, reffasta, chrom, binsize, kmersize)
+            for chrom in refobj.references:
+                tracks[chrom] = chromresults[chrom].result()
+    else:
+        for chrom in refobj.references:
+            tracks[chrom] = chrom_gccontent_extreme_kmer_track(reffasta, chrom, binsize, kmersize)
 
-        seqstop += 1
+    write_track_file(trackfile, lambda tmpfile: write_gc_track(tracks, tmpfile))
+    logger.info("Wrote GC content and extreme kmer counts to " + trackfile)
 
-    return [count_at, count_ag, count_ac, count_gc, count_gcnucs, count_atnucs]
+    return tracks
 
+def write_gc_track(tracks:dict, trackfile:str):
+    chroms = list(tracks.keys())
+    with open(trackfile, "wb") as tfh:
+        np.savez(tfh, chroms=np.array(chroms), chrombins=np.array([len(tracks[chrom]) for chrom in chroms], dtype=np.int64), bincounts=np.concatenate([tracks[chrom] for chrom in chroms]) if len(chroms) > 0 else np.zeros((0, len(GCTRACKCOLUMNS)), dtype=np.int64))
 
 def count_extreme_kmers_in_bins(outputbed:str, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, coveragebins:pybedtools.BedTool, binsize:int):
     # this should truncate intervals that aren't fully included in the includedintervals:
@@ -225,10 +398,13 @@ def count_extreme_kmers_in_bins(outputbed:str, refobj:pysam.FastaFile, includedi
 
     return 0
 
+# Tallies of alignment starts (+1) and ends (-1, at the last aligned position) at each position of the
+# chromosome, in an int32 array (no position can have more than 2^31 alignments starting there)
 def tally_chrom_starts_ends(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, chrom:str, outputcountbed:str, args):
 
     chromlength = refobj.get_reference_length(chrom)
-    startendcountlist = np.zeros(chromlength, dtype=int)
+    refstarts = array.array('q')
+    reflastpositions = array.array('q')
 
     for align in alignobj.fetch(chrom):
 
@@ -238,16 +414,78 @@ def tally_chrom_starts_ends(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile
         if align.is_secondary or refstart is None or refend is None:
             continue
 
-        startendcountlist[refstart] += 1
-        startendcountlist[refend - 1] -= 1
+        refstarts.append(refstart)
+        reflastpositions.append(refend - 1)
+
+    startendcountlist = np.zeros(chromlength, dtype=np.int32)
+    np.add.at(startendcountlist, np.frombuffer(refstarts, dtype=np.int64), 1)
+    np.subtract.at(startendcountlist, np.frombuffer(reflastpositions, dtype=np.int64), 1)
 
     print("Done with " + chrom)
     logger.debug("Done with " + chrom)
 
     return(startendcountlist)
 
-def tally_bin_coverages(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, includedbed:str, outputcountbed:str, outputincludedcountbed, args):
-
+# Mean depth of each complete bin of binsize bases from the start/end tallies of tally_chrom_starts_ends.
+# The running sum of the tallies (the depth at each position) is computed in place, and summed over bins
+# with int64 totals:
+def bin_mean_depths(startendarray, binsize:int)->list:
+
+    depths = np.cumsum(startendarray, dtype=startendarray.dtype, out=startendarray)
+    numbins = len(depths) // binsize
+    bintotals = depths[:numbins * binsize].reshape(numbins, binsize).sum(axis=1, dtype=np.int64)
+
+    return [1.0*bintotal/binsize for bintotal in bintotals.tolist()]
+
+# Total depth (summed over positions) of each complete bin of binsize bases on a chromosome with numbins complete bins,
+# for alignments starting at refstarts and ending at reflastpositions (tallied as in tally_chrom_starts_ends). Only the
+# positions from the first start to the last end are tallied, so this can be used for a window's alignments (see
+# readpass), and the totals of windows summed:
+def bin_depth_totals(refstarts:np.ndarray, reflastpositions:np.ndarray, numbins:int, binsize:int)->np.ndarray:
+
+    bintotals = np.zeros(numbins, dtype=np.int64)
+    if len(refstarts) == 0:
+        return bintotals
+    firstbin = min(int(refstarts.min()), int(reflastpositions.min())) // binsize
+    lastbin = min(int(reflastpositions.max()) // binsize, numbins - 1)
+    if lastbin < firstbin:
+        return bintotals
+    offset = firstbin * binsize
+    startendarray = np.zeros((lastbin - firstbin + 1) * binsize + 1, dtype=np.int32)
+    # tallies past the last complete bin go in a final element that isn't summed:
+    np.add.at(startendarray, np.minimum(refstarts - offset, len(startendarray) - 1), 1)
+    np.subtract.at(startendarray, np.minimum(reflastpositions - offset, len(startendarray) - 1), 1)
+    depths = np.cumsum(startendarray[:-1], dtype=np.int32)
+    bintotals[firstbin:lastbin + 1] = depths.reshape(lastbin - firstbin + 1, binsize).sum(axis=1, dtype=np.int64)
+
+    return bintotals
+
+# bed lines for a chromosome's complete bins, with the number of G and C bases and the mean depth of each bin:
+def bin_coverage_lines(chrom:str, binaverages:list, binsize:int, gctrack:np.ndarray)->str:
+
+    binlines = []
+    for binindex in range(len(binaverages)):
+        binstart = binindex * binsize
+        count_gcnucs = int(gctrack[binindex][4])
+        binlines.append(chrom + "\t" + str(binstart) + "\t" + str(binstart + binsize) + "\t" + str(count_gcnucs) + "\t" + str(binaverages[binindex]) + "\n")
+
+    return "".join(binlines)
+
+# worker for tally_bin_coverages--opens its own pysam file handles and returns the bed lines for a chromosome's bins:
+def tally_chrom_bin_coverages(bamfile:str, reffasta:str, chrom:str, binsize:int, gctrack:np.ndarray, outputcountbed:str, args)->str:
+
+    alignobj = pysam.AlignmentFile(bamfile, "rb")
+    refobj = pysam.FastaFile(reffasta)
+    startendarray = tally_chrom_starts_ends(alignobj, refobj, chrom, outputcountbed, args)
+    binaverages = bin_mean_depths(startendarray, binsize)
+    currentreads = int(startendarray[-1]) if len(startendarray) > 0 else 0
+    print("Current reads at end of " + chrom + " is " + str(currentreads))
+    logger.debug("Current reads at end of " + chrom + " is " + str(currentreads))
+
+    return bin_coverage_lines(chrom, binaverages, binsize, gctrack)
+
+# bin size for the coverage analyses, chosen from the read arrival rate unless given with --covbinsize:
+def coverage_bin_size(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, args)->int:
     if args.covbinsize == 0:
         binsize = choose_bin_size(alignobj, refobj, includedintervals, args)
     else:
@@ -255,59 +493,112 @@ def tally_bin_coverages(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, in
 
     logger.info("Using bin size " + str(binsize))
 
-    # tally coverage across chromosomes, mosdepth style:
+    return binsize
+
+# With passbintotals ([binsize, the depth totals of each chromosome's bins] from a single pass through the bam file,
+# see readpass), these are written without reading the alignments again:
+def tally_bin_coverages(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, includedbed:str, outputcountbed:str, outputincludedcountbed, args, passbintotals=None):
+
+    if passbintotals is not None:
+        [binsize, chrombintotals] = passbintotals
+    else:
+        binsize = coverage_bin_size(alignobj, refobj, includedintervals, args)
+
+    # tally coverage across chromosomes, mosdepth style, with chromosomes in separate processes:
+    bamfile = os.fsdecode(alignobj.filename)
+    reffasta = os.fsdecode(refobj.filename)
+    numworkers = args.t if 't' in args else 1
+    gctracks = gccontent_extreme_kmer_tracks(refobj, binsize, 40, benchmark_track_directory(args), numworkers)
     with open(outputcountbed, "w") as cfh:
-        for chrom in alignobj.references:
-            startendarray = tally_chrom_starts_ends(alignobj, refobj, chrom, outputcountbed, args)
-            # binstart/binend is the first/last zero based position in the current bin
-            binstart = 0
-            binend = binstart + binsize - 1
-            currentreads = 0
-            # 0-based position
-            currentpos = 0
-            chromlength = refobj.get_reference_length(chrom)
-            bintotal = 0
-    
-            while currentpos < chromlength:
-                # calculate how many reads are covering this position:
-                currentreads = currentreads + startendarray[currentpos]
-                bintotal += currentreads
-                if currentpos == binend:
-                    binaverage = 1.0*bintotal/binsize
-                    [count_at, count_ag, count_ac, count_gc, count_gcnucs, count_atnucs] =  bin_gccontent_extreme_kmers(refobj, chrom, binstart, binend + 1, 40)
-                    cfh.write(chrom + "\t" + str(binstart) + "\t" + str(binend + 1) + "\t" + str(count_gcnucs) + "\t" + str(binaverage) + "\n")
-                    bintotal = 0
-                    binstart = binend + 1
-                    binend = binstart + binsize - 1
-                currentpos += 1
-
-            print("Current reads at end of " + chrom + " is " + str(currentreads))
-            logger.debug("Current reads at end of " + chrom + " is " + str(currentreads))
+        if passbintotals is not None:
+            for chrom in alignobj.references:
+                cfh.write(bin_coverage_lines(chrom, [1.0*bintotal/binsize for bintotal in chrombintotals[chrom].tolist()], binsize, gctracks[chrom]))
+        elif numworkers > 1:
+            with pipeline.worker_pool(numworkers) as executor:
+                chromresults = {}
+                # submit the longest chromosomes first to balance the load across workers:
+                for chrom in sorted(alignobj.references, key=lambda c: refobj.get_reference_length(c), reverse=True):
+                    chromresults[chrom] = executor.submit(tally_chrom_bin_coverages, bamfile, reffasta, chrom, binsize, gctracks[chrom], outputcountbed, args)
+                for chrom in alignobj.references:
+                    cfh.write(chromresults[chrom].result())
+        else:
+            for chrom in alignobj.references:
+                cfh.write(tally_chrom_bin_coverages(bamfile, reffasta, chrom, binsize, gctracks[chrom], outputcountbed, args))
 
     includedcountfile = bedtoolslib.intersectbed(outputcountbed, includedbed, outputincludedcountbed, requirewhole=True, writefirst=True)
     logger.info("Wrote count bed file of included whole bins")
 
-def tally_included_bin_arrival_rates(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, outputcountbed:str, args):
+# Reads arriving in each complete bin of a chromosome with numbins complete bins, from their start positions and
+# last reference positions. Reads are counted in the bin containing their start or, with bincovoverlap, in every bin
+# they overlap. Counts of different reads (e.g., those of the windows of readpass) can be summed:
+def bin_read_counts(refstarts:np.ndarray, reflastpositions:np.ndarray, numbins:int, binsize:int, bincovoverlap:bool)->np.ndarray:
+
+    startbins = refstarts // binsize
+    if not bincovoverlap:
+        startbins = startbins[startbins < numbins]
+        return np.bincount(startbins, minlength=numbins)[:numbins]
+
+    # +1 in each read's first bin and -1 after its last, summed along the chromosome:
+    lastbins = reflastpositions // binsize
+    bintallies = np.zeros(numbins + 1, dtype=np.int64)
+    np.add.at(bintallies, np.minimum(startbins, numbins), 1)
+    np.subtract.at(bintallies, np.minimum(lastbins + 1, numbins), 1)
+
+    return np.cumsum(bintallies)[:numbins]
+
+# the last reference position of an alignment for arrival counts (as pysam's count does, an alignment without reference
+# bases covers just its start position):
+def arrival_last_position(align)->int:
+    refstart = align.reference_start
+    refend = align.reference_end
+    return refend - 1 if refend is not None and refend > refstart else refstart
+
+# worker for tally_included_bin_arrival_rates--counts the reads in each complete bin of a chromosome in a single pass
+# through its alignments:
+def chrom_bin_read_counts(bamfile:str, chrom:str, chromlength:int, binsize:int, bincovoverlap:bool)->np.ndarray:
+
+    alignobj = pysam.AlignmentFile(bamfile, "rb")
+    refstarts = array.array('q')
+    reflastpositions = array.array('q')
+    for align in alignobj.fetch(chrom):
+        refstarts.append(align.reference_start)
+        reflastpositions.append(arrival_last_position(align))
 
-    if args.covbinsize == 0:
-        binsize = choose_bin_size(alignobj, refobj, includedintervals, args)
-    else:
-        binsize = args.covbinsize
+    return bin_read_counts(np.frombuffer(refstarts, dtype=np.int64), np.frombuffer(reflastpositions, dtype=np.int64), chromlength // binsize, binsize, bincovoverlap)
 
-    logger.info("Using bin size " + str(binsize))
+# With passbincounts ([binsize, the read counts of each chromosome's bins] from a single pass through the bam file,
+# see readpass), these are written without reading the alignments again:
+def tally_included_bin_arrival_rates(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, outputcountbed:str, args, passbincounts=None):
+
+    if passbincounts is not None:
+        [binsize, chrombincounts] = passbincounts
+    else:
+        binsize = coverage_bin_size(alignobj, refobj, includedintervals, args)
     [coveragebins, coveragebincounts, coveragebinindex] = initiate_bins(alignobj, binsize, args)
 
     # this should truncate intervals that aren't fully included in the includedintervals:
-    ibin = 0
     kmersize = 40
     includedbins = bedtoolslib.intersectintervals(coveragebins, includedintervals)
-    
-    [binstart, binend] = [0, 0]
-    def startsinbin(read):
-        if read.reference_start >= binstart and read.reference_start < binend:
-            return True
-        else:
-            return False
+    numworkers = args.t if 't' in args else 1
+    gctracks = gccontent_extreme_kmer_tracks(refobj, binsize, kmersize, benchmark_track_directory(args), numworkers)
+
+    # read counts for every bin, one pass through each chromosome's alignments:
+    bamfile = os.fsdecode(alignobj.filename)
+    chroms = [chrom for chrom in alignobj.references if chrom != "chrM"]
+    if passbincounts is not None:
+        logger.debug("Using bin read counts from single pass through alignments")
+    elif numworkers > 1:
+        chrombincounts = {}
+        with pipeline.worker_pool(numworkers) as executor:
+            chromresults = {}
+            for chrom in sorted(chroms, key=lambda c: alignobj.get_reference_length(c), reverse=True):
+                chromresults[chrom] = executor.submit(chrom_bin_read_counts, bamfile, chrom, alignobj.get_reference_length(chrom), binsize, args.bincovoverlap)
+            for chrom in chroms:
+                chrombincounts[chrom] = chromresults[chrom].result()
+    else:
+        chrombincounts = {}
+        for chrom in chroms:
+            chrombincounts[chrom] = chrom_bin_read_counts(bamfile, chrom, alignobj.get_reference_length(chrom), binsize, args.bincovoverlap)
 
     with open(outputcountbed, "w") as cfh:
         for seqbin in includedbins:
@@ -320,13 +611,9 @@ def tally_included_bin_arrival_rates(alignobj:pysam.AlignmentFile, refobj:pysam.
                 binchrom = seqbin.chrom
                 binstart = seqbin.start
                 binend = seqbin.end
-                if args.bincovoverlap:
-                    bincount = alignobj.count(contig=binchrom, start=binstart, stop=binend)
-                else:
-                    bincount = alignobj.count(contig=binchrom, start=binstart, stop=binend, read_callback=startsinbin)
-                coveragebincounts[ibin] = bincount
+                bincount = int(chrombincounts[binchrom][binstart // binsize])
                 # calculate things about this bin:
-                [count_at, count_ag, count_ac, count_gc, count_gcnucs, count_atnucs] =  bin_gccontent_extreme_kmers(refobj, binchrom, binstart, binend, kmersize)
+                [count_at, count_ag, count_ac, count_gc, count_gcnucs, count_atnucs] = gctracks[binchrom][binstart // binsize].tolist()
                 logger.debug(binchrom + "\t" + str(binstart) + "\t" + str(binend) + "\t" + str(bincount))
                 cfh.write(binchrom + "\t" + str(binstart) + "\t" + str(binend) + "\t" + str(count_at) + "\t" + str(count_ag) + "\t" + str(count_ac) + "\t" + str(count_gc) + "\t" + str(count_gcnucs) + "\t" + str(count_atnucs) + "\t" +  str(bincount) + "\n")
 
@@ -343,7 +630,128 @@ def read_extreme_kmer_counts(countfile:str)->dict:
 
     return(extremecounts)
 
-def compare_read_kmers_to_benchmark_kmers(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, outputbenchmarkcountbed:str, outputreadseqcountbed, outputstrandseqcountbed, config, args):
+# Two-bit codes of bases for kmer counting (in this order, kmer codes sort like kmer strings). Other characters
+# get code 4, and kmers containing them are tallied by name:
+KMERBASES = "ACGT"
+BASECODES = np.full(256, 4, dtype=np.uint8)
+for basecode, base in enumerate(KMERBASES):
+    BASECODES[ord(base)] = basecode
+
+# names of "extreme" kmer types tallied when kmers have five or more bases:
+EXTREMEKMERNAMES = ['CC', 'GG', 'GC', 'AA', 'TT', 'AT', 'AC', 'GT', 'AG', 'CT', 'NA']
+
+# sequences are read and tallied this many bases at a time:
+KMERCHUNKSIZE = 4000000
+
+# counts of A, C, G and T in the k-long windows starting at windowstarts in an array of base codes:
+def window_base_counts(seqcodes:np.ndarray, k:int, windowstarts:np.ndarray)->list:
+    basecounts = []
+    for basecode in range(len(KMERBASES)):
+        prefixsums = np.zeros(len(seqcodes) + 1, dtype=np.int32)
+        np.cumsum(seqcodes == basecode, dtype=np.int32, out=prefixsums[1:])
+        basecounts.append(prefixsums[windowstarts + k] - prefixsums[windowstarts])
+
+    return basecounts
+
+# Extreme kmer types of benchmark windows, as indices into EXTREMEKMERNAMES (AA==TT, CC==GG, AC==GT and AG==CT
+# for the double stranded benchmark). Bases other than A, C, G and T aren't counted, so a window of Ns is "CC":
+def benchmark_extreme_kmer_ids(basecounts:list)->np.ndarray:
+    [noa, noc, nog, not_] = [basecount == 0 for basecount in basecounts]
+    conditions = [noa & not_ & (nog | noc), noa & not_, nog & noc & (noa | not_), nog & noc, (nog & not_) | (noc & noa), (nog & noa) | (noc & not_)]
+    kmertypes = [EXTREMEKMERNAMES.index(kmertype) for kmertype in ['CC', 'GC', 'AA', 'AT', 'AC', 'AG']]
+
+    return np.select(conditions, kmertypes, default=EXTREMEKMERNAMES.index('NA'))
+
+# Extreme kmer types of read windows, as indices into EXTREMEKMERNAMES: the strand-independent type, and the
+# stranded types of the window's sequence and of its reverse complement. These are the types assigned by the
+# original base-by-base read tallies, in which kmers of only A's are counted as "AT":
+READEXTREMEKMERTYPES = [['CC', 'CC', 'GG'], ['CC', 'GG', 'CC'], ['GC', 'GC', 'GC'], ['AA', 'TT', 'AA'], ['AT', 'AT', 'AT'], ['AC', 'AC', 'GT'], ['AC', 'GT', 'AC'], ['AG', 'AG', 'CT'], ['AG', 'CT', 'AG'], ['NA', 'NA', 'NA']]
+
+def read_extreme_kmer_ids(basecounts:list)->list:
+    [noa, noc, nog, not_] = [basecount == 0 for basecount in basecounts]
+    conditions = [noa & not_ & nog, noa & not_ & noc, noa & not_, nog & noc & noa, nog & noc, nog & not_, noc & noa, noc & not_, nog & noa]
+    caseindices = np.select(conditions, range(len(conditions)), default=len(conditions))
+    kmertypeids = np.array([[EXTREMEKMERNAMES.index(kmertype) for kmertype in casetypes] for casetypes in READEXTREMEKMERTYPES])
+
+    return [kmertypeids[caseindices, 0], kmertypeids[caseindices, 1], kmertypeids[caseindices, 2]]
+
+# Ids of the kmers starting at windowstarts in an array of sequence characters, for kmers shorter than five bases:
+# the canonical (lower-sorting of the kmer and its reverse complement) kmer, the kmer and its reverse complement.
+# Kmers of A, C, G and T have their two-bit codes as ids, while those with other characters are numbered after
+# them. Returns the three id arrays and a function giving the kmer for an id.
+def small_kmer_ids(seqbytes:np.ndarray, k:int, windowstarts:np.ndarray)->list:
+    seqcodes = BASECODES[seqbytes]
+    forwardids = np.zeros(len(windowstarts), dtype=np.int64)
+    reverseids = np.zeros(len(windowstarts), dtype=np.int64)
+    otherwindows = np.zeros(len(windowstarts), dtype=bool)
+    for offset in range(k):
+        windowcodes = seqcodes[windowstarts + offset].astype(np.int64)
+        otherwindows |= windowcodes == 4
+        windowcodes &= 3
+        forwardids = forwardids * 4 + windowcodes
+        reverseids += (3 - windowcodes) << (2 * offset)
+    canonicalids = np.minimum(forwardids, reverseids)
+
+    # kmers with other characters are compared as strings, as in the original tallies:
+    othernames = []
+    if np.any(otherwindows):
+        otherindices = np.flatnonzero(otherwindows)
+        otherkmers = np.ascontiguousarray(seqbytes[windowstarts[otherindices, None] + np.arange(k)]).view("S" + str(k)).ravel()
+        [uniquekmers, kmerindices] = np.unique(otherkmers, return_inverse=True)
+        othernameids = {}
+        def othernameid(kmername:str)->int:
+            if kmername not in othernameids:
+                othernameids[kmername] = 4**k + len(othernames)
+                othernames.append(kmername)
+            return othernameids[kmername]
+        uniqueids = []
+        for kmerseq in uniquekmers.tolist():
+            kmerseq = kmerseq.decode()
+            rckmerseq = seqparse.revcomp(kmerseq)
+            uniqueids.append([othernameid(min(kmerseq, rckmerseq)), othernameid(kmerseq), othernameid(rckmerseq)])
+        uniqueids = np.array(uniqueids, dtype=np.int64)[kmerindices.ravel()]
+        canonicalids[otherindices] = uniqueids[:, 0]
+        forwardids[otherindices] = uniqueids[:, 1]
+        reverseids[otherindices] = uniqueids[:, 2]
+
+    def kmername(kmerid:int)->str:
+        if kmerid >= 4**k:
+            return othernames[kmerid - 4**k]
+        return "".join(KMERBASES[(kmerid >> (2 * (k - 1 - offset))) & 3] for offset in range(k))
+
+    return [canonicalids, forwardids, reverseids, kmername]
+
+def extreme_kmer_name(kmerid:int)->str:
+    return EXTREMEKMERNAMES[kmerid]
+
+# Adds counts of kmer ids to a dictionary of counts keyed by kmer name. New kmers are added in the order in which
+# they first occur, so the dictionary (and files written from it) are in the same order as in a base-by-base tally.
+def add_kmer_id_counts(kmercountdict:dict, kmerids:np.ndarray, kmername):
+    if len(kmerids) == 0:
+        return
+    [uniqueids, firstindices, idcounts] = np.unique(kmerids, return_index=True, return_counts=True)
+    for uniqueindex in np.argsort(firstindices):
+        kmerseq = kmername(int(uniqueids[uniqueindex]))
+        kmercountdict[kmerseq] = kmercountdict.get(kmerseq, 0) + int(idcounts[uniqueindex])
+
+# Benchmark kmer counts depend only on the benchmark, the included regions and the kmer size, so they're saved in
+# the track directory in a file named by the checksums of the benchmark and of the included intervals:
+def benchmark_kmer_count_file(refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, k:int, trackdir:str)->str:
+    regionhash = hashlib.sha256()
+    for interval in includedintervals:
+        regionhash.update((interval.chrom + "\t" + str(interval.start) + "\t" + str(interval.end) + "\n").encode())
+
+    return trackdir + "/benchmarkkmers." + benchmark_checksum(refobj, trackdir)[:16] + "." + regionhash.hexdigest()[:16] + ".k" + str(k) + ".txt"
+
+def write_kmer_counts(kmercountdict:dict, countfile:str):
+    with open(countfile, "w") as ofh:
+        for kmerseq in kmercountdict.keys():
+            kmercount = kmercountdict[kmerseq]
+            ofh.write(kmerseq + "\t" + str(kmercount) + "\n")
+
+# With readkmercounts (the canonical and stranded read kmer counts from a single pass through the bam file, see
+# readpass), the read kmers are not tallied again:
+def compare_read_kmers_to_benchmark_kmers(alignobj:pysam.AlignmentFile, refobj:pysam.FastaFile, includedintervals:pybedtools.BedTool, outputbenchmarkcountbed:str, outputreadseqcountbed, outputstrandseqcountbed, config, args, readkmercounts=None):
  
     # Should have this read in from an included count file specified in the config, but for now, calculating it:
     kmersize = args.covkmersize
@@ -351,14 +759,20 @@ def compare_read_kmers_to_benchmark_kmers(alignobj:pysam.AlignmentFile, refobj:p
     if "extremekmercounts" in config.keys() and os.path.exists(config["extremekmercounts"]):
         benchmark_kmer_counts = read_extreme_kmer_counts(config["extremekmercounts"])
     else:
-        benchmark_kmer_counts = tally_included_benchmark_kmers(refobj, includedintervals, args)
+        kmercountfile = benchmark_kmer_count_file(refobj, includedintervals, kmersize, benchmark_track_directory(args))
+        if os.path.exists(kmercountfile):
+            logger.info("Reading benchmark kmer counts from " + kmercountfile)
+            benchmark_kmer_counts = read_extreme_kmer_counts(kmercountfile)
+        else:
+            benchmark_kmer_counts = tally_included_benchmark_kmers(refobj, includedintervals, args)
+            write_track_file(kmercountfile, lambda tmpfile: write_kmer_counts(benchmark_kmer_counts, tmpfile))
+            logger.info("Wrote benchmark kmer counts to " + kmercountfile)
 
-        with open(outputbenchmarkcountbed, "w") as ofh:
-            for kmerseq in benchmark_kmer_counts.keys():
-                kmercount = benchmark_kmer_counts[kmerseq]
-                ofh.write(kmerseq + "\t" + str(kmercount) + "\n")
+        write_kmer_counts(benchmark_kmer_counts, outputbenchmarkcountbed)
 
-    [aligned_read_kmer_counts, stranded_read_kmer_counts] = tally_included_aligned_read_kmers(alignobj, refobj, includedintervals, args)
+    if readkmercounts is None:
+        readkmercounts = tally_included_aligned_read_kmers(alignobj, refobj, includedintervals, args)
+    [aligned_read_kmer_counts, stranded_read_kmer_counts] = readkmercounts
 
     with open(outputreadseqcountbed, "w") as ofh:
         for kmerseq in aligned_read_kmer_counts.keys():
@@ -405,65 +819,93 @@ def tally_included_benchmark_kmers(refobj, includedintervals, args)->dict:
             logger.debug("Skipping mitochondrial region from " + str(interval.start) + " to " + str(interval.end))
             continue
         logger.debug("Calculating kmer counts for " + interval.chrom + ":" + str(interval.start) + "-" + str(interval.end))
-        refsequence = refobj.fetch(reference=interval.chrom, start=interval.start, end=interval.end).upper()
-        seqstart = 0
-        seqstop = k
-        # count initial kmer:
-        kmerseq = refsequence[0:seqstop]
-        # compare to reverse comp and tally
-        rckmerseq = seqparse.revcomp(kmerseq)
-
-        intervallength = interval.end - interval.start
-        tallykmer = "NA"
-        while seqstop <= intervallength:
+        # tally kmers starting in each chunk of the interval:
+        for chunkstart in range(interval.start, interval.end - k + 1, KMERCHUNKSIZE):
+            chunkend = min(interval.end, chunkstart + KMERCHUNKSIZE + k - 1)
+            refsequence = refobj.fetch(reference=interval.chrom, start=chunkstart, end=chunkend).upper()
+            seqbytes = np.frombuffer(refsequence.encode(), dtype=np.uint8)
+            windowstarts = np.arange(len(seqbytes) - k + 1)
             if k >= 5: # record extreme kmer types (only 6 different ones since AA==TT, CC==GG, AC==GT and AG==CT for the double stranded benchmark)
-                acount = kmerseq.count("A")
-                tcount = kmerseq.count("T")
-                gcount = kmerseq.count("G")
-                ccount = kmerseq.count("C")
-                if acount==0 and tcount==0: # kmer is all G's and/or C's
-                    if gcount == 0 or ccount == 0: # kmer is entirely G or entirely C
-                        tallykmer = "CC"
-                    else: # kmer is mix of G's and C's
-                        tallykmer = "GC"
-                elif gcount==0 and ccount==0: # kmer is all A's and/or T's
-                    if acount == 0 or tcount == 0: # kmer is entirely A's or entirely T's
-                        tallykmer = "AA"
-                    else: # kmer is mix of A's and T's
-                        tallykmer = "AT"
-                elif (gcount==0 and tcount==0) or (ccount==0 and acount==0): # kmer must be all A's and C's or all G's and T's
-                    tallykmer = "AC"
-                elif (gcount==0 and acount==0) or (ccount==0 and tcount==0): # kmer must be all A's and G's or all T's and C's
-                    tallykmer = "AG"
-                else: # kmer has at least three different nucleotides
-                    tallykmer = "NA"
-            elif kmerseq <= rckmerseq: # if using small kmers (right now, just 3), tally the lower-sorted ("canonical") kmer
-                tallykmer = kmerseq
-            else:
-                tallykmer = rckmerseq
-            if tallykmer in kmercountdict.keys():
-                kmercountdict[tallykmer] += 1
-            else:
-                kmercountdict[tallykmer] = 1
-
-            # subtract the first base and add the next:
-            if seqstop == intervallength:
-                break
-            nextbase = refsequence[seqstop]
-            kmerseq = kmerseq[1:] + nextbase
-            rckmerseq = seqparse.revcomp(kmerseq)
-            seqstop += 1
-
-        logger.debug("Last kmer recorded: " + tallykmer)
+                add_kmer_id_counts(kmercountdict, benchmark_extreme_kmer_ids(window_base_counts(BASECODES[seqbytes], k, windowstarts)), extreme_kmer_name)
+            else: # if using small kmers (right now, just 3), tally the lower-sorted ("canonical") kmer
+                [canonicalids, forwardids, reverseids, kmername] = small_kmer_ids(seqbytes, k, windowstarts)
+                add_kmer_id_counts(kmercountdict, canonicalids, kmername)
 
     return kmercountdict
 
+# tallies the canonical and stranded kmers of a batch of read sequences (kmers don't span reads):
+def tally_read_kmer_batch(readseqs:list, readreversestrands:list, k:int, canonicalkmercountdict:dict, strandedkmercountdict:dict):
+    seqbytes = np.frombuffer("".join(readseqs).encode(), dtype=np.uint8)
+    readlengths = np.array([len(readseq) for readseq in readseqs], dtype=np.int64)
+    readoffsets = np.cumsum(readlengths) - readlengths
+    readwindows = np.maximum(readlengths - k + 1, 0)
+    windowoffsets = np.cumsum(readwindows) - readwindows
+    windowstarts = np.arange(np.sum(readwindows)) + np.repeat(readoffsets - windowoffsets, readwindows)
+    windowreversestrands = np.repeat(np.array(readreversestrands, dtype=bool), readwindows)
+
+    if k >= 5:
+        [canonicalids, forwardids, reverseids] = read_extreme_kmer_ids(window_base_counts(BASECODES[seqbytes], k, windowstarts))
+        kmername = extreme_kmer_name
+    else:
+        [canonicalids, forwardids, reverseids, kmername] = small_kmer_ids(seqbytes, k, windowstarts)
+
+    # record the canonical (strand independent) kmer and the kmer on the read's strand
+    add_kmer_id_counts(canonicalkmercountdict, canonicalids, kmername)
+    add_kmer_id_counts(strandedkmercountdict, np.where(windowreversestrands, reverseids, forwardids), kmername)
+
+# The aligned sequence of a read (without clipped ends) trimmed to the reference positions of an included interval,
+# or None if too much of the read is clipped:
+def included_read_sequence(align, interval, regionstring:str, minreadalignedpercentage:int):
+
+    # read sequence is align.query_sequence[query_alignment_start:query_alignment_end], which doesn't include clipped ends
+    # it needs to be trimmed to exclude reference positions that are outside of the included region
+    alignedreadseq = align.query_alignment_sequence
+    querylength = len(alignedreadseq)
+    readlength = align.infer_query_length()
+    alignrefstart = align.reference_start
+    alignrefend = align.reference_end
+    if 100*querylength/readlength < minreadalignedpercentage:
+        percentclipped = int(100*(readlength - querylength)/readlength)
+        logger.debug("Skipping read in " + regionstring + "(" + str(alignrefstart) + "-" + str(alignrefend) + ") due to excessive clipping: " + str(percentclipped) + " percent")
+        return None
+    cigarops = align.cigartuples
+    cigarindex = 0
+    while interval.start > alignrefstart:
+        logger.debug(str(interval.start) + " is greater than " + str(alignrefstart))
+        cigarop = cigarops[cigarindex]
+        if cigarop[0] in [0, 1]:
+            alignedreadseq = alignedreadseq[cigarop[1]:]
+        if cigarop[0] in [0, 2]:
+            alignrefstart += cigarop[1]
+        cigarindex += 1
+        if cigarindex >= len(cigarops) - 1:
+            logger.debug("Reached end of cigar ops while trimming alignment start!")
+            break
+    cigarindex = len(cigarops) - 1
+    while interval.end < alignrefend:
+        logger.debug(str(interval.end) + " is less than " + str(alignrefend))
+        cigarop = cigarops[cigarindex]
+        if cigarop[0] in [0, 1]:
+            alignedreadseq = alignedreadseq[0:-1*cigarop[1]]
+        if cigarop[0] in [0, 2]:
+            alignrefend -= cigarop[1]
+        cigarindex -= 1
+        if cigarindex < 0:
+            logger.debug("Reached beginning of cigar ops while trimming alignment end!")
+            break
+
+    logger.debug("Calculating kmer counts for read " + align.query_name + " from " + align.reference_name + ":" + str(alignrefstart) + "-" + str(alignrefend))
+
+    return alignedreadseq
+
 def tally_included_aligned_read_kmers(alignobj, refobj, includedintervals, args)->dict:
     canonicalkmercountdict = {}
     strandedkmercountdict = {}
 
     k = args.covkmersize
     minreadalignedpercentage = args.minreadalignedpercentage
+    # read sequences are tallied in batches:
+    [readseqs, readreversestrands, batchlength] = [[], [], 0]
     for interval in includedintervals:
         if interval.chrom == "chrM":
             logger.debug("Skipping read alignments in mitochondrial region from " + str(interval.start) + " to " + str(interval.end))
@@ -475,137 +917,17 @@ def tally_included_aligned_read_kmers(alignobj, refobj, includedintervals, args)
             if align.is_secondary or align.cigartuples is None or (args.downsample is not None and random.random() >= args.downsample):
                 continue
 
-            # read sequence is align.query_sequence[query_alignment_start:query_alignment_end], which doesn't include clipped ends
-            # it needs to be trimmed to exclude reference positions that are outside of the included region
-            alignedreadseq = align.query_alignment_sequence
-            querylength = len(alignedreadseq)
-            readlength = align.infer_query_length()
-            alignrefstart = align.reference_start
-            alignrefend = align.reference_end
-            if 100*querylength/readlength < minreadalignedpercentage:
-                percentclipped = int(100*(readlength - querylength)/readlength)
-                logger.debug("Skipping read in " + regionstring + "(" + str(alignrefstart) + "-" + str(alignrefend) + ") due to excessive clipping: " + str(percentclipped) + " percent")
+            alignedreadseq = included_read_sequence(align, interval, regionstring, minreadalignedpercentage)
+            if alignedreadseq is None:
                 continue
-            cigarops = align.cigartuples
-            cigarindex = 0
-            while interval.start > alignrefstart:
-                logger.debug(str(interval.start) + " is greater than " + str(alignrefstart))
-                cigarop = cigarops[cigarindex]
-                if cigarop[0] in [0, 1]:
-                    alignedreadseq = alignedreadseq[cigarop[1]:]
-                if cigarop[0] in [0, 2]:
-                    alignrefstart += cigarop[1]
-                cigarindex += 1
-                if cigarindex >= len(cigarops) - 1:
-                    logger.debug("Reached end of cigar ops while trimming alignment start!")
-                    break
-            cigarindex = len(cigarops) - 1
-            while interval.end < alignrefend:
-                logger.debug(str(interval.end) + " is less than " + str(alignrefend))
-                cigarop = cigarops[cigarindex]
-                if cigarop[0] in [0, 1]:
-                    alignedreadseq = alignedreadseq[0:-1*cigarop[1]]
-                if cigarop[0] in [0, 2]:
-                    alignrefend -= cigarop[1]
-                cigarindex -= 1
-                if cigarindex < 0:
-                    logger.debug("Reached beginning of cigar ops while trimming alignment end!")
-                    break
-
-            logger.debug("Calculating kmer counts for read " + align.query_name + " from " + align.reference_name + ":" + str(alignrefstart) + "-" + str(alignrefend))
-            seqstart = 0
-            seqstop = k
-            # count initial kmer:
-            querylength = len(alignedreadseq)
-            kmerseq = alignedreadseq[0:seqstop]
-            # compare to reverse comp and tally
-            rckmerseq = seqparse.revcomp(kmerseq)
-    
-            queryreversestrand = align.is_reverse
-            tallykmer = "NA"
-            while seqstop <= querylength:
-                reckmerseq = kmerseq
-                recrckmerseq = rckmerseq
-                if k >= 5:
-                    acount = kmerseq.count("A")
-                    tcount = kmerseq.count("T")
-                    gcount = kmerseq.count("G")
-                    ccount = kmerseq.count("C")
-                    if acount==0 and tcount==0: # kmer is all G's and/or C's
-                        if gcount==0: # all C's
-                            tallykmer = "CC"
-                            reckmerseq = "CC"
-                            recrckmerseq = "GG"
-                        elif ccount == 0: # all G's
-                            tallykmer = "CC"
-                            reckmerseq = "GG"
-                            recrckmerseq = "CC"
-                        else: # all G's and C's
-                            tallykmer = "GC"
-                            reckmerseq = "GC"
-                            recrckmerseq = "GC"
-                    elif gcount==0 and ccount==0: # kmer is all A's and/or T's
-                        if tcount==0: # all A's
-                            tallykmer = "AA"
-                            reckmerseq = "AA"
-                            recrckmerseq = "TT"
-                        if acount==0: # all T's
-                            tallykmer = "AA"
-                            reckmerseq = "TT"
-                            recrckmerseq = "AA"
-                        else: # all A's and T's
-                            tallykmer = "AT"
-                            reckmerseq = "AT"
-                            recrckmerseq = "AT"
-                    elif gcount==0 and tcount==0: # kmer is all A's and C's
-                        tallykmer = "AC"
-                        reckmerseq = "AC"
-                        recrckmerseq = "GT"
-                    elif ccount==0 and acount==0: # kmer is all G's and T's
-                        tallykmer = "AC"
-                        reckmerseq = "GT"
-                        recrckmerseq = "AC"
-                    elif ccount==0 and tcount==0: # kmer is all A's and G's
-                        tallykmer = "AG"
-                        reckmerseq = "AG"
-                        recrckmerseq = "CT"
-                    elif gcount==0 and acount==0: # kmer is all C's and T's
-                        tallykmer = "AG"
-                        reckmerseq = "CT"
-                        recrckmerseq = "AG"
-                    else:
-                        tallykmer = "NA"
-                        reckmerseq = "NA"
-                        recrckmerseq = "NA"
-                elif kmerseq <= rckmerseq:
-                    tallykmer = kmerseq
-                else:
-                    tallykmer = rckmerseq
-
-                # record the canonical (strand independent) kmer
-                if tallykmer in canonicalkmercountdict.keys():
-                    canonicalkmercountdict[tallykmer] += 1
-                else:
-                    canonicalkmercountdict[tallykmer] = 1
-
-                if queryreversestrand:
-                    strandedkmer = recrckmerseq
-                else:
-                    strandedkmer = reckmerseq
-                if strandedkmer in strandedkmercountdict.keys():
-                    strandedkmercountdict[strandedkmer] += 1
-                else:
-                    strandedkmercountdict[strandedkmer] = 1
-    
-                # subtract the first base and add the next:
-                if seqstop == querylength:
-                    break
-                nextbase = alignedreadseq[seqstop]
-                kmerseq = kmerseq[1:] + nextbase
-                rckmerseq = seqparse.revcomp(kmerseq)
-                seqstop += 1
-
-            logger.debug("Last kmer recorded: " + tallykmer + "/" + kmerseq)
+            readseqs.append(alignedreadseq)
+            readreversestrands.append(align.is_reverse)
+            batchlength += len(alignedreadseq)
+            if batchlength >= KMERCHUNKSIZE:
+                tally_read_kmer_batch(readseqs, readreversestrands, k, canonicalkmercountdict, strandedkmercountdict)
+                [readseqs, readreversestrands, batchlength] = [[], [], 0]
+
+    tally_read_kmer_batch(readseqs, readreversestrands, k, canonicalkmercountdict, strandedkmercountdict)
 
     return [canonicalkmercountdict, strandedkmercountdict]
 
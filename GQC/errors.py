@@ -2,14 +2,18 @@ import os
 import re
 import sys
 import random
+import shutil
+import pysam
 import pybedtools
 import logging
 import datetime
+import numpy as np
 from collections import namedtuple
 from GQC import seqparse
 from GQC import alignparse
 from GQC import bedtoolslib
 from GQC import coverage
+from GQC import pipeline
 
 # create namedtuple for bed intervals:
 varianttuple = namedtuple('varianttuple', ['chrom', 'start', 'end', 'name', 'vartype', 'excluded', 'qvscore']) 
@@ -60,7 +64,7 @@ def classify_errors(refobj, queryobj, variants, hetsites, outputdict, benchparam
             #logger.debug("Splitting variant name " + variant.name + " and found contigname " + contigname)
             varname = variant.chrom + "_" + str(int(variant.start) + 1) + "_" + refallele + "_" + altallele
 
-            if hetsites and varname in hetsites.keys():
+            if hetsites and varname in hetsites:
                 errortype = 'PHASING'
                 errortypecolor = '255,0,0'
             else:
@@ -324,20 +328,145 @@ def assess_mononuc_read_coverage(align_obj, mononucbedfile, outputdict, bedinter
 
     return mononucdict
 
+# size of the genomic windows in which reads and benchmark sequence are fetched once for all of the STR loci
+# they contain, with --strfetch tiled:
+STRTILESIZE = 100000
+
+# For each STR locus in an included STR bed file: the locus, its benchmark flanking sequences and allele,
+# and its overlapping read alignments. With strfetch "locus", reads and sequence are fetched separately for
+# every locus. With "tiled", consecutive loci on a chromosome are grouped into windows of up to STRTILESIZE
+# bases, for which reads and sequence are fetched just once (see tile_locus_reads).
+def str_loci_with_reads(strbedfh, align_obj, refobj, strfetch:str):
+    tileloci = []
+    for strline in strbedfh:
+        strfields = strline.rstrip().split("\t")
+        [chrom, start, end, name] = [strfields[0], int(strfields[1]), int(strfields[2]), strfields[3]]
+        if strfetch == 'locus':
+            benchleftflankseq = refobj.fetch(reference=chrom, start=start-5, end=start).upper()
+            benchrightflankseq = refobj.fetch(reference=chrom, start=end, end=end+5).upper()
+            refalleleseq = refobj.fetch(reference=chrom, start=start, end=end)
+            yield [chrom, start, end, name, benchleftflankseq, benchrightflankseq, refalleleseq, align_obj.fetch(contig=chrom, start=start, stop=end)]
+            continue
+
+        if len(tileloci) > 0 and (chrom != tileloci[0][0] or start < tileloci[-1][1] or end - tileloci[0][1] > STRTILESIZE):
+            yield from tile_str_loci_with_reads(tileloci, align_obj, refobj)
+            tileloci = []
+        tileloci.append([chrom, start, end, name])
+
+    if len(tileloci) > 0:
+        yield from tile_str_loci_with_reads(tileloci, align_obj, refobj)
+
+def tile_str_loci_with_reads(tileloci:list, align_obj, refobj):
+    chrom = tileloci[0][0]
+    tilestart = tileloci[0][1]
+    tileend = max([locus[2] for locus in tileloci])
+    tileseqstart = max(0, tilestart - 5)
+    tileseq = refobj.fetch(reference=chrom, start=tileseqstart, end=tileend + 5)
+    locusreads = tile_locus_reads(align_obj, chrom, tileloci)
+    for locusindex, [chrom, start, end, name] in enumerate(tileloci):
+        benchleftflankseq = tileseq[max(0, start - 5 - tileseqstart):start - tileseqstart].upper()
+        benchrightflankseq = tileseq[end - tileseqstart:end + 5 - tileseqstart].upper()
+        refalleleseq = tileseq[start - tileseqstart:end - tileseqstart]
+        yield [chrom, start, end, name, benchleftflankseq, benchrightflankseq, refalleleseq, locusreads[locusindex]]
+
+# Reads overlapping each of a list of [chrom, start, end, ...] loci on one chromosome, sorted by start, from a
+# single fetch of the window spanning them. Each locus's reads are in the order align_obj.fetch would return
+# them for the locus (as with htslib, an alignment with no reference bases covers just its start position).
+def tile_locus_reads(align_obj, chrom:str, loci:list)->list:
+    tilestart = loci[0][1]
+    tileend = max([locus[2] for locus in loci])
+    tilereads = list(align_obj.fetch(contig=chrom, start=tilestart, stop=tileend))
+    readends = [readalign.reference_end if readalign.reference_end is not None else readalign.reference_start + 1 for readalign in tilereads]
+
+    locusreads = []
+    nextread = 0
+    activereads = []
+    for locus in loci:
+        [locusstart, locusend] = [locus[1], locus[2]]
+        while nextread < len(tilereads) and tilereads[nextread].reference_start < locusend:
+            activereads.append(nextread)
+            nextread = nextread + 1
+        # loci are sorted by start, so reads ending before this one won't overlap later loci either:
+        activereads = [readindex for readindex in activereads if readends[readindex] > locusstart]
+        locusreads.append([tilereads[readindex] for readindex in activereads if tilereads[readindex].reference_start < locusend])
+
+    return locusreads
+
 def assess_str_read_coverage_require_flank(strlabel, align_obj, refobj, strbedfile, outputdict, bedintervals, hetsitedict, args):
 
-    max_reads_per_str = args.maxstrreads
+    strdicts = assess_str_classes_read_coverage_require_flank([[strlabel, strbedfile]], align_obj, refobj, outputdict, bedintervals, hetsitedict, args)
 
-    includedstrfile = outputdict["includedstrprefix"] + "." + strlabel + ".included.bed"
-    strstatsfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out"
+    return strdicts[strlabel]
 
-    logger.info("Writing " + strlabel + " STR data to " + strstatsfile)
+# Assesses reads for several classes of STRs, given as [strlabel, strbedfile] pairs, returning a dictionary of
+# each class's tallies. With more than one worker (args.t), loci of all classes are sharded by chromosome across
+# a single pool of processes, each shard writing its own stats file and returning its own tallies. These are
+# combined in the order of the included STR bed files, so the stats files and tallies are those of a single
+# process (except with --downsample, for which each shard seeds its own random numbers). strshardresults can
+# instead give, for each class, the [tallies, stats file] of its shards from a single pass through the bam file
+# (see readpass), whose included STR bed files have already been written.
+def assess_str_classes_read_coverage_require_flank(strclasses:list, align_obj, refobj, outputdict, bedintervals, hetsitedict, args, strshardresults=None)->dict:
 
-    # if the file already exists, don't recreate it
-    if os.path.exists(strstatsfile) and os.path.getsize(strstatsfile) > 0:
-        strdict = retrieve_stats_from_strstats_file(strstatsfile)
-        return strdict
+    numworkers = args.t if 't' in args else 1
+    strdicts = {}
+    classshards = {}
+    classshardresults = {}
+    for [strlabel, strbedfile] in strclasses:
+        includedstrfile = outputdict["includedstrprefix"] + "." + strlabel + ".included.bed"
+        strstatsfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out"
+
+        logger.info("Writing " + strlabel + " STR data to " + strstatsfile)
+
+        # if the file already exists, don't recreate it
+        if os.path.exists(strstatsfile) and os.path.getsize(strstatsfile) > 0:
+            strdicts[strlabel] = retrieve_stats_from_strstats_file(strstatsfile)
+            continue
 
+        if strshardresults is not None and strlabel in strshardresults:
+            classshardresults[strlabel] = strshardresults[strlabel]
+            continue
+
+        write_included_str_file(strbedfile, includedstrfile, bedintervals)
+
+        print("Saved included STR bed file. Will now open statsfile")
+        if numworkers > 1:
+            classshards[strlabel] = chrom_str_shards(includedstrfile)
+        else:
+            with open(includedstrfile, "r") as ifh, open(strstatsfile, "w", buffering=1) as sfh:
+                strdicts[strlabel] = tally_str_loci(ifh, align_obj, refobj, sfh, hetsitedict, args)
+
+    if len(classshards) > 0:
+        bamfile = os.fsdecode(align_obj.filename)
+        reffasta = os.fsdecode(refobj.filename)
+        chromhetsites = chrom_hetsite_subsets(hetsitedict)
+        shards = [[strlabel, shardindex] for strlabel in classshards for shardindex in range(len(classshards[strlabel]))]
+        with pipeline.worker_pool(numworkers) as executor:
+            shardresults = {}
+            # submit the shards with the most loci first to balance the load across workers:
+            for [strlabel, shardindex] in sorted(shards, key=lambda shard: len(classshards[shard[0]][shard[1]][1]), reverse=True):
+                [chrom, strlines] = classshards[strlabel][shardindex]
+                shardstatsfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out.shard" + str(shardindex)
+                shardhetsites = chromhetsites.get(chrom, {}) if chromhetsites is not None else hetsitedict
+                shardresults[(strlabel, shardindex)] = executor.submit(tally_str_shard, strlines, bamfile, reffasta, shardstatsfile, shardhetsites, strlabel + ":" + chrom, args)
+
+            for strlabel in classshards:
+                classshardresults[strlabel] = [shardresults[(strlabel, shardindex)].result() for shardindex in range(len(classshards[strlabel]))]
+
+    for strlabel in classshardresults:
+        strstatsfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out"
+        strdict = {}
+        with open(strstatsfile, "w") as sfh:
+            for [shardstrdict, shardstatsfile] in classshardresults[strlabel]:
+                merge_str_tallies(strdict, shardstrdict)
+                with open(shardstatsfile, "r") as shfh:
+                    shutil.copyfileobj(shfh, sfh)
+                os.remove(shardstatsfile)
+        strdicts[strlabel] = strdict
+
+    return strdicts
+
+# STR loci of a class's bed file that are within the benchmark intervals being assessed (all loci if bedintervals is None):
+def write_included_str_file(strbedfile:str, includedstrfile:str, bedintervals):
     strbedintervals = pybedtools.BedTool(strbedfile)
     if bedintervals is not None:
         includedstrbeds = bedtoolslib.intersectintervals(strbedintervals, bedintervals, wa=True)
@@ -345,129 +474,174 @@ def assess_str_read_coverage_require_flank(strlabel, align_obj, refobj, strbedfi
     else:
         strbedintervals.saveas(includedstrfile)
 
-    print("Saved included STR bed file. Will now open statsfile")
-    strdict = {}
-    sfh = open(strstatsfile, "w", buffering=1)
-    # for each str run in the str bedfile, retrieve reads, count length of str, classify as CORRECT, HET, ERROR, or COMPLEX
+# lines of an included STR bed file grouped by chromosome, as [chrom, lines] pairs in the order of the file:
+def chrom_str_shards(includedstrfile:str)->list:
+    chromlines = {}
     with open(includedstrfile, "r") as ifh:
-        strline = ifh.readline()
-        while strline:
-            strline = strline.rstrip()
-            strfields = strline.split("\t")
-            chrom = strfields[0]
-            start = int(strfields[1])
-            end = int(strfields[2])
-            name = strfields[3]
+        for strline in ifh:
+            chrom = strline.split("\t", 1)[0]
+            if chrom not in chromlines:
+                chromlines[chrom] = []
+            chromlines[chrom].append(strline)
+
+    return [[chrom, chromlines[chrom]] for chrom in chromlines]
+
+# het sites of a dictionary from phasing.read_hetsites split by chromosome, so that workers only receive their own
+# chromosome's sites (None for a het site store, which workers re-open from its file)
+def chrom_hetsite_subsets(hetsitedict)->dict:
+    if not isinstance(hetsitedict, dict):
+        return None
+    chromhetsites = {}
+    for hetsitename, hetsite in hetsitedict.items():
+        if hetsite.chrom not in chromhetsites:
+            chromhetsites[hetsite.chrom] = {}
+        chromhetsites[hetsite.chrom][hetsitename] = hetsite
+
+    return chromhetsites
+
+# adds the counts of one STR tally (runlength -> read allele length -> match type -> count) to another:
+def merge_str_tallies(strdict:dict, otherstrdict:dict):
+    for runlength in otherstrdict:
+        if runlength not in strdict:
+            strdict[runlength] = {}
+        for numbases in otherstrdict[runlength]:
+            if numbases not in strdict[runlength]:
+                strdict[runlength][numbases] = {}
+            for matchtype in otherstrdict[runlength][numbases]:
+                strdict[runlength][numbases][matchtype] = strdict[runlength][numbases].get(matchtype, 0) + otherstrdict[runlength][numbases][matchtype]
 
-            # need to extract benchmark's flanking bases here for comparison later!!!
-            benchleftflankseq = refobj.fetch(reference=chrom, start=start-5, end=start)
-            benchleftflankseq = benchleftflankseq.upper()
-            benchrightflankseq = refobj.fetch(reference=chrom, start=end, end=end+5)
-            benchrightflankseq = benchrightflankseq.upper()
-            runlength = end - start
-            if runlength not in strdict:
-                strdict[runlength] = {}
-            namefields = name.split("_")
-            repeatedbases = namefields[-1]
-            refalleleseq = refobj.fetch(reference=chrom, start=start, end=end)
-            readsforthisstr = 0
-            # for each read, attempt to find read positions aligned to the bases immediately flanking
-            # the STR. If one side and/or the other has no aligning base (due either to a deletion or
-            # to clipped sequence) then check for clipping beginning at that base, and
-            # extend the STR-aligned read sequence with clipped sequence to include adjacent 
-            # bases that extend the repeat plus 5 bp additional (this is NIST's so-called "slop" length).
-            # If a flanking base *does* have a read base aligned to it, also extend that end to 
-            # include repeated bases plut 5 bp slop.
-            for readalign in align_obj.fetch(contig=chrom, start=start, stop=end):
-                if max_reads_per_str > 0 and readsforthisstr >= max_reads_per_str:
-                    break
-                if args.downsample is not None and random.random() >= args.downsample:
-                    continue
-                # query_sequence includes soft clipped bases:
-                queryseq = readalign.query_sequence
-                if readalign.is_secondary or queryseq is None:
-                    continue
-                queryseq = queryseq.upper()
-                readname = readalign.query_name
-                # if the read doesn't align to the entire STR, skip it:
-                if readalign.reference_start is None or readalign.reference_end is None:
-                    logger.debug("Read " + readname + " has no reference_start or reference_end for " + chrom + ":" + str(start) + "-" + str(end))
-                    continue
-                if readalign.reference_start > start or readalign.reference_end < end:
-                    continue
-                # if the read doesn't align to the flanking bases, it must be clipped:
-                cigartuples = readalign.cigartuples
-                if ((readalign.reference_start == start and cigartuples[0][0] != 4) or
-                    (readalign.reference_end == end and cigartuples[len(cigartuples)-1][0] != 4)):
-                    logger.debug("Read " + readname + " aligns just to end of " + name + " but is not soft clipped--skipping")
-                    continue
-                pairs = readalign.get_aligned_pairs()
-                if len(pairs) == 0:
-                    continue
-                # find zero-based read pos of base aligned to ref base one before STR:
-                if readalign.reference_start < start:
-                    readstart = find_readpos_in_pairs(pairs, start-1)
-                elif readalign.query_alignment_start > 0: # must be clipped--set start to one efore base aligning to reference start:
-                    readstart = readalign.query_alignment_start - 1
-                # find zero-based read pos of base aligned to ref base one after STR:
-                if readalign.reference_end > end:
-                    readend = find_readpos_in_pairs(pairs, end)
-                elif readalign.query_alignment_end < len(queryseq):
-                    readend = readalign.query_alignment_end + 1
+# worker for assess_str_classes_read_coverage_require_flank--opens its own pysam file handles and returns the tallies
+# and stats file of its shard:
+def tally_str_shard(strlines:list, bamfile:str, reffasta:str, shardstatsfile:str, hetsitedict, randomseed:str, args)->dict:
 
-                if readstart is not None and readend is not None:
-                    # extend the read sequence to 5' and 3' so long as it matches the STR. "correctcomp" is True or False depending
-                    # on whether the alleleseq is a faithful repeat (even if flanking copies are partial) of the repeatedbases passed to it:
-                    [alleleseq, readstart, readend, correctcomp] = widen_str_on_readseq(queryseq, readstart, readend, repeatedbases)
+    align_obj = pysam.AlignmentFile(bamfile, "rb")
+    refobj = pysam.FastaFile(reffasta)
+    random.seed(randomseed)
+    with open(shardstatsfile, "w") as sfh:
+        strdict = tally_str_loci(strlines, align_obj, refobj, sfh, hetsitedict, args)
 
-                    # check that read has 5 flanking base pairs on either side of the HP:
-                    if readstart < 5 or readend > len(queryseq)-5:
-                        logger.debug("Skipping align of read " + readname + " which has fewer than 5 bp outside of HP repeat for " + chrom + ":" + str(start) + "-" + str(end))
-                        continue
-                    else:
-                        leftflankseq = queryseq[readstart-4:readstart+1]
-                        leftflankseq = leftflankseq.upper()
-                        rightflankseq = queryseq[readend:readend+5]
-                        rightflankseq = rightflankseq.upper()
-                    matchtype = "UNKNOWN"
-                    if correctcomp:
-                        numbases = len(alleleseq)
-                        if numbases != runlength:
-                            potentialhetname = chrom + "_" + str(start+1) + "_" + refalleleseq + "_" + alleleseq
-                            if potentialhetname in hetsitedict:
-                                matchtype = "HET"
-                            else:
-                                matchtype = "LENGTHERROR"
-                                logger.debug("Potential het " + potentialhetname + " is not a het")
-                        else:
-                            if leftflankseq == benchleftflankseq and rightflankseq == benchrightflankseq:
-                                matchtype = "CORRECT"
-                            else:
-                                logger.debug(leftflankseq + "/" + rightflankseq + " doesnt match " + benchleftflankseq + "/" + benchrightflankseq)
-                                matchtype = "FLANKERROR"
-                    else: # discrepancies within the HP 
-                        numbases = -1
-                        matchtype = "COMPLEX"
+    return [strdict, shardstatsfile]
 
-                    sfh.write(chrom + "\t" + str(start) + "\t" + str(end) + "\t" + readname + "\t" + repeatedbases + "\t" + str(runlength) + "\t" + str(numbases) + "\t" + matchtype + "\n")
-                    if numbases not in strdict[runlength]:
-                        strdict[runlength][numbases] = {}
-                    if matchtype not in strdict[runlength][numbases]:
-                        strdict[runlength][numbases][matchtype] = 1
-                    else:
-                        strdict[runlength][numbases][matchtype] = strdict[runlength][numbases][matchtype] + 1
-                    readsforthisstr = readsforthisstr + 1
-                else:
-                    logger.debug(readname + " is unaligned at one endpoint of interval " + str(start) + " to " + str(end) + " and has fewer than 5 clipped bases!")
-                    if readstart is None:
-                        logger.warning(readname + " " + str(readalign.reference_start) + "-" + str(readalign.reference_end) + " does not have a start")
-                    if readend is None:
-                        logger.warning(readname + " " + str(readalign.reference_start) + "-" + str(readalign.reference_end) + " does not have a end")
+# For each STR locus in lines of an included STR bed file, retrieves reads, counts the length of the STR, and
+# classifies it as CORRECT, HET, LENGTHERROR, FLANKERROR or COMPLEX, writing a line for each read to sfh and
+# returning the tallies
+def tally_str_loci(strlines, align_obj, refobj, sfh, hetsitedict, args)->dict:
 
-            strline = ifh.readline()
+    strfetch = args.strfetch if 'strfetch' in args else 'locus'
+    strdict = {}
+    tally_str_locus_reads(str_loci_with_reads(strlines, align_obj, refobj, strfetch), sfh, hetsitedict, strdict, args)
 
     return strdict
 
+# adds the read tallies of STR loci, given as the lists yielded by str_loci_with_reads, to strdict. rng gives the
+# random numbers for --downsample:
+def tally_str_locus_reads(lociwithreads, sfh, hetsitedict, strdict:dict, args, rng=random):
+
+    max_reads_per_str = args.maxstrreads
+    strfetch = args.strfetch if 'strfetch' in args else 'locus'
+    for [chrom, start, end, name, benchleftflankseq, benchrightflankseq, refalleleseq, strreads] in lociwithreads:
+        runlength = end - start
+        if runlength not in strdict:
+            strdict[runlength] = {}
+        namefields = name.split("_")
+        repeatedbases = namefields[-1]
+        readsforthisstr = 0
+        # for each read, attempt to find read positions aligned to the bases immediately flanking
+        # the STR. If one side and/or the other has no aligning base (due either to a deletion or
+        # to clipped sequence) then check for clipping beginning at that base, and
+        # extend the STR-aligned read sequence with clipped sequence to include adjacent 
+        # bases that extend the repeat plus 5 bp additional (this is NIST's so-called "slop" length).
+        # If a flanking base *does* have a read base aligned to it, also extend that end to 
+        # include repeated bases plut 5 bp slop.
+        for readalign in strreads:
+            if max_reads_per_str > 0 and readsforthisstr >= max_reads_per_str:
+                break
+            if args.downsample is not None and rng.random() >= args.downsample:
+                continue
+            # query_sequence includes soft clipped bases:
+            queryseq = readalign.query_sequence
+            if readalign.is_secondary or queryseq is None:
+                continue
+            queryseq = queryseq.upper()
+            readname = readalign.query_name
+            # if the read doesn't align to the entire STR, skip it:
+            if readalign.reference_start is None or readalign.reference_end is None:
+                logger.debug("Read " + readname + " has no reference_start or reference_end for " + chrom + ":" + str(start) + "-" + str(end))
+                continue
+            if readalign.reference_start > start or readalign.reference_end < end:
+                continue
+            # if the read doesn't align to the flanking bases, it must be clipped:
+            cigartuples = readalign.cigartuples
+            if ((readalign.reference_start == start and cigartuples[0][0] != 4) or
+                (readalign.reference_end == end and cigartuples[len(cigartuples)-1][0] != 4)):
+                logger.debug("Read " + readname + " aligns just to end of " + name + " but is not soft clipped--skipping")
+                continue
+            # tiled fetching walks the cigar string rather than searching aligned pairs:
+            pairs = None
+            if strfetch == 'locus':
+                pairs = readalign.get_aligned_pairs()
+                if len(pairs) == 0:
+                    continue
+            # find zero-based read pos of base aligned to ref base one before STR:
+            if readalign.reference_start < start:
+                readstart = find_readpos(readalign, start-1, pairs)
+            elif readalign.query_alignment_start > 0: # must be clipped--set start to one efore base aligning to reference start:
+                readstart = readalign.query_alignment_start - 1
+            # find zero-based read pos of base aligned to ref base one after STR:
+            if readalign.reference_end > end:
+                readend = find_readpos(readalign, end, pairs)
+            elif readalign.query_alignment_end < len(queryseq):
+                readend = readalign.query_alignment_end + 1
+
+            if readstart is not None and readend is not None:
+                # extend the read sequence to 5' and 3' so long as it matches the STR. "correctcomp" is True or False depending
+                # on whether the alleleseq is a faithful repeat (even if flanking copies are partial) of the repeatedbases passed to it:
+                [alleleseq, readstart, readend, correctcomp] = widen_str_on_readseq(queryseq, readstart, readend, repeatedbases)
+
+                # check that read has 5 flanking base pairs on either side of the HP:
+                if readstart < 5 or readend > len(queryseq)-5:
+                    logger.debug("Skipping align of read " + readname + " which has fewer than 5 bp outside of HP repeat for " + chrom + ":" + str(start) + "-" + str(end))
+                    continue
+                else:
+                    leftflankseq = queryseq[readstart-4:readstart+1]
+                    leftflankseq = leftflankseq.upper()
+                    rightflankseq = queryseq[readend:readend+5]
+                    rightflankseq = rightflankseq.upper()
+                matchtype = "UNKNOWN"
+                if correctcomp:
+                    numbases = len(alleleseq)
+                    if numbases != runlength:
+                        potentialhetname = chrom + "_" + str(start+1) + "_" + refalleleseq + "_" + alleleseq
+                        if potentialhetname in hetsitedict:
+                            matchtype = "HET"
+                        else:
+                            matchtype = "LENGTHERROR"
+                            logger.debug("Potential het " + potentialhetname + " is not a het")
+                    else:
+                        if leftflankseq == benchleftflankseq and rightflankseq == benchrightflankseq:
+                            matchtype = "CORRECT"
+                        else:
+                            logger.debug(leftflankseq + "/" + rightflankseq + " doesnt match " + benchleftflankseq + "/" + benchrightflankseq)
+                            matchtype = "FLANKERROR"
+                else: # discrepancies within the HP 
+                    numbases = -1
+                    matchtype = "COMPLEX"
+
+                sfh.write(chrom + "\t" + str(start) + "\t" + str(end) + "\t" + readname + "\t" + repeatedbases + "\t" + str(runlength) + "\t" + str(numbases) + "\t" + matchtype + "\n")
+                if numbases not in strdict[runlength]:
+                    strdict[runlength][numbases] = {}
+                if matchtype not in strdict[runlength][numbases]:
+                    strdict[runlength][numbases][matchtype] = 1
+                else:
+                    strdict[runlength][numbases][matchtype] = strdict[runlength][numbases][matchtype] + 1
+                readsforthisstr = readsforthisstr + 1
+            else:
+                logger.debug(readname + " is unaligned at one endpoint of interval " + str(start) + " to " + str(end) + " and has fewer than 5 clipped bases!")
+                if readstart is None:
+                    logger.warning(readname + " " + str(readalign.reference_start) + "-" + str(readalign.reference_end) + " does not have a start")
+                if readend is None:
+                    logger.warning(readname + " " + str(readalign.reference_start) + "-" + str(readalign.reference_end) + " does not have a end")
+
 def assess_mononuc_read_coverage_require_flank(align_obj, refobj, mononucbedfile, outputdict, bedintervals, hetsitedict, args):
 
     p = {}
@@ -713,6 +887,36 @@ def find_readpos_in_pairs(pairs, pos, ifnone="lower"):
 
     return None
 
+# Zero-based position in the read sequence (including soft-clipped bases, as in get_aligned_pairs) of the base
+# aligned to zero-based reference position "pos", found by walking the alignment's cigar operations. Returns
+# None if pos is deleted from the read or isn't within the alignment.
+def find_readpos_in_cigar(cigartuples:list, refstart:int, pos:int):
+    readpos = 0
+    refpos = refstart
+    for [cigarop, oplength] in cigartuples:
+        if cigarop in [0, 7, 8]: # M, =, X
+            if refpos <= pos < refpos + oplength:
+                return readpos + pos - refpos
+            readpos = readpos + oplength
+            refpos = refpos + oplength
+        elif cigarop in [1, 4]: # I, S
+            readpos = readpos + oplength
+        elif cigarop in [2, 3]: # D, N
+            if refpos <= pos < refpos + oplength:
+                return None
+            refpos = refpos + oplength
+        if refpos > pos:
+            return None
+
+    return None
+
+# read position aligned to reference position pos, from aligned pairs if they've been retrieved, otherwise from
+# the cigar string. Unlike find_readpos_in_pairs, the cigar walk finds the first and last aligned positions.
+def find_readpos(readalign, pos:int, pairs=None):
+    if pairs is not None:
+        return find_readpos_in_pairs(pairs, pos)
+    return find_readpos_in_cigar(readalign.cigartuples, readalign.reference_start, pos)
+
 def widen_str_on_readseq(readseq:str, readstart:int, readend:int, repbases:str)->list:
     alleleseq = readseq[readstart+1:readend]
 
@@ -759,13 +963,90 @@ def widen_str_on_readseq(readseq:str, readstart:int, readend:int, repbases:str)-
 
     return [alleleseq, readstart, readend, perfectrepeat]
 
-def assess_read_align_errors(align_obj, refobj, readerrorfile:str, bedintervals, hetsitedict, args):
-   
-    if not args.errorfile and not args.rerun:
-        refh = open(readerrorfile, "w")
-    elif args.errorfile:
+# Errors in read alignments are tallied by read position, error type and quality bin in count matrices. Error types
+# are the single base substitutions (read base to read base, on the read's strand) followed by insertions and
+# deletions, and quality bins are ten quality values wide, with a last bin for bases without qualities:
+READERRORSNVTYPES = [refbase + "_" + altbase for refbase in "ACGTN" for altbase in "ACGTN" if refbase != altbase]
+READERRORTYPES = READERRORSNVTYPES + ["INS", "DEL"]
+READERRORQUALBINSIZE = 10
+READERRORQUALBINS = 11
+# the regions of a genome in which read errors are assessed are sharded into groups of about this many bases:
+READERRORSHARDSIZE = 10000000
+# Each error (or het site) found in a read is also recorded in this form in a binary record file, which --rerun
+# reads in place of the text read error file. chrom indexes the references of the bam file, readpos is the 1-based
+# position in the read, qv is -1 for reads without qualities, and errortype indexes READERRORTYPES (or is -1 for a
+# substitution of a base other than ACGTN). readref and readalt are the bases of a substitution on the read's
+# strand, and lengthdiff is the length change of an indel:
+READERRORDTYPE = np.dtype([("chrom", np.int32), ("start", np.int64), ("end", np.int64), ("readpos", np.int64), ("strand", "S1"), ("het", np.bool_), ("qv", np.int16), ("errortype", np.int8), ("readref", "S1"), ("readalt", "S1"), ("lengthdiff", np.int32)])
+
+# With more than one worker (args.t), shards of the benchmark regions (see read_error_shards) are assessed by a pool
+# of processes, each writing its own part of the read error file and returning its own tallies and error records.
+# These are combined in the order of the regions, so the read error file and stats are those of a single process
+# (except with --downsample, for which each shard seeds its own random numbers). shardresults can instead give the
+# [tallies, error records, read error file part] of the shards of a single pass through the bam file (see readpass).
+def assess_read_align_errors(align_obj, refobj, readerrorfile:str, bedintervals, hetsitedict, args, shardresults=None):
+
+    callvariants = not args.errorfile and not args.rerun
+    if args.errorfile:
         readerrorfile = args.errorfile 
+    recordfile = read_error_record_file(readerrorfile)
+
+    numworkers = args.t if 't' in args else 1
+    stats = new_read_error_stats()
+    shardrecords = []
+    shards = read_error_shards(bedintervals, align_obj) if shardresults is None else []
+    if shardresults is not None:
+        logger.debug("Using read error tallies from single pass through alignments")
+    elif numworkers > 1 and len(shards) > 1:
+        bamfile = os.fsdecode(align_obj.filename)
+        reffasta = os.fsdecode(refobj.filename)
+        chromhetsites = chrom_hetsite_subsets(hetsitedict)
+        with pipeline.worker_pool(numworkers) as executor:
+            shardfutures = []
+            for shardindex, regions in enumerate(shards):
+                shardhetsites = hetsitedict
+                if chromhetsites is not None:
+                    shardhetsites = {}
+                    for chrom in set([region[0] for region in regions]):
+                        shardhetsites.update(chromhetsites.get(chrom, {}))
+                shardfile = readerrorfile + ".shard" + str(shardindex) if callvariants else None
+                randomseed = "readerrors:" + regions[0][0] + ":" + str(regions[0][1])
+                shardfutures.append(executor.submit(tally_read_error_shard, regions, bamfile, reffasta, shardfile, shardhetsites, randomseed, callvariants, args))
+            shardresults = [shardfuture.result() for shardfuture in shardfutures]
+    else:
+        refh = open(readerrorfile, "w") if callvariants else None
+        for regions in shards:
+            shardrecords.append(tally_region_align_errors(regions, align_obj, refobj, refh, hetsitedict, stats, callvariants, args))
+
+    if shardresults is not None:
+        refh = open(readerrorfile, "w") if callvariants else None
+        for [shardstats, records, shardfile] in shardresults:
+            merge_read_error_stats(stats, shardstats)
+            shardrecords.append(records)
+            if shardfile is not None:
+                if callvariants:
+                    with open(shardfile, "r") as shfh:
+                        shutil.copyfileobj(shfh, refh)
+                os.remove(shardfile)
+
+    if callvariants:
+        refh.close()
+        stats["positiontotalcounts"] = trim_position_counts(stats["positiontotalcounts"])
+        stats["positionerrorcounts"] = stats["positionerrorcounts"][:len(stats["positiontotalcounts"])]
+        write_read_error_records(recordfile, shardrecords, align_obj.references, stats)
+    elif not args.errorfile and os.path.exists(recordfile) and (not os.path.exists(readerrorfile) or os.path.getmtime(recordfile) >= os.path.getmtime(readerrorfile)):
+        logger.info("Reading read errors from record file " + recordfile)
+        tally_read_error_records(recordfile, stats)
+    else:
+        tally_read_error_file(readerrorfile, stats)
+
+    return stats
+
+# the binary record file (see READERRORDTYPE) that accompanies a text read error file:
+def read_error_record_file(readerrorfile:str)->str:
+    return os.path.splitext(readerrorfile)[0] + ".npz"
 
+def new_read_error_stats()->dict:
     stats = {}
     stats["totalalignedbases"] = 0
     stats["totalclippedbases"] = 0
@@ -773,163 +1054,290 @@ def assess_read_align_errors(align_obj, refobj, readerrorfile:str, bedintervals,
     stats["singlebasecounts"] = {}
     stats["indellengthcounts"] = {}
     stats["alignedqualscorecounts"] = []
-    # position counts are zero-based, i.e., one less than the ordinal position in the read:
-    stats["positionsnvcounts"] = []
-    stats["positionindelcounts"] = []
-    stats["positiontotalcounts"] = []
     stats["snverrorqualscorecounts"] = []
     stats["indelerrorqualscorecounts"] = []
-    alignsprocessed = 0
+    # position counts are zero-based, i.e., one less than the ordinal position in the read, and are indexed by
+    # position and quality bin (aligned bases) or position, error type and quality bin (errors). Their rows are
+    # preallocated, and are extended (see extend_position_counts) when a longer read comes along:
+    stats["positiontotalcounts"] = np.zeros((0, READERRORQUALBINS), dtype=np.int64)
+    stats["positionerrorcounts"] = np.zeros((0, len(READERRORTYPES), READERRORQUALBINS), dtype=np.int32)
 
-    # are we dealing with just a set of regions? or the whole genome?
-    if bedintervals is None:
-        bedintervals = [None]
+    return stats
 
-    for benchinterval in bedintervals:
-        if benchinterval is not None:
-            regionstring = benchinterval.chrom + ":" + str(benchinterval.start + 1) + "-" + str(benchinterval.end)
-        else:
-            regionstring = None
+# makes sure the position count matrices have at least numpositions rows, doubling their size as needed:
+def extend_position_counts(stats:dict, numpositions:int):
+    capacity = len(stats["positiontotalcounts"])
+    if capacity >= numpositions:
+        return
+    newcapacity = max(numpositions, 2*capacity)
+    for countkey in ["positiontotalcounts", "positionerrorcounts"]:
+        counts = stats[countkey]
+        newcounts = np.zeros((newcapacity,) + counts.shape[1:], dtype=counts.dtype)
+        newcounts[:capacity] = counts
+        stats[countkey] = newcounts
+
+# position counts without their trailing empty rows:
+def trim_position_counts(positioncounts):
+    nonzerorows = np.flatnonzero(positioncounts.any(axis=tuple(range(1, positioncounts.ndim))))
+    if len(nonzerorows) == 0:
+        return positioncounts[:0]
+    return positioncounts[:nonzerorows[-1] + 1]
+
+def read_error_qual_bin(qvscore)->int:
+    if qvscore is None:
+        return READERRORQUALBINS - 1
+    return min(int(qvscore) // READERRORQUALBINSIZE, READERRORQUALBINS - 2)
+
+# Regions in which read alignment errors are assessed, as lists of [chrom, start, end, isinterval] regions of about
+# READERRORSHARDSIZE bases. The reads of a benchmark interval (isinterval True) are all reads that overlap it, with
+# their aligned bases and errors outside of it left out (so that a read overlapping two intervals is assessed in
+# both), while the reads of a window of a whole chromosome (when there are no benchmark intervals) are the reads
+# that start within it, so that each read is assessed once:
+def read_error_shards(bedintervals, align_obj)->list:
+    regions = []
+    if bedintervals is not None:
+        for benchinterval in bedintervals:
+            regions.append([benchinterval.chrom, benchinterval.start, benchinterval.end, True])
+    else:
+        for chrom, chromlength in zip(align_obj.references, align_obj.lengths):
+            for windowstart in range(0, chromlength, READERRORSHARDSIZE):
+                regions.append([chrom, windowstart, min(windowstart + READERRORSHARDSIZE, chromlength), False])
+
+    shards = []
+    shardbases = 0
+    for region in regions:
+        if len(shards) == 0 or shardbases + region[2] - region[1] > READERRORSHARDSIZE:
+            shards.append([])
+            shardbases = 0
+        shards[-1].append(region)
+        shardbases = shardbases + region[2] - region[1]
+
+    return shards
+
+# adds the tallies of one set of read error stats to another:
+def merge_read_error_stats(stats:dict, otherstats:dict):
+    for countkey in ["totalalignedbases", "totalclippedbases", "totalerrorsinaligns"]:
+        stats[countkey] = stats[countkey] + otherstats[countkey]
+    for countkey in ["singlebasecounts", "indellengthcounts"]:
+        for errorkey in otherstats[countkey]:
+            stats[countkey][errorkey] = stats[countkey].get(errorkey, 0) + otherstats[countkey][errorkey]
+    for countkey in ["alignedqualscorecounts", "snverrorqualscorecounts", "indelerrorqualscorecounts"]:
+        alignparse.add_score_counts(stats[countkey], otherstats[countkey])
+    extend_position_counts(stats, len(otherstats["positiontotalcounts"]))
+    for countkey in ["positiontotalcounts", "positionerrorcounts"]:
+        stats[countkey][:len(otherstats[countkey])] += otherstats[countkey]
+
+# worker for assess_read_align_errors--opens its own pysam file handles and returns the tallies, error records and
+# read error file part of its shard:
+def tally_read_error_shard(regions:list, bamfile:str, reffasta:str, shardfile:str, hetsitedict, randomseed:str, callvariants:bool, args)->list:
+
+    align_obj = pysam.AlignmentFile(bamfile, "rb")
+    refobj = pysam.FastaFile(reffasta)
+    random.seed(randomseed)
+    stats = new_read_error_stats()
+    refh = open(shardfile, "w") if shardfile is not None else None
+    records = tally_region_align_errors(regions, align_obj, refobj, refh, hetsitedict, stats, callvariants, args)
+    if refh is not None:
+        refh.close()
+    stats["positiontotalcounts"] = trim_position_counts(stats["positiontotalcounts"])
+    stats["positionerrorcounts"] = stats["positionerrorcounts"][:len(stats["positiontotalcounts"])]
+
+    return [stats, records, shardfile]
+
+# Tallies aligned and clipped bases of the reads in regions (see read_error_shards) into stats, and, if callvariants
+# is true, their errors, writing a line for each error or het site to refh and returning their records
+def tally_region_align_errors(regions:list, align_obj, refobj, refh, hetsitedict, stats:dict, callvariants:bool, args)->np.ndarray:
+
+    records = []
+    alignsprocessed = 0
+    for [chrom, regionstart, regionend, isinterval] in regions:
+        benchinterval = pybedtools.Interval(chrom, regionstart, regionend) if isinterval else None
 
-        for align in align_obj.fetch(region=regionstring):
+        for align in align_obj.fetch(chrom, regionstart, regionend):
 
-            if align.is_secondary or align.cigartuples is None or (args.downsample is not None and random.random() >= args.downsample):
+            if not isinterval and align.reference_start < regionstart:
+                continue
+            if not tally_align_errors(align, benchinterval, refobj, refh, hetsitedict, stats, records, callvariants, args):
                 continue
 
-            stats["totalalignedbases"] = stats["totalalignedbases"] + align.reference_length
-            if benchinterval is not None: # shorten aligned length contribution if necessary
-                if benchinterval.start > align.reference_start:
-                    stats["totalalignedbases"] = stats["totalalignedbases"] + align.reference_start - benchinterval.start
-                if benchinterval.end < align.reference_end:
-                    stats["totalalignedbases"] = stats["totalalignedbases"] - align.reference_end + benchinterval.end
-
-            # TODO: clipping calc should be amended to not count if alignment endpoints are outside desired benchinterval!
-            cigartuples = align.cigartuples
-            if cigartuples[0][0] in [4, 5]:
-                if benchinterval is None or benchinterval.start < align.reference_start:
-                    stats["totalclippedbases"] = stats["totalclippedbases"] + cigartuples[0][1]
-            if cigartuples[-1][0] in [4, 5]:
-                if benchinterval is None or benchinterval.end > align.reference_end:
-                    stats["totalclippedbases"] = stats["totalclippedbases"] + cigartuples[-1][1]
-            
-            if not args.errorfile and not args.rerun:
-                query, querystart, queryend, ref, refstart, refend, strand = alignparse.retrieve_align_data(align)
-                if strand == "F":
-                    queryleft = querystart
-                    queryright = queryend
-                else:
-                    queryleft = queryend
-                    queryright = querystart
-
-                # make sure position arrays (zero-base indexed) are long enough to store position counts:
-                while len(stats["positionindelcounts"]) < queryend:
-                    stats["positionindelcounts"].append(0)
-                while len(stats["positionsnvcounts"]) < queryend:
-                    stats["positionsnvcounts"].append({})
-                while len(stats["positiontotalcounts"]) < queryend:
-                    stats["positiontotalcounts"].append(0)
-                for position in range(querystart-1, queryend):
-                    stats["positiontotalcounts"][position-1] = stats["positiontotalcounts"][position-1] + 1
-
-                hetsites = {}
-                hetsitealleles = {} # no need to track het site alleles in this context
-                queryobj = None
-    
-                read_variants = alignparse.align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, stats["alignedqualscorecounts"], stats["snverrorqualscorecounts"], stats["indelerrorqualscorecounts"], True)
-    
-                for variant in read_variants:
-                    namefields = variant.name.split("_")
-                    # this is the read position (from beginning of read, regardless of strand):
-                    pos = int(namefields[-4])
-                    refallele = namefields[-3]
-                    altallele = namefields[-2]
-                    if benchinterval is not None and (variant.start < benchinterval.start or variant.end > benchinterval.end):
-                        continue
-                    if namefields[-1] == "F":
-                        alignstrand = '+'
-                    else:
-                        alignstrand = '-'
-                    varname = variant.chrom + "_" + str(int(variant.start) + 1) + "_" + refallele + "_" + altallele
-                    varqvscore = "1000"
-                    if variant.qvscore is not None:
-                        varqvscore = str(variant.qvscore)
+            alignsprocessed = alignsprocessed + 1
+            if alignsprocessed == 100000*int(alignsprocessed/100000):
+                logger.debug("Processed " + str(alignsprocessed) + " aligns")
 
-        
-                    if varname in hetsitedict.keys():
-                        errortype = 'HET'
-                        errortypecolor = '255,0,0'
-                    else:
-                        errortype = 'ERROR'
-                        errortypecolor = '0,0,255'
+    return np.array(records, dtype=READERRORDTYPE)
+
+# Tallies the aligned and clipped bases of a read alignment (trimmed to benchinterval, unless it is None) into stats,
+# and, if callvariants is true, its errors, writing a line to refh and appending a record to records for each error or
+# het site. Returns False for alignments that aren't assessed (secondary, unaligned or left out by --downsample, with
+# random numbers from rng):
+def tally_align_errors(align, benchinterval, refobj, refh, hetsitedict, stats:dict, records:list, callvariants:bool, args, rng=random)->bool:
+
+    if align.is_secondary or align.cigartuples is None or (args.downsample is not None and rng.random() >= args.downsample):
+        return False
+
+    stats["totalalignedbases"] = stats["totalalignedbases"] + align.reference_length
+    if benchinterval is not None: # shorten aligned length contribution if necessary
+        if benchinterval.start > align.reference_start:
+            stats["totalalignedbases"] = stats["totalalignedbases"] + align.reference_start - benchinterval.start
+        if benchinterval.end < align.reference_end:
+            stats["totalalignedbases"] = stats["totalalignedbases"] - align.reference_end + benchinterval.end
+
+    # TODO: clipping calc should be amended to not count if alignment endpoints are outside desired benchinterval!
+    cigartuples = align.cigartuples
+    if cigartuples[0][0] in [4, 5]:
+        if benchinterval is None or benchinterval.start < align.reference_start:
+            stats["totalclippedbases"] = stats["totalclippedbases"] + cigartuples[0][1]
+    if cigartuples[-1][0] in [4, 5]:
+        if benchinterval is None or benchinterval.end > align.reference_end:
+            stats["totalclippedbases"] = stats["totalclippedbases"] + cigartuples[-1][1]
     
-                    # record error in stats:
-                    if errortype == 'ERROR':
-                        stats["totalerrorsinaligns"] = stats["totalerrorsinaligns"] + 1
-                        if refallele != "*" and altallele != "*" and len(refallele) == 1 and len(altallele) == 1:
-                            if alignstrand == "+":
-                                readrefallele = refallele
-                                readaltallele = altallele
-                            else:
-                                readrefallele = seqparse.revcomp(refallele)
-                                readaltallele = seqparse.revcomp(altallele)
+    if callvariants:
+        query, querystart, queryend, ref, refstart, refend, strand = alignparse.retrieve_align_data(align)
+
+        # count aligned bases at each (zero-based) read position--the first aligned base of a reverse
+        # strand alignment is the last (3') aligned base of the read:
+        extend_position_counts(stats, queryend)
+        alignedquals = align.query_alignment_qualities
+        if strand == "F":
+            readpositions = np.arange(querystart - 1, queryend)
+        else:
+            readpositions = np.arange(queryend - 1, querystart - 2, -1)
+        if alignedquals is not None:
+            qualbins = np.minimum(np.asarray(alignedquals, dtype=np.int64) // READERRORQUALBINSIZE, READERRORQUALBINS - 2)
+            stats["positiontotalcounts"][readpositions, qualbins] += 1
+        else:
+            stats["positiontotalcounts"][querystart - 1:queryend, READERRORQUALBINS - 1] += 1
 
-                            snvkey = readrefallele + "_" + readaltallele
-                            if snvkey in stats["singlebasecounts"]:
-                                stats["singlebasecounts"][snvkey] = stats["singlebasecounts"][snvkey] + 1
-                            else:
-                                stats["singlebasecounts"][snvkey] = 1
-                            # add SNV error to tally at this read position:
-                            if snvkey in stats["positionsnvcounts"][pos - 1]:
-                                stats["positionsnvcounts"][pos-1][snvkey] = stats["positionsnvcounts"][pos-1][snvkey] + 1
-                            else:
-                                stats["positionsnvcounts"][pos-1][snvkey] = 1
-                        else:
-                            trueref = refallele.replace('*', '')
-                            truealt = altallele.replace('*', '')
-                            lengthdiff = len(truealt) - len(trueref)
-                            if lengthdiff in stats["indellengthcounts"]:
-                                stats["indellengthcounts"][lengthdiff] = stats["indellengthcounts"][lengthdiff] + 1
-                            else:
-                                stats["indellengthcounts"][lengthdiff] = 1
-                            #stats["positionindelcounts"][pos-1] = stats["positionindelcounts][pos-1] + 1
+        hetsites = {}
+        hetsitealleles = {} # no need to track het site alleles in this context
+        queryobj = None
     
-                    refh.write(variant.chrom + "\t" + str(variant.start) + "\t" + str(variant.end) + "\t" + varname + "\t" + varqvscore + "\t" + alignstrand + "\t" + str(variant.start) + "\t" + str(variant.end) + "\t" + errortypecolor + "\t" + errortype + "\t" + variant.name + "\n")
+        read_variants = alignparse.align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, stats["alignedqualscorecounts"], stats["snverrorqualscorecounts"], stats["indelerrorqualscorecounts"], True, args.variantengine)
     
-            alignsprocessed = alignsprocessed + 1
-            if alignsprocessed == 100000*int(alignsprocessed/100000):
-                logger.debug("Processed " + str(alignsprocessed) + " aligns")
+        for variant in read_variants:
+            namefields = variant.name.split("_")
+            # this is the read position (from beginning of read, regardless of strand):
+            pos = int(namefields[-4])
+            refallele = namefields[-3]
+            altallele = namefields[-2]
+            if benchinterval is not None and (variant.start < benchinterval.start or variant.end > benchinterval.end):
+                continue
+            if namefields[-1] == "F":
+                alignstrand = '+'
+            else:
+                alignstrand = '-'
+            varname = variant.chrom + "_" + str(int(variant.start) + 1) + "_" + refallele + "_" + altallele
+            varqvscore = "1000"
+            if variant.qvscore is not None:
+                varqvscore = str(variant.qvscore)
 
 
-    if args.errorfile or args.rerun:
-        with open(readerrorfile, "r") as efh:
-            errorline = efh.readline()
-            while errorline:
-                errorline = errorline.rstrip()
-                [chrom, start, end, varname, score, strand, widestart, wideend, color, variant_type, queryvariantname] = errorline.split("\t")
-                if variant_type == "HET":
-                    errorline = efh.readline()
-                    continue
+            if varname in hetsitedict:
+                errortype = 'HET'
+                errortypecolor = '255,0,0'
+            else:
+                errortype = 'ERROR'
+                errortypecolor = '0,0,255'
+    
+            readrefallele = ""
+            readaltallele = ""
+            lengthdiff = 0
+            if refallele != "*" and altallele != "*" and len(refallele) == 1 and len(altallele) == 1:
+                if alignstrand == "+":
+                    readrefallele = refallele
+                    readaltallele = altallele
+                else:
+                    readrefallele = seqparse.revcomp(refallele)
+                    readaltallele = seqparse.revcomp(altallele)
+                snvkey = readrefallele + "_" + readaltallele
+                errortypeindex = READERRORTYPES.index(snvkey) if snvkey in READERRORSNVTYPES else -1
+            else:
+                trueref = refallele.replace('*', '')
+                truealt = altallele.replace('*', '')
+                lengthdiff = len(truealt) - len(trueref)
+                errortypeindex = READERRORTYPES.index("INS") if lengthdiff > 0 else READERRORTYPES.index("DEL")
 
-                namefields = varname.split("_")
-                refallele = namefields[-2]
-                altallele = namefields[-1]
-                
-                # record error in stats:
+            # record error in stats:
+            if errortype == 'ERROR':
                 stats["totalerrorsinaligns"] = stats["totalerrorsinaligns"] + 1
-                if refallele != "*" and altallele != "*" and len(refallele) == 1 and len(altallele) == 1:
-                    snvkey = refallele + "_" + altallele
+                if readrefallele != "":
                     if snvkey in stats["singlebasecounts"]:
                         stats["singlebasecounts"][snvkey] = stats["singlebasecounts"][snvkey] + 1
                     else:
                         stats["singlebasecounts"][snvkey] = 1
                 else:
-                    trueref = refallele.replace('*', '')
-                    truealt = altallele.replace('*', '')
-                    lengthdiff = len(truealt) - len(trueref)
                     if lengthdiff in stats["indellengthcounts"]:
                         stats["indellengthcounts"][lengthdiff] = stats["indellengthcounts"][lengthdiff] + 1
                     else:
                         stats["indellengthcounts"][lengthdiff] = 1
+                # add error to tally at this read position:
+                if errortypeindex >= 0:
+                    stats["positionerrorcounts"][pos - 1, errortypeindex, read_error_qual_bin(variant.qvscore)] += 1
+    
+            refh.write(variant.chrom + "\t" + str(variant.start) + "\t" + str(variant.end) + "\t" + varname + "\t" + varqvscore + "\t" + alignstrand + "\t" + str(variant.start) + "\t" + str(variant.end) + "\t" + errortypecolor + "\t" + errortype + "\t" + variant.name + "\n")
+            records.append((align.reference_id, variant.start, variant.end, pos, alignstrand, errortype == 'HET', variant.qvscore if variant.qvscore is not None else -1, errortypeindex, readrefallele, readaltallele, lengthdiff))
+
+    return True
+
+# writes the error records of each shard, with the names of the references they index and the count matrices and
+# quality score counts of stats, to a binary record file:
+def write_read_error_records(recordfile:str, shardrecords:list, chroms:list, stats:dict):
+    records = np.concatenate(shardrecords) if len(shardrecords) > 0 else np.zeros(0, dtype=READERRORDTYPE)
+    countarrays = {}
+    for countkey in ["positiontotalcounts", "positionerrorcounts", "alignedqualscorecounts", "snverrorqualscorecounts", "indelerrorqualscorecounts"]:
+        countarrays[countkey] = np.asarray(stats[countkey], dtype=np.int64)
+    with open(recordfile, "wb") as rfh:
+        np.savez(rfh, records=records, chroms=np.array(chroms, dtype=str), **countarrays)
+    logger.info("Wrote " + str(len(records)) + " read error records to " + recordfile)
+
+# tallies the errors in a binary record file (see write_read_error_records) into stats:
+def tally_read_error_records(recordfile:str, stats:dict):
+    with np.load(recordfile) as recorddata:
+        records = recorddata["records"]
+        errorrecords = records[~records["het"]]
+        stats["totalerrorsinaligns"] = stats["totalerrorsinaligns"] + len(errorrecords)
+        issnv = errorrecords["readref"] != b""
+        snvkeys = np.char.add(np.char.add(errorrecords["readref"][issnv], b"_"), errorrecords["readalt"][issnv])
+        for snvkey, count in zip(*np.unique(snvkeys, return_counts=True)):
+            snvkey = snvkey.decode()
+            stats["singlebasecounts"][snvkey] = stats["singlebasecounts"].get(snvkey, 0) + int(count)
+        for lengthdiff, count in zip(*np.unique(errorrecords["lengthdiff"][~issnv], return_counts=True)):
+            stats["indellengthcounts"][int(lengthdiff)] = stats["indellengthcounts"].get(int(lengthdiff), 0) + int(count)
+        for countkey in ["alignedqualscorecounts", "snverrorqualscorecounts", "indelerrorqualscorecounts"]:
+            stats[countkey] = [int(count) for count in recorddata[countkey]]
+        stats["positiontotalcounts"] = recorddata["positiontotalcounts"]
+        stats["positionerrorcounts"] = recorddata["positionerrorcounts"].astype(np.int32)
+
+# tallies the errors in a text read error file (written by assess_read_align_errors or given with --errorfile) into
+# stats. Unlike the binary record file, its alleles are those of the reference strand:
+def tally_read_error_file(readerrorfile:str, stats:dict):
+    with open(readerrorfile, "r") as efh:
+        errorline = efh.readline()
+        while errorline:
+            errorline = errorline.rstrip()
+            [chrom, start, end, varname, score, strand, widestart, wideend, color, variant_type, queryvariantname] = errorline.split("\t")
+            if variant_type == "HET":
                 errorline = efh.readline()
+                continue
 
-    return stats
+            namefields = varname.split("_")
+            refallele = namefields[-2]
+            altallele = namefields[-1]
+            
+            # record error in stats:
+            stats["totalerrorsinaligns"] = stats["totalerrorsinaligns"] + 1
+            if refallele != "*" and altallele != "*" and len(refallele) == 1 and len(altallele) == 1:
+                snvkey = refallele + "_" + altallele
+                if snvkey in stats["singlebasecounts"]:
+                    stats["singlebasecounts"][snvkey] = stats["singlebasecounts"][snvkey] + 1
+                else:
+                    stats["singlebasecounts"][snvkey] = 1
+            else:
+                trueref = refallele.replace('*', '')
+                truealt = altallele.replace('*', '')
+                lengthdiff = len(truealt) - len(trueref)
+                if lengthdiff in stats["indellengthcounts"]:
+                    stats["indellengthcounts"][lengthdiff] = stats["indellengthcounts"][lengthdiff] + 1
+                else:
+                    stats["indellengthcounts"][lengthdiff] = 1
+            errorline = efh.readline()
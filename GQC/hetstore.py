@@ -0,0 +1,230 @@
+import sys
+import os
+import json
+import struct
+import argparse
+import logging
+import numpy as np
+from GQC import phasing
+
+logger = logging.getLogger(__name__)
+
+# A compiled het site store holds the sites of a benchmark het site bed file as per-chromosome columns
+# of a single binary file, which is memory-mapped when loaded so that sites are only read (and turned
+# into varianttuples) when they are used. The file begins with the magic string, the length of a JSON
+# header, and the header, which gives for each chromosome the number of sites and the byte offset, type
+# and length of each column. Sites are sorted by start and end, as in phasing.sort_chrom_hetsite_arrays.
+# String columns (names, ref and alt alleles and phase, which is the last field of the name) are stored
+# as a byte array of the concatenated strings with an array of offsets into it.
+
+HETSTORE_MAGIC = b"GQCHETS1"
+HETSTORE_SUFFIX = ".hetstore"
+VARTYPES = ['SNV', 'INDEL']
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION] [FILE]...",
+        description="Compile a benchmark het site bed file into a binary het site store that can be loaded quickly"
+    )
+    parser.add_argument(
+        "-v", "--version", action="version",
+        version = f"{parser.prog} version 0.1.0"
+    )
+    parser.add_argument('hetsitebed', type=str, help='het site bed file (the hetsitevariants file of a benchmark config)')
+    parser.add_argument('-o', '--output', type=str, required=False, default=None, help='name of store file to write (default is the bed file name with .hetstore appended, which is used automatically by assemblybench and readbench)')
+    parser.add_argument('--debug', action='store_true', required=False, help='print verbose output for debugging purposes')
+
+    return parser
+
+def parse_arguments(args):
+    parser = init_argparse()
+    args = parser.parse_args(args)
+
+    return args
+
+# the store file that is used in place of a het site bed file:
+def hetsite_store_file(hetsitefile:str)->str:
+    return hetsitefile + HETSTORE_SUFFIX
+
+def is_hetsite_store(hetsitefile:str)->bool:
+    if not os.path.isfile(hetsitefile):
+        return False
+    with open(hetsitefile, "rb") as hfh:
+        return hfh.read(len(HETSTORE_MAGIC)) == HETSTORE_MAGIC
+
+def string_column(strings:list)->list:
+    encodedstrings = [string.encode() for string in strings]
+    offsets = np.zeros(len(encodedstrings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(encodedstring) for encodedstring in encodedstrings], dtype=np.int64)
+
+    return [np.frombuffer(b"".join(encodedstrings), dtype=np.uint8), offsets]
+
+def compile_hetsite_store(hetsitefile:str, storefile:str)->int:
+    hetsites = phasing.read_hetsites(hetsitefile)
+    chromhetsites = phasing.sort_chrom_hetsite_arrays(hetsites)
+
+    header = {"chroms": {}}
+    columnarrays = []
+    dataoffset = 0
+    for chrom in chromhetsites:
+        sites = chromhetsites[chrom]
+        namefields = [site.name.split("_") for site in sites]
+        [nameblob, nameoffsets] = string_column([site.name for site in sites])
+        [refblob, refoffsets] = string_column([fields[-3] for fields in namefields])
+        [altblob, altoffsets] = string_column([fields[-2] for fields in namefields])
+        [phaseblob, phaseoffsets] = string_column([fields[-1] for fields in namefields])
+        columns = {"starts": np.array([site.start for site in sites], dtype=np.int64),
+                   "ends": np.array([site.end for site in sites], dtype=np.int64),
+                   "vartypes": np.array([VARTYPES.index(site.vartype) for site in sites], dtype=np.uint8),
+                   "names": nameblob, "nameoffsets": nameoffsets,
+                   "refalleles": refblob, "refoffsets": refoffsets,
+                   "altalleles": altblob, "altoffsets": altoffsets,
+                   "phases": phaseblob, "phaseoffsets": phaseoffsets}
+        header["chroms"][chrom] = {"count": len(sites), "columns": {}}
+        for column in columns:
+            columnarray = columns[column]
+            header["chroms"][chrom]["columns"][column] = [dataoffset, columnarray.dtype.str, len(columnarray)]
+            columnarrays.append(columnarray)
+            # keep every column 8-byte aligned:
+            dataoffset = dataoffset + (columnarray.nbytes + 7) // 8 * 8
+
+    headerbytes = json.dumps(header).encode()
+    headerlength = len(HETSTORE_MAGIC) + 8 + len(headerbytes)
+    headerpadding = (8 - headerlength % 8) % 8
+    with open(storefile, "wb") as sfh:
+        sfh.write(HETSTORE_MAGIC)
+        sfh.write(struct.pack("<Q", len(headerbytes) + headerpadding))
+        sfh.write(headerbytes + b" " * headerpadding)
+        for columnarray in columnarrays:
+            sfh.write(columnarray.tobytes())
+            sfh.write(b"\0" * ((8 - columnarray.nbytes % 8) % 8))
+
+    logger.info("Wrote " + str(len(hetsites)) + " het sites to store " + storefile)
+
+    return len(hetsites)
+
+# Sites of one chromosome in a store. Indexing returns a varianttuple like those from phasing.read_hetsites,
+# and "starts" is the sorted array of start positions (see phasing.index_hetsite_starts). Pickling (e.g., to
+# send to a worker process) only sends the store file name and chromosome, which the worker re-opens.
+class HetSiteArray:
+    def __init__(self, storefile:str, chrom:str, columns:dict):
+        self.storefile = storefile
+        self.chrom = chrom
+        self.columns = columns
+        self.starts = columns["starts"]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index:int):
+        columns = self.columns
+        return phasing.varianttuple(chrom=self.chrom, start=int(columns["starts"][index]), end=int(columns["ends"][index]), name=self.column_string("names", "nameoffsets", index), vartype=VARTYPES[columns["vartypes"][index]], excluded=False, qvscore=None)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __reduce__(self):
+        return (load_hetsite_array, (self.storefile, self.chrom))
+
+    def column_string(self, blobcolumn:str, offsetcolumn:str, index:int)->str:
+        offsets = self.columns[offsetcolumn]
+        return self.columns[blobcolumn][offsets[index]:offsets[index+1]].tobytes().decode()
+
+    # true if the chromosome has a het site with the given start and alleles:
+    def has_site(self, start:int, refallele:str, altallele:str)->bool:
+        index = int(np.searchsorted(self.starts, start))
+        while index < len(self.starts) and self.starts[index] == start:
+            if self.column_string("refalleles", "refoffsets", index) == refallele and self.column_string("altalleles", "altoffsets", index) == altallele:
+                return True
+            index = index + 1
+        return False
+
+# A loaded store can be used in place of the dictionary of het sites from phasing.read_hetsites when
+# checking whether a variant name (chrom_pos_ref_alt, where pos is 1-based) is a het site, and
+# chrom_hetsite_arrays gives the same per-chromosome arrays as phasing.sort_chrom_hetsite_arrays.
+# Like HetSiteArray, a store is pickled as its file name:
+class HetSiteStore:
+    def __init__(self, storefile:str):
+        self.storefile = storefile
+        self.chromarrays = {}
+        with open(storefile, "rb") as sfh:
+            magic = sfh.read(len(HETSTORE_MAGIC))
+            if magic != HETSTORE_MAGIC:
+                logger.critical("File " + storefile + " is not a het site store")
+                print("File " + storefile + " is not a het site store")
+                exit(1)
+            headerlength = struct.unpack("<Q", sfh.read(8))[0]
+            header = json.loads(sfh.read(headerlength).decode())
+        dataoffset = len(HETSTORE_MAGIC) + 8 + headerlength
+        storemap = np.memmap(storefile, dtype=np.uint8, mode='r')
+        for chrom in header["chroms"]:
+            columns = {}
+            for column, [columnoffset, dtypestr, columnlength] in header["chroms"][chrom]["columns"].items():
+                dtype = np.dtype(dtypestr)
+                columnstart = dataoffset + columnoffset
+                columns[column] = storemap[columnstart:columnstart + columnlength * dtype.itemsize].view(dtype)
+            self.chromarrays[chrom] = HetSiteArray(storefile, chrom, columns)
+
+    def __len__(self):
+        return sum(len(chromarray) for chromarray in self.chromarrays.values())
+
+    def __reduce__(self):
+        return (HetSiteStore, (self.storefile,))
+
+    def __contains__(self, hetsitename):
+        namefields = hetsitename.rsplit("_", 3)
+        if len(namefields) != 4 or namefields[0] not in self.chromarrays:
+            return False
+        [chrom, pos, refallele, altallele] = namefields
+        try:
+            start = int(pos) - 1
+        except ValueError:
+            return False
+        return self.chromarrays[chrom].has_site(start, refallele, altallele)
+
+    def chrom_hetsite_arrays(self)->dict:
+        return dict(self.chromarrays)
+
+def load_hetsite_array(storefile:str, chrom:str):
+    return HetSiteStore(storefile).chromarrays[chrom]
+
+# Het sites for a benchmark: hetsitefile can be a bed file or a compiled store. A bed file's store (see
+# hetsite_store_file) is used instead of the bed file if it is at least as new as the bed file:
+def load_hetsites(hetsitefile:str):
+    storefile = hetsite_store_file(hetsitefile)
+    if is_hetsite_store(hetsitefile):
+        storefile = hetsitefile
+    elif not os.path.isfile(storefile) or not os.path.isfile(hetsitefile) or os.path.getmtime(storefile) < os.path.getmtime(hetsitefile):
+        return phasing.read_hetsites(hetsitefile)
+
+    logger.info("Loading het sites from store " + storefile)
+    return HetSiteStore(storefile)
+
+# per-chromosome position-sorted het site arrays for the het sites returned by load_hetsites:
+def chrom_hetsite_arrays(hetsites)->dict:
+    if isinstance(hetsites, HetSiteStore):
+        return hetsites.chrom_hetsite_arrays()
+    return phasing.sort_chrom_hetsite_arrays(hetsites)
+
+def main() -> None:
+
+    args = parse_arguments(sys.argv[1:])
+
+    logformat = '%(asctime)s %(message)s'
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG, format=logformat)
+    else:
+        logging.basicConfig(level=logging.INFO, format=logformat)
+
+    if not os.path.isfile(args.hetsitebed):
+        logger.critical("Het site file " + args.hetsitebed + " does not exist")
+        print("Het site file " + args.hetsitebed + " does not exist")
+        exit(1)
+
+    storefile = args.output if args.output is not None else hetsite_store_file(args.hetsitebed)
+    numsites = compile_hetsite_store(args.hetsitebed, storefile)
+    print("Wrote " + str(numsites) + " het sites to " + storefile)
+
+if __name__ == "__main__":
+    main()
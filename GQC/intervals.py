@@ -0,0 +1,281 @@
+import os
+import logging
+import numpy as np
+import pybedtools
+from collections import namedtuple
+
+# In-memory interval sets for the places where calling bedtools through pybedtools (writing
+# temporary BED files and starting a process for each call) is too slow. An interval set is a
+# dictionary keyed by chromosome name, with values that are dictionaries of NumPy arrays "starts"
+# and "ends" (0-based, half-open, as in BED files) sorted by start and then end, and a list "names"
+# in the same order (entries are None for intervals without names). Only the first four BED columns
+# are kept.
+#
+# As in bedtools, intervals overlap if they share at least one base, and zero-length intervals
+# (start equal to end, e.g., insertions) are treated as covering the bases on either side of them.
+
+# record for each overlapping pair of intervals reported by intersect_intervals with mode "wo":
+overlaptuple = namedtuple('overlaptuple', ['chrom', 'start', 'end', 'name', 'otherstart', 'otherend', 'othername', 'overlap'])
+
+logger = logging.getLogger(__name__)
+
+def create_intervals(chroms:list, starts:list, ends:list, names=None)->dict:
+    chromindices = {}
+    for index in range(len(chroms)):
+        chrom = chroms[index]
+        if chrom not in chromindices:
+            chromindices[chrom] = []
+        chromindices[chrom].append(index)
+
+    intervals = {}
+    allstarts = np.asarray(starts, dtype=np.int64)
+    allends = np.asarray(ends, dtype=np.int64)
+    for chrom in chromindices:
+        indices = np.array(chromindices[chrom], dtype=np.int64)
+        chromstarts = allstarts[indices]
+        chromends = allends[indices]
+        order = np.lexsort((chromends, chromstarts))
+        if names is None:
+            chromnames = [None] * len(indices)
+        else:
+            chromnames = [names[indices[i]] for i in order]
+        intervals[chrom] = {'starts': chromstarts[order], 'ends': chromends[order], 'names': chromnames}
+
+    return intervals
+
+def read_bedfile_intervals(bedfile:str)->dict:
+    chroms = []
+    starts = []
+    ends = []
+    names = []
+    with open(bedfile, "r") as bfh:
+        for bedline in bfh:
+            if bedline.startswith("#") or bedline.startswith("track") or bedline.startswith("browser") or bedline.strip() == "":
+                continue
+            fields = bedline.rstrip("\n").split("\t")
+            chroms.append(fields[0])
+            starts.append(int(fields[1]))
+            ends.append(int(fields[2]))
+            names.append(fields[3] if len(fields) > 3 else None)
+
+    return create_intervals(chroms, starts, ends, names)
+
+# convert a pybedtools BedTool (or an interval set, which is returned as is):
+def as_intervals(bedobj)->dict:
+    if isinstance(bedobj, dict):
+        return bedobj
+    bedfile = bedobj.fn
+    if isinstance(bedfile, str) and os.path.exists(bedfile):
+        return read_bedfile_intervals(bedfile)
+
+    chroms = []
+    starts = []
+    ends = []
+    names = []
+    for interval in bedobj:
+        chroms.append(interval.chrom)
+        starts.append(interval.start)
+        ends.append(interval.end)
+        names.append(interval.name if len(interval.fields) > 3 else None)
+
+    return create_intervals(chroms, starts, ends, names)
+
+def intervals_bedstring(intervals:dict)->str:
+    bedlines = []
+    for chrom in intervals:
+        chromintervals = intervals[chrom]
+        for start, end, name in zip(chromintervals['starts'].tolist(), chromintervals['ends'].tolist(), chromintervals['names']):
+            if name is None:
+                bedlines.append(chrom + "\t" + str(start) + "\t" + str(end) + "\n")
+            else:
+                bedlines.append(chrom + "\t" + str(start) + "\t" + str(end) + "\t" + name + "\n")
+
+    return "".join(bedlines)
+
+def write_bedfile_intervals(intervals:dict, bedfile:str):
+    with open(bedfile, "w") as bfh:
+        bfh.write(intervals_bedstring(intervals))
+
+def intervals_bedtool(intervals:dict):
+    return pybedtools.BedTool(intervals_bedstring(intervals), from_string=True)
+
+def count_intervals(intervals:dict)->int:
+    return sum(len(intervals[chrom]['starts']) for chrom in intervals)
+
+# total length of the intervals (overlapping bases are counted more than once, as in bedtoolslib.bedsum):
+def sum_intervals(intervals:dict)->int:
+    return int(sum(int(np.sum(intervals[chrom]['ends'] - intervals[chrom]['starts'])) for chrom in intervals))
+
+# merge intervals that overlap or are within distance bases of each other (book-ended intervals are
+# merged, as with bedtools merge). Names of merged intervals are joined with collapsedelim:
+def merge_intervals(intervals:dict, distance=0, collapsedelim='|')->dict:
+    mergedintervals = {}
+    for chrom in intervals:
+        starts = intervals[chrom]['starts']
+        ends = intervals[chrom]['ends']
+        names = intervals[chrom]['names']
+        if len(starts) == 0:
+            continue
+        maxends = np.maximum.accumulate(ends)
+        firstindices = np.concatenate(([0], np.flatnonzero(starts[1:] > maxends[:-1] + distance) + 1))
+        lastindices = np.concatenate((firstindices[1:] - 1, [len(starts) - 1]))
+        mergednames = []
+        for first, last in zip(firstindices.tolist(), lastindices.tolist()):
+            groupnames = [name for name in names[first:last+1] if name is not None]
+            mergednames.append(collapsedelim.join(groupnames) if len(groupnames) > 0 else None)
+        mergedintervals[chrom] = {'starts': starts[firstindices], 'ends': maxends[lastindices], 'names': mergednames}
+
+    return mergedintervals
+
+# zero-length intervals are widened by one base on each side before testing for overlaps:
+def overlap_bounds(starts, ends)->list:
+    zerolength = starts == ends
+    return [np.where(zerolength, starts - 1, starts), np.where(zerolength, ends + 1, ends)]
+
+# intervals in intervals1 that overlap intervals in intervals2, with the semantics of bedtools intersect
+# options: mode "u" returns an interval set of the intervals in intervals1 that overlap at least one
+# interval in intervals2, mode "v" those that overlap none, and mode "wo" a list of overlaptuple records
+# for each overlapping pair with the number of overlapping bases
+def intersect_intervals(intervals1:dict, intervals2:dict, mode='u'):
+    if mode not in ["u", "v", "wo"]:
+        logger.critical("Unrecognized interval intersection mode " + mode)
+        print("Unrecognized interval intersection mode " + mode)
+        exit(1)
+
+    intersection = [] if mode == "wo" else {}
+    for chrom in intervals1:
+        starts = intervals1[chrom]['starts']
+        ends = intervals1[chrom]['ends']
+        names = intervals1[chrom]['names']
+        [teststarts, testends] = overlap_bounds(starts, ends)
+        if chrom in intervals2 and len(intervals2[chrom]['starts']) > 0:
+            [otherstarts, otherends] = overlap_bounds(intervals2[chrom]['starts'], intervals2[chrom]['ends'])
+            otherorder = np.argsort(otherstarts, kind='stable')
+            otherstarts = otherstarts[otherorder]
+            otherends = otherends[otherorder]
+            # intervals in intervals2 with indices below numbefore start before the end of each interval:
+            numbefore = np.searchsorted(otherstarts, testends, side='left')
+        else:
+            otherstarts = np.zeros(0, dtype=np.int64)
+            otherends = np.zeros(0, dtype=np.int64)
+            numbefore = np.zeros(len(starts), dtype=np.int64)
+
+        if mode == "wo":
+            if len(otherstarts) == 0:
+                continue
+            [pairindices, otherindices] = find_overlapping_pairs(teststarts, testends, otherstarts, otherends)
+            otherindices = otherorder[otherindices]
+            chromstarts2 = intervals2[chrom]['starts']
+            chromends2 = intervals2[chrom]['ends']
+            names2 = intervals2[chrom]['names']
+            overlaps = np.maximum(np.minimum(ends[pairindices], chromends2[otherindices]) - np.maximum(starts[pairindices], chromstarts2[otherindices]), 0)
+            for pairindex, otherindex, overlap in zip(pairindices.tolist(), otherindices.tolist(), overlaps.tolist()):
+                intersection.append(overlaptuple(chrom=chrom, start=int(starts[pairindex]), end=int(ends[pairindex]), name=names[pairindex], otherstart=int(chromstarts2[otherindex]), otherend=int(chromends2[otherindex]), othername=names2[otherindex], overlap=overlap))
+        else:
+            hasoverlap = find_overlapping(teststarts, otherstarts, otherends, numbefore)
+            keep = hasoverlap if mode == "u" else ~hasoverlap
+            if np.any(keep):
+                intersection[chrom] = {'starts': starts[keep], 'ends': ends[keep], 'names': [names[i] for i in np.flatnonzero(keep).tolist()]}
+
+    return intersection
+
+# whether each interval (with overlap bounds teststarts) overlaps any of the intervals with overlap bounds
+# otherstarts and otherends (sorted by start), given the number of those that start before each interval ends:
+def find_overlapping(teststarts, otherstarts, otherends, numbefore):
+    if len(otherstarts) == 0:
+        return np.zeros(len(teststarts), dtype=bool)
+    maxotherends = np.maximum.accumulate(otherends)
+
+    return (numbefore > 0) & (maxotherends[np.maximum(numbefore - 1, 0)] > teststarts)
+
+# pairs of indices of overlapping intervals (with overlap bounds teststarts and testends, and otherstarts and otherends,
+# sorted by start), ordered by test interval and then by start. Intervals of the other set are split into classes of
+# lengths within a factor of two, and within each class a running maximum of ends sweeps past the intervals that end
+# before each test interval starts, so that a few long intervals don't make every test interval scan the intervals
+# that start before it:
+def find_overlapping_pairs(teststarts, testends, otherstarts, otherends)->list:
+    lengthclasses = np.floor(np.log2(np.maximum(otherends - otherstarts, 1))).astype(np.int64)
+    classpairs = []
+    classothers = []
+    for lengthclass in np.unique(lengthclasses).tolist():
+        classindices = np.flatnonzero(lengthclasses == lengthclass)
+        classstarts = otherstarts[classindices]
+        classends = otherends[classindices]
+        firstcandidates = np.searchsorted(np.maximum.accumulate(classends), teststarts, side='right')
+        numcandidates = np.maximum(np.searchsorted(classstarts, testends, side='left') - firstcandidates, 0)
+        pairindices = np.repeat(np.arange(len(teststarts)), numcandidates)
+        candidateoffsets = np.arange(len(pairindices)) - np.repeat(np.cumsum(numcandidates) - numcandidates, numcandidates)
+        candidates = firstcandidates[pairindices] + candidateoffsets
+        overlapping = classends[candidates] > teststarts[pairindices]
+        classpairs.append(pairindices[overlapping])
+        classothers.append(classindices[candidates[overlapping]])
+    pairindices = np.concatenate(classpairs)
+    otherindices = np.concatenate(classothers)
+    pairorder = np.lexsort((otherindices, pairindices))
+
+    return [pairindices[pairorder], otherindices[pairorder]]
+
+# remove the bases covered by intervals2 from intervals in intervals1, as with bedtools subtract.
+# Pieces of split intervals keep their names:
+def subtract_intervals(intervals1:dict, intervals2:dict)->dict:
+    mergedintervals2 = merge_intervals(intervals2)
+    subtractedintervals = {}
+    for chrom in intervals1:
+        if chrom not in mergedintervals2:
+            subtractedintervals[chrom] = intervals1[chrom]
+            continue
+        otherstarts = mergedintervals2[chrom]['starts']
+        otherends = mergedintervals2[chrom]['ends']
+        # zero-length intervals are kept only if they don't overlap anything:
+        [teststarts, testends] = overlap_bounds(intervals1[chrom]['starts'], intervals1[chrom]['ends'])
+        [boundstarts, boundends] = overlap_bounds(otherstarts, otherends)
+        boundorder = np.argsort(boundstarts, kind='stable')
+        hasoverlap = find_overlapping(teststarts, boundstarts[boundorder], boundends[boundorder], np.searchsorted(boundstarts[boundorder], testends, side='left')).tolist()
+        starts = []
+        ends = []
+        names = []
+        for index, (start, end, name) in enumerate(zip(intervals1[chrom]['starts'].tolist(), intervals1[chrom]['ends'].tolist(), intervals1[chrom]['names'])):
+            if start == end:
+                if not hasoverlap[index]:
+                    starts.append(start)
+                    ends.append(end)
+                    names.append(name)
+                continue
+            currentstart = start
+            firstother = int(np.searchsorted(otherends, start, side='right'))
+            lastother = int(np.searchsorted(otherstarts, end, side='left'))
+            for otherstart, otherend in zip(otherstarts[firstother:lastother].tolist(), otherends[firstother:lastother].tolist()):
+                if otherstart > currentstart:
+                    starts.append(currentstart)
+                    ends.append(otherstart)
+                    names.append(name)
+                currentstart = max(currentstart, otherend)
+            if currentstart < end:
+                starts.append(currentstart)
+                ends.append(end)
+                names.append(name)
+        if len(starts) > 0:
+            subtractedintervals.update(create_intervals([chrom] * len(starts), starts, ends, names))
+
+    return subtractedintervals
+
+# regions of each chromosome in chromlengths (a dictionary of lengths, in the desired output order)
+# not covered by any interval, as with bedtools complement:
+def complement_intervals(intervals:dict, chromlengths:dict)->dict:
+    mergedintervals = merge_intervals(intervals)
+    complementintervals = {}
+    for chrom in chromlengths:
+        chromlength = chromlengths[chrom]
+        if chrom in mergedintervals:
+            starts = np.clip(mergedintervals[chrom]['starts'], 0, chromlength)
+            ends = np.clip(mergedintervals[chrom]['ends'], 0, chromlength)
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+            ends = np.zeros(0, dtype=np.int64)
+        gapstarts = np.concatenate(([0], ends))
+        gapends = np.concatenate((starts, [chromlength]))
+        keep = gapends > gapstarts
+        if np.any(keep):
+            complementintervals[chrom] = {'starts': gapstarts[keep].astype(np.int64), 'ends': gapends[keep].astype(np.int64), 'names': [None] * int(np.sum(keep))}
+
+    return complementintervals
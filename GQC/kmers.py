@@ -1,7 +1,9 @@
 import os
 import sys
 import re
+import heapq
 import subprocess
+import tempfile
 import logging
 from pathlib import Path
 
@@ -42,17 +44,19 @@ def find_anotb_kmers(db1prefix:str, db2prefix:str, outputdir:str, prefix:str, km
 
     return kmerdbroot
 
-def map_kmer_markers_onto_fasta(fastafile:str, markerfilelist:list, outputdir:str):
+# runs KmerMap for each marker file at the same time, dividing numthreads between the runs:
+def map_kmer_markers_onto_fasta(fastafile:str, markerfilelist:list, outputdir:str, numthreads=2):
     env = os.environ.copy()
     env['LD_LIBRARY_PATH'] = os.getcwd()
 
-    outputbedlist = []
     tmpdir = outputdir + "/tmp"
     path = Path(tmpdir)
     logger.info("Creating temporary directory " + tmpdir + " for output")
     path.mkdir(exist_ok=True)
 
-    mergefilestring = ""
+    threadspermap = max(1, numthreads // len(markerfilelist))
+    mergefilelist = []
+    markerprocs = []
     for markerfile in markerfilelist:
         pattern = r"\.fastq$|\.fasta$|\.fq$|\.fa$|\.fastq.gz$|\.fasta.gz$|\.fq.gz$|\.fa.gz$"
         assemblyroot = re.sub(pattern, "", fastafile)
@@ -60,34 +64,78 @@ def map_kmer_markers_onto_fasta(fastafile:str, markerfilelist:list, outputdir:st
         # KmerMap constructs the output file name from the third argument with ".assemblyroot" + ".kmers.merge.bed"
         kmermapinputprefix = markerfile
         kmermapoutputprefix = markerfile + "." + assemblyroot
-        mergefilestring = mergefilestring + " " + kmermapoutputprefix + ".kmers.merge.bed"
-        markercommand = "KmerMap -v -m -T2 -P" + tmpdir + " " + markerfile + " " + fastafile + " " + kmermapinputprefix
+        mergefilelist.append(kmermapoutputprefix + ".kmers.merge.bed")
+        markercommand = "KmerMap -v -m -T" + str(threadspermap) + " -P" + tmpdir + " " + markerfile + " " + fastafile + " " + kmermapinputprefix
         
         if not os.path.exists(kmermapoutputprefix + ".kmers.merge.bed"):
             logger.info("Running: " + markercommand)
-            proc = subprocess.Popen(markercommand, shell=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = proc.communicate()
-            proc.wait()
-
-            if proc.returncode == 0:
-                logger.info(markercommand + " completed successfully")
-            else:
-                logger.info(stderr.decode())
+            # stderr goes to a temporary file rather than a pipe so that one run can't block waiting for its pipe to be read:
+            errfh = tempfile.TemporaryFile()
+            proc = subprocess.Popen(markercommand, shell=True, env=env, stdout=subprocess.DEVNULL, stderr=errfh)
+            markerprocs.append([markercommand, proc, errfh])
         else:
             logger.info("Skipping run of " + markercommand + ": output already exists")
+
+    for [markercommand, proc, errfh] in markerprocs:
+        proc.wait()
+        if proc.returncode == 0:
+            logger.info(markercommand + " completed successfully")
+        else:
+            errfh.seek(0)
+            logger.info(errfh.read().decode())
+        errfh.close()
     
     outputfile = outputdir + "/" + assemblyroot + ".kmers.merge.bed"
 
     if not os.path.exists(outputfile):
         logger.debug("Merging output files into " + outputfile)
-        mergesortcommand = "cat" + mergefilestring + " | sort -k1,1n -k2,2n -k3,3n " + " > " + outputfile
-        logger.debug(mergesortcommand)
-        os.system(mergesortcommand)
+        merge_sorted_bedfiles(mergefilelist, outputfile)
     else:
         logger.debug("Skipping merging of kmer files into " + outputfile + ": output already exists")
    
     return outputfile
 
+# KmerMap bed files have numeric scaffold indices in the first column, and are sorted by scaffold, start and end.
+# This writes the lines of all files in bedfilelist to outputfile in the order of "sort -k1,1n -k2,2n -k3,3n" of
+# their concatenation, with a streaming merge of the files. If any file turns out not to be sorted, the lines are
+# sorted in memory instead.
+def merge_sorted_bedfiles(bedfilelist:list, outputfile:str):
+    existingfiles = []
+    for bedfile in bedfilelist:
+        if os.path.exists(bedfile):
+            existingfiles.append(bedfile)
+        else:
+            logger.warning("Kmer bed file " + bedfile + " does not exist, so it will not be merged into " + outputfile)
+
+    unsortedfiles = []
+    with open(outputfile, "w") as ofh:
+        for [sortkey, bedline] in heapq.merge(*[read_sorted_bedlines(bedfile, unsortedfiles) for bedfile in existingfiles]):
+            ofh.write(bedline)
+
+    if len(unsortedfiles) > 0:
+        logger.warning("Kmer bed file " + unsortedfiles[0] + " is not sorted, so lines will be sorted in memory")
+        bedlines = []
+        for bedfile in existingfiles:
+            bedlines.extend(read_sorted_bedlines(bedfile, []))
+        with open(outputfile, "w") as ofh:
+            for [sortkey, bedline] in sorted(bedlines):
+                ofh.write(bedline)
+
+# yields the sort key and line for each line of a KmerMap bed file, adding the file to unsortedfiles if a line
+# sorts before the line preceding it:
+def read_sorted_bedlines(bedfile:str, unsortedfiles:list):
+    lastkey = None
+    with open(bedfile, "r") as bfh:
+        for bedline in bfh:
+            if not bedline.endswith("\n"):
+                bedline = bedline + "\n"
+            fields = bedline.split("\t", 3)
+            sortkey = (int(fields[0]), int(fields[1]), int(fields[2]), bedline)
+            if lastkey is not None and sortkey < lastkey and bedfile not in unsortedfiles:
+                unsortedfiles.append(bedfile)
+            lastkey = sortkey
+            yield [sortkey, bedline]
+
 def find_extreme_kmers(fastkdbroot:str):
     if os.path.exists(fastkdbroot + ".hist"):
         env = os.environ.copy()
@@ -1,4 +1,5 @@
 import re
+import heapq
 import pysam
 import pybedtools
 import logging
@@ -55,51 +56,12 @@ def filter_aligns(alignlist:list, sorttype="target", maxoverlap=0.95, mummeralgo
         lis = []
 
         if mummeralgorithm:
-            for i in range(numaligns):
-                lis.append({"used":False})
+            if maxoverlap < 1:
+                lis = score_lis_sweep(alignlist, lowfield, highfield, maxoverlap)
+            else:
+                lis = score_lis_pairwise(alignlist, lowfield, highfield, maxoverlap)
             allbest = []
-    
-            while True:
-                for i in range(numaligns):
-                    if lis[i]["used"]:
-                        continue
-                    if "identity" not in alignlist[i]:
-                        alignlist[i]["identity"] = 1.0
-                    lis[i]["align"] = alignlist[i]
-                    lis[i]["score"] = (alignlist[i][highfield] - alignlist[i][lowfield] + 1)*alignlist[i]["identity"]*alignlist[i]["identity"]
-                    lis[i]["from"] = -1
-                    lis[i]["diff"] = 0
-    
-                    for j in range(i):
-                        if lis[j]["used"] or (lis[j]["from"] >=0 and lis[lis[j]["from"]]["align"][highfield] >= lis[i]["align"][lowfield]):
-                            continue
-                        leni = lis[i]["align"][highfield] - lis[i]["align"][lowfield] + 1
-                        lenj = lis[j]["align"][highfield] - lis[j]["align"][lowfield] + 1
-                        olap = lis[j]["align"][highfield] - lis[i]["align"][lowfield] + 1
-                        if olap < 0:
-                            olap = 0
-                        diff = lis[j]["diff"]
-                        if lis[j]["align"]["targetstart"] < lis[i]["align"]["targetstart"]:
-                            diff = diff + lis[j]["align"]["targetend"] - lis[i]["align"]["targetstart"]
-                        else:
-                            diff = diff + lis[i]["align"]["targetend"] - lis[j]["align"]["targetstart"]
-                        if lis[j]["align"]["querylow"] < lis[i]["align"]["querylow"]:
-                            diff = diff + lis[j]["align"]["queryhigh"] - lis[i]["align"]["querylow"]
-                        else:
-                            diff = diff + lis[i]["align"]["queryhigh"] - lis[j]["align"]["querylow"]
-    
-                        olapfraction = max(olap/leni, olap/lenj)
-                        if olapfraction <= maxoverlap:
-                            score = lis[j]["score"] + (leni - olap)*alignlist[i]["identity"]*alignlist[i]["identity"]
-                        else:
-                            score = -1.0
-    
-                        if score > lis[i]["score"] or (score == lis[i]["score"] and diff < lis[i]["diff"]):
-                            lis[i]["from"] = j
-                            lis[i]["score"] = score
-                            lis[i]["diff"] = diff
-                if updatebest(lis, numaligns, allbest):
-                    break
+            updatebest(lis, numaligns, allbest)
     
             numbests = len(allbest)
             eqc = 0
@@ -110,10 +72,13 @@ def filter_aligns(alignlist:list, sorttype="target", maxoverlap=0.95, mummeralgo
             # need to have this pick a random number between 0 and eqc instead of using 0
             bestpick = 0
     
+            # the chain is walked from its last alignment, and goes in front of chains from earlier entries:
+            chainaligns = []
             i = allbest[bestpick]
             while i != -1:
-                filteredaligns.insert(0, lis[i]["align"])
+                chainaligns.append(lis[i]["align"])
                 i = lis[i]["from"]
+            filteredaligns = chainaligns[::-1] + filteredaligns
         else:
             return -1
         
@@ -222,6 +187,142 @@ def filter_aligns(alignlist:list, sorttype="target", maxoverlap=0.95, mummeralgo
     #}
 
 
+# Score each alignment (sorted by lowfield) with the best chain of earlier alignments that could precede
+# it, comparing each alignment to every earlier one, as in mummer. Each alignment gets the "score" of its
+# best chain, the summed overlaps of the alignments in the chain ("diff", used to break ties) and the
+# index of the previous alignment in the chain ("from", -1 if the chain starts with this alignment):
+def score_lis_pairwise(alignlist:list, lowfield:str, highfield:str, maxoverlap:float)->list:
+
+    numaligns = len(alignlist)
+    lis = []
+    for i in range(numaligns):
+        lis.append({"used":False})
+
+    for i in range(numaligns):
+        if "identity" not in alignlist[i]:
+            alignlist[i]["identity"] = 1.0
+        lis[i]["align"] = alignlist[i]
+        lis[i]["score"] = (alignlist[i][highfield] - alignlist[i][lowfield] + 1)*alignlist[i]["identity"]*alignlist[i]["identity"]
+        lis[i]["from"] = -1
+        lis[i]["diff"] = 0
+
+        for j in range(i):
+            if lis[j]["used"] or (lis[j]["from"] >=0 and lis[lis[j]["from"]]["align"][highfield] >= lis[i]["align"][lowfield]):
+                continue
+            leni = lis[i]["align"][highfield] - lis[i]["align"][lowfield] + 1
+            lenj = lis[j]["align"][highfield] - lis[j]["align"][lowfield] + 1
+            olap = lis[j]["align"][highfield] - lis[i]["align"][lowfield] + 1
+            if olap < 0:
+                olap = 0
+            diff = lis[j]["diff"] + chain_diff(lis[j]["align"], lis[i]["align"])
+
+            olapfraction = max(olap/leni, olap/lenj)
+            if olapfraction <= maxoverlap:
+                score = lis[j]["score"] + (leni - olap)*alignlist[i]["identity"]*alignlist[i]["identity"]
+            else:
+                score = -1.0
+
+            if score > lis[i]["score"] or (score == lis[i]["score"] and diff < lis[i]["diff"]):
+                lis[i]["from"] = j
+                lis[i]["score"] = score
+                lis[i]["diff"] = diff
+
+    return lis
+
+# Same scores as score_lis_pairwise, found with a sweep along the sorted alignments. Earlier alignments
+# that end before the current one starts ("closed" alignments) add the same number of bases to any chain,
+# so the best of them is the one with the highest chain score, and they are kept in a max-heap of chain
+# scores. Only earlier alignments that overlap the current one (kept in a heap ordered by their ends until
+# they close) are compared individually. Ties are broken exactly as in score_lis_pairwise (lowest diff,
+# then earliest alignment), so the same chains are found. Requires maxoverlap < 1, which guarantees that
+# the previous alignment in a closed alignment's chain ends before the current alignment starts.
+def score_lis_sweep(alignlist:list, lowfield:str, highfield:str, maxoverlap:float)->list:
+
+    numaligns = len(alignlist)
+    for align in alignlist:
+        if "identity" not in align:
+            align["identity"] = 1.0
+    lows = [align[lowfield] for align in alignlist]
+    highs = [align[highfield] for align in alignlist]
+
+    scores = [0.0] * numaligns
+    diffs = [0] * numaligns
+    froms = [-1] * numaligns
+    openaligns = []
+    closedaligns = []
+    for i in range(numaligns):
+        align = alignlist[i]
+        low = lows[i]
+        identity = align["identity"]
+        leni = highs[i] - low + 1
+        while len(openaligns) > 0 and openaligns[0][0] < low:
+            j = heapq.heappop(openaligns)[1]
+            heapq.heappush(closedaligns, (-scores[j], j))
+
+        bestscore = leni*identity*identity
+        bestdiff = 0
+        bestfrom = -1
+
+        # closed alignments: visit every heap entry whose chain score ties with the best after adding this
+        # alignment's bases (entries below one that doesn't tie can't tie either):
+        if len(closedaligns) > 0:
+            addedscore = (leni - 0)*identity*identity
+            maxscore = -closedaligns[0][0] + addedscore
+            if maxscore >= bestscore:
+                heapindices = [0]
+                while len(heapindices) > 0:
+                    heapindex = heapindices.pop()
+                    if heapindex >= len(closedaligns) or -closedaligns[heapindex][0] + addedscore != maxscore:
+                        continue
+                    j = closedaligns[heapindex][1]
+                    diff = diffs[j] + chain_diff(alignlist[j], align)
+                    if maxscore > bestscore or diff < bestdiff or (diff == bestdiff and bestfrom != -1 and j < bestfrom):
+                        bestscore = maxscore
+                        bestdiff = diff
+                        bestfrom = j
+                    heapindices.append(2*heapindex + 1)
+                    heapindices.append(2*heapindex + 2)
+
+        # open alignments overlap this one:
+        for highj, j in openaligns:
+            if froms[j] >= 0 and highs[froms[j]] >= low:
+                continue
+            lenj = highj - lows[j] + 1
+            olap = highj - low + 1
+            if max(olap/leni, olap/lenj) > maxoverlap:
+                continue
+            score = scores[j] + (leni - olap)*identity*identity
+            diff = diffs[j] + chain_diff(alignlist[j], align)
+            if score > bestscore or (score == bestscore and (diff < bestdiff or (diff == bestdiff and bestfrom != -1 and j < bestfrom))):
+                bestscore = score
+                bestdiff = diff
+                bestfrom = j
+
+        scores[i] = bestscore
+        diffs[i] = bestdiff
+        froms[i] = bestfrom
+        heapq.heappush(openaligns, (highs[i], i))
+
+    lis = []
+    for i in range(numaligns):
+        lis.append({"used":False, "align":alignlist[i], "score":scores[i], "from":froms[i], "diff":diffs[i]})
+
+    return lis
+
+# overlap in target and query coordinates added to the diff of a chain when alignj precedes aligni:
+def chain_diff(alignj:dict, aligni:dict)->int:
+
+    if alignj["targetstart"] < aligni["targetstart"]:
+        diff = alignj["targetend"] - aligni["targetstart"]
+    else:
+        diff = aligni["targetend"] - alignj["targetstart"]
+    if alignj["querylow"] < aligni["querylow"]:
+        diff = diff + alignj["queryhigh"] - aligni["querylow"]
+    else:
+        diff = diff + aligni["queryhigh"] - alignj["querylow"]
+
+    return diff
+
 def create_align_by_entry_dict(alignlist:list, entrytype:str):
 
     alignbyentrydict = {}
@@ -55,9 +55,16 @@ def name_output_files(args, outputdir:str)->dict:
     files["snvstatsfile"] = outputdir + "/" + args.assembly + ".singlenucerrorstats.txt"
     files["indelstatsfile"] = outputdir + "/" + args.assembly + ".indelerrorstats.txt"
     files["qvstatsfile"] = outputdir + "/" + args.assembly + ".qvstats.txt"
+    files["manifest"] = outputdir + "/" + args.assembly + ".manifest.json"
+    files["telemetryfile"] = outputdir + "/" + args.assembly + ".telemetry.json"
+    files["benchresultsstate"] = bench_results_state_file(outputdir, args.assembly)
 
     return files
 
+# the saved results of an assemblybench run restricted to some of the benchmark sequences, for assemblybench-merge:
+def bench_results_state_file(outputdir:str, assembly:str)->str:
+    return outputdir + "/" + assembly + ".benchresults.state"
+
 def name_read_stats_files(args, outputdir:str)->dict:
     files = {}
     files["includedbedfile"] = outputdir + "/" + args.readsetname + ".includedregions." + args.benchmark + ".bed"
@@ -82,6 +89,8 @@ def name_read_stats_files(args, outputdir:str)->dict:
     files["benchmarkkmercountfile"] = outputdir + "/" + args.readsetname + ".benchmarkkmercounts.txt"
     files["readalignedkmercountfile"] = outputdir + "/" + args.readsetname + ".readalignedkmercounts.txt"
     files["strandedalignedkmercountfile"] = outputdir + "/" + args.readsetname + ".strandedalignedkmercounts.txt"
+    files["telemetryfile"] = outputdir + "/" + args.readsetname + ".telemetry.json"
+    files["readpassstatefile"] = outputdir + "/" + args.readsetname + ".readpass.state"
 
     return files
 
@@ -108,6 +117,8 @@ def name_constructgenome_output_files(args, outputdir:str)->dict:
 def name_compare_output_files(args, outputdir:str)->dict:
     files = {}
     #files[""] = outputdir + "/" + args.A + "_vs_" + args.B + ".bed"
+    files["manifest"] = outputdir + "/" + args.qname + "_vs_" + args.rname + ".manifest.json"
+    files["telemetryfile"] = outputdir + "/" + args.qname + "_vs_" + args.rname + ".telemetry.json"
 
     return files
 
@@ -6,12 +6,15 @@ import pysam
 import pybedtools
 import logging
 import math
+import bisect
+import numpy as np
 from pathlib import Path
 from collections import namedtuple
 from pybedtools import BedTool
 from GQC import seqparse
 from GQC import kmers
 from GQC import bedtoolslib
+from GQC import pipeline
 
 # create namedtuple for bed intervals:
 varianttuple = namedtuple('varianttuple', ['chrom', 'start', 'end', 'name', 'vartype', 'excluded', 'qvscore']) 
@@ -68,6 +71,25 @@ def sort_chrom_hetsite_arrays(hetsites:dict):
     
     return chromhetsites
 
+# sorted start positions of the het sites in each chromosome's array from sort_chrom_hetsite_arrays, so
+# that the hets within a range of positions can be found by bisection rather than scanning the array
+# (arrays from a compiled het site store--see hetstore.py--already have an array of starts):
+def index_hetsite_starts(chromhetsites:dict)->dict:
+    hetstarts = {}
+    for chrom in chromhetsites:
+        if hasattr(chromhetsites[chrom], "starts"):
+            hetstarts[chrom] = chromhetsites[chrom].starts
+        else:
+            hetstarts[chrom] = [hetsite['start'] if hetsite.__class__==dict else hetsite.start for hetsite in chromhetsites[chrom]]
+
+    return hetstarts
+
+# index in the chromosome's sorted het site array of the first het site starting at or after position:
+def first_hetsite_index(hetstarts:dict, chrom:str, position:int)->int:
+    if chrom not in hetstarts:
+        return 0
+    return bisect.bisect_left(hetstarts[chrom], position)
+
 def write_hetallele_bed(hetsitealleles:dict, hetbed:str):
 
     contigsortedhetalleles = sort_chrom_hetsite_arrays(hetsitealleles)
@@ -91,7 +113,8 @@ def write_hetallele_bed(hetsitealleles:dict, hetbed:str):
                 assemblyend = hetsite['end'] - 1
                 hfh.write(contig + "\t" + str(hetsite['start']) + "\t" + str(hetsite['end']) + "\t" + hetsite['name'] + "\t" + hetsite['allele'] + "\t" + hetsite['ref'] + "\t" + str(hetsite['refstart']) + "\t" + str(hetsite['refend']) + "\t" + assemblycontig + "\t" + str(assemblystart) + "\t" + str(assemblyend) + "\t" + allelehap + "\n")
 
-def map_benchmark_hapmers_onto_assembly(queryfasta, matmarkerfile:str, patmarkerfile:str, outputdir:str, outputfiles:dict):
+# maternal and paternal hapmers are mapped with concurrent KmerMap runs, which share numthreads:
+def map_benchmark_hapmers_onto_assembly(queryfasta, matmarkerfile:str, patmarkerfile:str, outputdir:str, outputfiles:dict, manifest=None, numthreads=2):
     env = os.environ.copy()
     env['LD_LIBRARY_PATH'] = os.getcwd()
     currentdir = os.getcwd()
@@ -114,33 +137,34 @@ def map_benchmark_hapmers_onto_assembly(queryfasta, matmarkerfile:str, patmarker
             logger.info("Running: " + matpatcommand)
             proc = subprocess.Popen(matpatcommand, shell=True, env=env)
             proc.wait()
+            markerbedfiles = [matpatoutputlocation]
         else:
             # map maternal/paternal kmers onto the query fasta:
             #matpatoutputlocation = kmers.map_kmer_markers_onto_fasta(queryfasta:str, markerdbs:list, outputdir:str)
-            matcommand = "KmerMap -v -m -T2 -P" + tmpdir + " " + matmarkerfile + " " + queryfasta + " " + outputdir + "/" + mathapmeroutput
-            patcommand = "KmerMap -v -m -T2 -P" + tmpdir + " " + patmarkerfile + " " + queryfasta + " " + outputdir + "/" + pathapmeroutput
+            threadspermap = str(max(1, numthreads // 2))
+            matcommand = "KmerMap -v -m -T" + threadspermap + " -P" + tmpdir + " " + matmarkerfile + " " + queryfasta + " " + outputdir + "/" + mathapmeroutput
+            patcommand = "KmerMap -v -m -T" + threadspermap + " -P" + tmpdir + " " + patmarkerfile + " " + queryfasta + " " + outputdir + "/" + pathapmeroutput
     
+            path = Path(currentdir + "/" + outputdir + "/tmp")
+            logger.info("Creating temporary directory " + outputdir + "/tmp for output")
+            path.mkdir(exist_ok=True)
+            procs = []
             for command in [matcommand, patcommand]:
-                path = Path(currentdir + "/" + outputdir + "/tmp")
-                logger.info("Creating temporary directory " + outputdir + "/tmp for output")
-                path.mkdir(exist_ok=True)
                 #print("Running: " + command)
                 logger.info("Running: " + command)
-                proc = subprocess.Popen(command, shell=True, env=env)
+                procs.append(subprocess.Popen(command, shell=True, env=env))
+            for proc in procs:
                 proc.wait()
+            markerbedfiles = [matoutputlocation, patoutputlocation]
     
-            logger.debug("Merging output files into " + matpatoutputlocation)
-            mergecommand = "cat " + matoutputlocation + " " + patoutputlocation + " > " + matpatoutputlocation
-            os.system(mergecommand)
-    
-        logger.debug("Sorting output file " + matpatoutputlocation)
-        sortcommand = "sort -k1,1n -k2,2n -k3,3n " + matpatoutputlocation + " > " + outputfiles["phasemarkerbed"]
-        os.system(sortcommand)
+        # KmerMap output is sorted, so files are merged rather than concatenated and sorted:
+        logger.debug("Merging output files into " + outputfiles["phasemarkerbed"])
+        kmers.merge_sorted_bedfiles(markerbedfiles, outputfiles["phasemarkerbed"])
     else:
         print("Using output file " + outputfiles["phasemarkerbed"])
         logger.info("Using output file " + outputfiles["phasemarkerbed"])
 
-    [mergedhapmerintervals, mergedhapmerbedfile] = bedtoolslib.mergebed(outputfiles["phasemarkerbed"], collapsecolumns='4', collapseoutput='distinct', collapsedelim=',')
+    [mergedhapmerintervals, mergedhapmerbedfile] = bedtoolslib.mergebed(outputfiles["phasemarkerbed"], collapsecolumns='4', collapseoutput='distinct', collapsedelim=',', manifest=manifest)
 
     return 0
 
@@ -340,9 +364,8 @@ def find_phase_blocks_from_marker_bed(bedfile:str, scaffnames:list, shortnum=100
 # given a set of observed haplotype-specific kmers from the benchmark along the test assemblies' scaffolds #
 # scaffold fasta object should be passed if you want phase block coordinates to extend to the ends of the 
 # scaffolds--otherwise they will only extend to the outermost marker positions!
-def find_hapmer_phase_blocks_with_hmm(bedfile:str, hmmphaseblockbedfile:str, scafffastaobj:str, alpha:float, beta:float, distmultiplier=0 ):
-
-    emissionprobs = [[1.0-alpha, alpha], [alpha, 1.0-alpha]]
+# Markers are read into arrays for each scaffold, and scaffolds are phased in up to numworkers processes
+def find_hapmer_phase_blocks_with_hmm(bedfile:str, hmmphaseblockbedfile:str, scafffastaobj:str, alpha:float, beta:float, distmultiplier=0, manifest=None, numworkers=1):
 
     # determine maternal/paternal haplotype names in marker bed--these could be mat/pat or hap1/hap2
     [mathap, pathap] = find_haplotype_names_in_hapmer_bedfile(bedfile)
@@ -367,24 +390,17 @@ def find_hapmer_phase_blocks_with_hmm(bedfile:str, hmmphaseblockbedfile:str, sca
     mathap1color = '255,0,0'
     pathap2color = '0,0,255'
 
-    haplogprobs = []
-    # time 0 has no previous state values:
-    previousstate = [[None, None]]
-    timepoint = 0
-
     current_scaffold = ""
-    scaffname = ""
     current_pos = 0
-    intermarkercoords = []
     phasedend1 = "." + mathap + ".bed"
     phasedend2 = "." + pathap + ".bed"
     matphaseblockbed = hmmphaseblockbedfile.replace('.bed', phasedend1)
     patphaseblockbed = hmmphaseblockbedfile.replace('.bed', phasedend2)
     scaffnamemarkerbed = bedfile.replace('.bed', '.scaffnames.bed')
-    mfh = open(matphaseblockbed, "w")
-    pfh = open(patphaseblockbed, "w")
     sfh = open(scaffnamemarkerbed, "w")
     scaffnames = scafffastaobj.references
+    # haplotype index (0 for mathap, 1 for pathap) and midpoint of each marker, for each run of markers on a scaffold:
+    scaffoldmarkers = []
     with open(bedfile, "r") as bfh:
         markerline = bfh.readline()
         while markerline:
@@ -409,61 +425,117 @@ def find_hapmer_phase_blocks_with_hmm(bedfile:str, hmmphaseblockbedfile:str, sca
             sfh.write(scaffname + "\t" + str(start) + "\t" + str(end) + "\t" + markertype + "\t0\t+\t" + str(start) + "\t" + str(end) + "\t" + bedcolor + "\n")
 
             if current_scaffold != scaffold:
-                # write out max log prob states if there was a previous chromosome:
-                if current_scaffold != "":
-                    if len(haplogprobs) > 0:
-                        oldscaffname = scaffnames[current_scaffold]
-                        lastlogprobs = haplogprobs.pop()
-                        scafflength = scafffastaobj.get_reference_length(oldscaffname)
-                        write_scaffold_phase_blocks(oldscaffname, scafflength, timepoint, lastlogprobs, previousstate, intermarkercoords, mathap1color, pathap2color, shortmathap, shortpathap, mfh, pfh)
-                    timepoint = 0
                 current_scaffold = scaffold
                 current_pos = 0
-                intermarkercoords = []
-                previousstate = [[None, None]]
-                haplogprobs = []
+                scaffoldmarkers.append([scaffname, [], []])
             if markertype == mathap or markertype == pathap:
                 if markertype == mathap:
-                    hapindex = 0
-                else:
-                    hapindex = 1
-                # for each timepoint, append an entry to the array of state probabilities--it will be overwritten
-                haplogprobs.append([None, None])
-                if timepoint == 0:
-                    haplogprobs[0][0] = math.log(emissionprobs[0][hapindex])
-                    haplogprobs[0][1] = math.log(emissionprobs[1][hapindex])
-                    #logger.debug("Assigning haploprobs " + str(haplogprobs[timepoint][0]) + " and " + str(haplogprobs[timepoint][1]) + " at timepoint " + str(timepoint))
+                    scaffoldmarkers[-1][1].append(0)
                 else:
-                    previousstate.append([0,0])
-                    transitionprobs = [[1.0-beta, beta], [beta, 1.0-beta]]
-                    for state in range(2):
-                        for laststate in range(2):
-                            transitionprob = transitionprobs[laststate][state]
-                            newlogprob = haplogprobs[timepoint-1][laststate] + math.log(transitionprob) + math.log(emissionprobs[state][hapindex])
-                            if haplogprobs[timepoint][state] is None or newlogprob > haplogprobs[timepoint][state]:
-                                haplogprobs[timepoint][state] = newlogprob
-                                previousstate[timepoint][state] = laststate
-                                #print("Logging previous state " + str(laststate) + " at time " + str(timepoint))
-                    #logger.debug("Assigning haploprobs " + str(haplogprobs[timepoint][0]) + " and " + str(haplogprobs[timepoint][1]) + " at timepoint " + str(timepoint))
-                intermarkercoords.append([current_pos, midpos])
+                    scaffoldmarkers[-1][1].append(1)
+                scaffoldmarkers[-1][2].append(midpos)
                 current_pos = midpos
-                timepoint = timepoint + 1
             markerline = bfh.readline()
+    sfh.close()
 
-    scafflength = scafffastaobj.get_reference_length(scaffname)
-    write_scaffold_phase_blocks(scaffname, scafflength, timepoint, lastlogprobs, previousstate, intermarkercoords, mathap1color, pathap2color, shortmathap, shortpathap, mfh, pfh)
+    scaffoldmarkers = [markers for markers in scaffoldmarkers if len(markers[1]) > 0]
+    phaseblockstrings = []
+    if numworkers > 1 and len(scaffoldmarkers) > 1:
+        with pipeline.worker_pool(numworkers) as executor:
+            scaffoldresults = []
+            for [scaffname, hapindices, midpositions] in scaffoldmarkers:
+                scafflength = scafffastaobj.get_reference_length(scaffname)
+                scaffoldresults.append(executor.submit(phase_scaffold_with_hmm, scaffname, scafflength, hapindices, midpositions, alpha, beta, mathap1color, pathap2color, shortmathap, shortpathap))
+            for scaffoldresult in scaffoldresults:
+                phaseblockstrings.append(scaffoldresult.result())
+    else:
+        for [scaffname, hapindices, midpositions] in scaffoldmarkers:
+            scafflength = scafffastaobj.get_reference_length(scaffname)
+            phaseblockstrings.append(phase_scaffold_with_hmm(scaffname, scafflength, hapindices, midpositions, alpha, beta, mathap1color, pathap2color, shortmathap, shortpathap))
 
-    mfh.close()
-    pfh.close()
-    sfh.close()
+    with open(matphaseblockbed, "w") as mfh:
+        for [matstring, patstring] in phaseblockstrings:
+            mfh.write(matstring)
+    with open(patphaseblockbed, "w") as pfh:
+        for [matstring, patstring] in phaseblockstrings:
+            pfh.write(patstring)
 
-    [matblockintervals, matblockbedfile] = bedtoolslib.mergebed(matphaseblockbed, collapsecolumns='4,5,6,7,8,9', collapseoutput='distinct,first,first,first,last,first', collapsedelim=',')
-    [patblockintervals, patblockbedfile] = bedtoolslib.mergebed(patphaseblockbed, collapsecolumns='4,5,6,7,8,9', collapseoutput='distinct,first,first,first,last,first', collapsedelim=',')
+    [matblockintervals, matblockbedfile] = bedtoolslib.mergebed(matphaseblockbed, collapsecolumns='4,5,6,7,8,9', collapseoutput='distinct,first,first,first,last,first', collapsedelim=',', manifest=manifest)
+    [patblockintervals, patblockbedfile] = bedtoolslib.mergebed(patphaseblockbed, collapsecolumns='4,5,6,7,8,9', collapseoutput='distinct,first,first,first,last,first', collapsedelim=',', manifest=manifest)
 
     allphaseblockints = matblockintervals.cat(patblockintervals, postmerge=False).sort()
 
     return allphaseblockints
 
+# Most probable chain of states (0 for the first haplotype, 1 for the second) for a two-state HMM with
+# emission probability alpha of a marker from the other haplotype and transition probability beta between
+# markers. Log probabilities are computed once, and the previous state for each state at each marker is
+# kept as one bit, two bits per marker, until the traceback. Ties go to state 0 in the forward pass and
+# to state 1 at the last marker
+def find_hmm_state_path(hapindices, alpha:float, beta:float)->np.ndarray:
+
+    numtimepoints = len(hapindices)
+    logemissionprobs = [[math.log(1.0-alpha), math.log(alpha)], [math.log(alpha), math.log(1.0-alpha)]]
+    logtransitionprobs = [[math.log(1.0-beta), math.log(beta)], [math.log(beta), math.log(1.0-beta)]]
+    samelogprob = logtransitionprobs[0][0]
+    switchlogprob = logtransitionprobs[0][1]
+    hapindexarray = np.asarray(hapindices, dtype=np.int8)
+    state0emissions = np.where(hapindexarray == 0, logemissionprobs[0][0], logemissionprobs[0][1]).tolist()
+    state1emissions = np.where(hapindexarray == 0, logemissionprobs[1][0], logemissionprobs[1][1]).tolist()
+
+    previousstates = bytearray((numtimepoints + 3) // 4)
+    state0logprob = state0emissions[0]
+    state1logprob = state1emissions[0]
+    for timepoint in range(1, numtimepoints):
+        emission = state0emissions[timepoint]
+        staylogprob = state0logprob + samelogprob + emission
+        movelogprob = state1logprob + switchlogprob + emission
+        if movelogprob > staylogprob:
+            new0logprob = movelogprob
+            statebits = 1
+        else:
+            new0logprob = staylogprob
+            statebits = 0
+        emission = state1emissions[timepoint]
+        movelogprob = state0logprob + switchlogprob + emission
+        staylogprob = state1logprob + samelogprob + emission
+        if staylogprob > movelogprob:
+            new1logprob = staylogprob
+            statebits = statebits | 2
+        else:
+            new1logprob = movelogprob
+        if statebits:
+            previousstates[timepoint >> 2] |= statebits << ((timepoint & 3) << 1)
+        state0logprob = new0logprob
+        state1logprob = new1logprob
+
+    path = np.zeros(numtimepoints, dtype=np.uint8)
+    state = 0 if state0logprob > state1logprob else 1
+    path[numtimepoints - 1] = state
+    for timepoint in range(numtimepoints - 1, 0, -1):
+        state = (previousstates[timepoint >> 2] >> (((timepoint & 3) << 1) + state)) & 1
+        path[timepoint - 1] = state
+
+    return path
+
+# worker for find_hapmer_phase_blocks_with_hmm--returns strings with the bed lines of the blocks assigned
+# to each haplotype (one per marker, extending halfway to the neighboring markers and to the scaffold ends)
+def phase_scaffold_with_hmm(scaffoldname:str, scafflength:int, hapindices:list, midpositions:list, alpha:float, beta:float, hap1color:str, hap2color:str, mathap:str, pathap:str)->list:
+
+    path = find_hmm_state_path(hapindices, alpha, beta)
+    midpositions = np.asarray(midpositions, dtype=np.int64)
+    boundaries = ((midpositions[:-1] + midpositions[1:]) // 2).tolist()
+    blockstarts = [0] + boundaries
+    blockends = boundaries + [scafflength]
+
+    haplines = [[], []]
+    hapnames = [mathap, pathap]
+    hapcolors = [hap1color, hap2color]
+    for state, blockstart, blockend in zip(path.tolist(), blockstarts, blockends):
+        haplines[state].append(scaffoldname + "\t" + str(blockstart) + "\t" + str(blockend) + "\t" + hapnames[state] + "\t0\t+\t" + str(blockstart) + "\t" + str(blockend) + "\t" + hapcolors[state] + "\n")
+
+    return ["".join(haplines[0]), "".join(haplines[1])]
+
 def find_haplotype_names_in_hapmer_bedfile(bedfile:str):
 
     # if one found haplotype matches ".mat" or "[ab]1_not_[ab]2" (case insensitive), return it first--covers both benchmark and assembly comparison
@@ -518,36 +590,3 @@ def find_haplotype_names_in_hapmer_bedfile(bedfile:str):
 
         return [hap1, hap2]
 
-def write_scaffold_phase_blocks(scaffoldname:str, scafflength:int, timepoint:int, lastlogprobs:list, previousstate:list, intermarkercoords:list, hap1color:str, hap2color:str, mathap:str, pathap:str, hap1fh, hap2fh):
-    prevstatelength = len(previousstate)
-    intermarkerlength = len(intermarkercoords)
-    path = [0] * timepoint
-    if lastlogprobs[0] > lastlogprobs[1]:
-        path[timepoint-1] = 0
-    else:
-        path[timepoint-1] = 1
-    revtimepoints = range(timepoint-2, -1, -1)
-    for currenttime in revtimepoints:
-        path[currenttime] = previousstate[currenttime + 1][path[currenttime + 1]]
-    for currenttime in range(timepoint):
-        if path[currenttime] == 0:
-            currenthap = mathap
-            fh = hap1fh
-            bedcolor = hap1color
-        else:
-            currenthap = pathap
-            fh = hap2fh
-            bedcolor = hap2color
-
-        if currenttime == 0:
-            blockstart = 0
-        else:
-            blockstart = int((intermarkercoords[currenttime][0] + intermarkercoords[currenttime][1])/2.0)
-
-        if currenttime < timepoint-1:
-            blockend = int((intermarkercoords[currenttime+1][0] + intermarkercoords[currenttime+1][1])/2.0)
-        else:
-            blockend = scafflength
-        fh.write(scaffoldname + "\t" + str(blockstart) + "\t" + str(blockend) + "\t" + currenthap + "\t0\t+\t" + str(blockstart) + "\t" + str(blockend) + "\t" + bedcolor + "\n")
-
-    return 0
@@ -0,0 +1,377 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+import concurrent.futures
+from GQC import telemetry
+
+logger = logging.getLogger(__name__)
+
+# lock for changes to manifests and telemetry, which may be updated by steps running at the same time:
+manifestlock = threading.Lock()
+
+# A pipeline is a list of step dictionaries, each naming the function to run and
+# the names of the steps whose results it needs. Step functions take a single
+# dictionary of run data (args, output file names, objects produced by earlier
+# steps) and communicate with later steps by adding keys to it. A step can also
+# name (as functions of the run data) the external files it reads and the files
+# it writes, and list the command line arguments that affect its results, so that
+# a manifest can decide whether its outputs from a previous run can be reused.
+# A step's version is part of the signature of its outputs along with the installed
+# package version, and should be increased when a change to the code changes the
+# step's results, so that only the outputs of that step (and of the steps that
+# depend on it) are recomputed.
+
+def define_step(name:str, function, requires=[], inputs=None, params=[], outputs=None, version=1)->dict:
+    step = {}
+    step["name"] = name
+    step["function"] = function
+    step["requires"] = list(requires)
+    step["inputs"] = inputs
+    step["params"] = list(params)
+    step["outputs"] = outputs
+    step["version"] = version
+
+    return step
+
+# check that every required step is defined and that there are no cycles, and
+# return the step names in an order in which they can be run one at a time.
+# Among the steps that are ready to run, earlier-defined steps come first, so
+# with a budget of one step the pipeline runs in the order it was declared:
+def order_steps(steps:list)->list:
+    stepnames = [step["name"] for step in steps]
+    for step in steps:
+        if stepnames.count(step["name"]) > 1:
+            logger.critical("Pipeline step " + step["name"] + " is defined more than once")
+            print("Pipeline step " + step["name"] + " is defined more than once")
+            exit(1)
+        for required in step["requires"]:
+            if required not in stepnames:
+                logger.critical("Pipeline step " + step["name"] + " requires undefined step " + required)
+                print("Pipeline step " + step["name"] + " requires undefined step " + required)
+                exit(1)
+
+    orderedsteps = []
+    while len(orderedsteps) < len(steps):
+        readysteps = [step["name"] for step in steps if step["name"] not in orderedsteps and all(required in orderedsteps for required in step["requires"])]
+        if len(readysteps) == 0:
+            unorderedsteps = [name for name in stepnames if name not in orderedsteps]
+            logger.critical("Pipeline steps " + ",".join(unorderedsteps) + " have circular requirements")
+            print("Pipeline steps " + ",".join(unorderedsteps) + " have circular requirements")
+            exit(1)
+        orderedsteps.append(readysteps[0])
+
+    return orderedsteps
+
+# run the steps of a pipeline, starting each step as soon as all of the steps it
+# requires have finished, with at most maxparallel steps running at once. Steps
+# run in threads of this process, so overlap comes from steps that wait on
+# external programs (aligners, KmerMap, bedtools, samtools, Rscript) or on
+# pysam/htslib I/O. Each step should open its own pysam file objects.
+# If rundata contains a "manifest" (see read_manifest), each step is first checked
+# against it, and the outputs of steps whose inputs, arguments or versions have changed
+# (or of steps downstream of them) are removed so that they are recomputed:
+def run_steps(steps:list, rundata:dict, maxparallel=1)->list:
+    stepdict = {}
+    for step in steps:
+        stepdict[step["name"]] = step
+    stepnames = order_steps(steps)
+    if maxparallel < 1:
+        maxparallel = 1
+
+    if "manifest" in rundata and rundata["manifest"] is not None:
+        check_steps_against_manifest(steps, rundata)
+
+    logger.info("Running " + str(len(stepnames)) + " pipeline steps with up to " + str(maxparallel) + " at a time")
+    finishedsteps = []
+    runningsteps = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxparallel) as executor:
+        while len(finishedsteps) < len(stepnames):
+            for stepname in stepnames:
+                if len(runningsteps) >= maxparallel:
+                    break
+                if stepname in finishedsteps or stepname in runningsteps.values():
+                    continue
+                if all(required in finishedsteps for required in stepdict[stepname]["requires"]):
+                    logger.debug("Starting pipeline step " + stepname)
+                    future = executor.submit(run_step, stepdict[stepname], rundata)
+                    runningsteps[future] = stepname
+
+            doneset, notdoneset = concurrent.futures.wait(runningsteps.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+            # report steps in declared order when several finish together:
+            for future in sorted(doneset, key=lambda x: stepnames.index(runningsteps[x])):
+                stepname = runningsteps.pop(future)
+                steperror = future.exception()
+                if steperror is not None:
+                    logger.critical("Pipeline step " + stepname + " failed: " + repr(steperror))
+                    print("Pipeline step " + stepname + " failed: " + repr(steperror))
+                    for runningfuture in runningsteps.keys():
+                        runningfuture.cancel()
+                    raise steperror
+                logger.debug("Finished pipeline step " + stepname)
+                if "manifest" in rundata and rundata["manifest"] is not None:
+                    record_outputs(rundata["manifest"], stepname, step_outputs(stepdict[stepname], rundata))
+                finishedsteps.append(stepname)
+
+    return finishedsteps
+
+# -t gives the number of threads for a whole run, which are shared by the steps running at the same time: at most
+# numthreads steps run at once, and each has an equal share of the threads (at least one) for the external programs
+# and worker pools it runs. Returns [maxparallel, threads per step]:
+def share_threads(numthreads:int, maxparallel:int)->list:
+    maxparallel = max(1, min(maxparallel, numthreads))
+    stepthreads = max(1, numthreads // maxparallel)
+    if maxparallel > 1:
+        logger.info("Running up to " + str(maxparallel) + " pipeline steps at a time with " + str(stepthreads) + " threads each")
+
+    return [maxparallel, stepthreads]
+
+# Pool of worker processes for a step (or a function a step calls) to run in parallel. Workers are started by a fork
+# server rather than forked from this process, which may be running other pipeline steps in its threads--forking a
+# process with several threads can copy locks they hold (e.g., that of a logging handler) into the workers, which
+# then deadlock. Workers log to the same file as this process. As workers aren't children of this process, each task
+# returns the CPU time and memory it used with its result, and they are added to the telemetry record of the step
+# that submitted it:
+def worker_pool(numworkers:int):
+    return WorkerPool(max_workers=numworkers, mp_context=multiprocessing.get_context("forkserver"), initializer=init_worker_logging, initargs=worker_logging_config())
+
+class WorkerPool(concurrent.futures.ProcessPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        record = telemetry.active_step()
+        taskfuture = super().submit(run_worker_task, fn, args, kwargs)
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def finish_task(taskfuture):
+            if taskfuture.cancelled():
+                future.set_exception(concurrent.futures.CancelledError())
+            elif taskfuture.exception() is not None:
+                future.set_exception(taskfuture.exception())
+            else:
+                [result, usage] = taskfuture.result()
+                telemetry.add_worker_usage(record, usage)
+                future.set_result(result)
+
+        taskfuture.add_done_callback(finish_task)
+        return future
+
+def run_worker_task(function, args:tuple, kwargs:dict)->list:
+    usage = telemetry.start_worker_task()
+    result = function(*args, **kwargs)
+
+    return [result, telemetry.finish_worker_task(usage)]
+
+def worker_logging_config()->tuple:
+    rootlogger = logging.getLogger()
+    for handler in rootlogger.handlers:
+        if isinstance(handler, logging.FileHandler):
+            return (handler.baseFilename, rootlogger.level, handler.formatter._fmt if handler.formatter is not None else None)
+    return (None, rootlogger.level, None)
+
+def init_worker_logging(logfile:str, loglevel:int, logformat:str):
+    if logfile is not None:
+        logging.basicConfig(filename=logfile, level=loglevel, format=logformat)
+    else:
+        logging.getLogger().setLevel(loglevel)
+
+# run one step, adding a record of the time and resources it used to rundata["telemetry"].
+# Step functions can return a dictionary of the numbers of items they processed:
+def run_step(step:dict, rundata:dict):
+    record = telemetry.start_step(step["name"])
+    itemcounts = step["function"](rundata)
+    if not isinstance(itemcounts, dict):
+        itemcounts = None
+    record = telemetry.finish_step(record, itemcounts)
+    with manifestlock:
+        if "telemetry" not in rundata:
+            rundata["telemetry"] = []
+        rundata["telemetry"].append(record)
+
+    return itemcounts
+
+def step_outputs(step:dict, rundata:dict)->list:
+    if step["outputs"] is None:
+        return []
+    return step["outputs"](rundata)
+
+def step_inputs(step:dict, rundata:dict)->list:
+    if step["inputs"] is None:
+        return []
+    return step["inputs"](rundata)
+
+# compute each step's signature from its input files, arguments and the signatures
+# of the steps it requires, then mark which steps have reusable outputs in
+# rundata["currentsteps"] and remove the outputs of the others. Steps without
+# declared outputs always run, but their signatures still reach later steps:
+def check_steps_against_manifest(steps:list, rundata:dict):
+    manifest = rundata["manifest"]
+    args = rundata["args"]
+    stepdict = {}
+    for step in steps:
+        stepdict[step["name"]] = step
+
+    signatures = {}
+    invalidsteps = []
+    rundata["currentsteps"] = {}
+    for stepname in order_steps(steps):
+        step = stepdict[stepname]
+        params = {}
+        for param in step["params"]:
+            params[param] = getattr(args, param, None)
+        upstreamsignatures = [signatures[required] for required in step["requires"]]
+        signatures[stepname] = make_signature(manifest, step_inputs(step, rundata), params, upstreamsignatures, step.get("version", 1))
+        # signatures include those of required steps, so a change upstream invalidates all dependent steps:
+        outputs = step_outputs(step, rundata)
+        if len(outputs) > 0 and not outputs_are_current(manifest, stepname, outputs, signatures[stepname]):
+            invalidsteps.append(stepname)
+            rundata["currentsteps"][stepname] = False
+            remove_stale_outputs(outputs)
+        else:
+            rundata["currentsteps"][stepname] = True
+
+    if len(invalidsteps) > 0:
+        logger.info("Pipeline steps to be recomputed: " + ",".join(invalidsteps))
+    write_manifest(manifest)
+
+# can the outputs of a step from a previous run be used? Without a manifest, this
+# is the case whenever all of the outputs exist:
+def step_is_current(rundata:dict, stepname:str, outputs=[])->bool:
+    if "currentsteps" in rundata and stepname in rundata["currentsteps"]:
+        return rundata["currentsteps"][stepname]
+    return len(outputs) > 0 and all(os.path.exists(outputfile) for outputfile in outputs)
+
+def remove_stale_outputs(outputs:list):
+    for outputfile in outputs:
+        if os.path.isfile(outputfile):
+            logger.info("Removing out-of-date output file " + outputfile)
+            os.remove(outputfile)
+
+# The manifest is a JSON file recording, for each step or output file, the signature
+# (a hash of the input file contents, arguments and code version) it was created
+# with, along with a cache of input file checksums keyed by file size and
+# modification time so that large inputs are only re-read when they change:
+def read_manifest(manifestfile:str)->dict:
+    manifest = {"files": {}, "outputs": {}}
+    if os.path.exists(manifestfile):
+        with open(manifestfile, "r") as mfh:
+            try:
+                manifest = json.load(mfh)
+            except ValueError:
+                logger.warning("Unable to parse manifest " + manifestfile + "--all outputs will be recomputed")
+    manifest["manifestfile"] = manifestfile
+    manifest["pending"] = {}
+    # outputs missing from a manifest that already existed weren't finished by the run that kept it, so only runs
+    # without an earlier manifest adopt existing outputs (see outputs_are_current):
+    manifest["preexisting"] = os.path.exists(manifestfile)
+
+    return manifest
+
+def write_manifest(manifest:dict):
+    with manifestlock:
+        manifestdata = {"files": manifest["files"], "outputs": manifest["outputs"]}
+        write_file_atomically(manifest["manifestfile"], lambda tmpfile: write_json_file(manifestdata, tmpfile))
+
+def write_json_file(data:dict, jsonfile:str):
+    with open(jsonfile, "w") as jfh:
+        json.dump(data, jfh, indent=1, sort_keys=True)
+
+# Writes a file by calling writefile with the name of a temporary file of its own in the same directory, then moving
+# the temporary file into place, so that a partly written file is never seen, and so that runs writing the same file
+# at the same time (e.g., the shared track files of coverage.benchmark_track_directory) can't write into each other's
+# temporary files--whichever run finishes last replaces the file:
+def write_file_atomically(filename:str, writefile):
+    [tmpfd, tmpfile] = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    os.close(tmpfd)
+    try:
+        writefile(tmpfile)
+        os.chmod(tmpfile, 0o644)
+        os.replace(tmpfile, filename)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+# the installed package version. Changes to the source between releases don't change it, so that an unrelated edit
+# doesn't invalidate every step's outputs--steps have their own versions (see define_step):
+def code_version()->str:
+    try:
+        from importlib.metadata import version
+        return version("GQC")
+    except Exception:
+        return "unknown"
+
+def file_checksum(manifest:dict, filename:str)->str:
+    if filename is None or not os.path.exists(filename):
+        return "missing"
+
+    filepath = os.path.abspath(filename)
+    filestat = os.stat(filepath)
+    with manifestlock:
+        if filepath in manifest["files"]:
+            cached = manifest["files"][filepath]
+            if cached["size"] == filestat.st_size and cached["mtime"] == filestat.st_mtime_ns:
+                return cached["sha256"]
+
+    filehash = hashlib.sha256()
+    with open(filepath, "rb") as ifh:
+        chunk = ifh.read(1048576)
+        while chunk:
+            filehash.update(chunk)
+            chunk = ifh.read(1048576)
+    with manifestlock:
+        manifest["files"][filepath] = {"size": filestat.st_size, "mtime": filestat.st_mtime_ns, "sha256": filehash.hexdigest()}
+
+    return filehash.hexdigest()
+
+def make_signature(manifest:dict, inputfiles:list, params:dict, upstreamsignatures=[], stepversion=1)->str:
+    if "codeversion" not in manifest:
+        manifest["codeversion"] = code_version()
+    signaturedata = {"code": manifest["codeversion"] + ":" + str(stepversion), "params": params, "upstream": upstreamsignatures}
+    signaturedata["inputs"] = [[inputfile, file_checksum(manifest, inputfile)] for inputfile in inputfiles]
+
+    return hashlib.sha256(json.dumps(signaturedata, sort_keys=True, default=str).encode()).hexdigest()
+
+# are the outputs recorded under this key current for the given signature? The
+# signature is held until record_outputs is called after the outputs are written.
+# Outputs that exist but were never recorded are adopted if no manifest existed
+# before this run (e.g., from a run before manifests were kept). If one did, they
+# may be the partial outputs of a step that failed, and are recomputed:
+def outputs_are_current(manifest:dict, key:str, outputs:list, signature:str, adoptexisting=True)->bool:
+    with manifestlock:
+        manifest["pending"][key] = signature
+        outputsexist = all(os.path.exists(outputfile) for outputfile in outputs)
+        if key not in manifest["outputs"]:
+            if adoptexisting and not manifest.get("preexisting", False) and len(outputs) > 0 and outputsexist:
+                logger.info("Recording existing outputs for " + key + " in manifest " + manifest["manifestfile"])
+                manifest["outputs"][key] = signature
+                return True
+            return False
+
+        return manifest["outputs"][key] == signature and outputsexist
+
+def record_outputs(manifest:dict, key:str, outputs:list):
+    if manifest is None:
+        return
+    with manifestlock:
+        if key in manifest["pending"]:
+            manifest["outputs"][key] = manifest["pending"].pop(key)
+    write_manifest(manifest)
+
+# check whether outputs made from the given input files and parameters need to be
+# (re)computed, for callers that aren't organized as pipeline steps. Call
+# record_outputs with the same key once the outputs have been written. Outputs
+# that are cheap to remake can set adoptexisting=False to avoid trusting files
+# that aren't in the manifest:
+def needs_update(manifest:dict, key:str, outputs:list, inputfiles:list, params={}, adoptexisting=True)->bool:
+    if manifest is None:
+        return not all(os.path.exists(outputfile) for outputfile in outputs)
+
+    signature = make_signature(manifest, inputfiles, params)
+    if outputs_are_current(manifest, key, outputs, signature, adoptexisting):
+        return False
+    logger.info("Outputs for " + key + " are missing or out of date and will be recomputed")
+    remove_stale_outputs(outputs)
+
+    return True
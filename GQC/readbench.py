@@ -13,9 +13,12 @@ from GQC import output
 from GQC import seqparse
 from GQC import alignparse
 from GQC import phasing
+from GQC import hetstore
 from GQC import coverage
+from GQC import readpass
 from GQC import stats
 from GQC import plots
+from GQC import telemetry
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +44,7 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('-m', '--minalignlength', type=int, required=False, default=5000, help='minimum length of alignment required to be included in alignment statistics and error counts')
     parser.add_argument('--mincontiglength', type=int, required=False, default=500, help='minimum length for contig to be included in contig statistics')
     parser.add_argument('--maxstrreads', type=int, required=False, default=500, help='maximum number of reads to be evaluated for any one STR run in the STR run accuracy analysis. Use 0 to analyze all reads')
+    parser.add_argument('--strfetch', type=str, required=False, default='tiled', choices=['tiled', 'locus'], help='how reads are retrieved in the STR run accuracy analysis: once for each window of up to 100Kb of STR loci, locating flanking bases by walking cigar strings ("tiled"), or separately for each STR locus using aligned pairs ("locus")')
     parser.add_argument('--excludefile', type=str, required=False, default=None, help='bed file of benchmark locations to exclude from consideration (in addition to stretches of 10 or more Ns and regions in the exclude file specified in the config file)')
     parser.add_argument('--strs', action='store_true', required=False, help='perform analysis of short tandem repeat length accuracy')
     parser.add_argument('--baseerrors', action='store_true', required=False, help='perform analysis of base errors within reads')
@@ -48,7 +52,15 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('--kmercoverage', action='store_true', required=False, help='perform analyses of read kmer coverage')
     parser.add_argument('--arrivalratecoverage', action='store_true', required=False, help='perform analyses of read arrival rates (for test against Poisson)')
     parser.add_argument('--downsample', type=restricted_float, required=False, default=None, help='fraction of read alignments to include in error reporting statistics calculations (must be a floating point number between 0 and 1)')
+    parser.add_argument('--variantengine', type=str, required=False, default='numpy', choices=['numpy', 'python'], help='method for finding SNVs within aligned blocks: numpy compares whole blocks as arrays, python compares them base by base (slower, same results)')
+    parser.add_argument('-t', type=int, required=False, default=2, help='number of processors to use')
+    parser.add_argument('--readpass', type=str, required=False, default='single', choices=['single', 'separate'], help='how the enabled analyses read the bam file: together, in a single pass through each 10Mb window of the benchmark ("single"), or each in its own passes ("separate")')
+    parser.add_argument('--region', type=region_spec, action='append', required=False, default=None, help='benchmark chromosome or region (chrom:start-end, 1-based and inclusive) to assess, saving partial results to be combined with readbench-merge (can be given more than once)')
+    parser.add_argument('--shard', type=shard_spec, required=False, default=None, help='part i/N (e.g., 3/8) of the benchmark to assess, saving partial results to be combined with readbench-merge. The 10Mb windows of the benchmark (or of regions given with --region) are dealt out in turn to the N parts')
     parser.add_argument('--covbinsize', type=int, required=False, default=0, help='size of bins used to tally read counts in coverage analysis. If 0, will calculate bin size to result in roughly 1000 read starts per bin.')
+    parser.add_argument('--binsizemethod', type=str, required=False, default='count', choices=['count', 'index'], help='how to estimate read arrivals per base when choosing a bin size (--covbinsize 0): by counting reads in all included regions (the default, slow for large BAM files) or from the mapped read counts of the BAM index statistics (seconds, but may choose a slightly different bin size)')
+    parser.add_argument('--binsizesamples', type=int, required=False, default=0, help='number of 100Kb windows, spread evenly through the included regions, in which to count reads to refine the index statistics estimate of read arrivals per base')
+    parser.add_argument('--trackdir', type=str, required=False, default=None, help='directory for cached benchmark tracks (GC content and extreme kmer counts of bins, and benchmark kmer counts), which are reused by later runs with the same benchmark and parameters. Give a directory shared by runs on the same benchmark to reuse tracks between them (default is the output directory)')
     parser.add_argument('--bincovoverlap', action='store_true', required=False, help='count reads that overlap bins, rather than just reads that start in bins')
     parser.add_argument('--covkmersize', type=int, required=False, default=3, help='size of kmers used in coverage analysis. Values greater than 5 will cause only "extreme" kmers composed of two bases to be analyzed.')
     parser.add_argument('--minreadalignedpercentage', type=int, required=False, default=90, help='In the coverage analysis, minimum percentage of read required to be aligned without clipping.')
@@ -56,7 +68,7 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('-R', '--readsetname', type=str, required=False, default="test", help='name of the assembly being tested--should be query sequence in bam file')
     parser.add_argument('-B', '--benchmark', type=str, required=False, default="truth", help='name of the assembly being used as a benchmark--should be the reference sequence in the bam file')
     parser.add_argument('-c', '--config', type=str, required=False, default="benchconfig.txt", help='path to a config file specifying locations of benchmark data files')
-    parser.add_argument('--rerun', action='store_true', required=False, help='use existing file of read errors rather than recreating it')
+    parser.add_argument('--rerun', action='store_true', required=False, help='use existing file of read errors (or, if it is up to date, its binary .npz record file) rather than recreating it')
     parser.add_argument('--debug', action='store_true', required=False, help='print verbose output to log file for debugging')
 
     return parser
@@ -72,6 +84,25 @@ def restricted_float(x):
         raise argparse.ArgumentTypeError("%r not in range (0.0, 1.0]"%(x,))
     return x
 
+# function to parse a region as [chrom, start, end], with zero-based start and end None for a whole chromosome
+def region_spec(x):
+    match = re.match(r'^(.+):([\d,]+)-([\d,]+)$', x)
+    if not match:
+        return [x, 0, None]
+
+    start = int(match.group(2).replace(",", ""))
+    end = int(match.group(3).replace(",", ""))
+    if start < 1 or end < start:
+        raise argparse.ArgumentTypeError("%r not a region of the form chrom:start-end" % (x,))
+    return [match.group(1), start - 1, end]
+
+# function to parse a shard as [shardnumber, numshards]
+def shard_spec(x):
+    match = re.match(r'^(\d+)/(\d+)$', x)
+    if not match or int(match.group(1)) < 1 or int(match.group(1)) > int(match.group(2)):
+        raise argparse.ArgumentTypeError("%r not a shard of the form i/N with i from 1 to N" % (x,))
+    return [int(match.group(1)), int(match.group(2))]
+
 def parse_arguments(args):
     parser = init_argparse()
     args = parser.parse_args(args)
@@ -80,6 +111,34 @@ def parse_arguments(args):
         logger.critical("Must specify a bam file with --bam")
         exit(1)
 
+    if (args.region is not None or args.shard is not None) and (args.readpass != 'single' or args.errorfile or args.rerun):
+        logger.critical("Options --region and --shard require --readpass single, and can't be used with --errorfile or --rerun")
+        print("Options --region and --shard require --readpass single, and can't be used with --errorfile or --rerun")
+        exit(1)
+
+    return args
+
+def init_merge_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION] [SHARDPREFIX]...",
+        description="Combine the partial results of readbench runs with --region or --shard into read quality statistics for all of the regions they assessed"
+    )
+    parser.add_argument(
+        "-v", "--version", action="version",
+        version = f"{parser.prog} version 0.1.0"
+    )
+    parser.add_argument('shardprefixes', nargs='+', help='output prefixes (-p) of the readbench runs to combine, which must have used the same options other than --region, --shard and -t')
+    parser.add_argument('-p', '--prefix', type=str, required=True, help='prefix for output directory name')
+    parser.add_argument('-R', '--readsetname', type=str, required=False, default="test", help='name of the read set given to the readbench runs')
+    parser.add_argument('-t', type=int, required=False, default=2, help='number of processors to use')
+    parser.add_argument('--debug', action='store_true', required=False, help='print verbose output to log file for debugging')
+
+    return parser
+
+def parse_merge_arguments(args):
+    parser = init_merge_argparse()
+    args = parser.parse_args(args)
+
     return args
 
 def read_config_data(args)->dict:
@@ -117,6 +176,77 @@ def read_config_data(args)->dict:
 
     return configvals
 
+# number of read alignments assessed for a class of STRs:
+def count_str_reads(strdict:dict)->int:
+    numreads = 0
+    for runlength in strdict.keys():
+        for numbases in strdict[runlength].keys():
+            numreads = numreads + sum(strdict[runlength][numbases].values())
+
+    return numreads
+
+# the [strlabel, strbedfile] pairs of the classes of STRs in the config file--all classes are assessed together, so
+# that their loci can share one pool of worker processes:
+def read_str_classes(benchparams:dict)->list:
+    strclasses = []
+    for [strlabel, strdescription] in [['tetranuc', 'tetranucleotide'], ['trinuc', 'trinucleotide'], ['dinuc', 'dinucleotide'], ['mononuc', 'mononucleotide']]:
+        if strlabel + "runs" in benchparams:
+            logger.debug(benchparams[strlabel + "runs"])
+            strclasses.append([strlabel, benchparams[strlabel + "runs"]])
+        else:
+            logger.info("No " + strdescription + " bed file specified in configuration file(" + strlabel + "runs)")
+
+    return strclasses
+
+# Writes the results of each enabled analysis, using passresults from a single pass through the alignments (see
+# readpass) for the analyses that have them:
+def write_analysis_results(alignobj, refobj, benchintervals, hetsites, strclasses:list, benchparams:dict, outputfiles:dict, outputdir:str, passresults:dict, telemetryrecords:list, args):
+
+    benchmarkbases = sum(refobj.lengths)
+
+    if args.bincoverage:
+        logger.info("Calculating binned coverage")
+        logger.debug(outputfiles["coveragebedfile"])
+        steprecord = telemetry.start_step("bincoverage")
+        coverage.tally_bin_coverages(alignobj, refobj, benchintervals, outputfiles["includedbedfile"], outputfiles["coveragebedfile"], outputfiles["includedcoveragebedfile"], args, passresults.get("bincoverage"))
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": benchmarkbases}))
+        #plots.plot_read_coverage_vs_gccontent(outputfiles["coveragebedfile"], outputfiles["extremekmersbedfile"])
+
+    if args.arrivalratecoverage:
+        logger.info("Calculating read arrival rate in bins for comparison to Poisson distribution")
+        logger.debug(outputfiles["arrivalratebedfile"])
+        steprecord = telemetry.start_step("arrivalratecoverage")
+        coverage.tally_included_bin_arrival_rates(alignobj, refobj, benchintervals, outputfiles["arrivalratebedfile"], args, passresults.get("arrivalratecoverage"))
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"alignments": alignobj.mapped}))
+
+    if args.kmercoverage:
+        steprecord = telemetry.start_step("kmercoverage")
+        coverage.compare_read_kmers_to_benchmark_kmers(alignobj, refobj, benchintervals, outputfiles["benchmarkkmercountfile"], outputfiles["readalignedkmercountfile"], outputfiles["strandedalignedkmercountfile"], benchparams, args, passresults.get("kmercoverage"))
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": benchmarkbases}))
+
+    if args.strs:
+        logger.info("Assessing accuracy of short tandem repeats")
+        print("Assessing accuracy of short tandem repeats")
+    
+        steprecord = telemetry.start_step("strs")
+        strstats = errors.assess_str_classes_read_coverage_require_flank(strclasses, alignobj, refobj, outputfiles, benchintervals, hetsites, args, passresults.get("strs"))
+        for [strlabel, strbedfile] in strclasses:
+            stats.write_read_str_stats(strlabel, strstats[strlabel], outputfiles, args)
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"reads": sum([count_str_reads(strstats[strlabel]) for strlabel in strstats])}))
+
+    # evaluate errors within read alignments:
+    if args.baseerrors:
+        logger.info("Assessing errors within read alignments")
+        logger.debug(outputfiles["readerrorfile"])
+        steprecord = telemetry.start_step("baseerrors")
+        errorstats = errors.assess_read_align_errors(alignobj, refobj, outputfiles["readerrorfile"], benchintervals, hetsites, args, passresults.get("baseerrors"))
+        stats.write_read_error_summary(errorstats, outputfiles)
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": errorstats["totalalignedbases"]}))
+        if len(errorstats["alignedqualscorecounts"]) > 0:
+            plots.plot_read_error_stats(args.readsetname, args.benchmark, outputdir)
+
+    telemetry.write_telemetry(telemetryrecords, outputfiles["telemetryfile"])
+
 def main() -> None:
 
     args = parse_arguments(sys.argv[1:])
@@ -134,11 +264,18 @@ def main() -> None:
     outputdir = output.create_output_directory(args.prefix)
     benchparams = read_config_data(args)
 
-    hetsites = phasing.read_hetsites(benchparams["hetsitevariants"])
+    hetsites = hetstore.load_hetsites(benchparams["hetsitevariants"])
 
     alignobj = pysam.AlignmentFile(args.bam, "rb")
     refobj = pysam.FastaFile(args.reffasta)
 
+    if args.region is not None:
+        for [chrom, start, end] in args.region:
+            if chrom not in alignobj.references:
+                logger.critical("Region chromosome " + chrom + " is not a reference sequence of " + args.bam)
+                print("Region chromosome " + chrom + " is not a reference sequence of " + args.bam)
+                exit(1)
+
     outputfiles = output.name_read_stats_files(args, outputdir)
 
     benchintervals = seqparse.write_included_bedfile(refobj, args, benchparams, outputfiles)
@@ -146,60 +283,96 @@ def main() -> None:
     if args.downsample is not None:
         logger.info("Downsampling to fraction " + str(args.downsample) + " of reads")
 
-    if args.bincoverage:
-        logger.info("Calculating binned coverage")
-        logger.debug(outputfiles["coveragebedfile"])
-        coverage.tally_bin_coverages(alignobj, refobj, benchintervals, outputfiles["includedbedfile"], outputfiles["coveragebedfile"], outputfiles["includedcoveragebedfile"], args)
-        #plots.plot_read_coverage_vs_gccontent(outputfiles["coveragebedfile"], outputfiles["extremekmersbedfile"])
+    # time and resources used by each analysis, and the numbers of items it processed:
+    telemetryrecords = []
 
-    if args.arrivalratecoverage:
-        logger.info("Calculating read arrival rate in bins for comparison to Poisson distribution")
-        logger.debug(outputfiles["arrivalratebedfile"])
-        coverage.tally_included_bin_arrival_rates(alignobj, refobj, benchintervals, outputfiles["arrivalratebedfile"], args)
+    strclasses = read_str_classes(benchparams) if args.strs else []
 
-    if args.kmercoverage:
-        coverage.compare_read_kmers_to_benchmark_kmers(alignobj, refobj, benchintervals, outputfiles["benchmarkkmercountfile"], outputfiles["readalignedkmercountfile"], outputfiles["strandedalignedkmercountfile"], benchparams, args)
+    # with --region or --shard, the analyses are run in part of the benchmark, and their partial results are saved for
+    # readbench-merge to combine with those of other runs:
+    if args.region is not None or args.shard is not None:
+        logger.info("Assessing part of the benchmark and saving partial results to " + outputfiles["readpassstatefile"])
+        steprecord = telemetry.start_step("readpass")
+        passstate = readpass.read_pass_state(alignobj, refobj, benchintervals, hetsites, strclasses, outputfiles, args)
+        readpass.write_read_pass_state(outputfiles["readpassstatefile"], passstate)
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": sum([windowend - windowstart for [chrom, windowstart, windowend] in passstate["windows"]])}))
+        telemetry.write_telemetry(telemetryrecords, outputfiles["telemetryfile"])
+        print("Saved partial results to " + outputfiles["readpassstatefile"] + " for readbench-merge")
+        return
 
-    if args.strs:
-        logger.info("Assessing accuracy of short tandem repeats")
-        print("Assessing accuracy of short tandem repeats")
-    
-        if "tetranucruns" in benchparams:
-            logger.debug(benchparams["tetranucruns"])
-            tetranucstats = errors.assess_str_read_coverage_require_flank('tetranuc', alignobj, refobj, benchparams["tetranucruns"], outputfiles, benchintervals, hetsites, args)
-            stats.write_read_str_stats('tetranuc', tetranucstats, outputfiles, args)
-        else:
-            logger.info("No tetranucleotide bed file specified in configuration file(tetranucruns)")
-        
-        if "trinucruns" in benchparams:
-            logger.debug(benchparams["trinucruns"])
-            trinucstats = errors.assess_str_read_coverage_require_flank('trinuc', alignobj, refobj, benchparams["trinucruns"], outputfiles, benchintervals, hetsites, args)
-            stats.write_read_str_stats('trinuc', trinucstats, outputfiles, args)
-        else:
-            logger.info("No trinucleotide bed file specified in configuration file(trinucruns)")
-    
-        if "dinucruns" in benchparams:
-            logger.debug(benchparams["dinucruns"])
-            dinucstats = errors.assess_str_read_coverage_require_flank('dinuc', alignobj, refobj, benchparams["dinucruns"], outputfiles, benchintervals, hetsites, args)
-            stats.write_read_str_stats('dinuc', dinucstats, outputfiles, args)
-        else:
-            logger.info("No dinucleotide bed file specified in configuration file(dinucruns)")
-    
-        if "mononucruns" in benchparams:
-            logger.debug(benchparams["mononucruns"])
-            mononucstats = errors.assess_str_read_coverage_require_flank('mononuc', alignobj, refobj, benchparams["mononucruns"], outputfiles, benchintervals, hetsites, args)
-            stats.write_read_str_stats('mononuc', mononucstats, outputfiles, args)
-        else:
-            logger.info("No mononucleotide bed file specified in configuration file(mononucruns)")
+    # with --readpass single, the alignments are read once for all analyses, and each analysis below writes its results:
+    passresults = {}
+    if args.readpass == 'single' and (args.bincoverage or args.arrivalratecoverage or args.kmercoverage or args.strs or args.baseerrors):
+        logger.info("Reading alignments for all analyses in a single pass")
+        steprecord = telemetry.start_step("readpass")
+        passresults = readpass.run_read_pass(alignobj, refobj, benchintervals, hetsites, strclasses, outputfiles, args)
+        telemetryrecords.append(telemetry.finish_step(steprecord, {"alignments": alignobj.mapped}))
 
-    # evaluate errors within read alignments:
-    if args.baseerrors:
-        logger.info("Assessing errors within read alignments")
-        logger.debug(outputfiles["readerrorfile"])
-        errorstats = errors.assess_read_align_errors(alignobj, refobj, outputfiles["readerrorfile"], benchintervals, hetsites, args)
-        stats.write_read_error_summary(errorstats, outputfiles)
-        if len(errorstats["alignedqualscorecounts"]) > 0:
-            plots.plot_read_error_stats(args.readsetname, args.benchmark, outputdir)
+    write_analysis_results(alignobj, refobj, benchintervals, hetsites, strclasses, benchparams, outputfiles, outputdir, passresults, telemetryrecords, args)
+
+# options of readbench runs that can differ between runs whose partial results are combined:
+MERGEVARYINGOPTIONS = ['prefix', 'region', 'shard', 't', 'debug']
+
+def merge_main() -> None:
+
+    mergeargs = parse_merge_arguments(sys.argv[1:])
+    no_rscript = check_for_R()
+
+    logfile = mergeargs.prefix + ".log"
+    logformat = '%(asctime)s %(message)s'
+    if mergeargs.debug:
+        logging.basicConfig(filename=logfile, level=logging.DEBUG, format=logformat)
+        logger.info('Logging verbose output for debugging.')
+    else:
+        logging.basicConfig(filename=logfile, level=logging.INFO, format=logformat)
+
+    outputdir = output.create_output_directory(mergeargs.prefix)
+
+    passstates = []
+    for shardprefix in mergeargs.shardprefixes:
+        shardfiles = output.name_read_stats_files(mergeargs, shardprefix)
+        logger.info("Reading partial results from " + shardfiles["readpassstatefile"])
+        passstates.append(readpass.read_read_pass_state(shardfiles["readpassstatefile"]))
+
+    # the combined results are written with the options of the readbench runs:
+    shardargs = passstates[0]["args"]
+    for shardprefix, passstate in zip(mergeargs.shardprefixes, passstates):
+        for option in shardargs:
+            if option not in MERGEVARYINGOPTIONS and passstate["args"].get(option) != shardargs[option]:
+                logger.critical("Readbench runs " + mergeargs.shardprefixes[0] + " and " + shardprefix + " used different values of option " + option)
+                print("Readbench runs " + mergeargs.shardprefixes[0] + " and " + shardprefix + " used different values of option " + option)
+                exit(1)
+    args = argparse.Namespace(**shardargs)
+    args.prefix = mergeargs.prefix
+    args.t = mergeargs.t
+    args.debug = mergeargs.debug
+    args.region = None
+    args.shard = None
+
+    benchparams = read_config_data(args)
+    alignobj = pysam.AlignmentFile(args.bam, "rb")
+    refobj = pysam.FastaFile(args.reffasta)
+
+    outputfiles = output.name_read_stats_files(args, outputdir)
+
+    benchintervals = seqparse.write_included_bedfile(refobj, args, benchparams, outputfiles)
+
+    telemetryrecords = []
+    steprecord = telemetry.start_step("merge")
+    readpass.link_window_files(passstates, outputdir)
+    passresults = readpass.merge_read_pass_results(alignobj, passstates)
+    windowbases = sum([windowend - windowstart for passstate in passstates for [chrom, windowstart, windowend] in passstate["windows"]])
+    if windowbases < sum(alignobj.lengths):
+        logger.warning("Partial results cover " + str(windowbases) + " of the " + str(sum(alignobj.lengths)) + " bases of the benchmark")
+    telemetryrecords.append(telemetry.finish_step(steprecord, {"bases": windowbases}))
+
+    # STR classes assessed by the runs, with their included STR bed files, which are written again here:
+    strclasses = [[strlabel, strbedfile] for [strlabel, strbedfile] in read_str_classes(benchparams) if strlabel in passresults.get("strs", {})] if args.strs else []
+    for [strlabel, strbedfile] in strclasses:
+        errors.write_included_str_file(strbedfile, outputfiles["includedstrprefix"] + "." + strlabel + ".included.bed", benchintervals)
+
+    # het sites are only needed for alignments, which have already been assessed:
+    write_analysis_results(alignobj, refobj, benchintervals, None, strclasses, benchparams, outputfiles, outputdir, passresults, telemetryrecords, args)
 
 
 if __name__ == "__main__":
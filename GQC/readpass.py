@@ -0,0 +1,597 @@
+import io
+import os
+import array
+import bisect
+import pickle
+import random
+import shutil
+import itertools
+import pysam
+import logging
+import numpy as np
+from collections import namedtuple
+from GQC import coverage
+from GQC import errors
+from GQC import pipeline
+
+logger = logging.getLogger(__name__)
+
+# readbench's analyses can share a single pass through the bam file. The benchmark chromosomes are divided into
+# windows of up to READPASSWINDOWSIZE bases (grouped into shards of about that many bases for worker processes),
+# and the alignments of each window are fetched just once and given to an analyzer for each enabled analysis with
+# consume(align). An analyzer's finalize() returns the partial results of its window, and the partial results of
+# all windows are combined, in the order of the windows, into the results that readbench writes out. Analyzers that
+# tally alignments only consume those starting within their window (see ReadAnalyzer.owns), so that alignments
+# overlapping several windows are tallied once, while the STR analyzer consumes every alignment overlapping its loci.
+# Because the partial results of windows can be combined in any grouping, readbench runs with --region or --shard can
+# assess some of the windows and save their partial results (see write_read_pass_state) for readbench-merge to combine.
+READPASSWINDOWSIZE = 10000000
+
+READPASSANALYSES = ['bincoverage', 'arrivalratecoverage', 'kmercoverage', 'strs', 'baseerrors']
+
+# a benchmark interval, used like a pybedtools.Interval (which can't be sent to worker processes):
+intervaltuple = namedtuple('intervaltuple', ['chrom', 'start', 'end'])
+
+# Items (benchmark intervals or STR loci) of a chromosome, given as lists beginning with start and end, sorted by start
+# along with the running maximum of their ends, so that the items overlapping an alignment can be found by bisection
+# even when items overlap each other:
+class OverlapIndex:
+    def __init__(self, items:list):
+        self.items = sorted(items, key=lambda item: item[0])
+        self.starts = [item[0] for item in self.items]
+        self.maxends = list(itertools.accumulate([item[1] for item in self.items], max))
+
+    # indices of the items overlapping start-end, in order:
+    def overlapping(self, start:int, end:int)->list:
+        first = bisect.bisect_right(self.maxends, start)
+        last = bisect.bisect_left(self.starts, end)
+        return [itemindex for itemindex in range(first, last) if self.items[itemindex][1] > start]
+
+# the end of the reference interval an alignment is fetched for (as with htslib, an alignment with no reference bases
+# covers just its start position):
+def fetch_end(align)->int:
+    refend = align.reference_end
+    return refend if refend is not None and refend > align.reference_start else align.reference_start + 1
+
+class ReadAnalyzer:
+    def __init__(self, chrom:str, windowstart:int, windowend:int):
+        self.chrom = chrom
+        self.windowstart = windowstart
+        self.windowend = windowend
+        # alignments are fetched up to the largest fetchend of a window's analyzers:
+        self.fetchend = windowend
+        # random numbers for --downsample, given by stream_window:
+        self.rng = None
+
+    # true for alignments starting within the window:
+    def owns(self, align)->bool:
+        return self.windowstart <= align.reference_start < self.windowend
+
+    def consume(self, align):
+        pass
+
+    def finalize(self):
+        return None
+
+# depth totals of a chromosome's coverage bins (see coverage.tally_bin_coverages):
+class BinCoverageAnalyzer(ReadAnalyzer):
+    def __init__(self, chrom:str, windowstart:int, windowend:int, numbins:int, binsize:int):
+        super().__init__(chrom, windowstart, windowend)
+        self.numbins = numbins
+        self.binsize = binsize
+        self.refstarts = array.array('q')
+        self.reflastpositions = array.array('q')
+
+    def consume(self, align):
+        if not self.owns(align) or align.is_secondary or align.reference_end is None:
+            return
+        self.refstarts.append(align.reference_start)
+        self.reflastpositions.append(align.reference_end - 1)
+
+    def finalize(self):
+        return coverage.bin_depth_totals(np.frombuffer(self.refstarts, dtype=np.int64), np.frombuffer(self.reflastpositions, dtype=np.int64), self.numbins, self.binsize)
+
+# read arrivals in a chromosome's coverage bins (see coverage.tally_included_bin_arrival_rates):
+class ArrivalRateAnalyzer(BinCoverageAnalyzer):
+    def __init__(self, chrom:str, windowstart:int, windowend:int, numbins:int, binsize:int, bincovoverlap:bool):
+        super().__init__(chrom, windowstart, windowend, numbins, binsize)
+        self.bincovoverlap = bincovoverlap
+
+    def consume(self, align):
+        if not self.owns(align):
+            return
+        self.refstarts.append(align.reference_start)
+        self.reflastpositions.append(coverage.arrival_last_position(align))
+
+    def finalize(self):
+        return coverage.bin_read_counts(np.frombuffer(self.refstarts, dtype=np.int64), np.frombuffer(self.reflastpositions, dtype=np.int64), self.numbins, self.binsize, self.bincovoverlap)
+
+# canonical and stranded kmer counts of read sequence aligned to the benchmark intervals (see
+# coverage.tally_included_aligned_read_kmers):
+class ReadKmerAnalyzer(ReadAnalyzer):
+    def __init__(self, chrom:str, windowstart:int, windowend:int, intervals:list, args):
+        super().__init__(chrom, windowstart, windowend)
+        self.intervals = intervals
+        self.intervalindex = None
+        self.k = args.covkmersize
+        self.minreadalignedpercentage = args.minreadalignedpercentage
+        self.downsample = args.downsample
+        self.canonicalkmercountdict = {}
+        self.strandedkmercountdict = {}
+        [self.readseqs, self.readreversestrands, self.batchlength] = [[], [], 0]
+
+    def consume(self, align):
+        if not self.owns(align):
+            return
+        if self.intervalindex is None:
+            self.intervalindex = OverlapIndex(self.intervals)
+        for intervalindex in self.intervalindex.overlapping(align.reference_start, fetch_end(align)):
+            interval = self.intervalindex.items[intervalindex][2]
+            if align.is_secondary or align.cigartuples is None or (self.downsample is not None and self.rng.random() >= self.downsample):
+                continue
+            regionstring = interval.chrom + ":" + str(interval.start + 1) + "-" + str(interval.end)
+            alignedreadseq = coverage.included_read_sequence(align, interval, regionstring, self.minreadalignedpercentage)
+            if alignedreadseq is None:
+                continue
+            self.readseqs.append(alignedreadseq)
+            self.readreversestrands.append(align.is_reverse)
+            self.batchlength += len(alignedreadseq)
+            if self.batchlength >= coverage.KMERCHUNKSIZE:
+                coverage.tally_read_kmer_batch(self.readseqs, self.readreversestrands, self.k, self.canonicalkmercountdict, self.strandedkmercountdict)
+                [self.readseqs, self.readreversestrands, self.batchlength] = [[], [], 0]
+
+    def finalize(self):
+        coverage.tally_read_kmer_batch(self.readseqs, self.readreversestrands, self.k, self.canonicalkmercountdict, self.strandedkmercountdict)
+        return [self.canonicalkmercountdict, self.strandedkmercountdict]
+
+# Read error tallies, error records and read error file part of the window (see errors.assess_read_align_errors). With
+# benchmark intervals, an alignment is assessed for each interval it overlaps, and, as when intervals are fetched one
+# by one, the errors are written interval by interval: each interval's errors are held until no later alignment can
+# reach it. The window's intervals are returned as segments of [start, end, number of records (and lines)], so that
+# merge_read_pass_results can keep the order of intervals that alignments of more than one window reach:
+class ReadErrorAnalyzer(ReadAnalyzer):
+    def __init__(self, chrom:str, windowstart:int, windowend:int, intervals, reffasta:str, hetsitedict, windowfile:str, callvariants:bool, args):
+        super().__init__(chrom, windowstart, windowend)
+        self.intervals = intervals
+        self.intervalindex = None
+        self.reffasta = reffasta
+        self.hetsitedict = hetsitedict
+        self.windowfile = windowfile
+        self.callvariants = callvariants
+        self.args = args
+        self.refobj = None
+        self.refh = None
+        self.stats = errors.new_read_error_stats()
+        self.records = []
+        self.intervalparts = {}
+        self.segments = [] if intervals is not None else None
+
+    def consume(self, align):
+        if not self.owns(align):
+            return
+        # file handles are opened in the process that consumes the alignments:
+        if self.refobj is None:
+            self.refobj = pysam.FastaFile(self.reffasta)
+            if self.callvariants:
+                self.refh = open(self.windowfile, "w")
+            if self.intervals is not None:
+                self.intervalindex = OverlapIndex(self.intervals)
+        if self.intervalindex is None:
+            errors.tally_align_errors(align, None, self.refobj, self.refh, self.hetsitedict, self.stats, self.records, self.callvariants, self.args, self.rng)
+        else:
+            self.write_intervals(align.reference_start)
+            for intervalindex in self.intervalindex.overlapping(align.reference_start, fetch_end(align)):
+                if intervalindex not in self.intervalparts:
+                    self.intervalparts[intervalindex] = [io.StringIO() if self.callvariants else None, []]
+                [intervalfh, intervalrecords] = self.intervalparts[intervalindex]
+                errors.tally_align_errors(align, self.intervalindex.items[intervalindex][2], self.refobj, intervalfh, self.hetsitedict, self.stats, intervalrecords, self.callvariants, self.args, self.rng)
+
+    # writes the errors of the intervals that end at or before readstart, which no later alignment can reach:
+    def write_intervals(self, readstart):
+        lastinterval = bisect.bisect_right(self.intervalindex.maxends, readstart)
+        for intervalindex in sorted([intervalindex for intervalindex in self.intervalparts if intervalindex < lastinterval]):
+            [intervalfh, intervalrecords] = self.intervalparts.pop(intervalindex)
+            if intervalfh is not None:
+                self.refh.write(intervalfh.getvalue())
+            self.records.extend(intervalrecords)
+            [start, end, interval] = self.intervalindex.items[intervalindex]
+            self.segments.append([start, end, len(intervalrecords)])
+
+    def finalize(self):
+        if self.intervalindex is not None:
+            self.write_intervals(float("inf"))
+        windowfile = None
+        if self.refh is not None:
+            self.refh.close()
+            windowfile = self.windowfile
+        self.stats["positiontotalcounts"] = errors.trim_position_counts(self.stats["positiontotalcounts"])
+        self.stats["positionerrorcounts"] = self.stats["positionerrorcounts"][:len(self.stats["positiontotalcounts"])]
+        return [self.stats, np.array(self.records, dtype=errors.READERRORDTYPE), windowfile, self.segments]
+
+# Tallies and stats file part of a class of STR loci starting within the window (see errors.tally_str_loci). Alignments
+# arrive sorted by start, so a locus has all its reads once an alignment starts at or after its end, and loci are
+# tallied (in order) as soon as they have all their reads:
+class StrAnalyzer(ReadAnalyzer):
+    def __init__(self, chrom:str, windowstart:int, windowend:int, loci:list, reffasta:str, hetsitedict, windowfile:str, args):
+        super().__init__(chrom, windowstart, windowend)
+        self.loci = loci
+        self.reffasta = reffasta
+        self.hetsitedict = hetsitedict
+        self.windowfile = windowfile
+        self.args = args
+        self.fetchend = max([windowend] + [locus[2] for locus in loci])
+        self.locusindex = None
+        self.locusreads = []
+        self.nextlocus = 0
+        self.strdict = {}
+        self.sfh = None
+
+    def start_loci(self):
+        refobj = pysam.FastaFile(self.reffasta)
+        self.locusindex = OverlapIndex([[start, end, name] for [chrom, start, end, name] in self.loci])
+        self.locusreads = [[] for locus in self.loci]
+        self.seqstart = max(0, self.locusindex.starts[0] - 5) if len(self.loci) > 0 else 0
+        self.windowseq = refobj.fetch(reference=self.chrom, start=self.seqstart, end=self.fetchend + 5) if len(self.loci) > 0 else ""
+        self.sfh = open(self.windowfile, "w")
+
+    # tallies the loci up to (but not including) locus lastlocus:
+    def tally_loci(self, lastlocus:int):
+        lociwithreads = []
+        for locusindex in range(self.nextlocus, lastlocus):
+            [start, end, name] = self.locusindex.items[locusindex]
+            seqstart = self.seqstart
+            benchleftflankseq = self.windowseq[max(0, start - 5 - seqstart):start - seqstart].upper()
+            benchrightflankseq = self.windowseq[end - seqstart:end + 5 - seqstart].upper()
+            refalleleseq = self.windowseq[start - seqstart:end - seqstart]
+            lociwithreads.append([self.chrom, start, end, name, benchleftflankseq, benchrightflankseq, refalleleseq, self.locusreads[locusindex]])
+            self.locusreads[locusindex] = None
+        errors.tally_str_locus_reads(lociwithreads, self.sfh, self.hetsitedict, self.strdict, self.args, self.rng)
+        self.nextlocus = max(self.nextlocus, lastlocus)
+
+    def consume(self, align):
+        if self.locusindex is None:
+            self.start_loci()
+        readstart = align.reference_start
+        lastlocus = self.nextlocus
+        while lastlocus < len(self.loci) and self.locusindex.items[lastlocus][1] <= readstart:
+            lastlocus = lastlocus + 1
+        if lastlocus > self.nextlocus:
+            self.tally_loci(lastlocus)
+        for locusindex in self.locusindex.overlapping(readstart, fetch_end(align)):
+            self.locusreads[locusindex].append(align)
+
+    def finalize(self):
+        if self.locusindex is None:
+            self.start_loci()
+        self.tally_loci(len(self.loci))
+        self.sfh.close()
+        return [self.strdict, self.windowfile]
+
+# windows of up to READPASSWINDOWSIZE bases of each chromosome, or of the parts of chromosomes within regions (lists
+# of [chrom, start, end] with end None for the rest of the chromosome), in the order of the bam file's references:
+def read_pass_windows(align_obj, regions=None)->list:
+    windows = []
+    for chrom, chromlength in zip(align_obj.references, align_obj.lengths):
+        chromregions = [[0, chromlength]]
+        if regions is not None:
+            # overlapping regions are merged so that no part of the chromosome is assessed twice:
+            chromregions = []
+            for [regionstart, regionend] in sorted([[start, chromlength if end is None else min(end, chromlength)] for [regionchrom, start, end] in regions if regionchrom == chrom]):
+                if len(chromregions) > 0 and regionstart <= chromregions[-1][1]:
+                    chromregions[-1][1] = max(chromregions[-1][1], regionend)
+                elif regionstart < regionend:
+                    chromregions.append([regionstart, regionend])
+        for windowstart in range(0, chromlength, READPASSWINDOWSIZE):
+            windowend = min(windowstart + READPASSWINDOWSIZE, chromlength)
+            for [regionstart, regionend] in chromregions:
+                if regionstart < windowend and regionend > windowstart:
+                    windows.append([chrom, max(windowstart, regionstart), min(windowend, regionend)])
+
+    return windows
+
+# the windows of part shardnumber (counting from 1) of numshards parts of the windows, dealt out in turn so that each
+# part has windows from across the benchmark:
+def shard_windows(windows:list, shardnumber:int, numshards:int)->list:
+    return [window for windowindex, window in enumerate(windows) if windowindex % numshards == shardnumber - 1]
+
+# windows grouped into shards of about READPASSWINDOWSIZE bases for worker processes:
+def read_pass_shards(windows:list)->list:
+    shards = []
+    shardbases = 0
+    for [chrom, windowstart, windowend] in windows:
+        if len(shards) == 0 or shardbases + windowend - windowstart > READPASSWINDOWSIZE:
+            shards.append([])
+            shardbases = 0
+        shards[-1].append([chrom, windowstart, windowend])
+        shardbases = shardbases + windowend - windowstart
+
+    return shards
+
+# STR loci of an included STR bed file as lists of [chrom, start, end, name] for each chromosome:
+def chrom_str_loci(includedstrfile:str)->dict:
+    chromloci = {}
+    for [chrom, strlines] in errors.chrom_str_shards(includedstrfile):
+        chromloci[chrom] = []
+        for strline in strlines:
+            strfields = strline.rstrip().split("\t")
+            chromloci[chrom].append([chrom, int(strfields[1]), int(strfields[2]), strfields[3]])
+
+    return chromloci
+
+# streams the alignments of a window through its analyzers, returning the partial result of each analysis. Each
+# analyzer of a window has its own random numbers for --downsample, seeded by the window and the analysis, so that the
+# reads an analysis leaves out don't depend on which other analyses are run, whether windows are streamed in worker
+# processes, how they are grouped into shards, or how they are split between readbench runs with --shard:
+def stream_window(align_obj, windowanalyzers:dict)->dict:
+    analyzers = list(windowanalyzers.values())
+    if len(analyzers) == 0:
+        return {}
+    [chrom, windowstart] = [analyzers[0].chrom, analyzers[0].windowstart]
+    for analysis in windowanalyzers:
+        windowanalyzers[analysis].rng = random.Random("readpass:" + chrom + ":" + str(windowstart) + ":" + analysis)
+    fetchend = max([analyzer.fetchend for analyzer in analyzers])
+    for align in align_obj.fetch(chrom, windowstart, fetchend):
+        for analyzer in analyzers:
+            analyzer.consume(align)
+
+    return dict([(analysis, windowanalyzers[analysis].finalize()) for analysis in windowanalyzers])
+
+# worker for run_read_pass--opens its own pysam file handle and returns the partial results of each [window,
+# windowanalyzers] of a shard:
+def run_read_pass_shard(bamfile:str, shardanalyzers:list)->list:
+    align_obj = pysam.AlignmentFile(bamfile, "rb")
+
+    windowresults = []
+    for [window, windowanalyzers] in shardanalyzers:
+        windowresults.append(stream_window(align_obj, windowanalyzers))
+
+    return windowresults
+
+# the windows assessed by a readbench run--those within args.region, if given, and of part args.shard, if given:
+def select_read_pass_windows(align_obj, args)->list:
+    regions = args.region if 'region' in args else None
+    windows = read_pass_windows(align_obj, regions)
+    if 'shard' in args and args.shard is not None:
+        [shardnumber, numshards] = args.shard
+        windows = shard_windows(windows, shardnumber, numshards)
+
+    return windows
+
+# Runs the enabled analyses (those of READPASSANALYSES whose readbench option is set) in a single pass through the bam
+# file, returning a dictionary of the combined results of each analysis in the form its readbench step takes them.
+# strclasses are the [strlabel, strbedfile] pairs of the STR classes to assess--classes with existing stats files
+# are left for errors.assess_str_classes_read_coverage_require_flank to read.
+def run_read_pass(align_obj, refobj, bedintervals, hetsitedict, strclasses:list, outputdict:dict, args)->dict:
+
+    passstate = read_pass_state(align_obj, refobj, bedintervals, hetsitedict, strclasses, outputdict, args)
+
+    return merge_read_pass_results(align_obj, [passstate])
+
+# Runs the enabled analyses in the windows of select_read_pass_windows, returning the partial results of the windows
+# (along with what's needed to combine them) as a dictionary that can be saved with write_read_pass_state. With more
+# than one worker (args.t), shards of windows are assessed by a pool of processes.
+def read_pass_state(align_obj, refobj, bedintervals, hetsitedict, strclasses:list, outputdict:dict, args)->dict:
+
+    analyses = [analysis for analysis in READPASSANALYSES if analysis in args and vars(args)[analysis]]
+    bamfile = os.fsdecode(align_obj.filename)
+    reffasta = os.fsdecode(refobj.filename)
+    numworkers = args.t if 't' in args else 1
+
+    binsize = None
+    if 'bincoverage' in analyses or 'arrivalratecoverage' in analyses:
+        binsize = coverage.coverage_bin_size(align_obj, refobj, bedintervals, args)
+
+    chromintervals = {}
+    if bedintervals is not None:
+        for interval in bedintervals:
+            if interval.chrom not in chromintervals:
+                chromintervals[interval.chrom] = []
+            chromintervals[interval.chrom].append([interval.start, interval.end, intervaltuple(chrom=interval.chrom, start=interval.start, end=interval.end)])
+
+    strclassloci = {}
+    if 'strs' in analyses:
+        for [strlabel, strbedfile] in strclasses:
+            strstatsfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out"
+            if os.path.exists(strstatsfile) and os.path.getsize(strstatsfile) > 0:
+                continue
+            includedstrfile = outputdict["includedstrprefix"] + "." + strlabel + ".included.bed"
+            errors.write_included_str_file(strbedfile, includedstrfile, bedintervals)
+            strclassloci[strlabel] = chrom_str_loci(includedstrfile)
+
+    callvariants = not args.errorfile and not args.rerun
+    chromhetsites = errors.chrom_hetsite_subsets(hetsitedict)
+    windows = select_read_pass_windows(align_obj, args)
+    shardanalyzers = []
+    windowindex = 0
+    for shard in read_pass_shards(windows):
+        shardanalyzers.append([])
+        for [chrom, windowstart, windowend] in shard:
+            chromlength = align_obj.get_reference_length(chrom)
+            windowhetsites = chromhetsites.get(chrom, {}) if chromhetsites is not None else hetsitedict
+            windowanalyzers = {}
+            if 'bincoverage' in analyses:
+                windowanalyzers['bincoverage'] = BinCoverageAnalyzer(chrom, windowstart, windowend, chromlength // binsize, binsize)
+            if 'arrivalratecoverage' in analyses and chrom != "chrM":
+                windowanalyzers['arrivalratecoverage'] = ArrivalRateAnalyzer(chrom, windowstart, windowend, chromlength // binsize, binsize, args.bincovoverlap)
+            if 'kmercoverage' in analyses and chrom != "chrM" and chrom in chromintervals:
+                windowanalyzers['kmercoverage'] = ReadKmerAnalyzer(chrom, windowstart, windowend, chromintervals[chrom], args)
+            for strlabel in strclassloci:
+                windowloci = [locus for locus in strclassloci[strlabel].get(chrom, []) if windowstart <= locus[1] < windowend]
+                if len(windowloci) > 0:
+                    windowfile = outputdict["strstatsprefix"] + "." + strlabel + ".stats.out.window" + str(windowindex)
+                    windowanalyzers['strs:' + strlabel] = StrAnalyzer(chrom, windowstart, windowend, windowloci, reffasta, windowhetsites, windowfile, args)
+            if 'baseerrors' in analyses and (bedintervals is None or chrom in chromintervals):
+                windowfile = outputdict["readerrorfile"] + ".window" + str(windowindex)
+                intervals = chromintervals[chrom] if bedintervals is not None else None
+                windowanalyzers['baseerrors'] = ReadErrorAnalyzer(chrom, windowstart, windowend, intervals, reffasta, windowhetsites, windowfile, callvariants, args)
+            shardanalyzers[-1].append([[chrom, windowstart, windowend], windowanalyzers])
+            windowindex = windowindex + 1
+
+    logger.info("Running " + ", ".join(analyses) + " in a single pass through " + bamfile + " in " + str(windowindex) + " windows")
+    if numworkers > 1 and len(shardanalyzers) > 1:
+        with pipeline.worker_pool(numworkers) as executor:
+            shardfutures = [executor.submit(run_read_pass_shard, bamfile, shard) for shard in shardanalyzers]
+            windowresults = [windowresult for shardfuture in shardfutures for windowresult in shardfuture.result()]
+    else:
+        windowresults = [stream_window(align_obj, windowanalyzers) for [window, windowanalyzers] in itertools.chain.from_iterable(shardanalyzers)]
+
+    # the STR classes assessed, with the chromosome order of their included STR bed files:
+    strclasschroms = dict([(strlabel, list(strclassloci[strlabel].keys())) for strlabel in strclassloci])
+
+    return {"analyses": analyses, "binsize": binsize, "strclasschroms": strclasschroms, "windows": windows, "windowresults": windowresults, "args": vars(args)}
+
+# Saves the state of read_pass_state to a file, which readbench-merge combines with those of other readbench runs.
+# The window files of the results (parts of the read error file and STR stats files) stay next to the state file,
+# and are named without their directories so that the output directory can be moved:
+def write_read_pass_state(statefile:str, passstate:dict):
+    savedstate = dict(passstate)
+    savedstate["windowresults"] = [relocate_window_files(windowresult, os.path.basename) for windowresult in passstate["windowresults"]]
+    with open(statefile, "wb") as sfh:
+        pickle.dump(savedstate, sfh)
+    logger.info("Wrote partial results of " + str(len(passstate["windows"])) + " windows to " + statefile)
+
+def read_read_pass_state(statefile:str)->dict:
+    if not os.path.exists(statefile):
+        logger.critical("Partial results file " + statefile + " does not exist")
+        print("Partial results file " + statefile + " does not exist")
+        exit(1)
+    with open(statefile, "rb") as sfh:
+        passstate = pickle.load(sfh)
+    statedir = os.path.dirname(statefile)
+    passstate["windowresults"] = [relocate_window_files(windowresult, lambda windowfile: os.path.join(statedir, windowfile)) for windowresult in passstate["windowresults"]]
+
+    return passstate
+
+# Window files of pass states from read_read_pass_state are linked (or, on another file system, copied) into outputdir
+# for readbench-merge, as the readbench steps remove the window files they combine--those of the readbench runs are kept:
+def link_window_files(passstates:list, outputdir:str):
+    for stateindex, passstate in enumerate(passstates):
+        linkprefix = outputdir + "/shard" + str(stateindex) + "."
+        passstate["windowresults"] = [relocate_window_files(windowresult, lambda windowfile: link_window_file(windowfile, linkprefix + os.path.basename(windowfile))) for windowresult in passstate["windowresults"]]
+
+def link_window_file(windowfile:str, linkfile:str)->str:
+    if not os.path.exists(windowfile):
+        logger.critical("Window file " + windowfile + " of partial results does not exist")
+        print("Window file " + windowfile + " of partial results does not exist")
+        exit(1)
+    if os.path.exists(linkfile):
+        os.remove(linkfile)
+    try:
+        os.link(windowfile, linkfile)
+    except OSError:
+        shutil.copyfile(windowfile, linkfile)
+
+    return linkfile
+
+# a copy of a window's results with the names of its window files changed by relocate:
+def relocate_window_files(windowresult:dict, relocate)->dict:
+    relocatedresult = dict(windowresult)
+    for analysis in windowresult:
+        if analysis == 'baseerrors' and windowresult[analysis][2] is not None:
+            [stats, records, windowfile, segments] = windowresult[analysis]
+            relocatedresult[analysis] = [stats, records, relocate(windowfile), segments]
+        elif analysis.startswith('strs:'):
+            [strdict, windowfile] = windowresult[analysis]
+            relocatedresult[analysis] = [strdict, relocate(windowfile)]
+
+    return relocatedresult
+
+# Combines the partial results of the windows of one or more pass states (from read_pass_state or saved by readbench
+# runs with --region or --shard), in the order of the windows, into the results that each analysis's readbench step
+# takes. The states must be for the same analyses and bin size, and must not have windows in common:
+def merge_read_pass_results(align_obj, passstates:list)->dict:
+
+    analyses = passstates[0]["analyses"]
+    binsize = passstates[0]["binsize"]
+    strclasschroms = passstates[0]["strclasschroms"]
+    for passstate in passstates[1:]:
+        if passstate["analyses"] != analyses or passstate["binsize"] != binsize or passstate["strclasschroms"].keys() != strclasschroms.keys():
+            logger.critical("Partial results to be combined must be for the same analyses, bin size and STR classes")
+            print("Partial results to be combined must be for the same analyses, bin size and STR classes")
+            exit(1)
+
+    chromindices = dict([(chrom, chromindex) for chromindex, chrom in enumerate(align_obj.references)])
+    windowresults = sorted([[window, windowresult] for passstate in passstates for window, windowresult in zip(passstate["windows"], passstate["windowresults"])], key=lambda windowresult: (chromindices[windowresult[0][0]], windowresult[0][1]))
+    for [[chrom, windowstart, windowend], windowresult], [[nextchrom, nextstart, nextend], nextresult] in zip(windowresults, windowresults[1:]):
+        if chrom == nextchrom and nextstart < windowend:
+            logger.critical("Partial results to be combined overlap at " + chrom + ":" + str(nextstart + 1) + "-" + str(min(windowend, nextend)))
+            print("Partial results to be combined overlap at " + chrom + ":" + str(nextstart + 1) + "-" + str(min(windowend, nextend)))
+            exit(1)
+
+    passresults = {}
+    if 'bincoverage' in analyses:
+        passresults['bincoverage'] = [binsize, dict([(chrom, np.zeros(align_obj.get_reference_length(chrom) // binsize, dtype=np.int64)) for chrom in align_obj.references])]
+    if 'arrivalratecoverage' in analyses:
+        passresults['arrivalratecoverage'] = [binsize, dict([(chrom, np.zeros(align_obj.get_reference_length(chrom) // binsize, dtype=np.int64)) for chrom in align_obj.references if chrom != "chrM"])]
+    if 'kmercoverage' in analyses:
+        passresults['kmercoverage'] = [{}, {}]
+    if 'strs' in analyses:
+        passresults['strs'] = dict([(strlabel, []) for strlabel in strclasschroms])
+    if 'baseerrors' in analyses:
+        passresults['baseerrors'] = []
+
+    for [[chrom, windowstart, windowend], windowresult] in windowresults:
+        for analysis in windowresult:
+            if analysis in ['bincoverage', 'arrivalratecoverage']:
+                passresults[analysis][1][chrom] += windowresult[analysis]
+            elif analysis == 'kmercoverage':
+                for countdict, windowcountdict in zip(passresults[analysis], windowresult[analysis]):
+                    for kmername in windowcountdict:
+                        countdict[kmername] = countdict.get(kmername, 0) + windowcountdict[kmername]
+            elif analysis.startswith('strs:'):
+                passresults['strs'][analysis.split(":", 1)[1]].append([chrom, windowresult[analysis]])
+            elif analysis == 'baseerrors':
+                passresults[analysis].append([chrom, windowresult[analysis]])
+
+    if 'baseerrors' in analyses:
+        passresults['baseerrors'] = interval_ordered_read_errors(passresults['baseerrors'])
+
+    # STR stats files are in the chromosome order of the included STR bed files:
+    for strlabel in strclasschroms:
+        chromorder = strclasschroms[strlabel]
+        passresults['strs'][strlabel] = [windowresult for [chrom, windowresult] in sorted(passresults['strs'][strlabel], key=lambda chromresult: chromorder.index(chromresult[0]))]
+
+    return passresults
+
+# The read error results of windows (as [chrom, windowresult] in the order of the windows) as the [stats, records,
+# windowfile] that errors.assess_read_align_errors combines. With benchmark intervals, the errors in an interval that
+# alignments starting in more than one window reach are split between the windows' files, and can come before those of
+# an earlier interval. The window files of a chromosome where this happens are rewritten as one file in the order of
+# the intervals, which is that of a separate pass through each interval:
+def interval_ordered_read_errors(chromwindowresults:list)->list:
+    orderedresults = []
+    for chrom, chromresults in itertools.groupby(chromwindowresults, key=lambda chromresult: chromresult[0]):
+        windowresults = [windowresult for [chrom, windowresult] in chromresults]
+        parts = []
+        for windowposition, [stats, records, windowfile, segments] in enumerate(windowresults):
+            firstrecord = 0
+            for [start, end, numrecords] in (segments if segments is not None else []):
+                parts.append([start, end, windowposition, firstrecord, numrecords])
+                firstrecord = firstrecord + numrecords
+        orderedparts = sorted(parts, key=lambda part: (part[0], part[1]))
+        windowfiles = [windowresult[2] for windowresult in windowresults if windowresult[2] is not None]
+        if orderedparts == parts or len(windowfiles) == 0:
+            orderedresults.extend([[stats, records, windowfile] for [stats, records, windowfile, segments] in windowresults])
+            continue
+
+        logger.debug("Putting read errors of " + chrom + " windows in the order of the benchmark intervals")
+        chromstats = errors.new_read_error_stats()
+        windowlines = []
+        for [stats, records, windowfile, segments] in windowresults:
+            errors.merge_read_error_stats(chromstats, stats)
+            if windowfile is not None:
+                with open(windowfile, "r") as wfh:
+                    windowlines.append(wfh.readlines())
+                os.remove(windowfile)
+            else:
+                windowlines.append([])
+        chromstats["positiontotalcounts"] = errors.trim_position_counts(chromstats["positiontotalcounts"])
+        chromstats["positionerrorcounts"] = chromstats["positionerrorcounts"][:len(chromstats["positiontotalcounts"])]
+        chromfile = windowfiles[0] + ".intervalorder"
+        with open(chromfile, "w") as cfh:
+            for [start, end, windowposition, firstrecord, numrecords] in orderedparts:
+                cfh.writelines(windowlines[windowposition][firstrecord:firstrecord + numrecords])
+        chromrecords = [windowresults[windowposition][1][firstrecord:firstrecord + numrecords] for [start, end, windowposition, firstrecord, numrecords] in orderedparts]
+        orderedresults.append([chromstats, np.concatenate(chromrecords) if len(chromrecords) > 0 else np.zeros(0, dtype=errors.READERRORDTYPE), chromfile])
+
+    return orderedresults
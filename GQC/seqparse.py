@@ -189,6 +189,56 @@ def revcomp(seq:str) -> str:
 
     return ''.join(bases)
 
+# read-only view of the interval start-end (0-based, half-open) of a sequence in an indexed fasta file that
+# fetches it in windows of at most windowsize bases, so that long alignments never hold their whole sequence
+# in memory. Indexing, slicing and len() behave as they would on the upper-cased string returned by
+# fastaobj.fetch(), or on its reverse complement if revcompseq is True
+class WindowedSequence:
+    def __init__(self, fastaobj, name:str, start:int, end:int, windowsize:int, revcompseq=False):
+        self.fastaobj = fastaobj
+        self.name = name
+        self.start = start
+        self.end = max(start, min(end, fastaobj.get_reference_length(name)))
+        self.windowsize = windowsize
+        self.revcompseq = revcompseq
+        self.windowstart = 0
+        self.windowseq = ""
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            [startoffset, endoffset, step] = key.indices(len(self))
+            if step != 1:
+                return self[startoffset:endoffset][::step] if step > 0 else "".join(self[offset] for offset in range(startoffset, endoffset, step))
+            if endoffset <= startoffset:
+                return ""
+            if endoffset - startoffset > self.windowsize:
+                return self.fetch_offsets(startoffset, endoffset)
+            if startoffset < self.windowstart or endoffset > self.windowstart + len(self.windowseq):
+                self.load_window(startoffset, endoffset)
+            return self.windowseq[startoffset-self.windowstart:endoffset-self.windowstart]
+        else:
+            offset = key + len(self) if key < 0 else key
+            if offset < 0 or offset >= len(self):
+                raise IndexError("sequence index out of range")
+            if offset < self.windowstart or offset >= self.windowstart + len(self.windowseq):
+                self.load_window(offset, offset + 1)
+            return self.windowseq[offset-self.windowstart]
+
+    # load a window containing offsets startoffset to endoffset, along with some sequence to their left, since
+    # indels are widened in both directions:
+    def load_window(self, startoffset:int, endoffset:int):
+        self.windowstart = max(0, startoffset - self.windowsize // 8, endoffset - self.windowsize)
+        self.windowseq = self.fetch_offsets(self.windowstart, min(len(self), self.windowstart + self.windowsize))
+
+    def fetch_offsets(self, startoffset:int, endoffset:int)->str:
+        if self.revcompseq:
+            return revcomp(self.fastaobj.fetch(reference=self.name, start=self.end-endoffset, end=self.end-startoffset))
+        else:
+            return self.fastaobj.fetch(reference=self.name, start=self.start+startoffset, end=self.start+endoffset).upper()
+
 def compress_sequence(fastafile:str)->str:
     refobj = pysam.FastaFile(fastafile)
 
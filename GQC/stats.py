@@ -172,6 +172,20 @@ def write_general_assembly_stats(refobj, queryobj, contigregions, gapregions, ou
 
     return bmstats
 
+# For runs restricted to some of the benchmark's sequences (refcontigs), the benchmark totals used by the aligned, cluster
+# and het stats are replaced with those of the selected sequences (the scaffold and contig NG stats of the general stats
+# are still for the whole benchmark):
+def set_benchmark_totals(bmstats:dict, refobj, refcontigs:list):
+
+    phap1 = re.compile(r'.*MAT.*')
+    phap2 = re.compile(r'.*PAT.*')
+    bmstats['hap1totalbases'] = sum([refobj.get_reference_length(refcontig) for refcontig in refcontigs if phap1.match(refcontig)])
+    bmstats['hap2totalbases'] = sum([refobj.get_reference_length(refcontig) for refcontig in refcontigs if phap2.match(refcontig)])
+    bmstats['diploidtotalbases'] = bmstats['hap1totalbases'] + bmstats['hap2totalbases']
+    bmstats['totalbases'] = bmstats['hap1totalbases'] + bmstats['hap2totalbases']
+
+    return bmstats
+
 def write_merged_aligned_stats(refobj, queryobj, mergedtruthcoveredbed, mergedtestmatcoveredbed, mergedtestpatcoveredbed, bedfiles:dict, bmstats:dict, args)->dict:
 
     generalstatsfile = bedfiles["generalstatsfile"]
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import json
+import socket
+import logging
+import resource
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Telemetry records are dictionaries with the resources used by one step of a run:
+# wall time, CPU time (of this process and of external programs it waited on),
+# peak resident memory, bytes read and written, and the rate at which the step
+# processed items (alignments, variants, bases, etc.). Counters are process-wide,
+# so when pipeline steps run at the same time their CPU and I/O figures overlap.
+# Worker processes of pipeline.worker_pool aren't children of this process (they
+# are started by a fork server), so each of their tasks measures its own CPU time
+# and peak memory, which are added to the record of the step that submitted it.
+
+# the record of the step running in each thread, to which worker tasks are added:
+activesteps = threading.local()
+# lock for the addition of worker task usage, which is reported from the threads of worker pools:
+workerlock = threading.Lock()
+
+def read_proc_io()->dict:
+    iocounts = {}
+    if os.path.exists("/proc/self/io"):
+        with open("/proc/self/io", "r") as ifh:
+            for ioline in ifh:
+                [counter, value] = ioline.split(":")
+                iocounts[counter] = int(value)
+    return iocounts
+
+def read_peak_rss()->int:
+    # VmHWM is the high water mark of resident memory in kB (Linux only):
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r") as sfh:
+            for statusline in sfh:
+                if statusline.startswith("VmHWM:"):
+                    return int(statusline.split()[1]) * 1024
+    # ru_maxrss is in kB on Linux, bytes on Mac OS:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+# reset the resident memory high water mark so that peak memory is measured per step
+# (Linux only--elsewhere peak memory is for the run up to the end of the step):
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as cfh:
+            cfh.write("5")
+    except OSError:
+        pass
+
+def cpu_seconds(who)->float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+def child_peak_rss()->int:
+    childmaxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return childmaxrss if sys.platform == "darwin" else childmaxrss * 1024
+
+# the record of the step running in this thread, or None outside of steps:
+def active_step()->dict:
+    return getattr(activesteps, "record", None)
+
+# called in a worker process before and after each task, returning the CPU time and peak memory the task used:
+def start_worker_task()->dict:
+    reset_peak_rss()
+    return {"startcpu": cpu_seconds(resource.RUSAGE_SELF) + cpu_seconds(resource.RUSAGE_CHILDREN)}
+
+def finish_worker_task(usage:dict)->dict:
+    return {"cputime": cpu_seconds(resource.RUSAGE_SELF) + cpu_seconds(resource.RUSAGE_CHILDREN) - usage["startcpu"], "peakrss": read_peak_rss()}
+
+def add_worker_usage(record:dict, usage:dict):
+    if record is None:
+        return
+    with workerlock:
+        record["workertasks"] = record["workertasks"] + 1
+        record["workercputime"] = record["workercputime"] + usage["cputime"]
+        record["workerpeakrss"] = max(record["workerpeakrss"], usage["peakrss"])
+
+def start_step(name:str)->dict:
+    reset_peak_rss()
+    iocounts = read_proc_io()
+    record = {}
+    record["step"] = name
+    record["starttime"] = time.time()
+    record["startwall"] = time.perf_counter()
+    record["startcpu"] = cpu_seconds(resource.RUSAGE_SELF)
+    record["startchildcpu"] = cpu_seconds(resource.RUSAGE_CHILDREN)
+    record["startchildpeakrss"] = child_peak_rss()
+    record["startread"] = iocounts.get("rchar")
+    record["startwritten"] = iocounts.get("wchar")
+    record["workertasks"] = 0
+    record["workercputime"] = 0.0
+    record["workerpeakrss"] = 0
+    activesteps.record = record
+
+    return record
+
+# complete a telemetry record. itemcounts is a dictionary of the numbers of
+# items processed by the step, e.g. {"alignments": 1200, "bases": 3100000000}:
+def finish_step(record:dict, itemcounts=None)->dict:
+    iocounts = read_proc_io()
+    walltime = time.perf_counter() - record.pop("startwall")
+    record["walltime"] = round(walltime, 3)
+    record["cputime"] = round(cpu_seconds(resource.RUSAGE_SELF) - record.pop("startcpu"), 3)
+    record["childcputime"] = round(cpu_seconds(resource.RUSAGE_CHILDREN) - record.pop("startchildcpu"), 3)
+    record["peakrss"] = read_peak_rss()
+    # the peak memory of external programs is only known for the run as a whole, so it's only reported for the step
+    # whose programs raised it:
+    childpeakrss = child_peak_rss()
+    startchildpeakrss = record.pop("startchildpeakrss")
+    record["childpeakrss"] = childpeakrss if childpeakrss > startchildpeakrss else None
+    with workerlock:
+        record["workercputime"] = round(record["workercputime"], 3)
+    if getattr(activesteps, "record", None) is record:
+        activesteps.record = None
+    startread = record.pop("startread")
+    startwritten = record.pop("startwritten")
+    record["bytesread"] = iocounts["rchar"] - startread if startread is not None else None
+    record["byteswritten"] = iocounts["wchar"] - startwritten if startwritten is not None else None
+
+    record["items"] = {}
+    record["throughput"] = {}
+    if itemcounts is not None:
+        for itemtype in itemcounts.keys():
+            record["items"][itemtype] = itemcounts[itemtype]
+            if walltime > 0:
+                record["throughput"][itemtype + "/sec"] = round(itemcounts[itemtype] / walltime, 3)
+
+    logger.info("Step " + record["step"] + " took " + str(record["walltime"]) + " seconds (" + str(record["cputime"]) + " CPU seconds, " + str(record["childcputime"]) + " in external programs, " + str(record["workercputime"]) + " in " + str(record["workertasks"]) + " worker tasks) with peak memory " + str(record["peakrss"]) + " bytes")
+
+    return record
+
+def write_telemetry(records:list, telemetryfile:str, command=None):
+    summary = {}
+    summary["command"] = command if command is not None else " ".join(sys.argv)
+    summary["host"] = socket.gethostname()
+    summary["cpus"] = os.cpu_count()
+    summary["steps"] = records
+    # steps may overlap, so the run's wall time spans the earliest start to the latest finish:
+    if len(records) > 0:
+        summary["walltime"] = round(max(record["starttime"] + record["walltime"] for record in records) - min(record["starttime"] for record in records), 3)
+    summary["peakrss"] = max([record["peakrss"] for record in records], default=0)
+
+    with open(telemetryfile, "w") as tfh:
+        json.dump(summary, tfh, indent=1)
+    logger.info("Wrote step telemetry to " + telemetryfile)
+
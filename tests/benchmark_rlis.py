@@ -0,0 +1,68 @@
+import sys
+import time
+import random
+from GQC import mummermethods
+
+# Times mummermethods.filter_aligns on simulated alignments of a fragmented assembly to one
+# chromosome, from 10^3 to 10^6 alignments (or up to the power of ten given as the first argument).
+# The quadratic pairwise scoring is also timed, up to 10^3 alignments by default (or the power of ten
+# given as the second argument), and checked to give the same chains as the sweep.
+#
+# Usage: python tests/benchmark_rlis.py [maxexponent] [maxpairwiseexponent]
+
+def simulate_aligns(numaligns:int, rng)->list:
+
+    aligns = []
+    targetpos = 1
+    for i in range(numaligns):
+        alignlength = rng.randint(1000, 50000)
+        # mostly colinear alignments, with some overlapping and some from repeats elsewhere:
+        if rng.random() < 0.1:
+            targetstart = rng.randint(1, max(1, targetpos))
+        else:
+            targetstart = max(1, targetpos + rng.randint(-500, 2000))
+            targetpos = targetstart + alignlength
+        querystart = targetstart + rng.randint(-200, 200) if rng.random() < 0.9 else rng.randint(1, 10*numaligns)
+        queryend = querystart + alignlength if rng.random() < 0.95 else querystart - alignlength
+        aligns.append({"target":"chr1", "targetstart":targetstart, "targetend":targetstart + alignlength, "query":"scaffold" + str(i % 10), "querystart":max(1, querystart), "queryend":max(1, queryend), "identity":rng.choice([1.0, 0.999, 0.99])})
+
+    return aligns
+
+def time_scoring(scorefunction, aligns:list, maxoverlap:float)->list:
+
+    starttime = time.perf_counter()
+    lis = scorefunction(aligns, "targetstart", "targetend", maxoverlap)
+    elapsed = time.perf_counter() - starttime
+
+    return [lis, elapsed]
+
+def main()->int:
+
+    maxexponent = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    maxpairwiseexponent = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rng = random.Random(1)
+    print("numaligns\tsweepseconds\tpairwiseseconds\tfilterseconds\tnumfiltered")
+    for exponent in range(3, maxexponent + 1):
+        aligns = simulate_aligns(10**exponent, rng)
+        for align in aligns:
+            align["querylow"] = min(align["querystart"], align["queryend"])
+            align["queryhigh"] = max(align["querystart"], align["queryend"])
+        sortedaligns = sorted(aligns, key=lambda align: align["targetstart"])
+        [sweeplis, sweepseconds] = time_scoring(mummermethods.score_lis_sweep, sortedaligns, 0.95)
+        pairwiseseconds = "NA"
+        if exponent <= maxpairwiseexponent:
+            [pairwiselis, pairwiseseconds] = time_scoring(mummermethods.score_lis_pairwise, sortedaligns, 0.95)
+            if pairwiselis != sweeplis:
+                print("Sweep and pairwise scores differ for " + str(10**exponent) + " alignments!")
+                return 1
+            pairwiseseconds = "%.3f" % pairwiseseconds
+
+        starttime = time.perf_counter()
+        filteredaligns = mummermethods.filter_aligns(aligns, "target")
+        filterseconds = time.perf_counter() - starttime
+        print(str(10**exponent) + "\t" + "%.3f" % sweepseconds + "\t" + pairwiseseconds + "\t" + "%.3f" % filterseconds + "\t" + str(len(filteredaligns)))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
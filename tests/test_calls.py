@@ -2,13 +2,29 @@ import pytest
 import subprocess
 import sys
 import os
+import random
+import pickle
+import shutil
+import argparse
+import filecmp
 import pysam
+import pybedtools
+import numpy as np
 from GQC import bench
 from GQC import output
 from GQC import seqparse
 from GQC import alignparse
 from GQC import mummermethods
 from GQC import bedtoolslib
+from GQC import pipeline
+from GQC import phasing
+from GQC import intervals
+from GQC import kmers
+from GQC import hetstore
+from GQC import coverage
+from GQC import errors
+from GQC import readpass
+from GQC import telemetry
 
 def test_configs():
     args = bench.parse_arguments(['-c', 'tests/testconfig.txt', '-b', 'blah', '-r', 'blah', '-q', 'blah', '-p', 'blah'])
@@ -47,3 +63,725 @@ def test_writebedfiles():
 
     assert(len(aligndata) == 1)
 
+
+def test_benchmarksequences():
+    args = bench.parse_arguments(['-c', 'tests/testconfig.txt', '-b', 'tests/test.sort.bam', '-r', 'tests/testbenchmark.fasta.gz', '-q', 'tests/testassembly.fasta.gz', '-p', 'tests/testrun'])
+    refobj = pysam.FastaFile(args.reffasta)
+    assert(bench.select_benchmark_sequences(refobj, args) is None)
+    args.chromosomes = refobj.references[0]
+    assert(bench.select_benchmark_sequences(refobj, args) == [refobj.references[0]])
+
+    alignobj = pysam.AlignmentFile(args.bam, "rb")
+    assert(len(alignparse.read_bam_aligns(alignobj, args.minalignlength, [refobj.references[0]])) == 1)
+    assert(len(alignparse.read_bam_aligns(alignobj, args.minalignlength, [])) == 0)
+
+def test_pipelinesteps():
+    def record_step(rundata, name):
+        for required in rundata["requires"][name]:
+            assert(required in rundata["finished"])
+        rundata["finished"].append(name)
+
+    rundata = {"finished": [], "requires": {"a": [], "b": [], "c": ["a", "b"], "d": ["c"], "e": ["a"]}}
+    steps = [pipeline.define_step(name, lambda rundata, name=name: record_step(rundata, name), requires=rundata["requires"][name]) for name in ["a", "b", "c", "d", "e"]]
+    assert(pipeline.order_steps(steps) == ["a", "b", "c", "d", "e"])
+    finishedsteps = pipeline.run_steps(steps, rundata, maxparallel=3)
+    assert(sorted(finishedsteps) == ["a", "b", "c", "d", "e"])
+    assert(len(rundata["finished"]) == 5)
+    # -t is shared by the steps running at the same time:
+    assert(pipeline.share_threads(8, 1) == [1, 8])
+    assert(pipeline.share_threads(8, 3) == [3, 2])
+    assert(pipeline.share_threads(2, 4) == [2, 1])
+
+def test_workertelemetry():
+    # worker pool tasks report their CPU time and memory to the step that submitted them:
+    record = telemetry.start_step("workertest")
+    with pipeline.worker_pool(2) as executor:
+        sumfutures = [executor.submit(sum, range(2000000)) for task in range(4)]
+        assert([sumfuture.result() for sumfuture in sumfutures] == [sum(range(2000000))] * 4)
+        with pytest.raises(ValueError):
+            executor.submit(int, "notanumber").result()
+    record = telemetry.finish_step(record)
+    assert(record["workertasks"] == 4)
+    assert(record["workercputime"] > 0)
+    assert(record["workerpeakrss"] > 0)
+    assert(telemetry.active_step() is None)
+
+def test_manifest():
+    outputdir = output.create_output_directory('tests/testrun')
+    manifestfile = outputdir + '/test.manifest.json'
+    outputfile = outputdir + '/manifesttest.txt'
+    for filename in [manifestfile, outputfile]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    manifest = pipeline.read_manifest(manifestfile)
+    assert(pipeline.needs_update(manifest, 'manifesttest', [outputfile], ['tests/testconfig.txt'], {'minalignlength': 500}))
+    with open(outputfile, 'w') as ofh:
+        ofh.write('test\n')
+    pipeline.record_outputs(manifest, 'manifesttest', [outputfile])
+
+    manifest = pipeline.read_manifest(manifestfile)
+    assert(not pipeline.needs_update(manifest, 'manifesttest', [outputfile], ['tests/testconfig.txt'], {'minalignlength': 500}))
+    # a changed parameter invalidates (and removes) the earlier output:
+    assert(pipeline.needs_update(manifest, 'manifesttest', [outputfile], ['tests/testconfig.txt'], {'minalignlength': 1000}))
+    assert(not os.path.exists(outputfile))
+    # signatures depend on the version of a step, not on the rest of the package's code:
+    assert(pipeline.make_signature(manifest, ['tests/testconfig.txt'], {}, [], 1) == pipeline.make_signature(manifest, ['tests/testconfig.txt'], {}, [], 1))
+    assert(pipeline.make_signature(manifest, ['tests/testconfig.txt'], {}, [], 1) != pipeline.make_signature(manifest, ['tests/testconfig.txt'], {}, [], 2))
+    # outputs without an entry are only adopted when there was no manifest before the run:
+    with open(outputfile, 'w') as ofh:
+        ofh.write('partial\n')
+    assert(pipeline.needs_update(pipeline.read_manifest(manifestfile), 'unrecorded', [outputfile], ['tests/testconfig.txt']))
+    assert(not os.path.exists(outputfile))
+    with open(outputfile, 'w') as ofh:
+        ofh.write('test\n')
+    os.remove(manifestfile)
+    assert(not pipeline.needs_update(pipeline.read_manifest(manifestfile), 'unrecorded', [outputfile], ['tests/testconfig.txt']))
+    os.remove(outputfile)
+
+def test_variantengines():
+    refobj = pysam.FastaFile('tests/testbenchmark.fasta.gz')
+    queryobj = pysam.FastaFile('tests/testassembly.fasta.gz')
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    aligns = list(alignobj.fetch())
+
+    # simulate a read with SNVs, Ns, insertions, deletions and quality scores from the benchmark sequence:
+    rng = random.Random(11)
+    ref = alignobj.references[0]
+    refseq = refobj.fetch(reference=ref, start=1000, end=4000).upper()
+    readseq = ""
+    cigarops = []
+    refpos = 0
+    while refpos < len(refseq):
+        draw = rng.random()
+        if draw < 0.01 and refpos > 0:
+            dellength = rng.randint(1, 5)
+            cigarops.append((2, dellength))
+            refpos = refpos + dellength
+            continue
+        elif draw < 0.02 and refpos > 0:
+            insertion = "".join(rng.choice("ACGT") for i in range(rng.randint(1, 5)))
+            readseq = readseq + insertion
+            cigarops.append((1, len(insertion)))
+        if draw > 0.97:
+            readseq = readseq + rng.choice([base for base in "ACGTN" if base != refseq[refpos]])
+        else:
+            readseq = readseq + refseq[refpos]
+        cigarops.append((0, 1))
+        refpos = refpos + 1
+    mergedops = []
+    for cigarop in cigarops:
+        if len(mergedops) > 0 and mergedops[-1][0] == cigarop[0]:
+            mergedops[-1] = (cigarop[0], mergedops[-1][1] + cigarop[1])
+        else:
+            mergedops.append(cigarop)
+    for reverse in [False, True]:
+        read = pysam.AlignedSegment(alignobj.header)
+        read.query_name = "simulatedread"
+        read.reference_id = 0
+        read.reference_start = 1000
+        read.mapping_quality = 60
+        read.is_reverse = reverse
+        read.query_sequence = readseq
+        read.query_qualities = pysam.qualitystring_to_array("".join(chr(33 + rng.randint(0, 60)) for i in range(len(readseq))))
+        read.cigartuples = mergedops
+        aligns.append(read)
+
+    hetsites = {ref: [alignparse.varianttuple(chrom=ref, start=hetpos, end=hetpos+1, name="het_" + str(hetpos+1) + "_" + refobj.fetch(reference=ref, start=hetpos, end=hetpos+1).upper() + "_A_1", vartype='SNV', excluded=False, qvscore=None) for hetpos in range(1100, 3900, 97)]}
+
+    for align in aligns:
+        query, querystart, queryend, ref, refstart, refend, strand = alignparse.retrieve_align_data(align)
+        alignqueryobj = queryobj if align.query_name != "simulatedread" else None
+        results = {}
+        for engine in ["python", "numpy"]:
+            hetsitealleles = {}
+            scorecounts = [[], [], []]
+            variants = alignparse.align_variants(align, alignqueryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, scorecounts[0], scorecounts[1], scorecounts[2], True, engine)
+            results[engine] = [variants, hetsitealleles, scorecounts]
+        assert(results["numpy"] == results["python"])
+
+        # finding the hets within the alignment by bisection should give the same het alleles:
+        hetsitealleles = {}
+        alignparse.align_variants(align, alignqueryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, hetsites, hetsitealleles, [], [], [], True, "numpy", phasing.index_hetsite_starts(hetsites))
+        assert(hetsitealleles == results["python"][1])
+        if align.query_name == "simulatedread":
+            assert(len([variant for variant in results["numpy"][0] if variant.vartype == 'SNV']) > 0)
+            assert(len(results["numpy"][1]) > 0)
+
+def test_cigarblockmap():
+    # soft clip, match, deletion, match, insertion, match, ref skip, match, soft clip:
+    alignops = [(4, 3), (0, 5), (2, 2), (0, 4), (1, 3), (0, 2), (3, 4), (0, 1), (4, 2)]
+    blockmap = alignparse.build_cigar_blockmap(alignops)
+    assert(blockmap['reflength'] == 18)
+    assert(blockmap['querylength'] == 15)
+
+    # query offset for every ref offset, from a base-by-base walk of the cigar:
+    query_positions = []
+    queryoffset = 0
+    for op, oplength in alignops:
+        if op in [0, 7, 8]:
+            query_positions.extend(range(queryoffset, queryoffset + oplength))
+        elif op in [2, 3]:
+            query_positions.extend([queryoffset] * oplength)
+        if op in [0, 1, 7, 8]:
+            queryoffset = queryoffset + oplength
+    assert([alignparse.blockmap_query_offset(blockmap, refoffset) for refoffset in range(18)] == query_positions)
+
+    assert(alignparse.blockmap_query_opindex(blockmap, 0) == 1)
+    assert(alignparse.blockmap_query_opindex(blockmap, 10) == 4)
+    assert(alignparse.blockmap_query_opindex(blockmap, 15) is None)
+
+def test_windowedsequence():
+    refobj = pysam.FastaFile('tests/testbenchmark.fasta.gz')
+    ref = refobj.references[0]
+    rng = random.Random(7)
+    for revcompseq in [False, True]:
+        wholeseq = refobj.fetch(reference=ref, start=100, end=5100).upper()
+        if revcompseq:
+            wholeseq = seqparse.revcomp(wholeseq)
+        windowedseq = seqparse.WindowedSequence(refobj, ref, 100, 5100, 300, revcompseq)
+        assert(len(windowedseq) == len(wholeseq))
+        for i in range(200):
+            offset = rng.randint(-len(wholeseq), len(wholeseq) - 1)
+            assert(windowedseq[offset] == wholeseq[offset])
+            startoffset = rng.randint(-10, len(wholeseq) + 10)
+            endoffset = startoffset + rng.randint(-5, 700)
+            assert(windowedseq[startoffset:endoffset] == wholeseq[startoffset:endoffset])
+
+    # variants found while reading sequence in windows should be the same as with whole sequences:
+    queryobj = pysam.FastaFile('tests/testassembly.fasta.gz')
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    for align in alignobj.fetch():
+        query, querystart, queryend, ref, refstart, refend, strand = alignparse.retrieve_align_data(align)
+        for engine in ["python", "numpy"]:
+            wholevariants = alignparse.align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, {}, {}, [], [], [], True, engine)
+            windowedvariants = alignparse.align_variants(align, queryobj, query, querystart, queryend, refobj, ref, refstart, refend, strand, {}, {}, [], [], [], True, engine, {}, 250)
+            assert(windowedvariants == wholevariants)
+
+def test_collectaligndatabycontig():
+    refobj = pysam.FastaFile('tests/testbenchmark.fasta.gz')
+    queryobj = pysam.FastaFile('tests/testassembly.fasta.gz')
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    ref = alignobj.references[0]
+    hetsites = {ref: [alignparse.varianttuple(chrom=ref, start=hetpos, end=hetpos+1, name="het_" + str(hetpos+1) + "_A_G_1", vartype='SNV', excluded=False, qvscore=None) for hetpos in range(500, 9500, 250)]}
+    hetstarts = phasing.index_hetsite_starts(hetsites)
+    excludedbedobj = pybedtools.BedTool(ref + "\t6000\t7000\n", from_string=True)
+
+    hetsitealleles = {}
+    scorecounts = [[], [], []]
+    [refcoveredstring, querycoveredstring, variants] = alignparse.collect_align_data(alignobj.fetch(), queryobj, refobj, hetsites, hetstarts, hetsitealleles, scorecounts[0], scorecounts[1], scorecounts[2], 500)
+    variants = alignparse.exclude_variants(variants, excludedbedobj)
+    assert(len([variant for variant in variants if variant.excluded]) > 0)
+
+    contigresults = alignparse.collect_align_data_by_contig(alignobj, refobj, queryobj, hetsites, hetstarts, excludedbedobj, 2, 500)
+    assert(contigresults == [refcoveredstring, querycoveredstring, variants, hetsitealleles] + scorecounts)
+
+def test_alignoffsetindex():
+    args = bench.parse_arguments(['-c', 'tests/testconfig.txt', '-b', 'tests/test.sort.bam', '-r', 'tests/testbenchmark.fasta.gz', '-q', 'tests/testassembly.fasta.gz', '-p', 'tests/testrun'])
+    [alignindex, alignintervals] = alignparse.index_aligns_by_boundaries(args.bam, args)
+    align = next(pysam.AlignmentFile(args.bam, "rb").fetch())
+    assert(len(alignindex) == intervals.count_intervals(alignintervals) == 1)
+    alignname = alignintervals[align.query_name]['names'][0]
+    assert(alignindex[alignname].to_string() == align.to_string())
+
+    phaseblockints = intervals.create_intervals([align.query_name], [2000], [5000], ["mat"])
+    subaligns = alignparse.find_phaseblock_subaligns(phaseblockints, alignintervals, alignindex)
+    assert(len(subaligns) == 1)
+    assert(alignparse.count_consumed_query(subaligns[0].cigartuples) == len(align.query_sequence))
+
+def test_intervals():
+    intervalset1 = intervals.create_intervals(["chr1", "chr1", "chr1", "chr2"], [100, 50, 180, 10], [200, 120, 300, 20], ["a", "b", "c", "d"])
+    intervalset2 = intervals.create_intervals(["chr1", "chr1", "chr3"], [150, 400, 0], [160, 500, 10], ["x", "y", "z"])
+    assert(intervals.count_intervals(intervalset1) == 4)
+    assert(intervals.sum_intervals(intervalset1) == 70 + 100 + 120 + 10)
+
+    mergedintervals = intervals.merge_intervals(intervalset1)
+    assert(mergedintervals["chr1"]["starts"].tolist() == [50])
+    assert(mergedintervals["chr1"]["ends"].tolist() == [300])
+    assert(mergedintervals["chr1"]["names"] == ["b|a|c"])
+    assert(intervals.sum_intervals(mergedintervals) == 260)
+
+    overlaps = intervals.intersect_intervals(intervalset1, intervalset2, mode="wo")
+    assert([(overlap.name, overlap.othername, overlap.overlap) for overlap in overlaps] == [("a", "x", 10)])
+    overlapping = intervals.intersect_intervals(intervalset1, intervalset2, mode="u")
+    assert(overlapping["chr1"]["names"] == ["a"])
+    nonoverlapping = intervals.intersect_intervals(intervalset1, intervalset2, mode="v")
+    assert(nonoverlapping["chr1"]["names"] == ["b", "c"] and nonoverlapping["chr2"]["names"] == ["d"])
+
+    subtracted = intervals.subtract_intervals(mergedintervals, intervalset2)
+    assert(subtracted["chr1"]["starts"].tolist() == [50, 160])
+    assert(subtracted["chr1"]["ends"].tolist() == [150, 300])
+
+    complement = intervals.complement_intervals(mergedintervals, {"chr1": 1000, "chr2": 30, "chr3": 50})
+    assert(complement["chr1"]["starts"].tolist() == [0, 300] and complement["chr1"]["ends"].tolist() == [50, 1000])
+    assert(complement["chr3"]["starts"].tolist() == [0] and complement["chr3"]["ends"].tolist() == [50])
+
+    # zero-length intervals overlap the bases on either side of them, as in bedtools:
+    insertions = intervals.create_intervals(["chr1", "chr1"], [300, 310], [300, 310], ["ins1", "ins2"])
+    assert(intervals.intersect_intervals(insertions, mergedintervals, mode="u")["chr1"]["names"] == ["ins1"])
+
+    # overlapping pairs, with a few long intervals among short ones, are those of a comparison of every pair:
+    rng = random.Random(4)
+    for trial in range(50):
+        starts = [rng.randint(0, 5000) for i in range(60)]
+        lengths = [rng.choice([0, 1, 5, 20, 100, 4000]) for i in range(60)]
+        otherset = intervals.create_intervals(["chr1"] * 60, starts, [start + length for start, length in zip(starts, lengths)], ["o" + str(i) for i in range(60)])
+        teststarts = [rng.randint(0, 5000) for i in range(30)]
+        testset = intervals.create_intervals(["chr1"] * 30, teststarts, [start + rng.choice([0, 3, 50]) for start in teststarts], ["t" + str(i) for i in range(30)])
+        [otherstarts, otherends] = intervals.overlap_bounds(otherset["chr1"]["starts"], otherset["chr1"]["ends"])
+        otherbounds = sorted(zip(otherstarts.tolist(), otherends.tolist(), otherset["chr1"]["names"]), key=lambda otherbound: otherbound[0])
+        [teststarts, testends] = intervals.overlap_bounds(testset["chr1"]["starts"], testset["chr1"]["ends"])
+        expected = [(testname, othername) for [teststart, testend, testname] in zip(teststarts.tolist(), testends.tolist(), testset["chr1"]["names"]) for [otherstart, otherend, othername] in otherbounds if otherstart < testend and otherend > teststart]
+        assert([(overlap.name, overlap.othername) for overlap in intervals.intersect_intervals(testset, otherset, mode="wo")] == expected)
+
+def test_rlissweep():
+    rng = random.Random(10)
+    for trial in range(200):
+        aligns = []
+        for i in range(rng.randint(1, 50)):
+            targetstart = rng.randint(1, 500)
+            querystart = rng.randint(1, 500)
+            aligns.append({"target":"chr1", "targetstart":targetstart, "targetend":targetstart + rng.choice([9, 19, 49]), "query":"scaffold1", "querystart":querystart, "queryend":querystart + rng.choice([-49, 9, 19]), "identity":rng.choice([1.0, 0.99, 0.5])})
+        for align in aligns:
+            align["querylow"] = min(align["querystart"], align["queryend"])
+            align["queryhigh"] = max(align["querystart"], align["queryend"])
+        for lowfield, highfield in [("targetstart", "targetend"), ("querylow", "queryhigh")]:
+            sortedaligns = sorted(aligns, key=lambda align: align[lowfield])
+            for maxoverlap in [0.0, 0.5, 0.95]:
+                pairwiselis = mummermethods.score_lis_pairwise(sortedaligns, lowfield, highfield, maxoverlap)
+                sweeplis = mummermethods.score_lis_sweep(sortedaligns, lowfield, highfield, maxoverlap)
+                assert(sweeplis == pairwiselis)
+
+def test_hmmstatepath():
+    # isolated markers from the other haplotype don't switch states, but runs of them do:
+    hapindices = [0, 0, 0, 1, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0, 1, 1]
+    path = phasing.find_hmm_state_path(hapindices, 0.1, 0.01)
+    assert(path.tolist() == [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+    assert(phasing.find_hmm_state_path([1], 0.1, 0.01).tolist() == [1])
+
+    [matstring, patstring] = phasing.phase_scaffold_with_hmm("scaffold1", 1000, [0, 0, 1, 1], [100, 200, 300, 400], 0.1, 0.3, '255,0,0', '0,0,255', "mat", "pat")
+    assert(matstring == "scaffold1\t0\t150\tmat\t0\t+\t0\t150\t255,0,0\nscaffold1\t150\t250\tmat\t0\t+\t150\t250\t255,0,0\n")
+    assert(patstring == "scaffold1\t250\t350\tpat\t0\t+\t250\t350\t0,0,255\nscaffold1\t350\t1000\tpat\t0\t+\t350\t1000\t0,0,255\n")
+
+def test_mergesortedbedfiles():
+    matbed = 'tests/testrun/KmerMap.mat.test.kmers.merge.bed'
+    patbed = 'tests/testrun/KmerMap.pat.test.kmers.merge.bed'
+    mergedbed = 'tests/testrun/test.hapmers.bed'
+    with open(matbed, 'w') as mfh:
+        mfh.write("0\t100\t140\tmat\n0\t300\t340\tmat\n2\t50\t90\tmat\n10\t5\t45\tmat\n")
+    with open(patbed, 'w') as pfh:
+        pfh.write("0\t100\t140\tpat\n1\t20\t60\tpat\n2\t50\t80\tpat\n")
+    expectedlines = ["0\t100\t140\tmat\n", "0\t100\t140\tpat\n", "0\t300\t340\tmat\n", "1\t20\t60\tpat\n", "2\t50\t80\tpat\n", "2\t50\t90\tmat\n", "10\t5\t45\tmat\n"]
+
+    kmers.merge_sorted_bedfiles([matbed, patbed], mergedbed)
+    with open(mergedbed, 'r') as bfh:
+        assert(bfh.readlines() == expectedlines)
+
+    # unsorted files are sorted in memory:
+    with open(patbed, 'w') as pfh:
+        pfh.write("2\t50\t80\tpat\n0\t100\t140\tpat\n1\t20\t60\tpat")
+    kmers.merge_sorted_bedfiles([matbed, patbed], mergedbed)
+    with open(mergedbed, 'r') as bfh:
+        assert(bfh.readlines() == expectedlines)
+
+    for bedfile in [matbed, patbed, mergedbed]:
+        os.remove(bedfile)
+
+def test_hetsitestore():
+    hetbed = 'tests/testrun/hetsites.test.bed'
+    with open(hetbed, 'w') as hfh:
+        hfh.write("chr1\t500\t501\tchr1_501_A_G_1\nchr1\t100\t101\tchr1_101_C_T_2\nchr1_random\t10\t12\tchr1_random_11_AC_*_1\nchr1\t100\t103\tchr1_101_CAT_C_1\n")
+    storefile = hetstore.hetsite_store_file(hetbed)
+    assert(hetstore.compile_hetsite_store(hetbed, storefile) == 4)
+    assert(hetstore.is_hetsite_store(storefile) and not hetstore.is_hetsite_store(hetbed))
+
+    hetsites = phasing.read_hetsites(hetbed)
+    store = hetstore.load_hetsites(hetbed)
+    assert(isinstance(store, hetstore.HetSiteStore) and len(store) == len(hetsites))
+    for hetsitename in list(hetsites.keys()) + ["chr1_501_A_C", "chr1_500_A_G", "chr2_501_A_G", "chr1_random_11_A_*"]:
+        assert((hetsitename in store) == (hetsitename in hetsites))
+
+    hetarrays = phasing.sort_chrom_hetsite_arrays(hetsites)
+    storearrays = hetstore.chrom_hetsite_arrays(store)
+    for chrom in hetarrays:
+        assert(list(storearrays[chrom]) == hetarrays[chrom])
+        assert(list(phasing.index_hetsite_starts(storearrays)[chrom]) == phasing.index_hetsite_starts(hetarrays)[chrom])
+    assert(list(pickle.loads(pickle.dumps(storearrays["chr1"]))) == hetarrays["chr1"])
+
+    os.remove(hetbed)
+    os.remove(storefile)
+
+def test_binmeandepths():
+    # reads covering [2, 9) and [5, 7) (the last position of each read gets the end tally):
+    startendarray = np.zeros(12, dtype=np.int32)
+    startendarray[[2, 5]] += 1
+    startendarray[[9, 7]] -= 1
+    assert(coverage.bin_mean_depths(startendarray, 4) == [0.5, 1.5, 0.25])
+    assert(startendarray.tolist() == [0, 0, 1, 1, 1, 2, 2, 1, 1, 0, 0, 0])
+
+def test_gcextremekmercounts():
+    # two bins of 8 bases with 3-mers (the last kmer of each bin isn't counted, nor are kmers with Ns):
+    seqcodes = np.frombuffer(b"AATTGGCCAGNTACGT", dtype=np.uint8)
+    bincounts = coverage.gccontent_extreme_kmer_counts(seqcodes, 8, 3)
+    assert(bincounts.tolist() == [[2, 0, 2, 1, 4, 4], [0, 0, 0, 0, 3, 5]])
+    assert(coverage.gccontent_extreme_kmer_counts(seqcodes, 8, 8).tolist() == [[0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0]])
+    # tracks are cached in the output directory unless a shared directory is given:
+    assert(coverage.benchmark_track_directory(argparse.Namespace(prefix='tests/testrun', trackdir=None)) == 'tests/testrun')
+    assert(coverage.benchmark_track_directory(argparse.Namespace(prefix='tests/testrun', trackdir='tests/tracks')) == 'tests/tracks')
+
+def test_chrombinreadcounts():
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    chrom = alignobj.references[0]
+    chromlength = alignobj.get_reference_length(chrom)
+    binstarts = range(0, chromlength - 999, 1000)
+    overlapcounts = coverage.chrom_bin_read_counts('tests/test.sort.bam', chrom, chromlength, 1000, True)
+    assert(overlapcounts.tolist() == [alignobj.count(contig=chrom, start=binstart, stop=binstart + 1000) for binstart in binstarts])
+    startcounts = coverage.chrom_bin_read_counts('tests/test.sort.bam', chrom, chromlength, 1000, False)
+    assert(startcounts.tolist() == [alignobj.count(contig=chrom, start=binstart, stop=binstart + 1000, read_callback=lambda read: read.reference_start >= binstart) for binstart in binstarts])
+
+def test_smallkmerids():
+    # canonical kmers are the lower-sorting of the kmer and its reverse complement, and kmers with Ns are tallied by name:
+    seqbytes = np.frombuffer(b"ACGTTNAC", dtype=np.uint8)
+    [canonicalids, forwardids, reverseids, kmername] = coverage.small_kmer_ids(seqbytes, 3, np.arange(6))
+    assert([kmername(kmerid) for kmerid in forwardids.tolist()] == ["ACG", "CGT", "GTT", "TTN", "TNA", "NAC"])
+    assert([kmername(kmerid) for kmerid in reverseids.tolist()] == ["CGT", "ACG", "AAC", "NAA", "TNA", "GTN"])
+    assert([kmername(kmerid) for kmerid in canonicalids.tolist()] == ["ACG", "ACG", "AAC", "NAA", "TNA", "GTN"])
+    kmercounts = {"GTN": 2}
+    coverage.add_kmer_id_counts(kmercounts, canonicalids, kmername)
+    assert(list(kmercounts.items()) == [("GTN", 3), ("ACG", 2), ("AAC", 1), ("NAA", 1), ("TNA", 1)])
+
+def test_binsizeestimate():
+    assert(coverage.sample_region_windows([['chr1', 0, 100], ['chr2', 50, 350]], 4, 10) == [['chr1', 50, 60], ['chr2', 100, 110], ['chr2', 200, 210], ['chr2', 300, 310]])
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    chrom = alignobj.references[0]
+    regions = [[chrom, 0, alignobj.get_reference_length(chrom)]]
+    assert(coverage.index_region_arrivals(alignobj, regions, False) == coverage.count_region_arrivals(alignobj, regions, False))
+    # unmapped reads placed on a chromosome aren't read arrivals:
+    testbam = 'tests/testrun/binsizeestimate.bam'
+    with pysam.AlignmentFile(testbam, "wb", template=alignobj) as bfh:
+        for align in alignobj.fetch():
+            bfh.write(align)
+            unmappedalign = pysam.AlignedSegment.from_dict(align.to_dict(), bfh.header)
+            unmappedalign.query_name = "unmapped"
+            unmappedalign.is_unmapped = True
+            bfh.write(unmappedalign)
+    pysam.index(testbam)
+    assert(coverage.index_region_arrivals(pysam.AlignmentFile(testbam, "rb"), regions, False) == coverage.index_region_arrivals(alignobj, regions, False))
+    os.remove(testbam)
+    os.remove(testbam + '.bai')
+
+def test_findreadposincigar():
+    align = pysam.AlignedSegment()
+    align.reference_start = 100
+    align.cigartuples = [(4, 3), (0, 5), (1, 2), (0, 4), (2, 3), (0, 6), (4, 2)]
+    align.query_sequence = "A" * 22
+    alignedpairs = dict([(refpos, readpos) for readpos, refpos in align.get_aligned_pairs() if refpos is not None])
+    for refpos in range(95, 125):
+        assert(errors.find_readpos_in_cigar(align.cigartuples, align.reference_start, refpos) == alignedpairs.get(refpos))
+
+def test_tilelocusreads():
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    chrom = alignobj.references[0]
+    loci = [[chrom, start, start + 20] for start in range(0, alignobj.get_reference_length(chrom) - 20, 250)]
+    locusreads = errors.tile_locus_reads(alignobj, chrom, loci)
+    for locusindex, [chrom, start, end] in enumerate(loci):
+        assert([align.query_name for align in locusreads[locusindex]] == [align.query_name for align in alignobj.fetch(contig=chrom, start=start, stop=end)])
+
+def test_mergestrtallies():
+    strdict = {10: {10: {"CORRECT": 3}, 11: {"HET": 1}}}
+    errors.merge_str_tallies(strdict, {10: {10: {"CORRECT": 2, "FLANKERROR": 1}}, 12: {}})
+    assert(strdict == {10: {10: {"CORRECT": 5, "FLANKERROR": 1}, 11: {"HET": 1}}, 12: {}})
+
+def test_mergereaderrorstats():
+    stats = errors.new_read_error_stats()
+    otherstats = errors.new_read_error_stats()
+    errors.extend_position_counts(stats, 3)
+    errors.extend_position_counts(otherstats, 5)
+    stats["positiontotalcounts"][2, 4] = 2
+    otherstats["positiontotalcounts"][4, 4] = 1
+    otherstats["positionerrorcounts"][4, errors.READERRORTYPES.index("A_G"), errors.read_error_qual_bin(42)] = 1
+    otherstats["totalerrorsinaligns"] = 1
+    otherstats["singlebasecounts"] = {"A_G": 1}
+    errors.merge_read_error_stats(stats, otherstats)
+    assert(stats["totalerrorsinaligns"] == 1 and stats["singlebasecounts"] == {"A_G": 1})
+    assert(errors.trim_position_counts(stats["positiontotalcounts"])[:, 4].tolist() == [0, 0, 2, 0, 1])
+    assert(stats["positionerrorcounts"][4, errors.READERRORTYPES.index("A_G"), 4] == 1)
+
+def test_readpassoverlaps():
+    # the second interval overlaps the third, and reaches past the start of the fourth:
+    overlapindex = readpass.OverlapIndex([[10, 20], [30, 80], [40, 50], [60, 70], [90, 95]])
+    assert(overlapindex.overlapping(0, 10) == [])
+    assert(overlapindex.overlapping(15, 35) == [0, 1])
+    assert(overlapindex.overlapping(55, 60) == [1])
+    assert(overlapindex.overlapping(65, 100) == [1, 3, 4])
+    # depth totals of windows sum to the bin depths of the whole chromosome:
+    startendarray = np.zeros(12, dtype=np.int32)
+    startendarray[[2, 5]] += 1
+    startendarray[[9, 7]] -= 1
+    windowtotals = coverage.bin_depth_totals(np.array([2]), np.array([9]), 3, 4) + coverage.bin_depth_totals(np.array([5]), np.array([7]), 3, 4)
+    assert((windowtotals / 4).tolist() == coverage.bin_mean_depths(startendarray, 4))
+
+def test_readpasswindows():
+    alignobj = pysam.AlignmentFile('tests/test.sort.bam', "rb")
+    chrom = alignobj.references[0]
+    chromlength = alignobj.get_reference_length(chrom)
+    assert(readpass.read_pass_windows(alignobj) == [[chrom, 0, chromlength]])
+    # overlapping regions are merged, and regions of other chromosomes ignored:
+    regions = [[chrom, 2000, None], [chrom, 400, 900], [chrom, 100, 500], ["chrUn", 0, None]]
+    assert(readpass.read_pass_windows(alignobj, regions) == [[chrom, 100, 900], [chrom, 2000, chromlength]])
+    assert(readpass.shard_windows(list(range(7)), 2, 3) == [1, 4])
+
+# writes a benchmark of three chromosomes and a bam file of reads aligned to it with mismatches, indels and clipping:
+def write_readpass_test_data(testdir:str, numreads:int, seed:int):
+    rng = random.Random(seed)
+    chromseqs = {}
+    with open(testdir + "/bench.fa", "w") as ffh:
+        for chromindex in range(3):
+            chromseq = [rng.choice("ACGT") for base in range(rng.randint(15000, 25000))]
+            # a few STRs for the STR analysis:
+            for strindex in range(30):
+                strstart = rng.randint(100, len(chromseq) - 200)
+                strseq = rng.choice(["A", "AC", "GATA"]) * rng.randint(3, 8)
+                chromseq[strstart:strstart + len(strseq)] = list(strseq)
+            chromseqs["chr" + str(chromindex)] = "".join(chromseq)
+            ffh.write(">chr" + str(chromindex) + "\n" + chromseqs["chr" + str(chromindex)] + "\n")
+    pysam.faidx(testdir + "/bench.fa")
+
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"}, "SQ": [{"SN": chrom, "LN": len(chromseqs[chrom])} for chrom in chromseqs]}
+    aligns = []
+    for readindex in range(numreads):
+        chromindex = rng.randrange(3)
+        chromseq = chromseqs["chr" + str(chromindex)]
+        readstart = rng.randint(0, len(chromseq) - 3200)
+        cigartuples = [(4, 5)]
+        readseq = "ACGTA"
+        refpos = readstart
+        while refpos < readstart + rng.randint(50, 3000):
+            blocklength = rng.randint(10, 80)
+            blockseq = [base if rng.random() > 0.01 else rng.choice([other for other in "ACGT" if other != base]) for base in chromseq[refpos:refpos + blocklength]]
+            cigartuples.append((0, blocklength))
+            readseq = readseq + "".join(blockseq)
+            refpos = refpos + blocklength
+            if rng.random() < 0.1:
+                indellength = rng.randint(1, 3)
+                if rng.random() < 0.5:
+                    cigartuples.append((1, indellength))
+                    readseq = readseq + "ACG"[:indellength]
+                else:
+                    cigartuples.append((2, indellength))
+                    refpos = refpos + indellength
+        if cigartuples[-1][0] != 0:
+            cigartuples.append((0, 5))
+            readseq = readseq + chromseq[refpos:refpos + 5]
+        align = pysam.AlignedSegment()
+        align.query_name = "read" + str(readindex)
+        align.reference_id = chromindex
+        align.reference_start = readstart
+        align.cigartuples = cigartuples
+        align.query_sequence = readseq
+        align.query_qualities = pysam.qualitystring_to_array("".join([chr(33 + rng.randint(2, 60)) for base in readseq]))
+        align.mapping_quality = 60
+        align.is_reverse = rng.random() < 0.5
+        aligns.append(align)
+    with pysam.AlignmentFile(testdir + "/reads.bam", "wb", header=header) as bfh:
+        for align in sorted(aligns, key=lambda align: (align.reference_id, align.reference_start)):
+            bfh.write(align)
+    pysam.index(testdir + "/reads.bam")
+
+    # benchmark intervals that reads often span more than one of:
+    bedlines = []
+    for chrom in chromseqs:
+        intervalend = 0
+        while intervalend < len(chromseqs[chrom]) - 3000:
+            intervalstart = intervalend + rng.randint(50, 1000)
+            intervalend = intervalstart + rng.randint(300, 2500)
+            bedlines.append(chrom + "\t" + str(intervalstart) + "\t" + str(intervalend) + "\n")
+    with open(testdir + "/intervals.bed", "w") as ifh:
+        ifh.writelines(bedlines)
+    strlines = []
+    for chrom in chromseqs:
+        for strunit in ["A", "AC", "GATA"]:
+            strstart = chromseqs[chrom].find(strunit * 3)
+            while strstart >= 0:
+                strend = strstart + len(strunit) * 3
+                while chromseqs[chrom][strend:strend + len(strunit)] == strunit:
+                    strend = strend + len(strunit)
+                strlines.append([chrom, strstart, strend, "str_" + strunit])
+                strstart = chromseqs[chrom].find(strunit * 3, strend)
+    with open(testdir + "/strs.bed", "w") as sfh:
+        for [chrom, strstart, strend, strname] in sorted(strlines, key=lambda strline: (strline[0], strline[1], strline[2])):
+            sfh.write(chrom + "\t" + str(strstart) + "\t" + str(strend) + "\t" + strname + "\n")
+
+def run_readpass_test_analyses(testdir:str, outputdir:str, readpassmode:str, numworkers:int, analyses:list, downsample=None)->list:
+    os.makedirs(outputdir, exist_ok=True)
+    alignobj = pysam.AlignmentFile(testdir + "/reads.bam", "rb")
+    refobj = pysam.FastaFile(testdir + "/bench.fa")
+    bedintervals = pybedtools.BedTool(testdir + "/intervals.bed")
+    args = argparse.Namespace(covbinsize=500, t=numworkers, bincovoverlap=False, trackdir=testdir, prefix=outputdir, covkmersize=3, minreadalignedpercentage=90, downsample=downsample, maxstrreads=500, strfetch='tiled', errorfile='', rerun=False, variantengine='numpy', binsizemethod='index', binsizesamples=0, region=None, shard=None)
+    for analysis in readpass.READPASSANALYSES:
+        setattr(args, analysis, analysis in analyses)
+    outputfiles = {"includedstrprefix": outputdir + "/included", "strstatsprefix": outputdir + "/strstats", "readerrorfile": outputdir + "/readerrors.txt"}
+    strclasses = [["strs", testdir + "/strs.bed"]]
+
+    passresults = readpass.run_read_pass(alignobj, refobj, bedintervals, {}, strclasses, outputfiles, args) if readpassmode == "single" else {}
+    results = []
+    if "bincoverage" in analyses:
+        coverage.tally_bin_coverages(alignobj, refobj, bedintervals, outputdir + "/included.bed", outputdir + "/bincoverage.bed", outputdir + "/includedbincoverage.bed", args, passresults.get("bincoverage"))
+    if "arrivalratecoverage" in analyses:
+        coverage.tally_included_bin_arrival_rates(alignobj, refobj, bedintervals, outputdir + "/arrivalrates.bed", args, passresults.get("arrivalratecoverage"))
+    if "kmercoverage" in analyses:
+        coverage.compare_read_kmers_to_benchmark_kmers(alignobj, refobj, bedintervals, outputdir + "/benchkmers.txt", outputdir + "/readkmers.txt", outputdir + "/strandkmers.txt", {}, args, passresults.get("kmercoverage"))
+    if "strs" in analyses:
+        results.append(errors.assess_str_classes_read_coverage_require_flank(strclasses, alignobj, refobj, outputfiles, bedintervals, {}, args, passresults.get("strs")))
+    if "baseerrors" in analyses:
+        errorstats = errors.assess_read_align_errors(alignobj, refobj, outputfiles["readerrorfile"], bedintervals, {}, args, passresults.get("baseerrors"))
+        results.append([errorstats[countkey] for countkey in ["totalalignedbases", "totalclippedbases", "totalerrorsinaligns", "singlebasecounts", "indellengthcounts"]])
+
+    return results
+
+def test_readpassmodes():
+    testdir = "tests/testrun/readpassmodes"
+    if os.path.exists(testdir):
+        shutil.rmtree(testdir)
+    os.makedirs(testdir)
+    write_readpass_test_data(testdir, 400, 7)
+    # the coverage and STR analyses use bedtools:
+    analyses = ["kmercoverage", "baseerrors"]
+    if shutil.which("bedtools") is not None:
+        analyses = analyses + ["bincoverage", "arrivalratecoverage", "strs"]
+
+    windowsize = readpass.READPASSWINDOWSIZE
+    try:
+        # windows smaller than the chromosomes, so that reads reach intervals of more than one window:
+        readpass.READPASSWINDOWSIZE = 4000
+        separateresults = run_readpass_test_analyses(testdir, testdir + "/separate", "separate", 1, analyses)
+        for numworkers in [1, 3]:
+            singledir = testdir + "/single" + str(numworkers)
+            assert(run_readpass_test_analyses(testdir, singledir, "single", numworkers, analyses) == separateresults)
+            for outputfile in sorted(os.listdir(testdir + "/separate")):
+                assert(filecmp.cmp(testdir + "/separate/" + outputfile, singledir + "/" + outputfile, shallow=False))
+            assert(sorted(os.listdir(singledir)) == sorted(os.listdir(testdir + "/separate")))
+    finally:
+        readpass.READPASSWINDOWSIZE = windowsize
+    shutil.rmtree(testdir)
+
+def test_readpassdownsample():
+    testdir = "tests/testrun/readpassdownsample"
+    if os.path.exists(testdir):
+        shutil.rmtree(testdir)
+    os.makedirs(testdir)
+    write_readpass_test_data(testdir, 400, 11)
+    analyses = ["kmercoverage", "baseerrors"]
+
+    windowsize = readpass.READPASSWINDOWSIZE
+    try:
+        readpass.READPASSWINDOWSIZE = 4000
+        # the reads left out by --downsample don't depend on whether windows are streamed in worker processes:
+        random.seed(1)
+        serialresults = run_readpass_test_analyses(testdir, testdir + "/single1", "single", 1, analyses, 0.5)
+        random.seed(2)
+        workerresults = run_readpass_test_analyses(testdir, testdir + "/single3", "single", 3, analyses, 0.5)
+        fullresults = run_readpass_test_analyses(testdir, testdir + "/full", "single", 1, analyses)
+        assert(serialresults == workerresults)
+        assert(serialresults != fullresults)
+        for outputfile in sorted(os.listdir(testdir + "/single1")):
+            assert(filecmp.cmp(testdir + "/single1/" + outputfile, testdir + "/single3/" + outputfile, shallow=False))
+        # nor on which other analyses are run:
+        assert(run_readpass_test_analyses(testdir, testdir + "/baseerrors", "single", 1, ["baseerrors"], 0.5) == serialresults)
+        assert(filecmp.cmp(testdir + "/single1/readerrors.txt", testdir + "/baseerrors/readerrors.txt", shallow=False))
+    finally:
+        readpass.READPASSWINDOWSIZE = windowsize
+    shutil.rmtree(testdir)
+
+def test_mergebenchresults():
+    testdir = "tests/testrun/benchmerge"
+    if os.path.exists(testdir):
+        shutil.rmtree(testdir)
+    os.makedirs(testdir)
+
+    # a benchmark of two copies of the test benchmark sequence, with the test assembly aligned to each:
+    testrefobj = pysam.FastaFile("tests/testbenchmark.fasta.gz")
+    testref = testrefobj.references[0]
+    benchsequences = ["benchA", "benchB"]
+    with open(testdir + "/bench.fa", "w") as ffh:
+        for chrom in benchsequences:
+            ffh.write(">" + chrom + "\n" + testrefobj.fetch(testref) + "\n")
+    pysam.faidx(testdir + "/bench.fa")
+    with pysam.AlignmentFile("tests/test.sort.bam", "rb") as testbam:
+        testaligns = list(testbam.fetch())
+        header = {"HD": {"VN": "1.0", "SO": "coordinate"}, "SQ": [{"SN": chrom, "LN": testbam.lengths[0]} for chrom in benchsequences]}
+    with pysam.AlignmentFile(testdir + "/bench.bam", "wb", header=header) as bfh:
+        for chrom in benchsequences:
+            for testalign in testaligns:
+                aligndict = testalign.to_dict()
+                aligndict["ref_name"] = chrom
+                bfh.write(pysam.AlignedSegment.from_dict(aligndict, bfh.header))
+    pysam.index(testdir + "/bench.bam")
+
+    def run_bench_results(runprefix:str, chromosomes=None)->dict:
+        runargs = ['-c', 'tests/testconfig.txt', '-b', testdir + '/bench.bam', '-r', testdir + '/bench.fa', '-q', 'tests/testassembly.fasta.gz', '-p', runprefix]
+        if chromosomes is not None:
+            runargs = runargs + ['--chromosomes', chromosomes]
+        args = bench.parse_arguments(runargs)
+        refobj = pysam.FastaFile(args.reffasta)
+        queryobj = pysam.FastaFile(args.queryfasta)
+        alignobj = pysam.AlignmentFile(args.bam, "rb")
+        outputfiles = output.name_output_files(args, output.create_output_directory(args.prefix))
+        benchmarksequences = bench.select_benchmark_sequences(refobj, args)
+        hetsites = dict([(chrom, [alignparse.varianttuple(chrom=chrom, start=hetpos, end=hetpos + 1, name=chrom + "_" + str(hetpos + 1) + "_A_G_1", vartype='SNV', excluded=False, qvscore=None) for hetpos in range(500, 9500, 250)]) for chrom in benchsequences])
+        excludedbedobj = pybedtools.BedTool("benchA\t6000\t7000\nbenchB\t2000\t2500\n", from_string=True)
+        bedresults = alignparse.write_bedfiles(alignobj, None, refobj, queryobj, hetsites, outputfiles["testmatcovered"], outputfiles["testpatcovered"], outputfiles["truthcovered"], outputfiles["coveredhetsitealleles"], excludedbedobj, args, benchmarksequences)
+        return {"args": args, "outputfiles": outputfiles, "benchmarksequences": benchmarksequences, "rlis_aligndata": mummermethods.filter_aligns(alignparse.read_bam_aligns(alignobj, args.minalignlength, benchmarksequences), "target"),
+            "variants": bedresults[2], "alignedscorecounts": bedresults[4], "snverrorscorecounts": bedresults[5], "indelerrorscorecounts": bedresults[6]}
+
+    fullrundata = run_bench_results(testdir + "/full")
+    runprefixes = [testdir + "/runB", testdir + "/runA"]
+    benchresults = []
+    for runprefix, chrom in zip(runprefixes, ["benchB", "benchA"]):
+        rundata = run_bench_results(runprefix, chrom)
+        bench.step_save_results(rundata)
+        benchresults.append(bench.read_bench_results(rundata["outputfiles"]["benchresultsstate"]))
+        assert(benchresults[-1]["benchmarksequences"] == [chrom])
+
+    assert(bench.check_bench_results(runprefixes, benchresults) == {"benchB": runprefixes[0], "benchA": runprefixes[1]})
+    with pytest.raises(SystemExit):
+        bench.check_bench_results(runprefixes + [testdir + "/runA"], benchresults + [benchresults[1]])
+    # runs can differ in options like the number of threads, but not in options that change their results:
+    benchresults[1]["args"]["t"] = 4
+    bench.check_bench_results(runprefixes, benchresults)
+    mismatchedresults = dict(benchresults[1])
+    mismatchedresults["args"] = dict(benchresults[1]["args"])
+    mismatchedresults["args"]["minalignlength"] = benchresults[1]["args"]["minalignlength"] + 1
+    with pytest.raises(SystemExit):
+        bench.check_bench_results(runprefixes, [benchresults[0], mismatchedresults])
+
+    mergeargs = bench.parse_arguments(['-c', 'tests/testconfig.txt', '-r', testdir + '/bench.fa', '-q', 'tests/testassembly.fasta.gz', '-p', testdir + '/merged'])
+    mergerundata = {"args": mergeargs, "outputfiles": output.name_output_files(mergeargs, output.create_output_directory(mergeargs.prefix)), "benchresults": benchresults, "manifest": {}}
+    # merging the covered bed files needs bedtools:
+    merge_covered_bedfiles = bench.merge_covered_bedfiles
+    try:
+        if shutil.which("bedtools") is None:
+            bench.merge_covered_bedfiles = lambda rundata: None
+        assert(bench.step_merge_results(mergerundata) == {"alignments": 2, "variants": len(fullrundata["variants"])})
+    finally:
+        bench.merge_covered_bedfiles = merge_covered_bedfiles
+    assert(mergerundata["rlis_aligndata"] == fullrundata["rlis_aligndata"])
+    assert(mergerundata["variants"] == fullrundata["variants"])
+    for countkey in ["alignedscorecounts", "snverrorscorecounts", "indelerrorscorecounts"]:
+        assert(mergerundata[countkey] == fullrundata[countkey])
+    for filekey in bench.COVEREDBEDFILES:
+        assert(filecmp.cmp(fullrundata["outputfiles"][filekey], mergerundata["outputfiles"][filekey], shallow=False))
+    # lines at the same position are in benchmark sequence order:
+    assert(bench.covered_bed_sort_key("testmatcovered", "h1\t0\t10\tbenchA.x.1.10\n", {"benchA": 0, "benchB": 1}) < bench.covered_bed_sort_key("testmatcovered", "h1\t0\t10\tbenchB.x.1.10\n", {"benchA": 0, "benchB": 1}))
+
+    # the merge pipeline replaces the steps whose results were saved with the merge step:
+    mergesteps = bench.define_merge_pipeline_steps(mergeargs, True)
+    assert(mergesteps[0]["name"] == "mergeresults")
+    for step in mergesteps:
+        assert(step["name"] not in bench.MERGEDSTEPS)
+        assert(len([required for required in step["requires"] if required in bench.MERGEDSTEPS]) == 0)
+    steporder = pipeline.order_steps(mergesteps)
+    for step in mergesteps:
+        for required in step["requires"]:
+            assert(steporder.index(required) < steporder.index(step["name"]))
+    shutil.rmtree(testdir)